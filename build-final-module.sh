@@ -102,9 +102,6 @@ cd ${FAKE_ROOT}/srv
 ln -s httpd www || echo -n
 
 # We should build a controlpanel module to obviate these steps.
-echo "Creating directories for the traffic graphs."
-mkdir -p ${FAKE_ROOT}/srv/controlpanel/graphs
-
 echo "Copying control panel's HTML templates into place."
 cp -rv $BUILD_HOME/Byzantium/control_panel/srv/controlpanel/* ${FAKE_ROOT}/srv/controlpanel
 
@@ -140,10 +137,6 @@ mkdir -p ${FAKE_ROOT}/etc/avahi/inactive
 # Configure libnss to reference mDNS for resolution in addition to DNS.
 cp ${FAKE_ROOT}/etc/nsswitch.conf-mdns ${FAKE_ROOT}/etc/nsswitch.conf
 
-# This stuff probably belongs in the controlpanel package.
-echo "Installing rrdtool shell script."
-cp traffic_stats.sh ${FAKE_ROOT}/usr/local/bin
-
 echo "Installing the control panel."
 cd ../control_panel
 mkdir -p ${FAKE_ROOT}/usr/local/sbin
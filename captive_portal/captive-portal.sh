@@ -13,14 +13,17 @@ ARP=/sbin/arp
 # Set up the choice tree of options that can be passed to this script.
 case "$1" in
     'initialize')
-        # $2: IP address of the client interface.  Assumes final octet is .1.
+        # $2: IP address of the client interface.
+        # $3: Name of the mesh interface.
+        # $4: Length of the prefix of the client netblock (default 24).
 
         # Initialize the IP tables ruleset by creating a new chain for captive
         # portal users.
         $IPTABLES -N internet -t mangle
 
         # Convert the IP address of the client interface into a netblock.
-        CLIENTNET=`echo $2 | sed 's/1$/0\/24/'`
+        # iptables masks off the host part of the address.
+        CLIENTNET=$2/${4:-24}
 
         # Exempt traffic which does not originate from the client network.
         $IPTABLES -t mangle -A PREROUTING -p tcp ! -s $CLIENTNET -j RETURN
@@ -34,6 +37,12 @@ case "$1" in
         # Traffic not coming from an accepted user gets marked 99.
         $IPTABLES -t mangle -A internet -j MARK --set-mark 99
 
+        # Count the traffic headed to each accepted user, so the control
+        # panel can show who's using the most bandwidth.  Rules are added to
+        # this chain when users click through.
+        $IPTABLES -N clients -t mangle
+        $IPTABLES -t mangle -A POSTROUTING -j clients
+
         # $2 is actually the IP address of the client interface, so let's make
         # it a bit more clear.
         CLIENTIP=$2
@@ -81,6 +90,9 @@ case "$1" in
         $IPTABLES -t mangle -I internet -m mac --mac-source \
             $CLIENTMAC -j RETURN
 
+        # Start counting the traffic sent to the client.
+        $IPTABLES -t mangle -A clients -d $CLIENT -j RETURN
+
 	exit 0
         ;;
     'remove')
@@ -94,6 +106,9 @@ case "$1" in
         $IPTABLES -t mangle -D internet -m mac --mac-source \
             $CLIENTMAC -j RETURN
 
+        # Stop counting the traffic sent to the client.
+        $IPTABLES -t mangle -D clients -d $CLIENT -j RETURN
+
 	exit 0
         ;;
     'purge')
@@ -119,6 +134,6 @@ case "$1" in
 	exit 0
 	;;
     *)
-        echo "USAGE: $0 {initialize <IP> <interface>|add <IP> <interface>|remove <IP> <interface>|purge|list}"
+        echo "USAGE: $0 {initialize <IP> <interface> [<prefix length>]|add <IP> <interface>|remove <IP> <interface>|purge|list}"
         exit 0
     esac
@@ -217,6 +217,8 @@ def parse_args():
     parser.add_argument("--filedir", action="store", default="/srv/captiveportal")
     parser.add_argument("-i", "--interface", action="store", required=True,
                         help="The name of the interface the daemon listens on.")
+    parser.add_argument("-n", "--prefix-length", action="store", default=24, type=int,
+                        help="Length of the prefix of the client netblock. (Defaults to 24.)")
     parser.add_argument("-k", "--key", action="store", default="/etc/httpd/server.key",
                         help="Path to an SSL private key file. (Defaults to /etc/httpd/server.key)")
     parser.add_argument("--pidfile", action="store")
@@ -319,7 +321,7 @@ def setup_url_tree(args):
 def setup_iptables(args):
     # Initialize the IP tables ruleset for the node.
     initialize_iptables = ['/usr/local/sbin/captive-portal.sh', 'initialize',
-                           args.address, args.interface]
+                           args.address, args.interface, str(args.prefix_length)]
     iptables = 0
     if args.test:
         logging.debug("Command that would be executed:\n%s", ' '.join(initialize_iptables))
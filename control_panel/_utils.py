@@ -1,7 +1,15 @@
 from mako.exceptions import RichTraceback
+import cherrypy
 
+import hashlib
+import json
 import logging
+import os
+import os.path
 import sqlite3
+import tempfile
+import threading
+import time
 
 def debug(message,level = '1'):
     import os
@@ -42,6 +50,22 @@ def execute_query(db, query, template=None):
         cursor.execute(query)
     return connection, cursor
 
+# Adds a column to a table if it isn't there yet, for databases created by
+# older versions of the control panel.  Returns True if the column was added.
+def add_column(db, table, column, declaration):
+    connection = sqlite3.connect(db)
+    cursor = connection.cursor()
+    cursor.execute("PRAGMA table_info(%s);" % table)
+    added = column not in [i[1] for i in cursor.fetchall()]
+    if added:
+        logging.info("Adding column %s to table %s of %s.", column, table, db)
+        cursor.execute("ALTER TABLE %s ADD COLUMN %s %s;" % (table, column, declaration))
+        connection.commit()
+    cursor.close()
+    connection.close()
+    return added
+
+
 def check_for_configured_interface(netconfdb, interface, channel, essid):
     """docstring for check_for_configured_interface"""
     warning = ""
@@ -61,6 +85,30 @@ def check_for_configured_interface(netconfdb, interface, channel, essid):
     return (channel, essid, warning)
     
 
+# Returns the length of the prefix of the client netblock chosen for a
+# wireless interface, or default if none has been stored yet.  The column is
+# added to network.sqlite databases that don't have it.
+def get_client_prefix(netconfdb, interface, default=24):
+    add_column(netconfdb, 'wireless', 'client_prefix', 'NUMERIC')
+    query = "SELECT client_prefix FROM wireless WHERE mesh_interface=?;"
+    connection, cursor = execute_query(netconfdb, query, (interface, ))
+    result = cursor.fetchall()
+    connection.close()
+    if result and result[0][0]:
+        return int(result[0][0])
+    return default
+
+
+# Stores the length of the prefix of the client netblock of a wireless
+# interface.
+def set_client_prefix(netconfdb, interface, prefix_length):
+    add_column(netconfdb, 'wireless', 'client_prefix', 'NUMERIC')
+    query = "UPDATE wireless SET client_prefix=? WHERE mesh_interface=?;"
+    connection, cursor = execute_query(netconfdb, query, (int(prefix_length), interface))
+    connection.commit()
+    connection.close()
+
+
 def set_confdbs(test):
     if test:
         # self.netconfdb = '/home/drwho/network.sqlite'
@@ -92,4 +140,131 @@ def output_error_data():
         print '\n'
         print ('Error in file %s\n\tline %s\n\tfunction %s') % ((filename, lineno, function))
         print ('Execution died on line %s\n') % (line)
-        print ('%s: %s') % ((str(traceback.error.__class__.__name__), traceback.error))
\ No newline at end of file
+        print ('%s: %s') % ((str(traceback.error.__class__.__name__), traceback.error))
+
+
+# Holds the result of an expensive function (one that forks subprocesses or
+# runs SQL queries) for a number of seconds so that repeated page loads and
+# API polls share a single collection run.  Thread safe, because CherryPy
+# serves requests from a pool of worker threads.
+class CachedResult(object):
+
+    def __init__(self, function, ttl=10, volatile=()):
+        self.function = function
+        self.ttl = ttl
+        self.volatile = volatile
+        self.value = None
+        self.etag = ''
+        self.timestamp = 0
+        self.lock = threading.Lock()
+
+    # Returns a (value, etag) tuple, refreshing the value first if it has
+    # gone stale.  The ETag is the SHA-1 hash of the canonical JSON form of
+    # the value, so it only changes when the value does.  Top-level fields
+    # listed in volatile (timestamps and counters that change every time the
+    # value is collected) are left out of the hash; otherwise the ETag would
+    # never match twice.  A value with volatile fields can differ from
+    # another with the same ETag, so its ETag is a weak one.
+    def get(self):
+        with self.lock:
+            now = time.time()
+            if self.value is None or (now - self.timestamp) >= self.ttl:
+                self.value = self.function()
+                self.etag = make_etag(self.stable(self.value),
+                                      weak=bool(self.volatile))
+                self.timestamp = now
+            return self.value, self.etag
+
+    # Returns a copy of a value without its volatile fields.
+    def stable(self, value):
+        if not self.volatile or not isinstance(value, dict):
+            return value
+        return dict((key, value[key]) for key in value if key not in self.volatile)
+
+    # Throw away the cached value so the next call to get() recollects it.
+    def invalidate(self):
+        with self.lock:
+            self.timestamp = 0
+
+
+# Generates a strong ETag for anything that can be serialized as JSON, or a
+# weak one for a representation that only matters up to fields left out of
+# the value.
+def make_etag(value, weak=False):
+    body = json.dumps(value, sort_keys=True)
+    etag = '"%s"' % hashlib.sha1(body).hexdigest()
+    if weak:
+        etag = 'W/' + etag
+    return etag
+
+
+# Returns True if the ETag matches the client's If-None-Match header.
+# If-None-Match uses the weak comparison, so W/ prefixes are ignored.
+def etag_matches(etag):
+    if etag.startswith('W/'):
+        etag = etag[2:]
+    if_none_match = cherrypy.request.headers.get('If-None-Match')
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+# Serializes a document as JSON for the control panel's machine-readable
+# endpoints.  Sets the ETag header and answers with 304 Not Modified if the
+# client already has this version of the document, in which case nothing is
+# serialized at all.
+def json_response(document, etag=None):
+    if etag is None:
+        etag = make_etag(document)
+    cherrypy.response.headers['ETag'] = etag
+    cherrypy.response.headers['Cache-Control'] = 'no-cache'
+    if etag_matches(etag):
+        cherrypy.response.status = 304
+        return ''
+    cherrypy.response.headers['Content-Type'] = 'application/json'
+    return json.dumps(document, sort_keys=True)
+
+
+# Writes a generated configuration file, but only if its contents would
+# change.  The old and new contents are compared by hash, and a changed file
+# is written to a temporary file in the same directory and renamed into
+# place, so anything reading it sees either the old version or the new one
+# and never half of each.  Returns True if the file was written.  Raises
+# IOError or OSError if it couldn't be.
+def write_if_changed(path, contents):
+    digest = hashlib.sha1(contents).hexdigest()
+    try:
+        current = open(path, 'r')
+        unchanged = hashlib.sha1(current.read()).hexdigest() == digest
+        current.close()
+        if unchanged:
+            logging.debug("%s is unchanged.", path)
+            return False
+    except IOError:
+        pass
+
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temporary = tempfile.mkstemp(prefix='.' + os.path.basename(path),
+                                             dir=directory)
+    try:
+        new = os.fdopen(descriptor, 'w')
+        new.write(contents)
+        new.flush()
+        os.fsync(new.fileno())
+        new.close()
+        os.chmod(temporary, 0o644)
+        os.rename(temporary, path)
+    except (IOError, OSError):
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    logging.debug("Wrote new %s.", path)
+    return True
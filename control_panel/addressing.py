@@ -0,0 +1,176 @@
+# addressing.py - Picks the IP addresses of a node's mesh and client
+#    interfaces so that they don't collide with anything already on the mesh.
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# ARP probing can only see nodes one hop away, so two nodes a few hops apart
+# can still end up with the same client netblock, which costs the whole mesh
+# a round of routing churn to sort out.  Before anything is probed, every
+# prefix the node already knows a route to (from the kernel's routing table
+# and from babeld's route dump) is taken out of the running.  Candidates are
+# generated from a hash of the interface's MAC address, so the same node
+# tries the same addresses in the same order every time it's configured and
+# different nodes are spread across the address space.
+
+# Import modules.
+import hashlib
+import logging
+import random
+import socket
+import struct
+
+import babelctl
+
+# Address pools: the network addresses are allocated from, its prefix length,
+# and the prefix length of the block each node takes from it.  Mesh
+# interfaces get a single address in 192.168/16; client interfaces get a
+# block in 10/8 (a /24 unless the admin asks for a bigger one) and take the
+# first address in it.
+MESH_POOL = ('192.168.0.0', 16, 32)
+CLIENT_POOL = ('10.0.0.0', 8, 24)
+
+
+# Returns the pool to allocate client blocks of a given prefix length from.
+def client_pool(length):
+    return (CLIENT_POOL[0], CLIENT_POOL[1], int(length))
+
+
+# How many candidates to generate before giving up on a pool.
+max_candidates = 65536
+
+
+# Converts between dotted quads and integers.
+def aton(address):
+    return struct.unpack('!I', socket.inet_aton(address))[0]
+
+
+def ntoa(address):
+    return socket.inet_ntoa(struct.pack('!I', address))
+
+
+def netmask(length):
+    return (0xffffffff << (32 - length)) & 0xffffffff
+
+
+# Returns the network and broadcast addresses of the block an address is in.
+def block_bounds(address, length):
+    mask = netmask(length)
+    network = aton(address) & mask
+    return ntoa(network), ntoa(network | (~mask & 0xffffffff))
+
+
+# Returns True if two prefixes, each given as (network, length) with the
+# network as an integer, have any addresses in common.
+def overlaps(first, second):
+    mask = netmask(min(first[1], second[1]))
+    return first[0] & mask == second[0] & mask
+
+
+# Parses the contents of /proc/net/route.  Returns a list of (network,
+# length) pairs.  The kernel prints addresses and masks as hex in host byte
+# order.
+def parse_proc_route(lines):
+    prefixes = []
+    for line in list(lines)[1:]:
+        fields = line.split()
+        if len(fields) < 8:
+            continue
+        try:
+            network = struct.unpack('!I', struct.pack('=I', int(fields[1], 16)))[0]
+            mask = struct.unpack('!I', struct.pack('=I', int(fields[7], 16)))[0]
+        except ValueError:
+            continue
+        prefixes.append((network, bin(mask).count('1')))
+    return prefixes
+
+
+def read_kernel_routes(injected_open=open):
+    try:
+        route = injected_open('/proc/net/route', 'r')
+    except IOError:
+        logging.error("Unable to open /proc/net/route.")
+        return []
+    prefixes = parse_proc_route(route)
+    route.close()
+    return prefixes
+
+
+# Parses a dump of babeld's routing table, as printed on its local
+# configuration interface.  Every route and exported route names its prefix
+# after the word 'prefix'.  Returns the IPv4 ones as (network, length) pairs.
+def parse_babel_dump(lines):
+    prefixes = []
+    for line in lines:
+        fields = line.split()
+        if 'prefix' not in fields or fields.index('prefix') + 1 >= len(fields):
+            continue
+        prefix = fields[fields.index('prefix') + 1]
+        if ':' in prefix:
+            continue
+        network, _, length = prefix.partition('/')
+        try:
+            prefixes.append((aton(network), int(length or 32)))
+        except (socket.error, ValueError):
+            continue
+    return prefixes
+
+
+# Asks babeld for a dump of its routing table.  Returns the lines of the
+# dump, or an empty list if babeld isn't running.
+def babeld_dump(port=babelctl.PORT):
+    try:
+        return babelctl.dump(port)
+    except babelctl.BabelError as ex:
+        logging.debug("Couldn't get a route dump from babeld: %s", ex)
+        return []
+
+
+# Returns every IPv4 prefix the node knows a route to.
+def known_prefixes():
+    return read_kernel_routes() + parse_babel_dump(babeld_dump())
+
+
+# Reads the MAC address of a network interface from sysfs.  Aliases like
+# wlan0:1 share the MAC address of the physical interface.
+def interface_mac(interface, injected_open=open):
+    interface = interface.split(':')[0]
+    try:
+        address = injected_open('/sys/class/net/%s/address' % interface, 'r')
+    except IOError:
+        logging.error("Unable to read the MAC address of %s.", interface)
+        return None
+    mac = address.readline().strip()
+    address.close()
+    return mac
+
+
+# Generates candidate addresses from a pool, in an order determined by the
+# seed (normally the interface's MAC address).  Blocks overlapping any of the
+# excluded prefixes are skipped, except for routes covering the whole pool
+# (or more, like the default route), which say nothing about which blocks
+# are taken.
+def candidates(seed, pool, exclude=()):
+    if not seed:
+        seed = str(random.random())
+    network, pool_length, block_length = pool
+    network = aton(network)
+    host_bits = 32 - block_length
+    blocks = 2 ** (block_length - pool_length)
+    exclude = [i for i in exclude if i[1] > pool_length and overlaps(i, (network, pool_length))]
+
+    for i in range(max_candidates):
+        digest = hashlib.sha1(('%s:%d' % (seed, i)).encode('ascii')).hexdigest()
+        block = network | ((int(digest[:8], 16) % blocks) << host_bits)
+
+        # A single address can't be the network or broadcast address of a
+        # /24 either.
+        if host_bits == 0 and block & 0xff in (0, 255):
+            continue
+        if [j for j in exclude if overlaps(j, (block, block_length))]:
+            continue
+
+        if host_bits:
+            yield ntoa(block + 1)
+        else:
+            yield ntoa(block)
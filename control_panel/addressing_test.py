@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# addressing_test.py
+
+import itertools
+import unittest
+import addressing
+
+
+class AddressingTest(unittest.TestCase):
+
+    def test_parse_proc_route(self):
+        route = ['Iface\tDestination\tGateway \tFlags\tRefCnt\tUse\tMetric\tMask\t\tMTU\tWindow\tIRTT\n',
+                 'eth0\t00000000\t0100A8C0\t0003\t0\t0\t0\t00000000\t0\t0\t0\n',
+                 'wlan0\t0000A8C0\t00000000\t0001\t0\t0\t0\t0000FFFF\t0\t0\t0\n',
+                 'wlan0\t0005000A\t00000000\t0001\t0\t0\t0\t00FFFFFF\t0\t0\t0\n']
+        # /proc/net/route is in host byte order, so this only holds on
+        # little-endian machines.
+        if addressing.struct.pack('=I', 1) == b'\x01\x00\x00\x00':
+            self.assertEqual([(0, 0), (addressing.aton('192.168.0.0'), 16),
+                              (addressing.aton('10.0.5.0'), 24)],
+                             addressing.parse_proc_route(route))
+
+    def test_parse_babel_dump(self):
+        dump = ['add interface wlan0 up true ipv6 fe80::1 ipv4 192.168.4.7',
+                'add neighbour 1f2e3d address fe80::2 if wlan0 reach ffff rxcost 96 txcost 96 cost 96',
+                'add xroute prefix 10.0.5.0/24 from ::/0 metric 0',
+                'add route 9a8b7c prefix 10.7.7.0/24 from ::/0 installed yes id 02:ca:ff:ee:ba:be:00:01 metric 96 refmetric 0 via fe80::2 if wlan0',
+                'add route 9a8b7d prefix 192.168.9.9/32 from ::/0 installed yes id 02:ca:ff:ee:ba:be:00:01 metric 96 refmetric 0 via fe80::2 if wlan0',
+                'add route 9a8b7e prefix fd00::/64 from ::/0 installed yes id 02:ca:ff:ee:ba:be:00:01 metric 96 refmetric 0 via fe80::2 if wlan0']
+        expected = [(addressing.aton('10.0.5.0'), 24),
+                    (addressing.aton('10.7.7.0'), 24),
+                    (addressing.aton('192.168.9.9'), 32)]
+        self.assertEqual(expected, addressing.parse_babel_dump(dump))
+
+    def test_overlaps(self):
+        slash24 = (addressing.aton('10.0.5.0'), 24)
+        self.assertTrue(addressing.overlaps(slash24, (addressing.aton('10.0.4.0'), 22)))
+        self.assertTrue(addressing.overlaps(slash24, (addressing.aton('10.0.5.1'), 32)))
+        self.assertFalse(addressing.overlaps(slash24, (addressing.aton('10.0.6.0'), 24)))
+
+    def test_candidates_are_deterministic(self):
+        first = list(itertools.islice(addressing.candidates('02:ca:ff:ee:ba:be', addressing.CLIENT_POOL), 5))
+        second = list(itertools.islice(addressing.candidates('02:ca:ff:ee:ba:be', addressing.CLIENT_POOL), 5))
+        other = list(itertools.islice(addressing.candidates('02:ca:ff:ee:ba:bf', addressing.CLIENT_POOL), 5))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        for i in first:
+            self.assertTrue(i.startswith('10.') and i.endswith('.1'))
+
+    def test_bigger_client_blocks(self):
+        for i in itertools.islice(addressing.candidates('02:ca:ff:ee:ba:be', addressing.client_pool(20)), 50):
+            address = addressing.aton(i)
+            self.assertEqual(1, address & 0xfff)
+        self.assertEqual(('10.0.4.0', '10.0.7.255'), addressing.block_bounds('10.0.4.1', 22))
+
+    def test_mesh_candidates(self):
+        for i in itertools.islice(addressing.candidates('02:ca:ff:ee:ba:be', addressing.MESH_POOL), 200):
+            self.assertTrue(i.startswith('192.168.'))
+            self.assertTrue(i.split('.')[3] not in ('0', '255'))
+
+    def test_candidates_skip_known_prefixes(self):
+        seed = '02:ca:ff:ee:ba:be'
+        first = next(addressing.candidates(seed, addressing.CLIENT_POOL))
+        block = (addressing.aton(first) - 1, 24)
+        # Routes covering the whole pool don't rule anything out.
+        self.assertEqual(first, next(addressing.candidates(
+            seed, addressing.CLIENT_POOL, [(0, 0), (addressing.aton('10.0.0.0'), 8)])))
+        self.assertNotEqual(first, next(addressing.candidates(
+            seed, addressing.CLIENT_POOL, [block])))
+
+    def test_candidates_run_out(self):
+        exclude = [(addressing.aton('10.0.0.0'), 9), (addressing.aton('10.128.0.0'), 9)]
+        addressing.max_candidates, saved = 100, addressing.max_candidates
+        try:
+            self.assertEqual([], list(addressing.candidates('x', addressing.CLIENT_POOL, exclude)))
+        finally:
+            addressing.max_candidates = saved
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,191 @@
+# babelconfig.py - Per-interface babeld profiles, and the babeld configuration
+#    file generated from them.
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# A profile is a named set of babeld interface parameters kept in the
+# profiles table of mesh.sqlite: how often hellos and updates are sent,
+# whether link quality is estimated, whether the link is treated as wired and
+# whether split horizon is used.  Each mesh interface uses one profile (the
+# profile column of the meshes table).  Shorter intervals let the mesh
+# converge faster when something changes, at the cost of more control
+# traffic.  That adds up in a dense mesh, where every node has a lot of
+# neighbours; in a sparse one there's air to spare and routes are worth
+# repairing quickly.
+#
+# babeld's configuration file is generated from a base file, which holds the
+# global statements (redistribution and the like), followed by an 'interface'
+# statement per mesh interface with its profile's parameters and its channel.
+# The same statements are sent to a running babeld through its local
+# interface (see babelctl.py), which applies them without a restart.  A
+# parameter that's set back to babeld's default is left out of the
+# statement, and a running babeld would keep the old value, so babeld is
+# restarted instead when a profile clears a parameter it was given before
+# (see cleared()).
+
+# Import modules.
+import re
+import sqlite3
+
+import _utils
+
+# The parameters of a profile, in the order they're stored.
+FIELDS = ('hello_interval', 'update_interval', 'link_quality', 'wired',
+          'split_horizon')
+
+# Parameters that are numbers of seconds, and ones that are true, false or
+# left for babeld to decide.
+INTERVALS = ('hello_interval', 'update_interval')
+TRISTATES = ('link_quality', 'wired', 'split_horizon')
+TRISTATE_VALUES = ('auto', 'true', 'false')
+
+# Interfaces that haven't been given a profile use this one.
+DEFAULT_PROFILE = 'default'
+
+# The profiles a new mesh.sqlite starts with.  The default one leaves
+# everything to babeld (a hello every four seconds on wireless links, and an
+# update every four hellos).
+PROFILES = [
+    ('default', None, None, 'auto', 'auto', 'auto'),
+    ('dense', 8, 32, 'auto', 'auto', 'auto'),
+    ('sparse', 2, 8, 'auto', 'auto', 'auto'),
+    ('wired', None, None, 'false', 'true', 'true'),
+]
+
+# Longest interval babeld accepts, in seconds.
+maximum_interval = 600
+
+# Profile names end up in web pages and configuration files, so they're kept
+# simple.
+name_pattern = re.compile(r'^[A-Za-z0-9_-]{1,32}$')
+
+
+# Creates the profiles table of a mesh.sqlite that doesn't have one yet, with
+# the stock profiles, and adds the profile column to its meshes table.
+def upgrade(meshconfdb):
+    connection = sqlite3.connect(meshconfdb)
+    cursor = connection.cursor()
+    cursor.execute("CREATE TABLE IF NOT EXISTS profiles (name TEXT PRIMARY KEY, hello_interval NUMERIC, update_interval NUMERIC, link_quality TEXT, wired TEXT, split_horizon TEXT);")
+    cursor.execute("SELECT count(*) FROM profiles;")
+    if not cursor.fetchone()[0]:
+        cursor.executemany("INSERT INTO profiles VALUES (?, ?, ?, ?, ?, ?);", PROFILES)
+    connection.commit()
+    cursor.close()
+    connection.close()
+    _utils.add_column(meshconfdb, 'meshes', 'profile', 'TEXT')
+
+
+# Checks the values of a profile from a form.  Takes a dict of strings, with
+# empty intervals meaning babeld's default.  Returns a dict of the values as
+# they're stored.  Raises ValueError if any of them are wrong.
+def validate(values):
+    profile = {}
+    for field in INTERVALS:
+        value = (values.get(field) or '').strip()
+        if not value:
+            profile[field] = None
+            continue
+        try:
+            value = float(value)
+        except ValueError:
+            raise ValueError("The %s has to be a number of seconds." % field.replace('_', ' '))
+        if not 0 < value <= maximum_interval:
+            raise ValueError("The %s has to be between 0 and %d seconds." % (field.replace('_', ' '), maximum_interval))
+        profile[field] = int(value) if value == int(value) else value
+    for field in TRISTATES:
+        value = (values.get(field) or 'auto').strip().lower()
+        if value not in TRISTATE_VALUES:
+            raise ValueError("The %s has to be one of %s." % (field.replace('_', ' '), ', '.join(TRISTATE_VALUES)))
+        profile[field] = value
+    if (profile['hello_interval'] and profile['update_interval'] and
+            profile['update_interval'] < profile['hello_interval']):
+        raise ValueError("Updates can't be sent more often than hellos.")
+    return profile
+
+
+# Returns the profiles in a mesh.sqlite as a dict mapping their names to
+# dicts of their parameters.
+def load_profiles(meshconfdb):
+    query = "SELECT name, " + ', '.join(FIELDS) + " FROM profiles;"
+    connection, cursor = _utils.execute_query(meshconfdb, query)
+    profiles = {}
+    for row in cursor.fetchall():
+        profiles[row[0]] = dict(zip(FIELDS, row[1:]))
+    connection.close()
+    return profiles
+
+
+# Stores a profile, replacing the one with the same name if there is one.
+def save_profile(meshconfdb, name, profile):
+    connection = sqlite3.connect(meshconfdb)
+    cursor = connection.cursor()
+    cursor.execute("INSERT OR REPLACE INTO profiles (name, " + ', '.join(FIELDS) + ") VALUES (?, ?, ?, ?, ?, ?);",
+                   tuple([name] + [profile[i] for i in FIELDS]))
+    connection.commit()
+    cursor.close()
+    connection.close()
+
+
+# Turns a profile and a channel into babeld interface parameters, e.g.
+# ['hello-interval', '2', 'channel', '6'].  Parameters left to babeld are
+# left out.
+def parameters(profile, channel=None):
+    result = []
+    for field in FIELDS:
+        value = profile.get(field)
+        if value is None or value == 'auto':
+            continue
+        result = result + [field.replace('_', '-'), str(value)]
+    if channel:
+        result = result + ['channel', str(int(channel))]
+    return result
+
+
+# Generates the contents of babeld's configuration file.  Takes the contents
+# of the base file and a list of (interface, parameters) pairs.
+def config_contents(base, interfaces):
+    lines = ["# Generated by the Byzantium control panel.  Changes made here will be overwritten."]
+    if base.strip():
+        lines.append(base.strip())
+    for interface, interface_parameters in interfaces:
+        lines.append(' '.join(['interface', interface] + list(interface_parameters)))
+    return '\n'.join(lines) + '\n'
+
+
+# Returns the parameters of the 'interface' statements in the contents of a
+# configuration file, as a dict mapping interfaces to dicts of parameters.
+def interface_statements(contents):
+    statements = {}
+    for line in contents.splitlines():
+        words = line.split()
+        if len(words) < 2 or words[0] != 'interface':
+            continue
+        statements.setdefault(words[1], {}).update(zip(words[2::2], words[3::2]))
+    return statements
+
+
+# Returns the interfaces that were given a parameter in the old contents of
+# the configuration file that the new (interface, parameters) pairs leave to
+# babeld.  A running babeld can't be told to go back to its default, so
+# those interfaces need babeld restarted.
+def cleared(old_contents, interfaces):
+    old = interface_statements(old_contents)
+    result = []
+    for interface, interface_parameters in interfaces:
+        given = set(list(interface_parameters)[0::2])
+        if [i for i in old.get(interface, {}) if i not in given]:
+            result.append(interface)
+    return result
+
+
+# Returns the contents of the base configuration file, or nothing if there
+# isn't one.
+def read_base(path, injected_open=open):
+    try:
+        base = injected_open(path, 'r')
+    except IOError:
+        return ''
+    contents = base.read()
+    base.close()
+    return contents
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# babelconfig_test.py
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import babelconfig
+
+
+class BabelConfigTest(unittest.TestCase):
+
+    def test_validate(self):
+        profile = babelconfig.validate({'hello_interval': '2', 'update_interval': '',
+                                        'link_quality': 'False', 'wired': None})
+        self.assertEqual({'hello_interval': 2, 'update_interval': None,
+                          'link_quality': 'false', 'wired': 'auto',
+                          'split_horizon': 'auto'}, profile)
+        self.assertEqual(0.5, babelconfig.validate({'hello_interval': '0.5'})['hello_interval'])
+        for values in ({'hello_interval': 'often'}, {'hello_interval': '0'},
+                       {'update_interval': '1000'}, {'wired': 'maybe'},
+                       {'hello_interval': '8', 'update_interval': '4'}):
+            self.assertRaises(ValueError, babelconfig.validate, values)
+
+    def test_parameters(self):
+        self.assertEqual([], babelconfig.parameters(dict(zip(babelconfig.FIELDS, babelconfig.PROFILES[0][1:]))))
+        wired = dict(zip(babelconfig.FIELDS, babelconfig.PROFILES[3][1:]))
+        self.assertEqual(['link-quality', 'false', 'wired', 'true', 'split-horizon', 'true', 'channel', '6'],
+                         babelconfig.parameters(wired, 6))
+
+    def test_config_contents(self):
+        self.assertEqual('# Generated by the Byzantium control panel.  Changes made here will be overwritten.\n'
+                         'redistribute metric 128\n'
+                         'interface wlan0 hello-interval 2\n'
+                         'interface wlan1\n',
+                         babelconfig.config_contents('redistribute metric 128\n\n',
+                                                     [('wlan0', ['hello-interval', '2']), ('wlan1', [])]))
+
+    def test_cleared(self):
+        old = babelconfig.config_contents('redistribute metric 128', [
+            ('wlan0', ['hello-interval', '2', 'update-interval', '8', 'channel', '1']),
+            ('wlan1', ['channel', '11'])])
+        self.assertEqual({'hello-interval': '2', 'update-interval': '8', 'channel': '1'},
+                         babelconfig.interface_statements(old)['wlan0'])
+        # Changing a parameter or giving a new one can be done live...
+        self.assertEqual([], babelconfig.cleared(old, [
+            ('wlan0', ['hello-interval', '4', 'update-interval', '16', 'channel', '1']),
+            ('wlan1', ['wired', 'true', 'channel', '11'])]))
+        # ...but leaving one to babeld can't.
+        self.assertEqual(['wlan0'], babelconfig.cleared(old, [
+            ('wlan0', ['channel', '1']), ('wlan1', ['channel', '11'])]))
+        self.assertEqual([], babelconfig.cleared('', [('wlan0', ['channel', '1'])]))
+
+    def test_upgrade(self):
+        directory = tempfile.mkdtemp()
+        try:
+            meshconfdb = os.path.join(directory, 'mesh.sqlite')
+            connection = sqlite3.connect(meshconfdb)
+            connection.execute("CREATE TABLE meshes (enabled TEXT, interface TEXT, protocol TEXT);")
+            connection.commit()
+            connection.close()
+            babelconfig.upgrade(meshconfdb)
+            babelconfig.save_profile(meshconfdb, 'dense', babelconfig.validate({'hello_interval': '10'}))
+            # Upgrading again leaves the profiles alone.
+            babelconfig.upgrade(meshconfdb)
+            profiles = babelconfig.load_profiles(meshconfdb)
+            self.assertEqual(['default', 'dense', 'sparse', 'wired'], sorted(profiles))
+            self.assertEqual(10, profiles['dense']['hello_interval'])
+            self.assertEqual(None, profiles['dense']['update_interval'])
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
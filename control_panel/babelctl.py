@@ -0,0 +1,126 @@
+# babelctl.py - Talks to a running babeld through its local configuration
+#    interface (babeld -G, or -g before babeld 1.8), so that the control panel
+#    can read its routing table and change which interfaces it routes on
+#    without restarting it.
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# babeld listens on a TCP port on the loopback interface.  When somebody
+# connects it introduces itself with a few lines ending in 'ok'; after that
+# it takes one command per line and answers each with whatever the command
+# prints followed by 'ok', 'no' or 'bad'.  Configuration statements like
+# 'interface wlan0' are accepted as commands by babeld 1.8 and later, which
+# also understand 'flush interface wlan0'.  Older versions answer them with
+# 'bad', in which case the caller has to fall back to restarting babeld.
+# babeld 1.8 also made the port opened with -g read-only: it has to be
+# started with -G for the configuration statements to be accepted.
+
+# Import modules.
+import logging
+import re
+import socket
+import subprocess
+
+# The port babeld is started with.
+PORT = 33123
+
+
+# The first version of babeld that takes -G.
+read_write_version = (1, 8)
+
+
+class BabelError(Exception):
+    pass
+
+
+# Asks a babeld binary what version it is.  Returns a tuple like (1, 8), or
+# None if it couldn't be run or didn't say.
+def version(babeld):
+    try:
+        process = subprocess.Popen([babeld, '-V'], stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+        output = process.communicate()[0]
+    except OSError as ex:
+        logging.debug("Couldn't run %s -V: %s", babeld, ex)
+        return None
+    match = re.search(r'babeld-(\d+)\.(\d+)', output.decode('ascii', 'replace'))
+    if not match:
+        return None
+    return (int(match.group(1)), int(match.group(2)))
+
+
+# Returns the option that opens babeld's local configuration interface with
+# write access: -G if the babeld binary is new enough to have it, -g (which
+# was read-write until then) otherwise.
+def local_port_option(babeld):
+    babeld_version = version(babeld)
+    if babeld_version and babeld_version >= read_write_version:
+        return '-G'
+    return '-g'
+
+
+# Opens a connection to babeld and reads its introduction.  babeld may be
+# listening on IPv6 or IPv4 loopback depending on how it was built.  Returns
+# a (socket, file) pair.  Raises BabelError if babeld isn't listening.
+def connect(port=PORT, timeout=2):
+    for host in ('::1', '127.0.0.1'):
+        try:
+            connection = socket.create_connection((host, port), timeout)
+            break
+        except socket.error:
+            continue
+    else:
+        raise BabelError("babeld isn't listening on port %d." % port)
+
+    stream = connection.makefile('r')
+    try:
+        for line in stream:
+            if line.strip() == 'ok':
+                return connection, stream
+    except socket.error as ex:
+        connection.close()
+        raise BabelError("Couldn't read babeld's introduction: %s" % ex)
+    connection.close()
+    raise BabelError("babeld hung up before introducing itself.")
+
+
+# Sends one command to babeld and reads its answer.  Returns the lines it
+# printed.  Raises BabelError if the command failed or babeld couldn't be
+# reached.
+def command(line, port=PORT, timeout=2):
+    connection, stream = connect(port, timeout)
+    lines = []
+    try:
+        connection.sendall((line + '\n').encode('ascii'))
+        for reply in stream:
+            reply = reply.strip()
+            if reply == 'ok':
+                return lines
+            if reply in ('no', 'bad'):
+                raise BabelError("babeld answered '%s' to '%s'." % (reply, line))
+            lines.append(reply)
+        raise BabelError("babeld hung up while answering '%s'." % line)
+    except socket.error as ex:
+        raise BabelError("Lost the connection to babeld: %s" % ex)
+    finally:
+        stream.close()
+        connection.close()
+
+
+# Asks babeld for a dump of its neighbours, routes and exported routes.
+def dump(port=PORT):
+    return command('dump', port)
+
+
+# Starts routing on an interface.  Takes the name of the interface and any
+# babeld interface parameters (e.g. ['wired', 'true']).
+def add_interface(interface, parameters=(), port=PORT):
+    logging.debug("Asking babeld to route on %s.", interface)
+    command(' '.join(['interface', interface] + list(parameters)), port)
+
+
+# Stops routing on an interface.
+def flush_interface(interface, port=PORT):
+    logging.debug("Asking babeld to stop routing on %s.", interface)
+    command('flush interface ' + interface, port)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# babelctl_test.py
+
+from flexmock import flexmock  # http://has207.github.com/flexmock
+import socket
+import threading
+import unittest
+import babelctl
+
+
+# Pretends to be babeld's local configuration interface.  Answers each
+# command with the canned reply for it, and remembers what it was sent.
+class FakeBabeld(object):
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.received = []
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def serve(self):
+        connection, _ = self.server.accept()
+        connection.sendall(b'BABEL 1.0\nversion babeld-1.8.0\nhost node\nmy-id 02:ca:ff:ff:fe:ee:ba:be\nok\n')
+        stream = connection.makefile('r')
+        for line in stream:
+            line = line.strip()
+            self.received.append(line)
+            connection.sendall(self.replies.get(line, 'bad\n').encode('ascii'))
+        connection.close()
+        self.server.close()
+
+
+class BabelctlTest(unittest.TestCase):
+
+    def test_dump(self):
+        babeld = FakeBabeld({'dump': 'add neighbour 1 address fe80::1 if wlan0 reach ffff rxcost 96 txcost 96 cost 96\nok\n'})
+        self.assertEqual(['add neighbour 1 address fe80::1 if wlan0 reach ffff rxcost 96 txcost 96 cost 96'],
+                         babelctl.dump(babeld.port))
+
+    def test_add_interface(self):
+        babeld = FakeBabeld({'interface wlan1 wired true': 'ok\n'})
+        babelctl.add_interface('wlan1', ['wired', 'true'], port=babeld.port)
+        babeld.thread.join(5)
+        self.assertEqual(['interface wlan1 wired true'], babeld.received)
+
+    def test_old_babeld_refuses(self):
+        babeld = FakeBabeld({})
+        self.assertRaises(babelctl.BabelError, babelctl.flush_interface, 'wlan1', babeld.port)
+
+    def test_not_running(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        port = server.getsockname()[1]
+        server.close()
+        self.assertRaises(babelctl.BabelError, babelctl.dump, port)
+
+
+class LocalPortOptionTest(unittest.TestCase):
+
+    def babeld_says(self, output):
+        process = flexmock(communicate=lambda: (output, None))
+        flexmock(babelctl.subprocess).should_receive('Popen').and_return(process)
+
+    def test_new_babeld_is_started_read_write(self):
+        self.babeld_says(b'babeld-1.8.0\n')
+        self.assertEqual((1, 8), babelctl.version('/usr/local/bin/babeld'))
+        self.assertEqual('-G', babelctl.local_port_option('/usr/local/bin/babeld'))
+
+    def test_old_babeld_only_has_g(self):
+        self.babeld_says(b'babeld-1.3.1\n')
+        self.assertEqual('-g', babelctl.local_port_option('/usr/local/bin/babeld'))
+
+    def test_missing_babeld(self):
+        flexmock(babelctl.subprocess).should_receive('Popen').and_raise(OSError(2, 'No such file or directory'))
+        self.assertEqual(None, babelctl.version('/usr/local/bin/babeld'))
+        self.assertEqual('-g', babelctl.local_port_option('/usr/local/bin/babeld'))
+
+
+if __name__ == '__main__':
+    unittest.main()
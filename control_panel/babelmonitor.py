@@ -0,0 +1,289 @@
+# babelmonitor.py - Follows babeld's routing table as it changes, so that the
+#    control panel can show the node's neighbours and routes.
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# A background thread connects to babeld's local interface (see babelctl.py)
+# and sends 'monitor', after which babeld writes a line for every neighbour,
+# route and exported route (xroute) it has, and then another line whenever
+# one of them is added, changes or goes away:
+#
+#   add neighbour 1f3d0 address fe80::21c:... if wlan0 reach ffff rxcost 96 txcost 96 cost 96
+#   change route 2c4e8 prefix 10.0.7.0/24 installed yes id 02:ca:... metric 192 refmetric 96 via fe80::... if wlan0
+#   flush xroute 10.0.5.0/24 prefix 10.0.5.0/24 metric 0
+#
+# Each line is applied to the table it names as it's read, so the cost of an
+# update doesn't depend on how big the tables are.  Routes are also indexed
+# by prefix and by the neighbour they go through.  Every change bumps a
+# generation counter, which the API uses as its ETag and which lets anything
+# derived from the tables be cached until they change.  If babeld goes away
+# the tables are emptied and the thread keeps trying to reconnect, backing
+# off up to a ceiling.
+
+# Import modules.
+import cherrypy
+from cherrypy.process.plugins import SimplePlugin
+
+import logging
+import socket
+import threading
+import time
+
+import babelctl
+
+# The tables babeld reports on.
+KINDS = ('neighbour', 'route', 'xroute')
+
+# The metric babeld uses for unreachable.
+INFINITY = 0xFFFF
+
+
+# Parses one line of babeld's monitoring output.  Returns a tuple of the verb
+# ('add', 'change' or 'flush'), the kind of entry, babeld's identifier for
+# the entry and a dict of the entry's fields, or None if the line isn't an
+# update.
+def parse_event(line):
+    words = line.split()
+    if len(words) < 3 or words[0] not in ('add', 'change', 'flush') or words[1] not in KINDS:
+        return None
+    fields = {}
+    for i in range(3, len(words) - 1, 2):
+        fields[words[i]] = words[i + 1]
+    return words[0], words[1], words[2], fields
+
+
+# Splits off the complete lines at the front of a buffer.  Returns them and
+# whatever's left over.
+def split_lines(buffer):
+    lines = buffer.split('\n')
+    return lines[:-1], lines[-1]
+
+
+# Returns the (address, interface) pair that identifies a neighbour, from a
+# neighbour entry or from a route entry (where it's the next hop).
+def neighbour_of(fields):
+    return fields.get('address', fields.get('via')), fields.get('if')
+
+
+# Converts a cost or metric from babeld's output to a number.  babeld writes
+# unreachable as 65535 (its infinity); that comes back as None, as does
+# anything that isn't a number.
+def to_metric(value):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    if value >= INFINITY:
+        return None
+    return value
+
+
+# babeld's routing tables, kept up to date one event at a time.
+class RoutingTables(object):
+
+    def __init__(self):
+        self.tables = dict([(kind, {}) for kind in KINDS])
+        self.routes_by_prefix = {}
+        self.routes_by_neighbour = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    # Applies one event.  Returns True if it changed anything.
+    def apply(self, verb, kind, key, fields):
+        with self.lock:
+            table = self.tables[kind]
+            old = table.get(key)
+            if verb == 'flush':
+                if old is None:
+                    return False
+                del table[key]
+            elif old == fields:
+                return False
+            else:
+                table[key] = fields
+            if kind == 'route':
+                if old:
+                    self._unindex(key, old)
+                if verb != 'flush':
+                    self._index(key, fields)
+            self.generation += 1
+            return True
+
+    def _index(self, key, fields):
+        self.routes_by_prefix.setdefault(fields.get('prefix'), set()).add(key)
+        self.routes_by_neighbour.setdefault(neighbour_of(fields), set()).add(key)
+
+    def _unindex(self, key, fields):
+        for index, value in ((self.routes_by_prefix, fields.get('prefix')),
+                             (self.routes_by_neighbour, neighbour_of(fields))):
+            keys = index.get(value)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del index[value]
+
+    # Empties the tables, for when the connection to babeld is lost.
+    def clear(self):
+        with self.lock:
+            if not [i for i in self.tables.values() if i]:
+                return
+            for table in self.tables.values():
+                table.clear()
+            self.routes_by_prefix.clear()
+            self.routes_by_neighbour.clear()
+            self.generation += 1
+
+    # Returns a copy of one table as a list of dicts sorted by key.  Each
+    # entry's key is included as 'key' (route entries have a field called
+    # 'id' of their own: the ID of the router that originated them).
+    def entries(self, kind):
+        with self.lock:
+            return self._entries(kind)
+
+    def _entries(self, kind):
+        result = []
+        for key in sorted(self.tables[kind]):
+            entry = dict(self.tables[kind][key])
+            entry['key'] = key
+            result.append(entry)
+        return result
+
+    # Returns the generation of the tables and a copy of all of them, keyed
+    # by kind, taken at the same moment.
+    def snapshot(self):
+        with self.lock:
+            return self.generation, dict([(kind, self._entries(kind)) for kind in KINDS])
+
+    # Returns copies of the routes to a prefix.
+    def routes_to(self, prefix):
+        with self.lock:
+            return [dict(self.tables['route'][i], key=i)
+                    for i in sorted(self.routes_by_prefix.get(prefix, ()))]
+
+    # Returns one dict per neighbour with its address, interface, receive and
+    # transmit costs and the lowest metric of the installed routes through
+    # it (None if it isn't the next hop of any).  Metrics and costs are
+    # numbers, with None for babeld's infinity.
+    def links(self):
+        result = []
+        with self.lock:
+            for fields in self.tables['neighbour'].values():
+                neighbour = neighbour_of(fields)
+                metrics = []
+                for key in self.routes_by_neighbour.get(neighbour, ()):
+                    route = self.tables['route'][key]
+                    if route.get('installed') == 'yes':
+                        metrics.append(to_metric(route.get('metric')))
+                metrics = [i for i in metrics if i is not None]
+                result.append({'address': neighbour[0], 'if': neighbour[1],
+                               'rxcost': to_metric(fields.get('rxcost')),
+                               'txcost': to_metric(fields.get('txcost')),
+                               'metric': min(metrics) if metrics else None})
+        return result
+
+
+class BabelMonitor(SimplePlugin):
+
+    def __init__(self, bus, port=babelctl.PORT, initial_backoff=1, maximum_backoff=30):
+        SimplePlugin.__init__(self, bus)
+        self.port = port
+        self.initial_backoff = initial_backoff
+        self.maximum_backoff = maximum_backoff
+        self.tables = RoutingTables()
+
+        # Whether the monitor is connected to babeld right now, and when the
+        # connection last changed.
+        self.connected = False
+        self.since = time.time()
+
+        self.listener = None
+        self.running = threading.Event()
+
+    def start(self):
+        if self.listener and self.listener.is_alive():
+            return
+        self.running.set()
+        self.listener = threading.Thread(target=self.run, name='BabelMonitor')
+        self.listener.daemon = True
+        self.listener.start()
+    start.priority = 75
+
+    def stop(self):
+        self.running.clear()
+        if self.listener:
+            self.listener.join()
+            self.listener = None
+
+    def set_connected(self, connected):
+        if connected != self.connected:
+            self.connected = connected
+            self.since = time.time()
+        if not connected:
+            self.tables.clear()
+
+    # Runs in the background while CherryPy is running.
+    def run(self):
+        backoff = self.initial_backoff
+        while self.running.is_set():
+            try:
+                connection, stream = babelctl.connect(self.port)
+            except babelctl.BabelError as ex:
+                logging.debug("Not monitoring babeld: %s", ex)
+                self.set_connected(False)
+                self.running.wait(backoff)
+                backoff = min(backoff * 2, self.maximum_backoff)
+                continue
+
+            logging.debug("Monitoring babeld on port %d.", self.port)
+            backoff = self.initial_backoff
+            try:
+                # Start from a clean slate: babeld sends its whole table when
+                # monitoring starts.
+                self.tables.clear()
+                self.set_connected(True)
+                connection.sendall('monitor\n'.encode('ascii'))
+                self.follow(connection)
+            except socket.error as ex:
+                logging.debug("Lost the connection to babeld: %s", ex)
+            finally:
+                stream.close()
+                connection.close()
+                self.set_connected(False)
+
+            # Don't hammer a babeld that keeps hanging up.
+            self.running.wait(self.initial_backoff)
+
+    # Reads events until babeld hangs up or the monitor is stopped.  The
+    # socket is read directly rather than through a file so that a timeout
+    # (which is how the thread notices it's been stopped) can't lose half a
+    # line.
+    def follow(self, connection):
+        connection.settimeout(1)
+        buffer = ''
+        while self.running.is_set():
+            try:
+                data = connection.recv(65536)
+            except socket.timeout:
+                continue
+            if not data:
+                return
+            lines, buffer = split_lines(buffer + data.decode('ascii', 'replace'))
+            for line in lines:
+                event = parse_event(line)
+                if event:
+                    self.tables.apply(*event)
+
+
+# All of the control panel's pages share one monitor.
+_monitor = None
+_monitor_lock = threading.Lock()
+
+
+def shared_monitor():
+    global _monitor
+    with _monitor_lock:
+        if _monitor is None:
+            _monitor = BabelMonitor(cherrypy.engine)
+            _monitor.subscribe()
+        return _monitor
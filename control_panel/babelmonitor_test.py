@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# babelmonitor_test.py
+
+import socket
+import threading
+import unittest
+from flexmock import flexmock
+import babelmonitor
+import linkstate
+
+NEIGHBOUR = 'add neighbour 1f3d0 address fe80::21c:bfff:fe2a:3b4c if wlan0 reach ffff rxcost 96 txcost 96 cost 96'
+ROUTE = 'add route 2c4e8 prefix 10.0.7.0/24 installed yes id 02:ca:ff:ff:fe:ee:ba:be metric 96 refmetric 0 via fe80::21c:bfff:fe2a:3b4c if wlan0'
+XROUTE = 'add xroute 10.0.5.0/24 prefix 10.0.5.0/24 metric 0'
+
+
+class RoutingTablesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tables = babelmonitor.RoutingTables()
+
+    def test_parse_event(self):
+        self.assertEqual(('add', 'xroute', '10.0.5.0/24', {'prefix': '10.0.5.0/24', 'metric': '0'}),
+                         babelmonitor.parse_event(XROUTE))
+        self.assertEqual(None, babelmonitor.parse_event('BABEL 1.0'))
+        self.assertEqual(None, babelmonitor.parse_event('ok'))
+
+    def test_split_lines(self):
+        self.assertEqual((['one', 'two'], 'thr'), babelmonitor.split_lines('one\ntwo\nthr'))
+
+    def test_add_change_flush(self):
+        for line in (NEIGHBOUR, ROUTE, XROUTE):
+            self.assertTrue(self.tables.apply(*babelmonitor.parse_event(line)))
+        self.assertEqual(3, self.tables.generation)
+        self.assertEqual('wlan0', self.tables.entries('neighbour')[0]['if'])
+        self.assertEqual('02:ca:ff:ff:fe:ee:ba:be', self.tables.routes_to('10.0.7.0/24')[0]['id'])
+
+        # Repeats don't count as changes.
+        self.assertFalse(self.tables.apply(*babelmonitor.parse_event(ROUTE)))
+        self.assertEqual(3, self.tables.generation)
+
+        self.assertTrue(self.tables.apply(*babelmonitor.parse_event(ROUTE.replace('add', 'change').replace('metric 96', 'metric 192'))))
+        self.assertEqual('192', self.tables.routes_to('10.0.7.0/24')[0]['metric'])
+
+        self.assertTrue(self.tables.apply(*babelmonitor.parse_event('flush route 2c4e8 prefix 10.0.7.0/24')))
+        self.assertEqual([], self.tables.routes_to('10.0.7.0/24'))
+        self.assertEqual({}, self.tables.routes_by_prefix)
+        self.assertFalse(self.tables.apply(*babelmonitor.parse_event('flush route 2c4e8 prefix 10.0.7.0/24')))
+
+        self.assertEqual([], self.tables.routes_by_neighbour.get(('fe80::21c:bfff:fe2a:3b4c', 'wlan0'), []))
+
+        generation, entries = self.tables.snapshot()
+        self.assertEqual(5, generation)
+        self.assertEqual([], entries['route'])
+        self.assertEqual(1, len(entries['xroute']))
+
+    def test_links(self):
+        for line in (NEIGHBOUR, ROUTE, ROUTE.replace('2c4e8', '2c4f0').replace('metric 96', 'metric 65535')):
+            self.tables.apply(*babelmonitor.parse_event(line))
+        self.assertEqual([{'address': 'fe80::21c:bfff:fe2a:3b4c', 'if': 'wlan0',
+                           'rxcost': 96, 'txcost': 96, 'metric': 96}],
+                         self.tables.links())
+        self.tables.apply(*babelmonitor.parse_event('flush route 2c4e8'))
+        self.assertEqual(None, self.tables.links()[0]['metric'])
+
+
+class BabelMonitorTest(unittest.TestCase):
+
+    def test_follows_and_reconnects(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(2)
+        port = server.getsockname()[1]
+        # Make sure the monitor doesn't find something else on the IPv6
+        # loopback address.
+        flexmock(babelmonitor.babelctl).should_receive('connect').replace_with(
+            lambda port: self.connect(port))
+        hang_up = threading.Event()
+        finished = threading.Event()
+
+        def serve():
+            for session in range(2):
+                connection, _ = server.accept()
+                connection.sendall(b'BABEL 1.0\nok\n')
+                connection.recv(100)
+                connection.sendall(b'\n'.join([NEIGHBOUR, ROUTE, XROUTE[:20]]))
+                connection.sendall(XROUTE[20:] + b'\nok\n')
+                (hang_up if session == 0 else finished).wait(5)
+                connection.close()
+            server.close()
+        threading.Thread(target=serve).start()
+
+        monitor = babelmonitor.BabelMonitor(flexmock(subscribe=lambda *args: None), port,
+                                            initial_backoff=0.05)
+        monitor.start()
+        try:
+            self.assertTrue(linkstate.wait_for(lambda: len(monitor.tables.entries('xroute')) == 1, 5))
+            self.assertTrue(monitor.connected)
+            self.assertEqual(1, len(monitor.tables.entries('neighbour')))
+            generation = monitor.tables.generation
+
+            # babeld goes away and comes back: the tables are emptied and
+            # filled again.
+            hang_up.set()
+            self.assertTrue(linkstate.wait_for(lambda: monitor.tables.generation > generation + 1 and len(monitor.tables.entries('xroute')) == 1, 5))
+            self.assertEqual(1, len(monitor.tables.entries('route')))
+        finally:
+            finished.set()
+            monitor.stop()
+
+    def connect(self, port):
+        try:
+            connection = socket.create_connection(('127.0.0.1', port), 2)
+        except socket.error as ex:
+            raise babelmonitor.babelctl.BabelError(str(ex))
+        stream = connection.makefile('r')
+        for line in stream:
+            if line.strip() == 'ok':
+                break
+        return connection, stream
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,371 @@
+# babelsupervisor.py - Keeps babeld running.  If it dies it's started again
+#    within seconds, with whatever interfaces are in the mesh at the time,
+#    instead of the mesh staying down until somebody notices.
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# babeld is run in the foreground (without -D) as a child of the control
+# panel, and a thread per babeld blocks in waitpid() on it, so an exit is
+# noticed the moment it happens.  A babeld that was already running when the
+# control panel started (because the control panel was restarted) isn't a
+# child and can't be waited for; it's found through its pid file and watched
+# through a pidfd, which becomes readable when the process exits.  Kernels
+# older than 5.3 don't have pidfds, in which case /proc is checked once a
+# second instead.
+#
+# babeld is restarted after a short delay that doubles every time it dies
+# again, up to a ceiling, so a babeld that can't start doesn't spin.  The
+# delay goes back to the start once babeld has stayed up for a while.
+# Restarts made because babeld died and the time the mesh was down are
+# counted, so the admin can see how healthy it's been.  Restarts asked for by
+# the control panel (because the interfaces changed) don't count.
+
+# Import modules.
+import cherrypy
+from cherrypy.process.plugins import SimplePlugin
+
+import ctypes
+import errno
+import logging
+import os
+import os.path
+import select
+import signal
+import subprocess
+import threading
+import time
+
+# pidfd_open() has the same system call number on every architecture.
+SYS_pidfd_open = 434
+
+PIDFILE = '/var/run/babeld.pid'
+
+_libc = None
+
+
+# Opens a pidfd for a process.  Raises OSError if the process doesn't exist
+# (ESRCH) or the kernel doesn't support pidfds (ENOSYS).
+def pidfd_open(pid):
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(None, use_errno=True)
+    fd = _libc.syscall(ctypes.c_long(SYS_pidfd_open), ctypes.c_int(pid),
+                       ctypes.c_uint(0))
+    if fd < 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+    return fd
+
+
+# Waits for a process that isn't a child of this one to exit.  Returns True
+# once it has, or False if stop was set first.
+def wait_for_pid(pid, stop, interval=1):
+    try:
+        fd = pidfd_open(pid)
+    except OSError as ex:
+        if ex.errno == errno.ESRCH:
+            return True
+        fd = None
+    except AttributeError:
+        # No syscall() in this libc.
+        fd = None
+
+    if fd is None:
+        while os.path.isdir('/proc/%d' % pid):
+            if stop.wait(interval):
+                return False
+        return True
+
+    try:
+        poller = select.poll()
+        poller.register(fd, select.POLLIN)
+        while not poller.poll(interval * 1000):
+            if stop.is_set():
+                return False
+        return True
+    finally:
+        os.close(fd)
+
+
+# Reads a PID from a pid file.  Returns None if there isn't one.
+def read_pidfile(pidfile):
+    try:
+        pid = open(pidfile, 'r')
+    except IOError:
+        return None
+    try:
+        return int(pid.readline().strip())
+    except ValueError:
+        return None
+    finally:
+        pid.close()
+
+
+# One run of babeld.
+class Instance(object):
+
+    def __init__(self, pid, process=None):
+        self.pid = pid
+        self.process = process
+        self.started = time.time()
+        self.status = None
+        self.done = threading.Event()
+
+        # Set when the control panel stops it on purpose.
+        self.expected = False
+
+
+class BabelSupervisor(SimplePlugin):
+
+    def __init__(self, bus, build_command, test=False, pidfile=PIDFILE,
+                 initial_backoff=1, maximum_backoff=60, stable=60,
+                 stop_timeout=5):
+        SimplePlugin.__init__(self, bus)
+
+        # Called to get the command line to restart babeld with, or None if
+        # there are no interfaces left to route on.
+        self.build_command = build_command
+        self.test = test
+        self.pidfile = pidfile
+        self.initial_backoff = initial_backoff
+        self.maximum_backoff = maximum_backoff
+        self.stable = stable
+        self.stop_timeout = stop_timeout
+
+        # The babeld being watched, whether there should be one, and when
+        # the next attempt to restart it is due.
+        self.instance = None
+        self.wanted = False
+        self.restart_at = None
+        self.backoff = initial_backoff
+
+        # Restarts after babeld died, the time the mesh spent without babeld
+        # in all (not counting the current outage), when the current outage
+        # started and the exit status of the last babeld that died.
+        self.restarts = 0
+        self.downtime = 0.0
+        self.down_since = None
+        self.last_exit = None
+
+        self.condition = threading.Condition()
+
+        # Held while babeld is being stopped or started, so that a restart
+        # after a crash and one asked for by the control panel can't both
+        # start a babeld.
+        self.control = threading.Lock()
+
+        self.supervisor = None
+        self.stopping = threading.Event()
+
+    def start(self):
+        if self.supervisor and self.supervisor.is_alive():
+            return
+        self.stopping.clear()
+        self.adopt()
+        self.supervisor = threading.Thread(target=self.run, name='BabelSupervisor')
+        self.supervisor.daemon = True
+        self.supervisor.start()
+    start.priority = 72
+
+    # babeld is left running when the control panel stops, so the mesh
+    # stays up while it's restarted.
+    def stop(self):
+        self.stopping.set()
+        with self.condition:
+            self.condition.notify_all()
+        if self.supervisor:
+            self.supervisor.join()
+            self.supervisor = None
+        # A babeld that isn't a child stops being watched, and is picked up
+        # again from its pid file if the supervisor is started again.
+        with self.condition:
+            if self.instance and not self.instance.process:
+                self.instance = None
+
+    # Picks up a babeld that was already running from its pid file.
+    def adopt(self):
+        pid = read_pidfile(self.pidfile)
+        if not pid or not os.path.isdir('/proc/%d' % pid):
+            return
+        with self.condition:
+            if self.instance:
+                return
+            logging.debug("Watching the babeld that's already running (PID %d).", pid)
+            self.wanted = True
+            self.watch(Instance(pid))
+
+    # Starts a thread that waits for babeld to exit.  Must be called with the
+    # condition held.
+    def watch(self, instance):
+        self.instance = instance
+        watcher = threading.Thread(target=self.wait_for, args=(instance, ),
+                                   name='BabelSupervisor-%d' % instance.pid)
+        watcher.daemon = True
+        watcher.start()
+
+    def wait_for(self, instance):
+        if instance.process:
+            instance.status = instance.process.wait()
+        elif not wait_for_pid(instance.pid, self.stopping):
+            # The control panel is stopping.
+            return
+        # The supervisor's state is brought up to date first, so that anybody
+        # waiting on done sees that this babeld has gone.
+        self.exited(instance)
+        instance.done.set()
+
+    # Called when a babeld exits.  Unless it was meant to, schedules a
+    # restart.
+    def exited(self, instance):
+        now = time.time()
+        with self.condition:
+            if instance is not self.instance:
+                return
+            self.instance = None
+            if instance.expected or not self.wanted:
+                return
+            logging.error("babeld (PID %d) exited unexpectedly with status %s.  Restarting it in %d seconds.",
+                          instance.pid, instance.status, self.backoff)
+            self.last_exit = instance.status
+            self.down_since = now
+            if now - instance.started >= self.stable:
+                self.backoff = self.initial_backoff
+            self.restart_at = now + self.backoff
+            self.backoff = min(self.backoff * 2, self.maximum_backoff)
+            self.condition.notify_all()
+
+    # Runs in the background while CherryPy is running, restarting babeld
+    # when it's due.
+    def run(self):
+        while not self.stopping.is_set():
+            with self.condition:
+                now = time.time()
+                if self.restart_at is None or now < self.restart_at:
+                    timeout = 1
+                    if self.restart_at is not None:
+                        timeout = min(self.restart_at - now, 1)
+                    self.condition.wait(timeout)
+                    continue
+                self.restart_at = None
+            self.relaunch()
+
+    # Restarts babeld after it died.
+    def relaunch(self):
+        with self.control:
+            command = self.build_command()
+            with self.condition:
+                if not self.wanted or self.instance:
+                    return
+                if not command:
+                    logging.debug("No interfaces left to route on, leaving babeld stopped.")
+                    self.wanted = False
+                    self.end_outage()
+                    return
+                try:
+                    self.launch(command)
+                except OSError as ex:
+                    logging.error("Unable to restart babeld: %s", ex)
+                    self.restart_at = time.time() + self.backoff
+                    self.backoff = min(self.backoff * 2, self.maximum_backoff)
+                    return
+                self.restarts += 1
+                self.end_outage()
+
+    # Adds the current outage, if there is one, to the downtime.  Must be
+    # called with the condition held.
+    def end_outage(self):
+        if self.down_since is not None:
+            self.downtime += time.time() - self.down_since
+            self.down_since = None
+
+    # Starts babeld.  Must be called with the condition held.  Returns the
+    # new Instance, or None in test mode.
+    def launch(self, command):
+        if self.test:
+            logging.debug("Pretending to start babeld: %s", ' '.join(command))
+            return None
+        logging.debug("Starting babeld: %s", ' '.join(command))
+        process = subprocess.Popen(command, close_fds=True)
+        instance = Instance(process.pid, process)
+        self.watch(instance)
+        return instance
+
+    # Stops the babeld being watched, if there is one, and waits for it to
+    # exit.
+    def terminate(self):
+        with self.condition:
+            instance = self.instance
+            if not instance:
+                return
+            instance.expected = True
+        if self.test:
+            logging.debug("Pretending to stop babeld (PID %d).", instance.pid)
+        else:
+            logging.debug("Stopping babeld (PID %d).", instance.pid)
+            for sig in (signal.SIGTERM, signal.SIGKILL):
+                try:
+                    os.kill(instance.pid, sig)
+                except OSError as ex:
+                    if ex.errno != errno.ESRCH:
+                        raise
+                if instance.done.wait(self.stop_timeout):
+                    break
+        with self.condition:
+            if self.instance is instance:
+                self.instance = None
+
+    # (Re)starts babeld with a new command line, because the set of mesh
+    # interfaces changed.  Returns the new Instance, whose done event is set
+    # when it exits.
+    def restart(self, command):
+        with self.control:
+            self.terminate()
+            with self.condition:
+                self.wanted = True
+                self.restart_at = None
+                self.backoff = self.initial_backoff
+                self.end_outage()
+                return self.launch(command)
+
+    # Stops babeld for good, because there's nothing left to route on.
+    def shutdown(self):
+        with self.control:
+            self.terminate()
+            with self.condition:
+                self.wanted = False
+                self.restart_at = None
+                self.end_outage()
+
+    # Returns the PID of the babeld being watched, or None.
+    def pid(self):
+        with self.condition:
+            if self.instance:
+                return self.instance.pid
+            return None
+
+    # Returns the supervisor's state and counters as a dict.  The downtime
+    # doesn't include the current outage, if there is one, so that the dict
+    # only changes when something happens; when the outage started is
+    # included instead.
+    def describe(self):
+        with self.condition:
+            return {'pid': self.instance.pid if self.instance else None,
+                    'wanted': self.wanted, 'restarts': self.restarts,
+                    'downtime': round(self.downtime, 1),
+                    'down_since': self.down_since,
+                    'last_exit': self.last_exit}
+
+
+# All of the control panel's pages share one supervisor.
+_supervisor = None
+_supervisor_lock = threading.Lock()
+
+
+def shared_supervisor(build_command, test=False):
+    global _supervisor
+    with _supervisor_lock:
+        if _supervisor is None:
+            _supervisor = BabelSupervisor(cherrypy.engine, build_command, test)
+            _supervisor.subscribe()
+        return _supervisor
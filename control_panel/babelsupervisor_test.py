@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# babelsupervisor_test.py
+
+import os
+import signal
+import subprocess
+import tempfile
+import threading
+import unittest
+from flexmock import flexmock
+import babelsupervisor
+import linkstate
+
+# Stands in for babeld.
+COMMAND = ['sleep', '60']
+
+
+class BabelSupervisorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.command = COMMAND
+        handle, self.pidfile = tempfile.mkstemp()
+        os.close(handle)
+        self.supervisor = babelsupervisor.BabelSupervisor(
+            flexmock(subscribe=lambda *args: None), lambda: self.command,
+            pidfile=self.pidfile, initial_backoff=0.05, stop_timeout=2)
+        self.supervisor.start()
+
+    def tearDown(self):
+        self.supervisor.shutdown()
+        self.supervisor.stop()
+        os.unlink(self.pidfile)
+
+    def test_restarts_babeld_when_it_dies(self):
+        self.supervisor.restart(COMMAND)
+        pid = self.supervisor.pid()
+        self.assertTrue(pid)
+        os.kill(pid, signal.SIGKILL)
+        self.assertTrue(linkstate.wait_for(lambda: self.supervisor.pid() not in (None, pid), 5))
+        state = self.supervisor.describe()
+        self.assertEqual(1, state['restarts'])
+        self.assertEqual(-signal.SIGKILL, state['last_exit'])
+        self.assertEqual(None, state['down_since'])
+        self.assertTrue(state['downtime'] >= 0)
+
+    def test_planned_restarts_are_not_counted(self):
+        self.supervisor.restart(COMMAND)
+        pid = self.supervisor.pid()
+        self.supervisor.restart(COMMAND)
+        self.assertNotEqual(pid, self.supervisor.pid())
+        self.assertFalse(os.path.isdir('/proc/%d' % pid) and open('/proc/%d/stat' % pid).read().split()[2] != 'Z')
+        self.assertEqual(0, self.supervisor.describe()['restarts'])
+
+    def test_restart_reports_a_babeld_that_crashes(self):
+        instance = self.supervisor.restart(['false'])
+        self.assertTrue(instance.done.wait(5))
+        state = self.supervisor.describe()
+        self.assertEqual(None, state['pid'])
+        self.assertEqual(1, state['last_exit'])
+        self.assertTrue(state['down_since'] is not None)
+
+    def test_shutdown_leaves_babeld_stopped(self):
+        self.supervisor.restart(COMMAND)
+        self.supervisor.shutdown()
+        self.assertEqual(None, self.supervisor.pid())
+        self.assertFalse(linkstate.wait_for(lambda: self.supervisor.pid(), 0.3))
+
+    def test_stays_stopped_without_interfaces(self):
+        self.supervisor.restart(COMMAND)
+        self.command = None
+        os.kill(self.supervisor.pid(), signal.SIGKILL)
+        self.assertTrue(linkstate.wait_for(lambda: not self.supervisor.describe()['wanted'], 5))
+        self.assertEqual(None, self.supervisor.pid())
+
+    def test_adopts_a_running_babeld(self):
+        # A babeld that isn't a child of the supervisor.
+        shell = subprocess.Popen(['sh', '-c', 'sleep 60 >/dev/null 2>&1 & echo $!'],
+                                 stdout=subprocess.PIPE)
+        pid = int(shell.stdout.read())
+        shell.wait()
+        pidfile = open(self.pidfile, 'w')
+        pidfile.write('%d\n' % pid)
+        pidfile.close()
+
+        self.supervisor.stop()
+        self.supervisor.start()
+        self.assertEqual(pid, self.supervisor.pid())
+        os.kill(pid, signal.SIGKILL)
+        self.assertTrue(linkstate.wait_for(lambda: self.supervisor.pid() not in (None, pid), 5))
+        self.assertEqual(1, self.supervisor.describe()['restarts'])
+
+    def test_falls_back_to_proc_without_pidfds(self):
+        flexmock(babelsupervisor).should_receive('pidfd_open').and_raise(OSError(38, 'ENOSYS'))
+        stop = threading.Event()
+        self.assertTrue(babelsupervisor.wait_for_pid(2 ** 22 + 1, stop))
+        stop.set()
+        self.assertFalse(babelsupervisor.wait_for_pid(os.getpid(), stop))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,308 @@
+# channelplanner.py - Picks the wireless channel for the mesh by looking at
+#    what else is on the air near the node.
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# `iw dev <interface> scan` lists the networks (BSSes) the interface can hear,
+# with the frequency and signal strength of each, and `iw dev <interface>
+# survey dump` reports how much of the time each channel the radio has
+# visited was busy.  Every candidate channel is scored from those: each BSS
+# on or next to it adds to the score, more for stronger signals and for
+# closer channels (2.4GHz channels five or more apart don't overlap), and the
+# fraction of the time it was measured busy adds on top.  The lowest score
+# wins, with the three channels that don't overlap each other (1, 6 and 11)
+# preferred.  If the mesh's own ESSID is heard, its channel is proposed
+# regardless, because nodes on different channels can't hear each other at
+# all.
+#
+# A node with several mesh radios gets the most out of them when they're on
+# channels that don't overlap, so they aren't all sharing one collision
+# domain.  Channels that overlap the node's other mesh radios are avoided.
+#
+# Scanning takes a few seconds and takes the interface off its channel while
+# it does, so results are cached per interface for a while and the wizard
+# reuses them.
+
+# Import modules.
+import logging
+import re
+import subprocess
+import threading
+import time
+
+IW = '/usr/sbin/iw'
+
+# Channels the planner picks from: the ones every regulatory domain allows.
+candidate_channels = list(range(1, 12))
+
+# 2.4GHz channels this far apart or further don't overlap.
+overlap_distance = 5
+
+# Channels that don't overlap each other, which are preferred when nothing
+# else sets channels apart.
+preferred_channels = [1, 6, 11]
+
+# The channel Byzantium nodes have always used by default.  A node's first
+# mesh radio is proposed this one when there's no scan to go on, so that new
+# nodes can hear old ones.
+default_channel = 3
+
+# How much a channel that's busy all of the time adds to its score,
+# compared to a strong BSS right on it (which adds 2).
+utilisation_weight = 4.0
+
+# Signal levels, in dBm, that count as nothing and as as strong as it gets.
+weakest_signal = -95.0
+strongest_signal = -35.0
+
+# How long scan results are reused, in seconds.
+default_ttl = 300
+
+bss_line = re.compile(r'^BSS ([0-9a-fA-F:]{17})')
+
+
+# Converts a frequency in MHz to an 802.11b/g channel number.  Returns None
+# for frequencies outside of the 2.4GHz band.
+def frequency_channel(frequency):
+    frequency = int(round(frequency))
+    if frequency == 2484:
+        return 14
+    if 2412 <= frequency <= 2472:
+        return (frequency - 2407) // 5
+    return None
+
+
+# Parses the output of `iw dev <interface> scan`.  Returns a list of dicts,
+# one per BSS, with its BSSID, frequency (MHz), signal (dBm, or None), SSID
+# and whether it's an ad-hoc (IBSS) cell.
+def parse_scan(lines):
+    bsses = []
+    bss = None
+    for line in lines:
+        match = bss_line.match(line)
+        if match:
+            bss = {'bssid': match.group(1).lower(), 'frequency': None,
+                   'signal': None, 'ssid': '', 'ibss': False}
+            bsses.append(bss)
+            continue
+        if bss is None:
+            continue
+        key, _, value = line.strip().partition(':')
+        value = value.strip()
+        try:
+            if key == 'freq':
+                bss['frequency'] = float(value)
+            elif key == 'signal':
+                bss['signal'] = float(value.split()[0])
+        except (ValueError, IndexError):
+            continue
+        if key == 'SSID':
+            bss['ssid'] = value
+        elif key == 'capability':
+            bss['ibss'] = 'IBSS' in value.split()
+    return bsses
+
+
+# Parses the output of `iw dev <interface> survey dump`.  Returns a dict
+# mapping frequencies (MHz) to the fraction of the time they were busy, for
+# the channels the driver measured.
+def parse_survey(lines):
+    utilisation = {}
+    frequency = None
+    times = {}
+
+    def finish():
+        if frequency is not None and times.get('active'):
+            utilisation[frequency] = min(times.get('busy', 0) / float(times['active']), 1.0)
+
+    for line in lines:
+        key, _, value = line.strip().partition(':')
+        value = value.split()
+        if line.startswith('Survey data'):
+            finish()
+            frequency = None
+            times = {}
+        elif key == 'frequency' and value:
+            try:
+                frequency = int(value[0])
+            except ValueError:
+                frequency = None
+        elif key in ('channel active time', 'channel busy time') and value:
+            try:
+                times[key.split()[1]] = int(value[0])
+            except ValueError:
+                continue
+    finish()
+    return utilisation
+
+
+# Returns True if two channels overlap.
+def overlaps(channel, other):
+    return abs(int(channel) - int(other)) < overlap_distance
+
+
+# Proposes a channel without scanning.  Takes the channels of the node's
+# other mesh radios.  The default channel is proposed if it doesn't overlap
+# any of them, then the first preferred channel that doesn't, then the first
+# candidate that doesn't.  Always proposing the same one means nodes that
+# are set up the same way end up on the same channels.
+def propose_channel(avoid=()):
+    for channel in [default_channel] + preferred_channels + candidate_channels:
+        if not [i for i in avoid if overlaps(channel, i)]:
+            return channel
+    return default_channel
+
+
+# Turns a signal level into a weight between 0 and 1.  BSSes whose signal
+# wasn't reported count as middling.
+def signal_weight(signal):
+    if signal is None:
+        return 0.5
+    weight = (signal - weakest_signal) / (strongest_signal - weakest_signal)
+    return min(max(weight, 0.0), 1.0)
+
+
+# Scores the candidate channels.  Takes the BSSes and utilisation from a
+# scan and survey, and the mesh's ESSID.  Returns a list of dicts, one per
+# candidate channel in order, with the channel, its score (lower is better),
+# the number of BSSes on it or overlapping it, the strongest of their
+# signals, its measured utilisation (None if it wasn't measured) and whether
+# the mesh was heard on it.
+def score_channels(bsses, utilisation, essid=None, channels=None):
+    if channels is None:
+        channels = candidate_channels
+    busy = dict([(frequency_channel(f), u) for f, u in utilisation.items()])
+    scores = []
+    for channel in channels:
+        score = 0.0
+        count = 0
+        strongest = None
+        mesh = False
+        for bss in bsses:
+            other = frequency_channel(bss['frequency'] or 0)
+            if other is None or abs(other - channel) >= overlap_distance:
+                continue
+            if essid and bss['ssid'] == essid and bss['ibss']:
+                mesh = mesh or other == channel
+                continue
+            count += 1
+            overlap = 1 - abs(other - channel) / float(overlap_distance)
+            score += overlap * (1 + signal_weight(bss['signal']))
+            if bss['signal'] is not None and (strongest is None or bss['signal'] > strongest):
+                strongest = bss['signal']
+        if busy.get(channel) is not None:
+            score += utilisation_weight * busy[channel]
+        scores.append({'channel': channel, 'score': round(score, 3),
+                       'bsses': count, 'strongest': strongest,
+                       'utilisation': busy.get(channel), 'mesh': mesh})
+    return scores
+
+
+# Picks a channel from a list of scores.  Channels that overlap any in avoid
+# (the channels of the node's other mesh radios) are left out unless there's
+# nothing else.  The mesh's own channel wins if it was heard.  Otherwise the
+# lowest scoring channel does, with ties going to the preferred channels and
+# then to the lowest channel.  Returns the chosen score dict, or None if
+# there aren't any.
+def best_channel(scores, avoid=()):
+    usable = [i for i in scores if not [j for j in avoid if overlaps(i['channel'], j)]]
+    for score in usable:
+        if score['mesh']:
+            return score
+    pool = usable or scores
+    if not pool:
+        return None
+    return min(pool, key=lambda i: (i['score'], i['channel'] not in preferred_channels, i['channel']))
+
+
+class ChannelPlanner(object):
+
+    def __init__(self, test=False, ttl=default_ttl, iw=IW):
+        self.test = test
+        self.ttl = ttl
+        self.iw = iw
+
+        # The results of the last scan of each interface: when it was made,
+        # the BSSes heard and the utilisation measured.
+        self.scans = {}
+
+        # When the last scan of each interface failed, if it did.
+        self.failures = {}
+        self.lock = threading.Lock()
+
+    # Runs one iw command and returns its output as a list of lines, or None
+    # if it failed.
+    def run_iw(self, interface, args):
+        command = [self.iw, 'dev', interface] + args
+        if self.test:
+            logging.debug("Pretending to run %s.", ' '.join(command))
+            return []
+        try:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE)
+            output, errors = process.communicate()
+        except OSError as ex:
+            logging.error("Unable to run %s: %s", self.iw, ex)
+            return None
+        if process.returncode:
+            logging.error("%s failed: %s", ' '.join(command), errors.strip())
+            return None
+        return output.splitlines()
+
+    # Returns the BSSes and utilisation near an interface, from the cache if
+    # it was scanned less than ttl seconds ago (unless refresh is set).
+    # Returns None if the interface couldn't be scanned: hearing nothing
+    # because the scan failed isn't the same as the air being empty, so that
+    # isn't cached (and a previous scan is forgotten).  Not every driver can
+    # do a survey, so utilisation is left out if it fails.
+    def scan(self, interface, refresh=False):
+        now = time.time()
+        with self.lock:
+            cached = self.scans.get(interface)
+            if cached and not refresh and now - cached[0] < self.ttl:
+                return cached[1], cached[2]
+
+        logging.debug("Scanning for wireless networks near %s.", interface)
+        lines = self.run_iw(interface, ['scan'])
+        if lines is None:
+            with self.lock:
+                self.scans.pop(interface, None)
+                self.failures[interface] = time.time()
+            return None
+        bsses = parse_scan(lines)
+        utilisation = parse_survey(self.run_iw(interface, ['survey', 'dump']) or [])
+        with self.lock:
+            self.scans[interface] = (time.time(), bsses, utilisation)
+            self.failures.pop(interface, None)
+        return bsses, utilisation
+
+    # Returns the time of the last scan of an interface if it's still fresh,
+    # otherwise None.
+    def scanned(self, interface):
+        with self.lock:
+            cached = self.scans.get(interface)
+        if cached and time.time() - cached[0] < self.ttl:
+            return cached[0]
+        return None
+
+    # Returns the time of the last scan of an interface if it failed and that
+    # was recently, otherwise None.
+    def failed(self, interface):
+        with self.lock:
+            failure = self.failures.get(interface)
+        if failure and time.time() - failure < self.ttl:
+            return failure
+        return None
+
+    # Works out the best channel for the mesh on an interface.  Takes the
+    # channels of the node's other mesh radios to stay away from.  Returns the
+    # chosen score dict (see score_channels()) and the scores of all of the
+    # candidates, or None and no scores if the interface couldn't be scanned.
+    def plan(self, interface, essid=None, refresh=False, avoid=()):
+        result = self.scan(interface, refresh)
+        if result is None:
+            return None, []
+        bsses, utilisation = result
+        scores = score_channels(bsses, utilisation, essid)
+        return best_channel(scores, avoid), scores
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# channelplanner_test.py
+
+import unittest
+from flexmock import flexmock
+import channelplanner
+
+SCAN = """BSS 00:11:22:33:44:55(on wlan0)
+	TSF: 1234 usec (0d, 00:00:00)
+	freq: 2412
+	beacon interval: 100 TUs
+	capability: ESS Privacy ShortSlotTime (0x0411)
+	signal: -40.00 dBm
+	last seen: 120 ms ago
+	SSID: CoffeeShop
+	DS Parameter set: channel 1
+BSS 66:77:88:99:aa:bb(on wlan0)
+	freq: 2437.0
+	capability: ESS (0x0001)
+	signal: -90.00 dBm
+	SSID: FarAway
+BSS 02:ca:ff:ee:ba:be(on wlan0)
+	freq: 2462
+	capability: IBSS (0x0002)
+	signal: -60.00 dBm
+	SSID: Byzantium
+""".splitlines()
+
+SURVEY = """Survey data from wlan0
+	frequency:			2412 MHz
+	noise:				-95 dBm
+	channel active time:		200 ms
+	channel busy time:		150 ms
+Survey data from wlan0
+	frequency:			2437 MHz [in use]
+	channel active time:		400 ms
+	channel busy time:		40 ms
+Survey data from wlan0
+	frequency:			5180 MHz
+""".splitlines()
+
+
+class ChannelPlannerTest(unittest.TestCase):
+
+    def test_parse_scan(self):
+        bsses = channelplanner.parse_scan(SCAN)
+        self.assertEqual(3, len(bsses))
+        self.assertEqual({'bssid': '00:11:22:33:44:55', 'frequency': 2412.0,
+                          'signal': -40.0, 'ssid': 'CoffeeShop', 'ibss': False},
+                         bsses[0])
+        self.assertTrue(bsses[2]['ibss'])
+
+    def test_parse_survey(self):
+        self.assertEqual({2412: 0.75, 2437: 0.1}, channelplanner.parse_survey(SURVEY))
+
+    def test_frequency_channel(self):
+        self.assertEqual(1, channelplanner.frequency_channel(2412))
+        self.assertEqual(14, channelplanner.frequency_channel(2484))
+        self.assertEqual(None, channelplanner.frequency_channel(5180))
+
+    def test_scores(self):
+        scores = channelplanner.score_channels(channelplanner.parse_scan(SCAN),
+                                               channelplanner.parse_survey(SURVEY))
+        by_channel = dict([(i['channel'], i) for i in scores])
+        # A strong, busy network right on channel 1.
+        self.assertEqual(1, by_channel[1]['bsses'])
+        self.assertEqual(-40.0, by_channel[1]['strongest'])
+        self.assertEqual(0.75, by_channel[1]['utilisation'])
+        self.assertTrue(by_channel[1]['score'] > by_channel[6]['score'])
+        # Channels five apart don't overlap, so only the weak network on 6
+        # itself counts there.
+        self.assertEqual(1, by_channel[6]['bsses'])
+        self.assertEqual(-90.0, by_channel[6]['strongest'])
+        # Without the mesh's ESSID, the ad-hoc cell counts like any other
+        # network.
+        self.assertEqual(1, by_channel[11]['bsses'])
+        # Channel 7, in between the networks on 6 and 11, scores lowest.
+        self.assertTrue(by_channel[7]['score'] < by_channel[6]['score'])
+        best = channelplanner.best_channel(scores)
+        self.assertFalse(best['mesh'])
+        self.assertEqual(7, best['channel'])
+
+    def test_first_radio_gets_the_quietest_channel(self):
+        scores = channelplanner.score_channels(channelplanner.parse_scan(SCAN),
+                                               channelplanner.parse_survey(SURVEY))
+        best = channelplanner.best_channel(scores)
+        # The default channel isn't forced on a node's only radio.
+        self.assertNotEqual(channelplanner.default_channel, best['channel'])
+        self.assertEqual(min([i['score'] for i in scores]), best['score'])
+
+    def test_ties_go_to_preferred_channels(self):
+        scores = [{'channel': i, 'score': 1.0, 'mesh': False} for i in range(4, 9)]
+        self.assertEqual(6, channelplanner.best_channel(scores)['channel'])
+
+    def test_other_radios_are_avoided(self):
+        scores = channelplanner.score_channels(channelplanner.parse_scan(SCAN),
+                                               channelplanner.parse_survey(SURVEY))
+        self.assertEqual(9, channelplanner.best_channel(scores, avoid=[4])['channel'])
+        self.assertEqual(5, channelplanner.best_channel(scores, avoid=[11])['channel'])
+        # Unless there's nowhere else to go, in which case it's the quietest
+        # of all.
+        self.assertEqual(7, channelplanner.best_channel(scores, avoid=[1, 6, 11])['channel'])
+
+    def test_propose_channel(self):
+        self.assertEqual(3, channelplanner.propose_channel())
+        self.assertEqual(11, channelplanner.propose_channel([3]))
+        self.assertEqual(1, channelplanner.propose_channel([6, 11]))
+        self.assertEqual(3, channelplanner.propose_channel([1, 6, 11]))
+
+    def test_the_mesh_channel_wins(self):
+        scores = channelplanner.score_channels(channelplanner.parse_scan(SCAN), {}, 'Byzantium')
+        best = channelplanner.best_channel(scores)
+        self.assertEqual(11, best['channel'])
+        self.assertTrue(best['mesh'])
+        self.assertEqual(0, best['bsses'])
+        # Not if another of the node's radios is next to it, though.
+        self.assertNotEqual(11, channelplanner.best_channel(scores, avoid=[9])['channel'])
+
+    def test_scans_are_cached(self):
+        planner = channelplanner.ChannelPlanner(ttl=60)
+        flexmock(planner).should_receive('run_iw').with_args('wlan0', ['scan']).and_return(SCAN).twice
+        flexmock(planner).should_receive('run_iw').with_args('wlan0', ['survey', 'dump']).and_return(SURVEY).twice
+        self.assertEqual(None, planner.scanned('wlan0'))
+        planner.plan('wlan0')
+        planner.plan('wlan0')
+        self.assertTrue(planner.scanned('wlan0'))
+        planner.plan('wlan0', refresh=True)
+
+        # Once the results are stale, the next plan scans again.
+        planner.ttl = 0
+        self.assertEqual(None, planner.scanned('wlan0'))
+
+    def test_failed_scans_are_not_cached(self):
+        planner = channelplanner.ChannelPlanner(ttl=60)
+        flexmock(planner).should_receive('run_iw').with_args('wlan0', ['scan']).and_return(SCAN).and_return(None)
+        flexmock(planner).should_receive('run_iw').with_args('wlan0', ['survey', 'dump']).and_return(None)
+        # A survey failing isn't fatal: the scan still counts.
+        self.assertEqual({}, planner.scan('wlan0')[1])
+        self.assertTrue(planner.scanned('wlan0'))
+        self.assertEqual(None, planner.failed('wlan0'))
+
+        # A scan failing is, and the previous one is forgotten.
+        self.assertEqual(None, planner.scan('wlan0', refresh=True))
+        self.assertEqual(None, planner.scanned('wlan0'))
+        self.assertTrue(planner.failed('wlan0'))
+        flexmock(planner).should_receive('run_iw').and_return(None)
+        self.assertEqual((None, []), planner.plan('wlan0'))
+
+    def test_iw_failing(self):
+        planner = channelplanner.ChannelPlanner()
+        process = flexmock(returncode=255, communicate=lambda: ('', 'command failed: Network is down (-100)\n'))
+        flexmock(channelplanner.subprocess).should_receive('Popen').and_return(process)
+        self.assertEqual(None, planner.run_iw('wlan0', ['scan']))
+        flexmock(channelplanner.subprocess).should_receive('Popen').and_raise(OSError(2, 'No such file or directory'))
+        self.assertEqual(None, planner.run_iw('wlan0', ['scan']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+# clienttraffic.py - Keeps track of how much traffic each of the node's
+#    clients is sending and receiving, so that the admin can see who is using
+#    the uplink.
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# The captive portal whitelists clients by MAC address with one rule each in
+# the 'internet' chain of the mangle table, and counts traffic headed to them
+# with one rule per IP address in the 'clients' chain (see captive-portal.sh).
+# Every interval a single `iptables -L` dumps the counters of all of those
+# rules at once.  The difference from the previous dump gives each client's
+# rates, which go into a fixed-size ring buffer per client.  Picking the top
+# talkers uses a heap, so the cost of a page view grows with the number of
+# clients rather than with the number of clients squared.
+
+# Import modules.
+from cherrypy.process.plugins import Monitor
+
+import collections
+import heapq
+import logging
+import subprocess
+import threading
+import time
+
+# Dumps every chain in the mangle table with exact byte counts.
+IPTABLES = ['/usr/sbin/iptables', '-t', 'mangle', '-L', '-n', '-v', '-x']
+
+
+# Parses the output of `iptables -L -n -v -x`.  Returns a dict mapping chain
+# names to lists of rules, each of which is a dict with the rule's byte count,
+# source, destination and the rest of the line (which is where the MAC match
+# shows up).
+def parse_iptables(lines):
+    chains = {}
+    chain = None
+    for line in lines:
+        fields = line.split()
+        if not fields:
+            continue
+        if fields[0] == 'Chain':
+            chain = chains.setdefault(fields[1], [])
+            continue
+        if chain is None or fields[0] == 'pkts' or len(fields) < 8:
+            continue
+        # pkts bytes target prot opt in out source destination [extra]
+        # The target is missing from rules that only count.
+        if fields[2] in ('all', 'tcp', 'udp', 'icmp') or fields[2].isdigit():
+            fields.insert(2, '')
+        if len(fields) < 9:
+            continue
+        chain.append({'bytes': int(fields[1]), 'source': fields[7],
+                      'destination': fields[8], 'extra': fields[9:]})
+    return chains
+
+
+# Pulls the per-client counters out of a dump of the mangle table.  Returns
+# two dicts: bytes received from each client keyed by MAC address, and bytes
+# sent to each client keyed by IP address.
+def client_counters(chains):
+    received = {}
+    for rule in chains.get('internet', []):
+        extra = rule['extra']
+        if 'MAC' in extra and extra.index('MAC') + 1 < len(extra):
+            mac = extra[extra.index('MAC') + 1].lower()
+            received[mac] = received.get(mac, 0) + rule['bytes']
+    sent = {}
+    for rule in chains.get('clients', []):
+        if rule['destination'] != '0.0.0.0/0':
+            address = rule['destination'].split('/')[0]
+            sent[address] = sent.get(address, 0) + rule['bytes']
+    return received, sent
+
+
+# Reads the kernel's ARP table and returns a dict mapping IP addresses to MAC
+# addresses.  If an interface is given, only its neighbours are returned.
+def read_arp_table(injected_open=open, interface=None):
+    table = {}
+    try:
+        arp = injected_open('/proc/net/arp', 'r')
+    except IOError:
+        return table
+    for line in list(arp)[1:]:
+        fields = line.split()
+        if len(fields) < 4 or fields[3] == '00:00:00:00:00:00':
+            continue
+        if interface and (len(fields) < 6 or fields[5] != interface):
+            continue
+        table[fields[0]] = fields[3].lower()
+    arp.close()
+    return table
+
+
+class ClientTraffic(Monitor):
+
+    def __init__(self, bus, frequency=30, history=120):
+        Monitor.__init__(self, bus, self.tick, frequency, name='ClientTraffic')
+
+        # Each client gets a ring buffer of (timestamp, bytes received, bytes
+        # sent) for every interval, enough to cover an hour by default.
+        self.history = history
+        self.clients = {}
+        self.addresses = {}
+        self.lock = threading.Lock()
+
+        # Counters from the previous dump, to take differences against.
+        self.last_received = {}
+        self.last_sent = {}
+        self.last_time = 0
+
+    # Dumps the counters once and turns them into per-client samples.
+    def tick(self):
+        try:
+            output = subprocess.Popen(IPTABLES, stdout=subprocess.PIPE).stdout
+            chains = parse_iptables(output.readlines())
+        except OSError as ex:
+            logging.debug("Unable to dump iptables counters: %s", ex)
+            return
+        self.update(chains, read_arp_table(), time.time())
+
+    def update(self, chains, arp_table, now):
+        received, sent = client_counters(chains)
+
+        # Traffic to clients is counted per IP address; charge it to the MAC
+        # address that address belongs to right now.
+        sent_by_mac = {}
+        addresses = {}
+        for address, count in sent.items():
+            mac = arp_table.get(address)
+            if mac:
+                sent_by_mac[mac] = sent_by_mac.get(mac, 0) + count
+                addresses[mac] = address
+
+        with self.lock:
+            if self.last_time:
+                for mac in set(received) | set(sent_by_mac):
+                    rx = received.get(mac, 0) - self.last_received.get(mac, 0)
+                    tx = sent_by_mac.get(mac, 0) - self.last_sent.get(mac, 0)
+                    # Counters go backwards when a client's rule is removed and
+                    # added again.
+                    if rx < 0:
+                        rx = received.get(mac, 0)
+                    if tx < 0:
+                        tx = sent_by_mac.get(mac, 0)
+                    if mac not in self.clients:
+                        self.clients[mac] = collections.deque(maxlen=self.history)
+                    self.clients[mac].append((now, rx, tx))
+
+            # Forget clients that are no longer in the firewall at all.
+            for mac in set(self.clients) - set(received) - set(sent_by_mac):
+                del self.clients[mac]
+            self.addresses.update(addresses)
+            for mac in set(self.addresses) - set(self.clients):
+                del self.addresses[mac]
+
+            self.last_received = received
+            self.last_sent = sent_by_mac
+            self.last_time = now
+
+    # Returns the top count clients by total traffic over the last window
+    # seconds, as a list of dicts with the client's MAC and IP addresses and
+    # its average receive and transmit rates in bytes per second.
+    def top(self, window=300, count=10, now=None):
+        if now is None:
+            now = time.time()
+        since = now - window
+        totals = []
+        with self.lock:
+            for mac, samples in self.clients.items():
+                rx = 0
+                tx = 0
+                # Samples are in time order, so walk back from the newest.
+                for timestamp, sample_rx, sample_tx in reversed(samples):
+                    if timestamp <= since:
+                        break
+                    rx += sample_rx
+                    tx += sample_tx
+                if rx or tx:
+                    totals.append((rx + tx, rx, tx, mac, self.addresses.get(mac, '')))
+        top = heapq.nlargest(count, totals)
+        return [{'mac': mac, 'ip_address': address,
+                 'rx_rate': rx / float(window), 'tx_rate': tx / float(window)}
+                for _, rx, tx, mac, address in top]
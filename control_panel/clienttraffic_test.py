@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# clienttraffic_test.py
+
+import unittest
+import clienttraffic
+
+
+IPTABLES = ['Chain PREROUTING (policy ACCEPT 0 packets, 0 bytes)\n',
+            '    pkts      bytes target     prot opt in     out     source               destination         \n',
+            '    1000   200000 internet   all  --  wlan0  *       0.0.0.0/0            0.0.0.0/0           \n',
+            '\n',
+            'Chain clients (1 references)\n',
+            '    pkts      bytes target     prot opt in     out     source               destination         \n',
+            '      40    60000 RETURN     all  --  *      *       0.0.0.0/0            10.0.0.23           \n',
+            '       2      100            all  --  *      *       0.0.0.0/0            10.0.0.42           \n',
+            '\n',
+            'Chain internet (1 references)\n',
+            '    pkts      bytes target     prot opt in     out     source               destination         \n',
+            '      10     3000 RETURN     all  --  *      *       0.0.0.0/0            0.0.0.0/0            MAC 00:11:22:33:44:55 \n',
+            '      20     9000 RETURN     all  --  *      *       0.0.0.0/0            0.0.0.0/0            MAC AA:BB:CC:DD:EE:FF \n',
+            '     500    70000 MARK       all  --  *      *       0.0.0.0/0            0.0.0.0/0            MARK set 0x63\n']
+
+ARP = {'10.0.0.23': '00:11:22:33:44:55', '10.0.0.42': 'aa:bb:cc:dd:ee:ff'}
+
+
+# Builds an iptables dump with the given byte counts for the two clients.
+def dump(rx1, tx1, rx2, tx2):
+    return clienttraffic.parse_iptables(
+        ['Chain clients (1 references)\n',
+         '0 %d RETURN all -- * * 0.0.0.0/0 10.0.0.23\n' % tx1,
+         '0 %d RETURN all -- * * 0.0.0.0/0 10.0.0.42\n' % tx2,
+         'Chain internet (1 references)\n',
+         '0 %d RETURN all -- * * 0.0.0.0/0 0.0.0.0/0 MAC 00:11:22:33:44:55\n' % rx1,
+         '0 %d RETURN all -- * * 0.0.0.0/0 0.0.0.0/0 MAC AA:BB:CC:DD:EE:FF\n' % rx2])
+
+
+class ClientTrafficTest(unittest.TestCase):
+
+    def setUp(self):
+        self.traffic = clienttraffic.ClientTraffic(None, history=10)
+
+    def test_parse_iptables(self):
+        chains = clienttraffic.parse_iptables(IPTABLES)
+        self.assertEqual(['PREROUTING', 'clients', 'internet'], sorted(chains))
+        self.assertEqual(2, len(chains['clients']))
+        self.assertEqual('10.0.0.42', chains['clients'][1]['destination'])
+        self.assertEqual(100, chains['clients'][1]['bytes'])
+        self.assertEqual(['MAC', 'AA:BB:CC:DD:EE:FF'], chains['internet'][1]['extra'])
+
+    def test_client_counters(self):
+        received, sent = clienttraffic.client_counters(
+            clienttraffic.parse_iptables(IPTABLES))
+        self.assertEqual({'00:11:22:33:44:55': 3000, 'aa:bb:cc:dd:ee:ff': 9000},
+                         received)
+        self.assertEqual({'10.0.0.23': 60000, '10.0.0.42': 100}, sent)
+
+    def test_first_dump_is_only_a_baseline(self):
+        self.traffic.update(dump(100, 100, 100, 100), ARP, 1000)
+        self.assertEqual([], self.traffic.top(300, 10, now=1000))
+
+    def test_top(self):
+        self.traffic.update(dump(0, 0, 0, 0), ARP, 1000)
+        self.traffic.update(dump(3000, 6000, 300, 0), ARP, 1030)
+        self.traffic.update(dump(6000, 12000, 600, 0), ARP, 1060)
+        top = self.traffic.top(60, 10, now=1060)
+        self.assertEqual(['00:11:22:33:44:55', 'aa:bb:cc:dd:ee:ff'],
+                         [i['mac'] for i in top])
+        self.assertEqual('10.0.0.23', top[0]['ip_address'])
+        self.assertEqual(100.0, top[0]['rx_rate'])
+        self.assertEqual(200.0, top[0]['tx_rate'])
+        self.assertEqual(1, len(self.traffic.top(60, 1, now=1060)))
+
+        # Only the samples inside the window count.
+        top = self.traffic.top(30, 10, now=1060)
+        self.assertEqual(100.0, top[0]['rx_rate'])
+
+    def test_counter_reset(self):
+        self.traffic.update(dump(5000, 0, 0, 0), ARP, 1000)
+        self.traffic.update(dump(300, 0, 0, 0), ARP, 1030)
+        self.assertEqual(10.0, self.traffic.top(30, 10, now=1030)[0]['rx_rate'])
+
+    def test_history_is_bounded(self):
+        for i in range(50):
+            self.traffic.update(dump(i * 100, 0, 0, 0), ARP, 1000 + i * 30)
+        self.assertEqual(10, len(self.traffic.clients['00:11:22:33:44:55']))
+
+    def test_vanished_clients_are_forgotten(self):
+        self.traffic.update(dump(0, 0, 0, 0), ARP, 1000)
+        self.traffic.update(dump(300, 0, 300, 0), ARP, 1030)
+        chains = clienttraffic.parse_iptables(
+            ['Chain internet (1 references)\n',
+             '0 600 RETURN all -- * * 0.0.0.0/0 0.0.0.0/0 MAC 00:11:22:33:44:55\n'])
+        self.traffic.update(chains, ARP, 1060)
+        self.assertEqual(['00:11:22:33:44:55'], sorted(self.traffic.clients))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+# downsample.py - Reduces a time series to a fixed number of points while
+#    keeping its visual shape, so that the browser can draw long stretches of
+#    traffic history without the node sending (or rendering) every sample.
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# Implements Largest-Triangle-Three-Buckets (Sveinn Steinarsson, "Downsampling
+# Time Series for Visual Representation", 2013).  The series is split into
+# buckets and from each bucket the point that forms the largest triangle with
+# the point picked from the previous bucket and the average of the next bucket
+# is kept.  Unlike averaging, this keeps peaks and dips.
+
+# If NumPy is installed the points in each bucket are scored as one array
+# operation; otherwise the same thing is done in pure Python.
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Works out the boundaries of the buckets.  The first and last points are
+# always kept and get buckets of their own; the rest are split evenly into
+# threshold - 2 buckets.  Returns a list of (start, end) index pairs.
+def bucket_bounds(length, threshold):
+    every = (length - 2) / float(threshold - 2)
+    bounds = []
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = min(int((i + 1) * every) + 1, length - 1)
+        bounds.append((start, max(end, start + 1)))
+    bounds.append((length - 1, length))
+    return bounds
+
+
+# Returns the indices of the points to keep, in order.  Takes the x and y
+# values as sequences of equal length and the number of points wanted.
+def lttb(x, y, threshold):
+    length = len(x)
+    if threshold >= length or threshold < 3:
+        return list(range(length))
+    if numpy is not None:
+        return _lttb_numpy(x, y, threshold)
+    return _lttb_python(x, y, threshold)
+
+
+def _lttb_python(x, y, threshold):
+    bounds = bucket_bounds(len(x), threshold)
+    indices = [0]
+    a = 0
+    for i in range(len(bounds) - 1):
+        start, end = bounds[i]
+        next_start, next_end = bounds[i + 1]
+        count = float(next_end - next_start)
+        avg_x = sum(x[next_start:next_end]) / count
+        avg_y = sum(y[next_start:next_end]) / count
+
+        best_area = -1.0
+        best = start
+        for j in range(start, end):
+            area = abs((x[a] - avg_x) * (y[j] - y[a]) -
+                       (x[a] - x[j]) * (avg_y - y[a]))
+            if area > best_area:
+                best_area = area
+                best = j
+        indices.append(best)
+        a = best
+    indices.append(len(x) - 1)
+    return indices
+
+
+def _lttb_numpy(x, y, threshold):
+    x = numpy.asarray(x, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+    bounds = bucket_bounds(len(x), threshold)
+    indices = [0]
+    a = 0
+    for i in range(len(bounds) - 1):
+        start, end = bounds[i]
+        next_start, next_end = bounds[i + 1]
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        areas = numpy.abs((x[a] - avg_x) * (y[start:end] - y[a]) -
+                          (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(areas.argmax())
+        indices.append(a)
+    indices.append(len(x) - 1)
+    return indices
+
+
+# Convenience wrapper: takes a list of (x, y) pairs and returns the pairs that
+# survive downsampling.
+def downsample(points, threshold):
+    if len(points) <= threshold:
+        return list(points)
+    x = [i[0] for i in points]
+    y = [i[1] for i in points]
+    return [points[i] for i in lttb(x, y, threshold)]
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# downsample_test.py
+
+import math
+import unittest
+import downsample
+
+
+class LTTBTest(unittest.TestCase):
+
+    def setUp(self):
+        self.x = range(1000)
+        self.y = [math.sin(i / 50.0) for i in self.x]
+
+    def test_lttb_returns_everything_when_under_threshold(self):
+        self.assertEqual(range(10), downsample.lttb(range(10), range(10), 20))
+
+    def test_lttb_returns_threshold_points(self):
+        self.assertEqual(100, len(downsample.lttb(self.x, self.y, 100)))
+
+    def test_lttb_keeps_endpoints_in_order(self):
+        indices = downsample.lttb(self.x, self.y, 50)
+        self.assertEqual(0, indices[0])
+        self.assertEqual(999, indices[-1])
+        self.assertEqual(sorted(indices), indices)
+
+    def test_lttb_keeps_spikes(self):
+        y = [0.0] * 1000
+        y[537] = 100.0
+        self.assertTrue(537 in downsample.lttb(self.x, y, 20))
+
+    def test_python_and_numpy_agree(self):
+        if downsample.numpy is None:
+            return
+        self.assertEqual(downsample._lttb_python(self.x, self.y, 77),
+                         downsample._lttb_numpy(self.x, self.y, 77))
+
+    def test_downsample_pairs(self):
+        points = zip(self.x, self.y)
+        result = downsample.downsample(points, 30)
+        self.assertEqual(30, len(result))
+        self.assertEqual(points[0], result[0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -11,89 +11,21 @@
 # - Add code to configure encryption on wireless gateways.
 # - Make it possible to specify IP configuration information on a wireless
 #   uplink.
-# - Add code to update_network_interfaces() to delete interfaces from the
-#   database if they don't exist anymore.
+# - Add code to inventory.py to delete interfaces from the database if they
+#   don't exist anymore.
 
+import copy
 import logging
-import sqlite3
 import subprocess
-import time
 
 import _utils
+import addressing
+import inventory
+import jobs
+import netlink
 import networkconfiguration
 
 
-def audit_procnetdev(procnetdev):
-    if procnetdev:
-        logging.debug("Successfully opened /proc/net/dev.")
-    else:
-        # Note: This means that we use the contents of the database.
-        logging.debug("Warning: Unable to open /proc/net/dev.")
-        return False
-
-    # Smoke test by trying to read the first two lines from the pseudofile
-    # (which comprises the column headers.  If this fails, just return
-    # because we're falling back on the existing contents of the database.
-    headers = procnetdev.readline()
-    headers = procnetdev.readline()
-    if not headers:
-        logging.debug("Smoke test of /proc/net/dev read failed.")
-        procnetdev.close()
-        return False
-    return True
-    
-    
-def build_interfaces(interfaces, procnetdev):
-    for line in procnetdev:
-        interface = line.split()[0]
-        interface = interface.strip()
-        interface = interface.strip(':')
-        interfaces.append(interface)
-    return interfaces
-
-
-def check_for_wired_interface(interface, cursor):
-    template = (interface,)
-    logging.debug("Checking to see if interface %s is a known wired interface...", interface)
-    cursor.execute("SELECT interface FROM wired WHERE interface=?;", template)
-    result = cursor.fetchall()
-    if not result:
-        logging.debug("Interface %s isn't a known wired interface.  Checking wireless interfaces...",
-                      interface)
-        return ''
-    else:
-        logging.debug("Interface %s is a known wired interface.", interface)
-        return 'wired'
-
-
-def check_for_wireless_interface(interface, cursor):
-    template = (interface,)
-    cursor.execute("SELECT mesh_interface FROM wireless WHERE mesh_interface=?;", template)
-    result = cursor.fetchall()
-
-    # If it's not in there, either, figure out which table it
-    # has to go in.
-    if not result:
-        logging.debug("%s isn't a known wireless interface, either.  Figuring out where it has to go...", 
-                      interface)
-    else:
-        logging.debug("%s is a known wireless interface.", interface)
-        return 'wireless'
-
-
-def check_wireless_table(interface):
-    table = False
-    procnetwireless = open('/proc/net/wireless', 'r')
-    procnetwireless.readline()
-    procnetwireless.readline()
-    for line in procnetwireless:
-        if interface in line:
-            logging.debug("Goes in wireless table.")
-            table = True
-    procnetwireless.close()
-    return table
-
-
 # Classes.
 # This class allows the user to turn a configured network interface on their
 # node into a gateway from the mesh to another network (usually the global Net).
@@ -131,18 +63,28 @@ class Gateways(object):
         self.hosts_file = '/etc/hosts.mesh'
         self.dnsmasq_include_file = '/etc/dnsmasq.conf.include'
 
+        # The network interfaces on the node.
+        self.inventory = inventory.shared_inventory(self.netconfdb, self.test)
+
     # Pretends to be index.html.
     def index(self):
         ethernet_buttons = ""
         wireless_buttons = ""
 
-        # To find any new network interfaces, rescan the network interfaces on
-        # the node.
-        self.update_network_interfaces()
+        # Make sure every network interface on the node is in the database.
+        # The inventory keeps it up to date from then on.
+        self.inventory.load()
+
+        # Wired interfaces that are meshing with another node over a cable
+        # can't be gateways as well.
+        query = "SELECT interface FROM meshes WHERE enabled='yes';"
+        connection, cursor = _utils.execute_query(self.meshconfdb, query)
+        meshing = [i[0] for i in cursor.fetchall()]
+        connection.close()
 
         query = "SELECT interface FROM wired WHERE gateway='no';"
         _, cursor = _utils.execute_query(self.netconfdb, query)
-        results = cursor.fetchall()
+        results = [i for i in cursor.fetchall() if i[0] not in meshing]
         if results:
             for interface in results:
                 ethernet_buttons = ethernet_buttons + "<td><input type='submit' name='interface' value='" + interface[0] + "' /></td>\n"
@@ -170,62 +112,6 @@ class Gateways(object):
             _utils.output_error_data()
     index.exposed = True
 
-    # Utility method to update the list of all network interfaces on a node.
-    # New ones detected are added to the network.sqlite database.  Takes no
-    # arguments; returns nothing (but alters the database).
-    def update_network_interfaces(self):
-        logging.debug("Entered Gateways.update_network_interfaces().")
-
-        # Open the kernel's canonical list of network interfaces.
-        procnetdev = open("/proc/net/dev", "r")
-        if not audit_procnetdev(procnetdev):
-            return
-
-        # Open the network configuration database.
-        connection = sqlite3.connect(self.netconfdb)
-        cursor = connection.cursor()
-
-        # Begin parsing the contents of /proc/net/dev to extract the names of
-        # the interfaces.
-        interfaces = []
-        if self.test:
-            logging.debug("Pretending to harvest /proc/net/dev for network interfaces.  Actually using the contents of %s and loopback.", self.netconfdb)
-            return
-        else:
-            interfaces = build_interfaces(interfaces, procnetdev)
-
-            # Walk through the list of interfaces just generated and see if
-            # each one is already in the database.  If it's not, add it.
-            for interface in interfaces:
-
-                # See if it's in the table of wired interfaces.
-                found = check_for_wired_interface(interface, cursor)
-
-                # If it's not in the wired table, check the wireless table.
-                if not found:
-                    found = check_for_wireless_interface(interface, cursor)
-
-                # If it still hasn't been found, figure out where it has to go.
-                if not found:
-                    logging.debug("Interface %s really is new.  Figuring out where it should go.", interface)
-
-                    # Look in /proc/net/wireless.  If it's in there, it
-                    # goes in the wireless table.  Otherwise it goes in
-                    # the wired table.
-                    if check_wireless_table(interface):
-                        template = ('no', interface + ':1', 'no', 0, '', interface , )
-                        cursor.execute("INSERT INTO wireless VALUES (?,?,?,?,?,?);", template)
-                    else:
-                        logging.debug("Goes in wired table.")
-                        template = ('no', 'no', interface, )
-                        cursor.execute("INSERT INTO wired VALUES (?,?,?);", template)
-
-                    connection.commit()
-
-        # Close the network configuration database and return.
-        cursor.close()
-        logging.debug("Leaving Gateways.enumerate_network_interfaces().")
-
     # Implements step two of the wired gateway configuration process: turning
     # the gateway on.  This method assumes that whichever Ethernet interface
     # chosen is already configured via DHCP through ifplugd.
@@ -318,31 +204,43 @@ class Gateways(object):
         cursor.close()
 
     # Method that does the deed of turning an interface into a gateway.  This
+    # is done by a background job; the browser is sent to a page that follows
+    # its progress.
     def activate(self, interface=None):
         logging.debug("Entered Gateways.activate().")
+        gateways = copy.copy(self)
+        jobs.start("Making " + str(interface) + " a gateway",
+                   lambda: gateways.make_gateway(interface),
+                   key=('gateway', interface))
+    activate.exposed = True
+
+    # Does the work of activate().  Returns the rendered results page.
+    def make_gateway(self, interface):
+        logging.debug("Entered Gateways.make_gateway().")
 
         # Test to see if wireless configuration attributes are set, and if they
-        # are, use iwconfig to set up the interface.
+        # are, associate the interface with the access point.
         if self.essid:
-            command = ['/sbin/iwconfig', interface, 'essid', self.essid]
-            logging.debug("Setting ESSID to %s.", self.essid)
+            jobs.report(20, "Connecting " + interface + " to " + self.essid + ".")
+            frequency = None
+            if self.channel:
+                frequency = netlink.channel_frequency(self.channel)
+            logging.debug("Setting ESSID to %s, channel %s.", self.essid, self.channel)
             if self.test:
-                logging.debug("Command to set ESSID:\n%s", ' '.join(command))
+                logging.debug("Pretending to connect %s to %s.", interface, self.essid)
             else:
-                subprocess.Popen(command)
-        if self.channel:
-            command = ['/sbin/iwconfig', interface, 'channel', self.channel]
-            logging.debug("Setting channel %s.", self.channel)
-            if self.test:
-                logging.debug("Command to set channel:\n%s", ' '.join(command))
-            else:
-                subprocess.Popen(command)
+                try:
+                    netlink.connect(interface, self.essid, frequency)
+                except netlink.NetlinkError as ex:
+                    logging.error("Couldn't connect %s to %s: %s", interface, self.essid, ex)
 
         # If we have to configure layers 1 and 2, then it's a safe bet that we
         # should use DHCP to set up layer 3.  This is wrapped in a shell script
         # because of a timing conflict between the time dhcpcd starts, the
         # time dhcpcd gets IP configuration information (or not) and when
         # avahi-daemon is bounced.
+        jobs.checkpoint()
+        jobs.report(50, "Configuring " + interface + " with DHCP.")
         command = ['/usr/local/sbin/gateway.sh', interface]
         logging.debug("Preparing to configure interface %s.", interface)
         if self.test:
@@ -372,83 +270,75 @@ class Gateways(object):
                                interface = interface)
         except:
             _utils.output_error_data()
-    activate.exposed = True
 
-    # Configure the network interface.
+    # Configure the network interface.  Like activate(), this is done in the
+    # background.
     def set_ip(self):
+        jobs.start("Configuring " + self.mesh_interface,
+                   copy.copy(self).configure_interface,
+                   key=('network', self.mesh_interface))
+    set_ip.exposed = True
+
+    # Does the work of set_ip().  Returns the rendered results page.
+    def configure_interface(self):
         # If we've made it this far, the user's decided to (re)configure a
         # network interface.  Full steam ahead, damn the torpedoes!
 
-        # First, take the wireless NIC offline so its mode can be changed.
-        command = ['/sbin/ifconfig', self.mesh_interface, 'down']
-        output = subprocess.Popen(command)
-        time.sleep(5)
-
-        # Wrap this whole process in a loop to ensure that stubborn wireless
-        # interfaces are configured reliably.  The wireless NIC has to make it
-        # all the way through one iteration of the loop without errors before
-        # we can go on.
-        while True:
-            # Set the mode, ESSID and channel.
-            command = ['/sbin/iwconfig', self.mesh_interface, 'mode ad-hoc']
-            output = subprocess.Popen(command)
-            command = ['/sbin/iwconfig', self.mesh_interface, 'essid', self.essid]
-            output = subprocess.Popen(command)
-            command = ['/sbin/iwconfig', self.mesh_interface, 'channel',  self.channel]
-            output = subprocess.Popen(command)
-
-            # Run iwconfig again and capture the current wireless configuration.
-            command = ['/sbin/iwconfig', self.mesh_interface]
-            output = subprocess.Popen(command).stdout
-            configuration = output.readlines()
-
-            # Test the interface by going through the captured text to see if
-            # it's in ad-hoc mode.  If it's not, put it in ad-hoc mode and go
-            # back to the top of the loop to try again.
-            for line in configuration:
-                if 'Mode' in line:
-                    line = line.strip()
-                    mode = line.split(' ')[0].split(':')[1]
-                    if mode != 'Ad-Hoc':
-                        continue
-
-            # Test the ESSID to see if it's been set properly.
-            for line in configuration:
-                if 'ESSID' in line:
-                    line = line.strip()
-                    essid = line.split(' ')[-1].split(':')[1]
-                    if essid != self.essid:
-                        continue
-
-            # Check the wireless channel to see if it's been set properly.
-            for line in configuration:
-                if 'Frequency' in line:
-                    line = line.strip()
-                    frequency = line.split(' ')[2].split(':')[1]
-                    if frequency != self.frequency:
-                        continue
+        # Keep the size of client netblock picked when the interface was set
+        # up, so that dnsmasq isn't put back to a /24.
+        self.client_netmask = addressing.ntoa(addressing.netmask(
+            _utils.get_client_prefix(self.netconfdb, self.mesh_interface)))
+
+        # Put the wireless NIC into ad-hoc mode and join the mesh's cell.
+        # Stubborn wireless interfaces get a few tries: the settings are read
+        # back from the kernel and if they didn't all take, the whole thing is
+        # done again.  (netlink.configure_adhoc() takes the NIC offline to
+        # change its mode.)
+        for attempt in range(3):
+            jobs.checkpoint()
+            jobs.report(20 + 10 * attempt, "Joining the mesh's wireless cell.")
+            try:
+                configuration = netlink.configure_adhoc(self.mesh_interface,
+                                                        self.essid,
+                                                        self.channel)
+            except netlink.NetlinkError as ex:
+                logging.debug("Couldn't configure wireless interface: %s", ex)
+                continue
+            if configuration['iftype'] != netlink.IFTYPE_ADHOC:
+                continue
+            if configuration['essid'] not in (None, self.essid):
+                continue
+            if configuration['frequency'] not in (None, netlink.channel_frequency(self.channel)):
+                continue
 
             # "Victory is mine!"
             # --Stewie, _Family Guy_
             break
 
-        # Call ifconfig and set up the network configuration information.
-        command = ['/sbin/ifconfig', self.mesh_interface, self.mesh_ip,
-                   'netmask', self.mesh_netmask, 'up']
-        output = subprocess.Popen(command)
-        time.sleep(5)
+        # Set up the network configuration information.
+        jobs.checkpoint()
+        jobs.report(60, "Setting the addresses of the mesh and client interfaces.")
+        try:
+            netlink.set_address(self.mesh_interface, self.mesh_ip,
+                                netlink.netmask_length(self.mesh_netmask))
+            netlink.set_link(self.mesh_interface, True)
 
-        # Add the client interface.
-        command = ['/sbin/ifconfig', self.client_interface, self.client_ip, 'up']
-        output = subprocess.Popen(command)
+            # Add the client interface.
+            netlink.set_address(self.client_interface, self.client_ip,
+                                netlink.netmask_length(self.client_netmask))
+        except netlink.NetlinkError as ex:
+            logging.error("Couldn't set IP configuration of %s: %s", self.mesh_interface, ex)
 
         template = ('yes', self.channel, self.essid, self.mesh_interface, self.client_interface, self.mesh_interface)
         _utils.set_wireless_db_entry(self.netconfdb, template)
 
         # Send this information to the methods that write the /etc/hosts and
         # dnsmasq config files.
+        jobs.report(90, "Configuring dnsmasq.")
         networkconfiguration.make_hosts(self.hosts_file, self.test, starting_ip=self.client_ip)
-        networkconfiguration.configure_dnsmasq(self.dnsmasq_include_file, self.test, starting_ip=self.client_ip)
+        networkconfiguration.configure_dnsmasq(self.dnsmasq_include_file, self.test,
+                                               starting_ip=self.client_ip,
+                                               prefix_length=netlink.netmask_length(self.client_netmask))
 
         # Render and display the page.
         try:
@@ -462,5 +352,4 @@ class Gateways(object):
                                client_netmask = self.client_netmask)
         except:
             _utils.output_error_data()
-    set_ip.exposed = True
 
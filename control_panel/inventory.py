@@ -0,0 +1,258 @@
+# inventory.py - Keeps track of the node's network interfaces, so that the
+#    control panel's pages don't have to rescan them every time they're
+#    loaded.
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# When the control panel starts, the kernel is asked for every interface and
+# IPv4 address on the node in one netlink dump each.  After that a background
+# thread listens on the rtnetlink multicast groups for links and addresses
+# coming and going, and applies each change to an in-memory map of the
+# interfaces: whether each one is wired or wireless (worked out once, from
+# sysfs, when it first shows up), whether it's up, and its addresses.  New
+# interfaces are added to network.sqlite in a single transaction per batch of
+# events.  If the kernel drops events because the thread fell behind, the
+# whole inventory is dumped again.
+
+# Import modules.
+import cherrypy
+from cherrypy.process.plugins import SimplePlugin
+
+import errno
+import logging
+import os.path
+import socket
+import sqlite3
+import threading
+
+import netlink
+
+
+# Works out whether an interface is wireless from sysfs.  cfg80211 drivers
+# link their interfaces to a phy; drivers that only implement the old
+# wireless extensions have a wireless/ directory instead.
+def classify(name, exists=os.path.exists):
+    for entry in ('phy80211', 'wireless'):
+        if exists('/sys/class/net/%s/%s' % (name, entry)):
+            return 'wireless'
+    return 'wired'
+
+
+# Adds interfaces that aren't in network.sqlite yet to it, in one
+# transaction.  Takes a list of (name, kind) pairs.  Interfaces that are
+# already there keep their configuration.
+def store(netconfdb, interfaces):
+    wired = [(i, i) for i, kind in interfaces if kind == 'wired']
+    wireless = [(i + ':1', i, i) for i, kind in interfaces if kind == 'wireless']
+    connection = sqlite3.connect(netconfdb)
+    try:
+        with connection:
+            connection.executemany("INSERT INTO wired (enabled, gateway, interface) SELECT 'no', 'no', ? WHERE NOT EXISTS (SELECT 1 FROM wired WHERE interface=?);",
+                                   wired)
+            connection.executemany("INSERT INTO wireless (gateway, client_interface, enabled, channel, essid, mesh_interface) SELECT 'no', ?, 'no', 0, '', ? WHERE NOT EXISTS (SELECT 1 FROM wireless WHERE mesh_interface=?);",
+                                   wireless)
+    finally:
+        connection.close()
+
+
+class Inventory(SimplePlugin):
+
+    def __init__(self, bus, netconfdb, test=False, classify=classify):
+        SimplePlugin.__init__(self, bus)
+        self.netconfdb = netconfdb
+        self.test = test
+        self.classify = classify
+
+        # The interfaces on the node, keyed by name.  Each is a dict with the
+        # interface's index, kind ('wired' or 'wireless'), whether it's up and
+        # has a usable link, and a list of its IPv4 addresses (each a dict
+        # with the address's label, which names the alias it's on, the
+        # address and its prefix length).
+        self.interfaces = {}
+        self.lock = threading.Lock()
+        self.loaded = False
+
+        # Interfaces that have shown up since network.sqlite was last
+        # updated.
+        self.unstored = set()
+
+        self.listener = None
+        self.running = threading.Event()
+
+    def start(self):
+        if self.listener and self.listener.is_alive():
+            return
+        self.running.set()
+        self.listener = threading.Thread(target=self.listen, name='Inventory')
+        self.listener.daemon = True
+        self.listener.start()
+    start.priority = 70
+
+    def stop(self):
+        self.running.clear()
+        if self.listener:
+            self.listener.join()
+            self.listener = None
+
+    # Replaces the inventory with a fresh dump from the kernel.
+    def resync(self):
+        links = netlink.get_links()
+        addresses = netlink.get_addresses()
+        with self.lock:
+            known = self.interfaces
+            self.interfaces = {}
+            for link in links:
+                self.apply_link(link, known.get(link['name']))
+            for address in addresses:
+                self.apply_address(address, True)
+            self.loaded = True
+
+    # Records a new or changed link.  Must be called with the lock held.
+    def apply_link(self, link, previous=None):
+        name = link['name']
+        if not name:
+            return
+        if previous is None:
+            previous = self.interfaces.get(name)
+        if previous and previous['index'] == link['index']:
+            kind = previous['kind']
+            addresses = previous['addresses']
+        else:
+            kind = self.classify(name)
+            addresses = []
+            if name != 'lo':
+                self.unstored.add(name)
+        self.interfaces[name] = {'name': name, 'index': link['index'],
+                                 'kind': kind, 'up': link['up'],
+                                 'carrier': link['up'] and link['carrier'],
+                                 'addresses': addresses}
+
+    def remove_link(self, link):
+        interface = self.interfaces.get(link['name'])
+        if interface and interface['index'] == link['index']:
+            del self.interfaces[link['name']]
+            self.unstored.discard(link['name'])
+
+    # Records an address being added to or removed from an interface.  Must
+    # be called with the lock held.
+    def apply_address(self, address, added):
+        for interface in self.interfaces.values():
+            if interface['index'] != address['index']:
+                continue
+            entry = {'label': address['label'],
+                     'address': address['address'],
+                     'prefixlen': address['prefixlen']}
+            addresses = [i for i in interface['addresses'] if i != entry]
+            if added:
+                addresses.append(entry)
+            interface['addresses'] = addresses
+            return
+
+    # Applies one datagram's worth of events from the kernel.
+    def apply_events(self, data):
+        with self.lock:
+            for msg_type, _, _, body in netlink.parse_messages(data):
+                if msg_type == netlink.RTM_NEWLINK:
+                    self.apply_link(netlink.parse_link(body))
+                elif msg_type == netlink.RTM_DELLINK:
+                    self.remove_link(netlink.parse_link(body))
+                elif msg_type in (netlink.RTM_NEWADDR, netlink.RTM_DELADDR):
+                    address = netlink.parse_address(body)
+                    if address:
+                        self.apply_address(address, msg_type == netlink.RTM_NEWADDR)
+
+    # Writes any interfaces that have shown up to network.sqlite.
+    def flush(self):
+        with self.lock:
+            new = sorted([(i, self.interfaces[i]['kind']) for i in self.unstored if i in self.interfaces])
+            self.unstored = set()
+        if not new:
+            return
+        if self.test:
+            logging.debug("Pretending to add interfaces %s to %s.", new, self.netconfdb)
+            return
+        logging.debug("Adding interfaces %s to %s.", new, self.netconfdb)
+        try:
+            store(self.netconfdb, new)
+        except sqlite3.Error as ex:
+            logging.error("Unable to update %s: %s", self.netconfdb, ex)
+
+    # Runs in the background while CherryPy is running.  The socket is
+    # opened before the first dump so no events can slip between the two.
+    def listen(self):
+        try:
+            sock = netlink.listen(netlink.RTMGRP_LINK | netlink.RTMGRP_IPV4_IFADDR)
+        except socket.error as ex:
+            logging.error("Unable to listen for network interface events: %s", ex)
+            return
+        sock.settimeout(1)
+        stale = True
+        try:
+            while self.running.is_set():
+                if stale:
+                    try:
+                        self.resync()
+                        stale = False
+                    except (netlink.NetlinkError, socket.error) as ex:
+                        logging.error("Unable to list network interfaces: %s", ex)
+                    self.flush()
+                try:
+                    data = sock.recv(65536)
+                except socket.timeout:
+                    continue
+                except socket.error as ex:
+                    if ex.errno == errno.ENOBUFS:
+                        logging.debug("Missed network interface events; rescanning.")
+                        stale = True
+                        continue
+                    raise
+                self.apply_events(data)
+                self.flush()
+        finally:
+            sock.close()
+
+    # Lists the interfaces (and adds new ones to network.sqlite) if the
+    # background thread hasn't done so yet.
+    def load(self):
+        if self.loaded:
+            return
+        try:
+            self.resync()
+        except (netlink.NetlinkError, socket.error) as ex:
+            logging.error("Unable to list network interfaces: %s", ex)
+        self.flush()
+
+    # Returns a copy of the inventory.
+    def snapshot(self):
+        self.load()
+        with self.lock:
+            return dict([(name, dict(i)) for name, i in self.interfaces.items()])
+
+    # Returns two sorted lists of interface names, one of the wired
+    # interfaces and one of the wireless ones.  The loopback interface is
+    # left out, unless there's nothing else, in which case both lists
+    # contain only it.
+    def classified(self):
+        interfaces = self.snapshot()
+        interfaces.pop('lo', None)
+        if not interfaces:
+            logging.debug("No interfaces found.  Defaulting.")
+            return (['lo'], ['lo'])
+        wired = sorted([i for i in interfaces if interfaces[i]['kind'] == 'wired'])
+        wireless = sorted([i for i in interfaces if interfaces[i]['kind'] == 'wireless'])
+        return (wired, wireless)
+
+
+# All of the control panel's pages share one inventory.
+_inventory = None
+_inventory_lock = threading.Lock()
+
+
+def shared_inventory(netconfdb, test=False):
+    global _inventory
+    with _inventory_lock:
+        if _inventory is None:
+            _inventory = Inventory(cherrypy.engine, netconfdb, test)
+            _inventory.subscribe()
+        return _inventory
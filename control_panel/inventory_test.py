@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# inventory_test.py
+
+from flexmock import flexmock
+import os
+import shutil
+import socket
+import sqlite3
+import tempfile
+import unittest
+import inventory
+import netlink
+
+
+def link_message(msg_type, index, name, up=True):
+    body = (netlink.IFINFOMSG.pack(socket.AF_UNSPEC, 1, index, netlink.IFF_UP if up else 0, 0) +
+            netlink.pack_attr(netlink.IFLA_IFNAME, name + b'\0'))
+    return netlink.NLMSG_HEADER.pack(netlink.NLMSG_HEADER.size + len(body), msg_type, 0, 0, 0) + body
+
+
+def address_message(msg_type, index, address, prefixlen, label):
+    body = (netlink.IFADDRMSG.pack(socket.AF_INET, prefixlen, 0, 0, index) +
+            netlink.pack_attr(netlink.IFA_LOCAL, socket.inet_aton(address)) +
+            netlink.pack_attr(netlink.IFA_LABEL, label + b'\0'))
+    return netlink.NLMSG_HEADER.pack(netlink.NLMSG_HEADER.size + len(body), msg_type, 0, 0, 0) + body
+
+
+class InventoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.netconfdb = os.path.join(self.directory, 'network.sqlite')
+        connection = sqlite3.connect(self.netconfdb)
+        connection.execute("CREATE TABLE wired (enabled TEXT, gateway TEXT, interface TEXT);")
+        connection.execute("CREATE TABLE wireless (gateway TEXT, client_interface TEXT, enabled TEXT, channel NUMERIC, essid TEXT, mesh_interface TEXT);")
+        connection.execute("INSERT INTO wired VALUES ('yes', 'yes', 'eth0');")
+        connection.commit()
+        connection.close()
+
+        self.classified = []
+        def classify(name):
+            self.classified.append(name)
+            return 'wireless' if name.startswith('wlan') else 'wired'
+        self.inventory = inventory.Inventory(flexmock(subscribe=lambda *args: None),
+                                             self.netconfdb, classify=classify)
+        flexmock(netlink).should_receive('get_links').and_return(
+            [{'index': 1, 'name': 'lo', 'up': True, 'carrier': True},
+             {'index': 2, 'name': 'eth0', 'up': True, 'carrier': True},
+             {'index': 3, 'name': 'wlan0', 'up': False, 'carrier': True}])
+        flexmock(netlink).should_receive('get_addresses').and_return(
+            [{'index': 2, 'label': 'eth0', 'address': '172.16.0.5', 'prefixlen': 24}])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def rows(self, query):
+        connection = sqlite3.connect(self.netconfdb)
+        rows = connection.execute(query).fetchall()
+        connection.close()
+        return rows
+
+    def test_initial_load(self):
+        self.assertEqual((['eth0'], ['wlan0']), self.inventory.classified())
+        interfaces = self.inventory.snapshot()
+        self.assertFalse(interfaces['wlan0']['up'])
+        self.assertEqual([{'label': 'eth0', 'address': '172.16.0.5', 'prefixlen': 24}],
+                         interfaces['eth0']['addresses'])
+
+        # Known interfaces keep their configuration; new ones are added.
+        self.assertEqual([('yes', 'yes', 'eth0')], self.rows("SELECT * FROM wired;"))
+        self.assertEqual([('no', 'wlan0:1', 'no', 0, '', 'wlan0')], self.rows("SELECT * FROM wireless;"))
+
+    def test_events(self):
+        self.inventory.load()
+        classified = len(self.classified)
+        self.inventory.apply_events(link_message(netlink.RTM_NEWLINK, 3, b'wlan0') +
+                                    link_message(netlink.RTM_NEWLINK, 4, b'wlan1') +
+                                    address_message(netlink.RTM_NEWADDR, 3, '10.0.5.1', 24, b'wlan0:1') +
+                                    link_message(netlink.RTM_DELLINK, 2, b'eth0'))
+        self.inventory.flush()
+        # Interfaces are only classified when they first show up.
+        self.assertEqual(['wlan1'], self.classified[classified:])
+
+        interfaces = self.inventory.snapshot()
+        self.assertEqual(['lo', 'wlan0', 'wlan1'], sorted(interfaces))
+        self.assertTrue(interfaces['wlan0']['up'])
+        self.assertEqual('10.0.5.1', interfaces['wlan0']['addresses'][0]['address'])
+        self.assertEqual(['wlan0', 'wlan1'], [i[0] for i in self.rows("SELECT mesh_interface FROM wireless ORDER BY mesh_interface;")])
+
+        self.inventory.apply_events(address_message(netlink.RTM_DELADDR, 3, '10.0.5.1', 24, b'wlan0:1'))
+        self.assertEqual([], self.inventory.snapshot()['wlan0']['addresses'])
+
+    def test_nothing_but_loopback(self):
+        flexmock(netlink).should_receive('get_links').and_return(
+            [{'index': 1, 'name': 'lo', 'up': True, 'carrier': True}])
+        self.assertEqual((['lo'], ['lo']), self.inventory.classified())
+
+
+if __name__ == '__main__':
+    unittest.main()
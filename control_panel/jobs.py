@@ -0,0 +1,318 @@
+# jobs.py - Runs the control panel's slow operations (reconfiguring network
+#    interfaces, restarting babeld, bringing up gateways) in the background,
+#    so that they don't tie up CherryPy's worker threads.
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# Handlers submit a job and immediately redirect the browser to /jobs, which
+# follows its progress and shows the page the job produced once it's done.
+# Jobs are run one at a time by a single worker thread, because they all
+# reconfigure the same network stack and would trip over each other if they
+# ran side by side.  The number of jobs waiting to run is capped, and
+# submitting the same operation twice (a double-click, or two admins doing
+# the same thing) hands back the job that's already waiting.  Jobs can be
+# cancelled before they start, or at the checkpoints they pass while they
+# run.
+
+# Import modules.
+import cherrypy
+from cherrypy.process.plugins import SimplePlugin
+
+import collections
+import logging
+import os
+import Queue
+import threading
+import time
+
+import _utils
+
+# States a job goes through.
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class Cancelled(Exception):
+    pass
+
+
+class QueueFull(Exception):
+    pass
+
+
+# The job being run by the current thread, if any.
+_current = threading.local()
+
+
+def current():
+    return getattr(_current, 'job', None)
+
+
+# Reports the progress (a percentage) of the job being run by the current
+# thread, along with a short description of what it's doing.  Does nothing
+# outside of a job, so the code that calls it works the same either way.
+def report(progress, message=None):
+    job = current()
+    if job:
+        job.report(progress, message)
+
+
+# Raises Cancelled if somebody has asked for the current job to be cancelled.
+# Jobs call this at the points where it's safe for them to stop.
+def checkpoint():
+    job = current()
+    if job and job.cancel_requested.is_set():
+        raise Cancelled()
+
+
+class Job(object):
+
+    def __init__(self, description, function, key=None):
+        self.id = os.urandom(8).encode('hex')
+        self.description = description
+        self.function = function
+        self.key = key
+        self.state = QUEUED
+        self.progress = 0
+        self.message = 'Waiting to start.'
+        self.result = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_requested = threading.Event()
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+
+    def report(self, progress, message=None):
+        with self.lock:
+            self.progress = min(max(int(progress), 0), 100)
+            if message:
+                self.message = message
+
+    # Asks for the job to be cancelled.  Jobs that haven't started yet are
+    # cancelled on the spot; running ones stop at their next checkpoint.
+    # Returns False if the job had already finished.
+    def cancel(self):
+        with self.lock:
+            if self.state in FINISHED:
+                return False
+            self.cancel_requested.set()
+            if self.state == QUEUED:
+                self.state = CANCELLED
+                self.message = 'Cancelled.'
+                self.finished = time.time()
+                self.done.set()
+            return True
+
+    # Waits for the job to finish.  Returns False if it didn't within the
+    # timeout.
+    def wait(self, timeout=None):
+        self.done.wait(timeout)
+        return self.done.is_set()
+
+    # Returns the state of the job as a dict, for /jobs/state.
+    def describe(self):
+        with self.lock:
+            return {'id': self.id, 'description': self.description,
+                    'state': self.state, 'progress': self.progress,
+                    'message': self.message, 'submitted': self.submitted,
+                    'started': self.started, 'finished': self.finished}
+
+    # Runs the job in the current thread.
+    def run(self):
+        with self.lock:
+            if self.state != QUEUED:
+                return
+            self.state = RUNNING
+            self.message = 'Starting.'
+            self.started = time.time()
+        _current.job = self
+        try:
+            checkpoint()
+            result = self.function()
+            state, message = DONE, 'Finished.'
+        except Cancelled:
+            result = None
+            state, message = CANCELLED, 'Cancelled.'
+        except Exception as ex:
+            logging.exception("Job %s (%s) failed.", self.id, self.description)
+            result = None
+            state, message = FAILED, 'Failed: %s' % ex
+        finally:
+            _current.job = None
+        with self.lock:
+            self.result = result
+            self.state = state
+            self.message = message
+            if state == DONE:
+                self.progress = 100
+            self.finished = time.time()
+        self.done.set()
+
+
+class JobQueue(SimplePlugin):
+
+    def __init__(self, bus, max_pending=4, history=32):
+        SimplePlugin.__init__(self, bus)
+        self.max_pending = max_pending
+
+        # Every job that's been submitted, oldest first.  Finished jobs are
+        # forgotten once there are more than history of them.
+        self.history = history
+        self.jobs = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+        self.queue = Queue.Queue()
+        self.worker = None
+
+    def start(self):
+        if self.worker and self.worker.is_alive():
+            return
+        self.worker = threading.Thread(target=self.work, name='JobQueue')
+        self.worker.daemon = True
+        self.worker.start()
+    start.priority = 80
+
+    def stop(self):
+        if not self.worker:
+            return
+        # Whatever's running is allowed to finish; whatever's waiting isn't.
+        with self.lock:
+            for job in self.jobs.values():
+                if job.state == QUEUED:
+                    job.cancel()
+        self.queue.put(None)
+        self.worker.join()
+        self.worker = None
+
+    def work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            job.run()
+
+    # Adds a job to the queue.  Takes a description to show the user, the
+    # function to run (with no arguments; it returns the page to show once
+    # it's done) and an optional key identifying the operation.  If a job
+    # with the same key is already waiting or running, that job is returned
+    # instead.  Raises QueueFull if too many jobs are waiting.
+    def submit(self, description, function, key=None):
+        with self.lock:
+            pending = [i for i in self.jobs.values() if i.state in (QUEUED, RUNNING)]
+            if key is not None:
+                for job in pending:
+                    if job.key == key:
+                        logging.debug("Job %s is already pending, not submitting it again.", job.id)
+                        return job
+            if len(pending) >= self.max_pending:
+                raise QueueFull()
+
+            job = Job(description, function, key)
+            self.jobs[job.id] = job
+            finished = [i for i in self.jobs.values() if i.state in FINISHED]
+            for old in finished[:max(len(finished) - self.history, 0)]:
+                del self.jobs[old.id]
+        logging.debug("Submitting job %s: %s", job.id, description)
+        self.queue.put(job)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+
+# All of the control panel's handlers share one queue, so that their jobs
+# are run one after another.
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def shared_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue(cherrypy.engine)
+            _queue.subscribe()
+        return _queue
+
+
+# Submits a job from a request handler and sends the browser to the page
+# that follows it.  Takes the same arguments as JobQueue.submit().
+def start(description, function, key=None):
+    try:
+        job = shared_queue().submit(description, function, key)
+    except QueueFull:
+        raise cherrypy.HTTPError(503, "Too many operations are already waiting to run.  Try again in a minute.")
+    raise cherrypy.HTTPRedirect('/jobs?id=' + job.id, 303)
+
+
+# Implements /jobs, where the progress of background jobs can be followed.
+class Jobs(object):
+
+    def __init__(self, templatelookup, queue=None):
+        self.templatelookup = templatelookup
+        self.queue = queue or shared_queue()
+
+    def find(self, job_id):
+        job = self.queue.get(job_id)
+        if not job:
+            raise cherrypy.NotFound()
+        return job
+
+    # Pretends to be index.html.  Shows the progress of one job, or a list of
+    # the recent ones.
+    def index(self, id=None):
+        if id:
+            job = self.find(id).describe()
+            page = self.templatelookup.get_template("/jobs/progress.html")
+            return page.render(title = "Byzantium Node Operation",
+                               purpose_of_page = job['description'],
+                               job_id = job['id'], state = job['state'],
+                               progress = job['progress'],
+                               message = job['message'])
+
+        rows = ""
+        for job in reversed(self.queue.list()):
+            job = job.describe()
+            rows = rows + "<tr><td><a href='/jobs?id=" + job['id'] + "'>" + job['description'] + "</a></td>\n<td>" + job['state'] + "</td>\n<td>" + str(job['progress']) + "%</td></tr>\n"
+        if not rows:
+            rows = "<tr><td>n/a</td>\n<td>n/a</td>\n<td>n/a</td></tr>\n"
+        page = self.templatelookup.get_template("/jobs/index.html")
+        return page.render(title = "Byzantium Node Operations",
+                           purpose_of_page = "Recent Operations",
+                           jobs = rows)
+    index.exposed = True
+
+    # Returns the state and progress of a job as JSON, for the progress page
+    # to poll.
+    def state(self, id=None):
+        return _utils.json_response(self.find(id).describe())
+    state.exposed = True
+
+    # Shows the page a finished job produced.  Jobs that haven't finished (or
+    # didn't produce anything) send the browser back to their progress page.
+    def result(self, id=None):
+        job = self.find(id)
+        if job.state != DONE or job.result is None:
+            raise cherrypy.HTTPRedirect('/jobs?id=' + job.id, 303)
+        return job.result
+    result.exposed = True
+
+    def cancel(self, id=None):
+        if cherrypy.request.method != 'POST':
+            raise cherrypy.HTTPError(405, "Jobs are cancelled with POST.")
+        job = self.find(id)
+        if job.cancel():
+            logging.debug("Cancelling job %s.", job.id)
+        raise cherrypy.HTTPRedirect('/jobs?id=' + job.id, 303)
+    cancel.exposed = True
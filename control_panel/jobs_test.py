@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# jobs_test.py
+
+import threading
+import unittest
+from flexmock import flexmock
+import jobs
+
+
+class JobQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = jobs.JobQueue(flexmock(subscribe=lambda *args: None), max_pending=2)
+
+    def tearDown(self):
+        self.queue.stop()
+
+    def test_runs_jobs_and_keeps_results(self):
+        def work():
+            jobs.report(50, "Half way there.")
+            self.assertEqual(50, jobs.current().progress)
+            return 'page'
+        job = self.queue.submit('Working', work)
+        self.assertEqual(jobs.QUEUED, job.state)
+        self.queue.start()
+        self.assertTrue(job.wait(5))
+        self.assertEqual(jobs.DONE, job.state)
+        self.assertEqual(100, job.progress)
+        self.assertEqual('page', self.queue.get(job.id).result)
+
+    def test_failed_jobs(self):
+        def work():
+            raise ValueError('broken')
+        job = self.queue.submit('Failing', work)
+        job.run()
+        self.assertEqual(jobs.FAILED, job.state)
+        self.assertEqual('Failed: broken', job.describe()['message'])
+
+    def test_duplicates_are_merged_and_the_queue_is_bounded(self):
+        first = self.queue.submit('One', lambda: None, key='one')
+        self.assertTrue(first is self.queue.submit('One', lambda: None, key='one'))
+        self.queue.submit('Two', lambda: None, key='two')
+        self.assertRaises(jobs.QueueFull, self.queue.submit, 'Three', lambda: None)
+
+    def test_cancel_before_starting(self):
+        ran = []
+        job = self.queue.submit('Never', lambda: ran.append(1))
+        self.assertTrue(job.cancel())
+        self.queue.start()
+        self.queue.stop()
+        self.assertEqual(jobs.CANCELLED, job.state)
+        self.assertEqual([], ran)
+        self.assertFalse(job.cancel())
+
+    def test_cancel_at_checkpoint(self):
+        started = threading.Event()
+        proceed = threading.Event()
+        steps = []
+        def work():
+            started.set()
+            proceed.wait(5)
+            jobs.checkpoint()
+            steps.append('after')
+        job = self.queue.submit('Interrupted', work)
+        self.queue.start()
+        started.wait(5)
+        self.assertEqual(jobs.RUNNING, job.state)
+        job.cancel()
+        proceed.set()
+        self.assertTrue(job.wait(5))
+        self.assertEqual(jobs.CANCELLED, job.state)
+        self.assertEqual([], steps)
+
+    def test_report_outside_of_a_job(self):
+        jobs.report(10, "Nobody's listening.")
+        jobs.checkpoint()
+
+
+if __name__ == '__main__':
+    unittest.main()
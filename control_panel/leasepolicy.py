@@ -0,0 +1,226 @@
+# leasepolicy.py - Picks the length of the DHCP leases dnsmasq hands out to
+#    the node's clients from how many of them there are and how quickly they
+#    come and go.
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# Every client renews its lease halfway through it, so with a fixed five
+# minute lease a few hundred clients keep up a steady stream of DHCP traffic
+# on the air.  Longer leases cut that down, but leave the addresses of
+# clients that have walked away tied up for longer.  The policy below only
+# hands out long leases when there are enough clients for the renewals to
+# matter, shortens them again when clients are turning over quickly, and
+# drops to the shortest lease when the pool is close to running out so that
+# stale leases are reclaimed as soon as possible.  dnsmasq's lease file is
+# read every interval; the include file is only rewritten (and dnsmasq only
+# restarted) when the policy moves to a different bucket.
+
+# Import modules.
+from cherrypy.process.plugins import Monitor
+
+import collections
+import logging
+import re
+import socket
+import time
+
+import _utils
+import addressing
+
+# Lease buckets: the number of active leases at which the bucket starts to
+# apply, and the lease time it hands out, in seconds.
+buckets = [(0, 300), (32, 900), (128, 1800), (512, 3600)]
+
+# If more than this fraction of the clients arrived or left in the last
+# churn_window seconds the node is busy, and gets the next shorter bucket.
+churn_window = 3600
+churn_threshold = 0.5
+
+# If more than this fraction of the DHCP range is leased out, the shortest
+# bucket is used no matter what.
+full_threshold = 0.8
+
+# Number of intervals a longer bucket has to be called for before leases are
+# made longer.  Shorter ones are applied straight away.
+settle = 3
+
+# dnsmasq keeps its leases here (see the leasedir patch in the dnsmasq
+# package).
+LEASE_FILE = '/var/state/dnsmasq/dnsmasq.leases'
+
+dhcp_range = re.compile(r'^(dhcp-range=[^,\n]+,[^,\n]+,[^,\n]+),([0-9]+[smh]?|infinite)$', re.M)
+
+
+# Parses the contents of dnsmasq's lease file.  Each line holds the expiry
+# time (0 for leases that never expire), the client's MAC address, its IP
+# address, its hostname and its client ID.  Returns a dict mapping the MAC
+# addresses of clients whose leases are still good to their IP addresses.
+def parse_leases(lines, now):
+    leases = {}
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 3 or fields[0] == 'duid':
+            continue
+        try:
+            expiry = int(fields[0])
+        except ValueError:
+            continue
+        if expiry and expiry <= now:
+            continue
+        leases[fields[1].lower()] = fields[2]
+    return leases
+
+
+def read_leases(now, lease_file=LEASE_FILE, injected_open=open):
+    try:
+        leases = injected_open(lease_file, 'r')
+    except IOError:
+        return {}
+    result = parse_leases(leases, now)
+    leases.close()
+    return result
+
+
+# Converts between lease times in seconds and the way dnsmasq writes them.
+def format_lease(seconds):
+    if seconds % 3600 == 0:
+        return '%dh' % (seconds / 3600)
+    if seconds % 60 == 0:
+        return '%dm' % (seconds / 60)
+    return str(seconds)
+
+
+def parse_lease(lease):
+    if lease == 'infinite':
+        return None
+    multiplier = {'s': 1, 'm': 60, 'h': 3600}.get(lease[-1])
+    if multiplier:
+        return int(lease[:-1]) * multiplier
+    return int(lease)
+
+
+# Returns the lease time set in the contents of a dnsmasq include file, as
+# dnsmasq writes it, or None if there isn't a DHCP range in it.
+def current_lease(contents):
+    match = dhcp_range.search(contents)
+    if match:
+        return match.group(2)
+    return None
+
+
+# Returns the contents of a dnsmasq include file with the lease time of its
+# DHCP ranges replaced.
+def set_lease(contents, lease):
+    return dhcp_range.sub(lambda match: match.group(1) + ',' + lease, contents)
+
+
+# Returns the number of addresses in the DHCP ranges of a dnsmasq include
+# file.
+def pool_size(contents):
+    size = 0
+    for match in dhcp_range.finditer(contents):
+        fields = match.group(1)[len('dhcp-range='):].split(',')
+        try:
+            size += addressing.aton(fields[1]) - addressing.aton(fields[0]) + 1
+        except socket.error:
+            continue
+    return size
+
+
+# Works out which bucket the lease time should come from.  Takes the number
+# of active leases, the number of clients that arrived or left during the
+# last churn_window seconds and the size of the DHCP pool.  Returns an index
+# into buckets.
+def choose_bucket(clients, churn, pool):
+    if pool and clients >= full_threshold * pool:
+        return 0
+    bucket = 0
+    for i, (minimum, _) in enumerate(buckets):
+        if clients >= minimum:
+            bucket = i
+    if clients and churn > churn_threshold * clients:
+        bucket = max(bucket - 1, 0)
+    return bucket
+
+
+class LeasePolicy(Monitor):
+
+    def __init__(self, bus, include_file, reload_dnsmasq, test=False,
+                 frequency=60, lease_file=LEASE_FILE):
+        Monitor.__init__(self, bus, self.tick, frequency, name='LeasePolicy')
+        self.include_file = include_file
+        self.reload_dnsmasq = reload_dnsmasq
+        self.test = test
+        self.lease_file = lease_file
+
+        # The bucket the include file was last written from, worked out from
+        # the lease time in the file the first time it's read.
+        self.bucket = None
+        self.pending = 0
+
+        # The clients seen the last time the lease file was read, and how many
+        # arrived or left in each interval since.
+        self.clients = None
+        self.changes = collections.deque()
+
+    def tick(self):
+        try:
+            include = open(self.include_file, 'r')
+            contents = include.read()
+            include.close()
+        except IOError:
+            # dnsmasq hasn't been set up yet.
+            return
+        now = time.time()
+        self.update(contents, read_leases(now, self.lease_file), now)
+
+    # Records the clients that currently hold leases and rewrites the include
+    # file if the lease time has to change.  Returns True if it did.
+    def update(self, contents, leases, now):
+        lease = current_lease(contents)
+        if lease is None:
+            return False
+
+        clients = set(leases)
+        if self.clients is not None:
+            self.changes.append((now, len(clients ^ self.clients)))
+        self.clients = clients
+        while self.changes and self.changes[0][0] <= now - churn_window:
+            self.changes.popleft()
+        churn = sum([i[1] for i in self.changes])
+
+        if self.bucket is None:
+            seconds = parse_lease(lease)
+            self.bucket = len(buckets) - 1
+            for i, (_, length) in enumerate(buckets):
+                if seconds is not None and seconds <= length:
+                    self.bucket = i
+                    break
+
+        target = choose_bucket(len(clients), churn, pool_size(contents))
+        if target > self.bucket:
+            self.pending += 1
+            if self.pending < settle:
+                return False
+        elif target == self.bucket:
+            self.pending = 0
+            if lease == format_lease(buckets[target][1]):
+                return False
+        self.pending = 0
+        self.bucket = target
+
+        lease = format_lease(buckets[target][1])
+        logging.debug("%d clients, %d arrivals and departures in the last hour: setting the DHCP lease time to %s.",
+                      len(clients), churn, lease)
+        if self.test:
+            logging.debug("Pretended to set the lease time in %s.", self.include_file)
+            return True
+        try:
+            changed = _utils.write_if_changed(self.include_file, set_lease(contents, lease))
+        except (IOError, OSError) as ex:
+            logging.error("Unable to write %s: %s", self.include_file, ex)
+            return False
+        if changed:
+            self.reload_dnsmasq()
+        return changed
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# leasepolicy_test.py
+
+import unittest
+from flexmock import flexmock
+import leasepolicy
+
+
+INCLUDE = ('dhcp-range=10.0.5.2,10.0.5.254,255.255.255.0,5m\n'
+           'synth-domain=byzantium.mesh,10.0.5.0/24,client-\n')
+
+
+# Builds a set of leases for count clients, numbered from first.
+def leases(count, first=0):
+    return dict([('02:00:00:00:%02x:%02x' % divmod(i, 256), '10.0.5.%d' % (i % 250 + 2))
+                 for i in range(first, first + count)])
+
+
+class LeasePolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.reloads = []
+        self.policy = leasepolicy.LeasePolicy(flexmock(subscribe=lambda *args: None),
+                                              '/nonexistent', lambda: self.reloads.append(1))
+        self.written = []
+        flexmock(leasepolicy._utils).should_receive('write_if_changed').replace_with(
+            lambda path, contents: self.written.append(contents) or True)
+
+    def test_parse_leases(self):
+        lines = ['1000 00:11:22:33:44:55 10.0.5.23 laptop 01:00:11:22:33:44:55\n',
+                 '500 aa:bb:cc:dd:ee:ff 10.0.5.42 * *\n',
+                 '0 AA:BB:CC:DD:EE:00 10.0.5.43 * *\n',
+                 'duid 00:01:00:01:12:34:56:78\n',
+                 'garbage\n']
+        self.assertEqual({'00:11:22:33:44:55': '10.0.5.23', 'aa:bb:cc:dd:ee:00': '10.0.5.43'},
+                         leasepolicy.parse_leases(lines, 600))
+
+    def test_lease_times(self):
+        self.assertEqual('5m', leasepolicy.format_lease(300))
+        self.assertEqual('1h', leasepolicy.format_lease(3600))
+        self.assertEqual(1800, leasepolicy.parse_lease('30m'))
+        self.assertEqual(7200, leasepolicy.parse_lease('2h'))
+        self.assertEqual('5m', leasepolicy.current_lease(INCLUDE))
+        self.assertEqual(INCLUDE.replace(',5m', ',1h'), leasepolicy.set_lease(INCLUDE, '1h'))
+        self.assertEqual(253, leasepolicy.pool_size(INCLUDE))
+
+    def test_choose_bucket(self):
+        self.assertEqual(0, leasepolicy.choose_bucket(10, 0, 1021))
+        self.assertEqual(2, leasepolicy.choose_bucket(200, 10, 1021))
+        # Busy nodes get shorter leases.
+        self.assertEqual(1, leasepolicy.choose_bucket(200, 150, 1021))
+        # So do nearly full ones.
+        self.assertEqual(0, leasepolicy.choose_bucket(210, 10, 253))
+
+    def test_only_rewrites_when_the_bucket_changes(self):
+        include = INCLUDE.replace('255.255.255.0', '255.255.252.0').replace('10.0.5.254', '10.0.7.254')
+        self.assertFalse(self.policy.update(include, leases(10), 0))
+        self.assertEqual([], self.written)
+
+        # Longer leases have to be called for a few times in a row.
+        for i in range(1, leasepolicy.settle):
+            self.assertFalse(self.policy.update(include, leases(200), i * 60))
+        self.assertTrue(self.policy.update(include, leases(200), leasepolicy.settle * 60))
+        self.assertEqual([include.replace(',5m', ',15m')], self.written)
+        self.assertEqual([1], self.reloads)
+
+        include = self.written[-1]
+        self.assertFalse(self.policy.update(include, leases(200), 1000))
+        self.assertEqual(1, len(self.written))
+
+    def test_shortens_leases_straight_away(self):
+        include = INCLUDE.replace(',5m', ',30m')
+        self.assertTrue(self.policy.update(include, leases(220), 0))
+        self.assertEqual([INCLUDE], self.written)
+
+
+if __name__ == '__main__':
+    unittest.main()
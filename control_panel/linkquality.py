@@ -0,0 +1,221 @@
+# linkquality.py - Keeps a short history of how good each of the node's mesh
+#    links has been, so that when a link degrades the admin can see when it
+#    started and how bad it got.
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# Every interval the receive and transmit costs babeld has worked out for
+# each neighbour, the best metric of the routes through it and the signal and
+# noise levels of the interface it's heard on are appended to a ring buffer
+# per neighbour.  Each ring is a handful of preallocated arrays of doubles, so
+# a neighbour's history takes the same amount of memory however long it's
+# been around, and a tick costs the same whatever the history length.  The
+# neighbours and routes come from babelmonitor's tables, which are already in
+# memory, and /proc/net/wireless is read once per tick for every interface.
+# Neighbours that haven't been seen for a whole history length are forgotten,
+# and the number of neighbours tracked is capped.
+
+# The wireless extensions only report one signal level per interface (for
+# the last frame received), so every neighbour on an interface gets the same
+# signal and noise.  On a busy interface that's an approximation.
+
+# Import modules.
+from cherrypy.process.plugins import Monitor
+
+import array
+import collections
+import logging
+import threading
+import time
+
+# What's recorded for each neighbour, in the order it's stored.
+FIELDS = ('rxcost', 'txcost', 'metric', 'signal', 'noise')
+
+NAN = float('nan')
+
+
+# Parses the contents of /proc/net/wireless.  The first two lines are column
+# headers; after that each line holds an interface's name, status, link
+# quality, signal level and noise level (the last three followed by a '.' if
+# they were updated since the last read) and some counters.  Returns a dict
+# mapping interface names to (signal, noise) in dBm, with None for levels the
+# driver doesn't report.
+def parse_proc_wireless(lines):
+    levels = {}
+    for line in list(lines)[2:]:
+        if ':' not in line:
+            continue
+        interface, fields = line.split(':', 1)
+        fields = fields.split()
+        if len(fields) < 4:
+            continue
+        values = []
+        for field in fields[2:4]:
+            try:
+                value = float(field.rstrip('.'))
+            except ValueError:
+                value = None
+            # Drivers that don't measure a level report -256.  Some old ones
+            # report dBm as an unsigned byte.
+            if value is not None and value > 63:
+                value -= 256
+            if value is not None and value <= -256:
+                value = None
+            values.append(value)
+        levels[interface.strip()] = tuple(values)
+    return levels
+
+
+def read_proc_wireless(injected_open=open):
+    try:
+        proc_wireless = injected_open('/proc/net/wireless', 'r')
+    except IOError:
+        return {}
+    levels = parse_proc_wireless(proc_wireless)
+    proc_wireless.close()
+    return levels
+
+
+# A fixed-size ring of samples.  Takes the number of samples to keep.
+class Series(object):
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = array.array('d', [0.0]) * capacity
+        self.values = dict([(i, array.array('d', [NAN]) * capacity) for i in FIELDS])
+
+        # Where the next sample goes, and how many there are.
+        self.head = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    # Adds a sample.  Takes a timestamp and a dict of values; fields that are
+    # missing or None are stored as unknown.
+    def append(self, timestamp, values):
+        self.timestamps[self.head] = timestamp
+        for field in FIELDS:
+            value = values.get(field)
+            self.values[field][self.head] = NAN if value is None else float(value)
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def last(self):
+        if not self.count:
+            return 0
+        return self.timestamps[(self.head - 1) % self.capacity]
+
+    # Returns the samples taken after since, oldest first, as a list of
+    # timestamps and a dict mapping each field to a list of values with None
+    # for unknown ones.
+    def samples(self, since=0):
+        start = (self.head - self.count) % self.capacity
+        order = [(start + i) % self.capacity for i in range(self.count)]
+        order = [i for i in order if self.timestamps[i] > since]
+        values = {}
+        for field in FIELDS:
+            column = self.values[field]
+            values[field] = [None if column[i] != column[i] else column[i] for i in order]
+        return [self.timestamps[i] for i in order], values
+
+
+class LinkQuality(Monitor):
+
+    def __init__(self, bus, tables, frequency=10, history=360, max_links=64,
+                 read_wireless=read_proc_wireless):
+        Monitor.__init__(self, bus, self.tick, frequency, name='LinkQuality')
+        self.tables = tables
+        self.frequency = frequency
+        self.history = history
+        self.max_links = max_links
+        self.read_wireless = read_wireless
+
+        # Each neighbour's Series, keyed by (address, interface), with the
+        # ones seen least recently first.
+        self.links = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def tick(self):
+        self.update(self.tables.links(), self.read_wireless(), time.time())
+
+    # Records one sample of every neighbour.  Takes the neighbours as
+    # returned by RoutingTables.links(), the signal levels as returned by
+    # read_proc_wireless() and the time.
+    def update(self, links, wireless, now):
+        with self.lock:
+            for link in links:
+                key = (link['address'], link['if'])
+                series = self.links.pop(key, None)
+                if series is None:
+                    if len(self.links) >= self.max_links:
+                        forgotten, _ = self.links.popitem(last=False)
+                        logging.debug("Tracking too many links, forgetting %s on %s.", *forgotten)
+                    series = Series(self.history)
+                signal, noise = wireless.get(link['if'], (None, None))
+                series.append(now, {'rxcost': link['rxcost'],
+                                    'txcost': link['txcost'],
+                                    'metric': link['metric'],
+                                    'signal': signal, 'noise': noise})
+                # Moving the neighbour to the end keeps the least recently
+                # seen ones at the front.
+                self.links[key] = series
+
+            expired = now - self.history * self.frequency
+            while self.links:
+                key = next(iter(self.links))
+                if self.links[key].last() > expired:
+                    break
+                del self.links[key]
+
+    # Returns the (address, interface) pairs of the neighbours with history.
+    def neighbours(self):
+        with self.lock:
+            return sorted(self.links)
+
+    # Returns the history of one neighbour (see Series.samples()), or None if
+    # there isn't any.
+    def samples(self, neighbour, since=0):
+        with self.lock:
+            series = self.links.get(neighbour)
+            if series is None:
+                return None
+            return series.samples(since)
+
+
+# Draws a line graph as an SVG element.  Takes the timestamps, a list of
+# (label, colour, values) lines, the time range and the size of the plot.
+# Unknown values leave gaps in the lines.  The vertical axis covers the range
+# of the values.
+def svg_graph(timestamps, lines, start, end, width=600, height=120):
+    known = [v for _, _, values in lines for v in values if v is not None]
+    bottom = min(known) if known else 0
+    top = max(known) if known else 1
+    if top == bottom:
+        top, bottom = top + 1, bottom - 1
+    span = float(end - start) or 1.0
+
+    def x(t):
+        return (t - start) / span * width
+
+    def y(v):
+        return height - (v - bottom) / float(top - bottom) * height
+
+    svg = ['<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" viewBox="0 0 %d %d">' % (width, height + 20, width, height + 20),
+           '<rect x="0" y="0" width="%d" height="%d" fill="none" stroke="#000000" />' % (width, height)]
+    for label, colour, values in lines:
+        segment = []
+        for t, v in list(zip(timestamps, values)) + [(None, None)]:
+            if v is not None:
+                segment.append('%.1f,%.1f' % (x(t), y(v)))
+                continue
+            if len(segment) == 1:
+                svg.append('<circle cx="%s" cy="%s" r="1.5" fill="%s" />' % tuple(segment[0].split(',') + [colour]))
+            elif segment:
+                svg.append('<polyline fill="none" stroke="%s" points="%s" />' % (colour, ' '.join(segment)))
+            segment = []
+    legend = ' '.join(['<tspan fill="%s">%s</tspan>' % (colour, label) for label, colour, _ in lines])
+    svg.append('<text x="0" y="%d" font-size="12">%s (%g to %g)</text>' % (height + 15, legend, bottom, top))
+    svg.append('</svg>')
+    return '\n'.join(svg)
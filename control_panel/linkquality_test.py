@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# linkquality_test.py
+
+import unittest
+from flexmock import flexmock
+import linkquality
+
+PROC_WIRELESS = """Inter-| sta-|   Quality        |   Discarded packets               | Missed | WE
+ face | tus | link level noise |  nwid  crypt   frag  retry   misc | beacon | 22
+ wlan0: 0000   54.  -56.  -95.       0      0      0      0      0        0
+ wlan1: 0000    0   200   -256        0      0      0      0      0        0
+""".splitlines(True)
+
+
+def link(address, interface='wlan0', rxcost=96, txcost=96, metric=96):
+    return {'address': address, 'if': interface, 'rxcost': rxcost,
+            'txcost': txcost, 'metric': metric}
+
+
+class LinkQualityTest(unittest.TestCase):
+
+    def setUp(self):
+        self.quality = linkquality.LinkQuality(flexmock(subscribe=lambda *args: None),
+                                               None, frequency=10, history=4,
+                                               max_links=2)
+
+    def test_parse_proc_wireless(self):
+        self.assertEqual({'wlan0': (-56.0, -95.0), 'wlan1': (-56.0, None)},
+                         linkquality.parse_proc_wireless(PROC_WIRELESS))
+
+    def test_series_wraps_around(self):
+        series = linkquality.Series(3)
+        for i in range(5):
+            series.append(i + 1, {'rxcost': i * 10, 'metric': None})
+        timestamps, values = series.samples()
+        self.assertEqual([3.0, 4.0, 5.0], timestamps)
+        self.assertEqual([20.0, 30.0, 40.0], values['rxcost'])
+        self.assertEqual([None, None, None], values['metric'])
+        self.assertEqual([5.0], series.samples(4)[0])
+        self.assertEqual(3, len(series))
+
+    def test_update(self):
+        self.quality.update([link('fe80::1', rxcost=256)], {'wlan0': (-56.0, -95.0)}, 100)
+        self.quality.update([link('fe80::1', rxcost=None)], {}, 110)
+        timestamps, values = self.quality.samples(('fe80::1', 'wlan0'))
+        self.assertEqual([100.0, 110.0], timestamps)
+        self.assertEqual([256.0, None], values['rxcost'])
+        self.assertEqual([-56.0, None], values['signal'])
+
+    def test_number_of_links_is_capped(self):
+        self.quality.update([link('fe80::1'), link('fe80::2')], {}, 100)
+        self.quality.update([link('fe80::2'), link('fe80::3')], {}, 110)
+        self.assertEqual([('fe80::2', 'wlan0'), ('fe80::3', 'wlan0')], self.quality.neighbours())
+
+    def test_silent_links_are_forgotten(self):
+        self.quality.update([link('fe80::1'), link('fe80::2')], {}, 100)
+        self.quality.update([link('fe80::2')], {}, 130)
+        self.assertEqual(2, len(self.quality.neighbours()))
+        self.quality.update([link('fe80::2')], {}, 140)
+        self.assertEqual([('fe80::2', 'wlan0')], self.quality.neighbours())
+        self.assertEqual(None, self.quality.samples(('fe80::1', 'wlan0')))
+
+    def test_svg_graph_breaks_lines_at_gaps(self):
+        svg = linkquality.svg_graph([0, 1, 2, 3], [('cost', '#000000', [1, 2, None, 4])], 0, 3)
+        self.assertEqual(1, svg.count('<polyline'))
+        self.assertEqual(1, svg.count('<circle'))
+
+
+if __name__ == '__main__':
+    unittest.main()
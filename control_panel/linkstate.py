@@ -0,0 +1,114 @@
+# linkstate.py - Waits for network interfaces to reach a given state, so that
+#    the configuration code can move on as soon as the hardware is ready
+#    instead of sleeping for a fixed amount of time.
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# The state of an interface is read from sysfs (/sys/class/net/<iface>/flags
+# and operstate), and its IPv4 address with the SIOCGIFADDR ioctl, which works
+# on aliases like wlan0:1 as well.  The conditions are polled with exponential
+# backoff: the first check comes almost immediately and the interval doubles
+# up to a ceiling, so that fast hardware is noticed within milliseconds and
+# slow hardware isn't polled in a busy loop.
+
+# Import modules.
+import fcntl
+import logging
+import socket
+import struct
+import time
+
+# From <linux/if.h> and <linux/sockios.h>.
+IFF_UP = 0x1
+SIOCGIFADDR = 0x8915
+
+
+# Calls condition() until it returns something true or the timeout (in
+# seconds) passes.  Returns True if the condition came to hold and False if
+# it didn't.
+def wait_for(condition, timeout=10, initial=0.01, maximum=0.5,
+             clock=time.time, sleep=time.sleep):
+    deadline = clock() + timeout
+    interval = initial
+    while True:
+        if condition():
+            return True
+        remaining = deadline - clock()
+        if remaining <= 0:
+            return False
+        sleep(min(interval, remaining))
+        interval = min(interval * 2, maximum)
+
+
+# Reads one of the attributes of a network interface from sysfs.  Aliases
+# share the attributes of the physical interface.  Returns None if the
+# interface doesn't exist.
+def read_attribute(interface, attribute, injected_open=open):
+    interface = interface.split(':')[0]
+    try:
+        sysfs = injected_open('/sys/class/net/%s/%s' % (interface, attribute), 'r')
+    except IOError:
+        return None
+    value = sysfs.readline().strip()
+    sysfs.close()
+    return value
+
+
+# Returns True if an interface has been brought up (ifconfig <iface> up).  If
+# carrier is True the link also has to be usable, which for a wireless
+# interface means it's associated or has joined an ad-hoc cell.  Interfaces
+# whose drivers don't report their link state count as usable once they're
+# up.
+def is_up(interface, carrier=False, injected_open=open):
+    flags = read_attribute(interface, 'flags', injected_open)
+    if flags is None or not int(flags, 16) & IFF_UP:
+        return False
+    if carrier:
+        return read_attribute(interface, 'operstate', injected_open) in ('up', 'unknown')
+    return True
+
+
+def is_down(interface, injected_open=open):
+    flags = read_attribute(interface, 'flags', injected_open)
+    return flags is not None and not int(flags, 16) & IFF_UP
+
+
+# Returns the IPv4 address of an interface (or alias), or None if it doesn't
+# have one.
+def get_address(interface):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        request = struct.pack('256s', interface[:15].encode('ascii'))
+        response = fcntl.ioctl(sock.fileno(), SIOCGIFADDR, request)
+        return socket.inet_ntoa(response[20:24])
+    except IOError:
+        return None
+    finally:
+        sock.close()
+
+
+# Convenience methods for the conditions the configuration code waits on.
+# Each returns True if the condition came to hold before the timeout.
+def wait_until_up(interface, timeout=10, carrier=False):
+    logging.debug("Waiting for %s to come up.", interface)
+    if wait_for(lambda: is_up(interface, carrier), timeout):
+        return True
+    logging.debug("Gave up waiting for %s to come up.", interface)
+    return False
+
+
+def wait_until_down(interface, timeout=10):
+    logging.debug("Waiting for %s to go down.", interface)
+    if wait_for(lambda: is_down(interface), timeout):
+        return True
+    logging.debug("Gave up waiting for %s to go down.", interface)
+    return False
+
+
+def wait_for_address(interface, address, timeout=10):
+    logging.debug("Waiting for %s to get address %s.", interface, address)
+    if wait_for(lambda: get_address(interface) == address, timeout):
+        return True
+    logging.debug("Gave up waiting for %s to get address %s.", interface, address)
+    return False
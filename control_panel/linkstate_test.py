@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# linkstate_test.py
+
+import unittest
+import linkstate
+
+
+# A clock that only moves when something sleeps.
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeSysfs(object):
+
+    def __init__(self, attributes):
+        self.attributes = attributes
+        self.opened = []
+
+    def open(self, path, mode):
+        self.opened.append(path)
+        name = path.split('/')[-1]
+        if name not in self.attributes:
+            raise IOError()
+        return FakeFile(self.attributes[name])
+
+
+class FakeFile(object):
+
+    def __init__(self, value):
+        self.value = value
+
+    def readline(self):
+        return self.value + '\n'
+
+    def close(self):
+        pass
+
+
+class LinkStateTest(unittest.TestCase):
+
+    def test_wait_for_backs_off(self):
+        clock = FakeClock()
+        results = iter([False] * 6 + [True])
+        self.assertTrue(linkstate.wait_for(lambda: next(results), timeout=10,
+                                           initial=0.01, maximum=0.1,
+                                           clock=clock.time, sleep=clock.sleep))
+        self.assertEqual([0.01, 0.02, 0.04, 0.08, 0.1, 0.1], clock.sleeps)
+
+    def test_wait_for_returns_immediately(self):
+        clock = FakeClock()
+        self.assertTrue(linkstate.wait_for(lambda: True, clock=clock.time,
+                                           sleep=clock.sleep))
+        self.assertEqual([], clock.sleeps)
+
+    def test_wait_for_gives_up_at_deadline(self):
+        clock = FakeClock()
+        self.assertFalse(linkstate.wait_for(lambda: False, timeout=1,
+                                            clock=clock.time, sleep=clock.sleep))
+        self.assertAlmostEqual(1.0, clock.now)
+
+    def test_is_up(self):
+        sysfs = FakeSysfs({'flags': '0x1003', 'operstate': 'down'})
+        self.assertTrue(linkstate.is_up('wlan0:1', injected_open=sysfs.open))
+        self.assertFalse(linkstate.is_up('wlan0', carrier=True, injected_open=sysfs.open))
+        self.assertEqual('/sys/class/net/wlan0/flags', sysfs.opened[0])
+        sysfs = FakeSysfs({'flags': '0x1003', 'operstate': 'unknown'})
+        self.assertTrue(linkstate.is_up('wlan0', carrier=True, injected_open=sysfs.open))
+
+    def test_is_down(self):
+        sysfs = FakeSysfs({'flags': '0x1002'})
+        self.assertTrue(linkstate.is_down('wlan0', injected_open=sysfs.open))
+        self.assertFalse(linkstate.is_up('wlan0', injected_open=sysfs.open))
+
+    def test_missing_interface_is_neither_up_nor_down(self):
+        sysfs = FakeSysfs({})
+        self.assertFalse(linkstate.is_up('wlan9', injected_open=sysfs.open))
+        self.assertFalse(linkstate.is_down('wlan9', injected_open=sysfs.open))
+
+    def test_get_address_of_loopback(self):
+        self.assertEqual('127.0.0.1', linkstate.get_address('lo'))
+
+
+if __name__ == '__main__':
+    unittest.main()
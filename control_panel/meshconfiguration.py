@@ -1,6 +1,7 @@
 # meshconfiguration.py - Lets the user configure and manipulate mesh-enabled
-#    wireless network interfaces.  Wired interfaces (Ethernet) are reserved for
-#    use as net.gateways and fall under a different web app.
+#    network interfaces.  Wireless interfaces are the mesh's radios.  Wired
+#    interfaces (Ethernet) that aren't net.gateways can mesh too, for nodes
+#    that share a cable, in which case babel treats them as wired links.
 
 # For the time being this class is designed to operate with the Babel protocol
 # (http://www.pps.jussieu.fr/~jch/software/babel/).  It would have to be
@@ -19,14 +20,68 @@
 #   network interface.  This will also likely involve selecting multiple mesh
 #   routing protocols (i.e., babel+others).
 
+import cherrypy
+
+import cgi
+import copy
 import logging
 import os
-import signal
+import socket
 import sqlite3
-import subprocess
+import threading
 import time
 
 import _utils
+import babelconfig
+import babelctl
+import babelmonitor
+import babelsupervisor
+import channelplanner
+import jobs
+import linkquality
+import netlink
+import topology
+
+# Bumped whenever the layout of the /mesh/api document changes.
+MESH_API_VERSION = 1
+
+# babeld's diversity routing, which favours routes that leave on a different
+# channel than they came in on, so that a node with radios on several
+# channels can receive on one while it forwards on another.  Kind 2 takes the
+# channels of the interfaces into account.
+DIVERSITY = '2'
+
+# mesh.sqlite databases that have been checked for the channel column and
+# the profiles.
+_upgraded = set()
+_upgraded_lock = threading.Lock()
+
+
+# Adds the channel column to the meshes table of a mesh.sqlite created before
+# each mesh interface had a channel of its own, and the babeld profiles to
+# one created before there were any.  Only checks each database once.
+def upgrade_meshconfdb(meshconfdb):
+    with _upgraded_lock:
+        if meshconfdb in _upgraded:
+            return
+        _utils.add_column(meshconfdb, 'meshes', 'channel', 'NUMERIC')
+        babelconfig.upgrade(meshconfdb)
+        _upgraded.add(meshconfdb)
+
+
+# Returns True if a list of (interface, channel) pairs covers more than one
+# channel.
+def diverse(channels):
+    return len(set([int(c) for _, c in channels if c])) > 1
+
+
+# Returns the babeld options that turn on diversity routing if a list of
+# (interface, channel) pairs covers more than one channel.  Which channel
+# each interface is on goes in the configuration file.
+def diversity_options(channels):
+    if diverse(channels):
+        return ['-z', DIVERSITY]
+    return []
 
 
 # Classes.
@@ -40,10 +95,45 @@ class MeshConfiguration(object):
         # Class constants.
         self.babeld = '/usr/local/bin/babeld'
         self.babeld_pid = '/var/run/babeld.pid'
-        self.babeld_timeout = 3
+
+        # How long a babeld that was just started is watched, so that one
+        # which dies straight away (say, because of a bad option) is reported.
+        self.babeld_timeout = 1
+
+        # babeld's configuration file is generated from the base file and the
+        # profiles of the mesh interfaces (see babelconfig.py).
+        self.babeld_conf_base = '/etc/babeld.conf'
+        self.babeld_conf = '/etc/byzantium/babeld.conf'
+
+        # Default command line options for babeld.  Some of these are
+        # redundant but are present in case an older version of babeld is
+        # used on the node.  See the following file to see why:
+        # http://www.pps.jussieu.fr/~jch/software/babel/CHANGES.text
+        # -G (-g before babeld 1.8) opens the local configuration interface,
+        # which is how interfaces are added to and removed from a running
+        # babeld and profiles are applied to them (see babelctl.py).
+        # babeld isn't told to daemonize (-D) because it runs as a child of
+        # the supervisor, which restarts it if it dies.
+        self.babeld_opts = ['-m', 'ff02:0:0:0:0:0:1:6', '-p', '6696',
+                            babelctl.local_port_option(self.babeld),
+                            str(babelctl.PORT), '-c', self.babeld_conf]
 
         self.netconfdb, self.meshconfdb = _utils.set_confdbs(self.test)
 
+        # Keeps babeld running in the background.
+        self.supervisor = babelsupervisor.shared_supervisor(self.babeld_command, self.test)
+
+        # Follows babeld's neighbours and routes in the background.
+        self.monitor = babelmonitor.shared_monitor()
+
+        # Samples the quality of the links to the node's neighbours in the
+        # background while the control panel is running.
+        self.link_quality = linkquality.LinkQuality(cherrypy.engine, self.monitor.tables)
+        self.link_quality.subscribe()
+
+        # The map of the mesh, laid out from babeld's tables as they change.
+        self.mesh_map = topology.Topology(self.monitor.tables)
+
         # Class attributes which apply to a network interface.  By default they
         # are blank but will be populated from the mesh.sqlite database if the
         # user picks an interface that's already been set up.
@@ -53,11 +143,14 @@ class MeshConfiguration(object):
         self.pid = ''
 
     def pid_check(self):
+        pid = self.supervisor.pid()
+        if pid:
+            return str(pid)
         pid = ''
         if os.path.exists(self.babeld_pid):
             logging.debug("Reading PID of babeld.")
             pidfile = open(self.babeld_pid, 'r')
-            pid = pidfile.readline()
+            pid = pidfile.readline().strip()
             pidfile.close()
             logging.debug("PID of babeld: %s", str(pid))
         return pid
@@ -75,15 +168,18 @@ class MeshConfiguration(object):
         netconfconn = sqlite3.connect(self.netconfdb)
         netconfcursor = netconfconn.cursor()
         interfaces = []
-        netconfcursor.execute("SELECT mesh_interface, enabled FROM wireless;")
+        netconfcursor.execute("SELECT mesh_interface, enabled, channel FROM wireless;")
         results = netconfcursor.fetchall()
         active_interfaces = []
+        channels = ""
+        mesh_channels = []
         if not results:
             # Display an error page which says that no wireless interfaces have
-            # been configured yet.
+            # been configured yet.  Wired interfaces can still be meshed.
             error.append("<p>ERROR: No wireless network interfaces have been configured yet.  <a href='/network'>You need to do that first!</a></p>")
         else:
             # Open a connection to the mesh configuration database.
+            upgrade_meshconfdb(self.meshconfdb)
             meshconfconn = sqlite3.connect(self.meshconfdb)
             meshconfcursor = meshconfconn.cursor()
 
@@ -94,12 +190,24 @@ class MeshConfiguration(object):
                     # See if the interface is already in the mesh configuration
                     # database, and if it's not insert it.
                     template = (i[0], )
-                    meshconfcursor.execute("SELECT interface, enabled FROM meshes WHERE interface=?;", template)
+                    meshconfcursor.execute("SELECT interface, enabled, channel FROM meshes WHERE interface=?;", template)
                     interface_found = meshconfcursor.fetchall()
                     interface_tag = "<input type='submit' name='interface' value='"
+
+                    # The mesh database keeps each interface's channel as
+                    # the network wizard last configured it.
+                    in_mesh = interface_found and interface_found[0][1] == 'yes'
+                    channels = channels + "<tr><td>" + i[0] + "</td>\n<td>" + (str(i[2]) if i[2] else 'n/a') + "</td>\n<td>" + ('yes' if in_mesh else 'no') + "</td></tr>\n"
+                    if in_mesh and i[2]:
+                        mesh_channels.append((i[0], int(i[2])))
+                    if interface_found and interface_found[0][2] != i[2]:
+                        template = (i[2], i[0], )
+                        meshconfcursor.execute("UPDATE meshes SET channel=? WHERE interface=?;", template)
+                        meshconfconn.commit()
+
                     if not interface_found:
-                        template = ('no', i[0], 'babel', )
-                        meshconfcursor.execute("INSERT INTO meshes VALUES (?, ?, ?);", template)
+                        template = ('no', i[0], 'babel', i[2], )
+                        meshconfcursor.execute("INSERT INTO meshes (enabled, interface, protocol, channel) VALUES (?, ?, ?, ?);", template)
                         meshconfconn.commit()
 
                         # This is a network interface that's ready to configure,
@@ -123,6 +231,38 @@ class MeshConfiguration(object):
                     interfaces.append("%s%s' style='background-color:orange;' />\n" % (interface_tag, i[0]))
             meshconfcursor.close()
 
+            # Mesh radios on overlapping channels share the air instead of
+            # adding to it.
+            for n, (first, first_channel) in enumerate(mesh_channels):
+                for second, second_channel in mesh_channels[n + 1:]:
+                    if channelplanner.overlaps(first_channel, second_channel):
+                        error.append("<p>WARNING: %s (channel %d) and %s (channel %d) are on overlapping channels, so they're slowing each other down.  <a href='/network'>Move one of them</a> to a channel at least %d away.</p>" % (first, first_channel, second, second_channel, channelplanner.overlap_distance))
+        if not channels:
+            channels = "<tr><td>n/a</td>\n<td>n/a</td>\n<td>n/a</td></tr>\n"
+
+        # Wired interfaces that aren't gateways can mesh too, with the wired
+        # profile, so that babel treats them as fast, reliable links.
+        wired_interfaces = []
+        netconfcursor.execute("SELECT interface FROM wired WHERE gateway='no' AND interface!='lo';")
+        wired = [i[0] for i in netconfcursor.fetchall()]
+        if wired:
+            upgrade_meshconfdb(self.meshconfdb)
+            meshconfconn = sqlite3.connect(self.meshconfdb)
+            meshconfcursor = meshconfconn.cursor()
+            for i in wired:
+                meshconfcursor.execute("SELECT enabled FROM meshes WHERE interface=?;", (i, ))
+                interface_found = meshconfcursor.fetchall()
+                interface_tag = "<input type='submit' name='interface' value='"
+                if not interface_found:
+                    template = ('no', i, 'babel', 'wired', )
+                    meshconfcursor.execute("INSERT INTO meshes (enabled, interface, protocol, profile) VALUES (?, ?, ?, ?);", template)
+                    meshconfconn.commit()
+                if interface_found and interface_found[0][0] == 'yes':
+                    active_interfaces.append("%s%s' style='background-color:green;' />\n" % (interface_tag, i))
+                else:
+                    wired_interfaces.append("%s%s' />\n" % (interface_tag, i))
+            meshconfcursor.close()
+
         # Clean up our connections to the configuration databases.
         netconfcursor.close()
 
@@ -132,7 +272,9 @@ class MeshConfiguration(object):
             return page.render(title = "Byzantium Node Mesh Configuration",
                                purpose_of_page = "Configure Mesh Interfaces",
                                error = ''.join(error), interfaces = ''.join(interfaces),
-                               active_interfaces = ''.join(active_interfaces))
+                               wired_interfaces = ''.join(wired_interfaces),
+                               active_interfaces = ''.join(active_interfaces),
+                               channels = channels)
         except:
             _utils.output_error_data()
     index.exposed = True
@@ -169,19 +311,132 @@ class MeshConfiguration(object):
             _utils.output_error_data()
     addtomesh.exposed = True
     
-    def _pid_helper(self, pid, error, output, cursor, connection, commit=False):
-        if not os.path.isdir('/proc/' + pid):
-            error = "ERROR: babeld is not running!  Did it crash during or after startup?"
-        else:
-            output = "%s has been successfully started with PID %s." % (self.babeld, pid)
-            
-            # Update the mesh configuration database to take into account
-            # the presence of the new interface.
-            template = ('yes', self.interface, )
-            cursor.execute("UPDATE meshes SET enabled=? WHERE interface=?;", template)
-            if commit:
-                connection.commit()
-        return error, output
+    # Asks the supervisor whether babeld is running.  Returns its PID, or ''
+    # and an error message saying why not.
+    def babeld_status(self):
+        babeld = self.supervisor.describe()
+        if babeld['pid']:
+            return str(babeld['pid']), ''
+        if babeld['wanted'] and babeld['down_since'] is not None:
+            return '', ("ERROR: babeld exited with status %s right after it was started.  "
+                        "It will be restarted, but it will probably keep crashing." % babeld['last_exit'])
+        return '', "ERROR: babeld is not running!  Did it crash during or after startup?"
+
+    # Returns the interfaces that are in the mesh right now and the channel
+    # each is on, as a list of (interface, channel) pairs.
+    def mesh_channels(self):
+        upgrade_meshconfdb(self.meshconfdb)
+        query = "SELECT interface, channel FROM meshes WHERE enabled='yes' AND protocol='babel';"
+        connection, cursor = _utils.execute_query(self.meshconfdb, query)
+        channels = [(i[0], i[1]) for i in cursor.fetchall()]
+        connection.close()
+        return channels
+
+    # Returns the channel the network wizard configured an interface on, or
+    # None.
+    def wireless_channel(self, interface):
+        query = "SELECT channel FROM wireless WHERE mesh_interface=?;"
+        connection, cursor = _utils.execute_query(self.netconfdb, query, (interface, ))
+        result = cursor.fetchall()
+        connection.close()
+        if result and result[0][0]:
+            return int(result[0][0])
+        return None
+
+    # Works out the babeld parameters of interfaces from their profiles and
+    # channels.  Takes a list of (interface, channel) pairs.  Returns a list of
+    # (interface, parameters) pairs.
+    def interface_parameters(self, channels):
+        upgrade_meshconfdb(self.meshconfdb)
+        profiles = babelconfig.load_profiles(self.meshconfdb)
+        query = "SELECT interface, profile FROM meshes;"
+        connection, cursor = _utils.execute_query(self.meshconfdb, query)
+        assigned = dict(cursor.fetchall())
+        connection.close()
+        result = []
+        for interface, channel in channels:
+            profile = profiles.get(assigned.get(interface) or babelconfig.DEFAULT_PROFILE, {})
+            result.append((interface, babelconfig.parameters(profile, channel)))
+        return result
+
+    # Generates babeld's configuration file.  Takes a list of (interface,
+    # parameters) pairs.  Returns True if the file changed.
+    def write_babeld_conf(self, parameters):
+        contents = babelconfig.config_contents(babelconfig.read_base(self.babeld_conf_base), parameters)
+        if self.test:
+            logging.debug("Pretending to write %s:\n%s", self.babeld_conf, contents)
+            return False
+        try:
+            if not os.path.isdir(os.path.dirname(self.babeld_conf)):
+                os.makedirs(os.path.dirname(self.babeld_conf))
+            return _utils.write_if_changed(self.babeld_conf, contents)
+        except (IOError, OSError) as ex:
+            logging.error("Unable to write %s: %s", self.babeld_conf, ex)
+            return False
+
+    # Returns True if an interface is in the wired table.
+    def is_wired(self, interface):
+        query = "SELECT interface FROM wired WHERE interface=?;"
+        connection, cursor = _utils.execute_query(self.netconfdb, query, (interface, ))
+        wired = bool(cursor.fetchall())
+        connection.close()
+        return wired
+
+    # Brings a wired interface up and, if it doesn't have an IPv4 address,
+    # gives it the node's mesh address as a /32 so that babeld can route
+    # IPv4 over it.  Every interface of a babel router can share the same
+    # address, and babeld installs its routes with the onlink flag, so no
+    # netblock has to be set aside for the cable.  Takes the node's other
+    # mesh interfaces, the first of which with an address lends it.  Returns
+    # False if the interface couldn't be set up.
+    def address_wired_interface(self, interface, others):
+        if self.test:
+            logging.debug("Pretending to bring up %s with the node's mesh address.", interface)
+            return True
+        try:
+            netlink.set_link(interface, True)
+            if netlink.get_address(interface):
+                return True
+            for other in others:
+                address = netlink.get_address(other)
+                if address:
+                    logging.debug("Giving %s the mesh address %s/32.", interface, address)
+                    netlink.set_address(interface, address, 32)
+                    return True
+        except (netlink.NetlinkError, socket.error) as ex:
+            logging.error("Unable to set up %s: %s", interface, ex)
+            return False
+        logging.debug("No mesh address to give %s yet; babeld will only route IPv6 over it.", interface)
+        return True
+
+    # Takes back the mesh address address_wired_interface() lent a wired
+    # interface when it leaves the mesh.  Nothing else gives a wired
+    # interface a /32, so any it has goes.  Returns False if that couldn't be
+    # done.
+    def unaddress_wired_interface(self, interface):
+        if self.test:
+            logging.debug("Pretending to take the mesh address back from %s.", interface)
+            return True
+        try:
+            for address in netlink.get_addresses():
+                if address['label'] == interface and address['prefixlen'] == 32:
+                    logging.debug("Taking the mesh address %s/32 back from %s.", address['address'], interface)
+                    netlink.remove_address(interface, address['address'], 32)
+        except (netlink.NetlinkError, socket.error) as ex:
+            logging.error("Unable to take the mesh address back from %s: %s", interface, ex)
+            return False
+        return True
+
+    # Builds the command line babeld is run with from the interfaces that are
+    # in the mesh right now, and the configuration file it reads.  Returns
+    # None if there aren't any.  The supervisor calls this to restart babeld.
+    def babeld_command(self):
+        channels = self.mesh_channels()
+        if not channels:
+            return None
+        self.write_babeld_conf(self.interface_parameters(channels))
+        return ([self.babeld] + self.babeld_opts + diversity_options(channels) +
+                [i[0] for i in channels])
 
     def update_babeld(self, common_babeld_opts, unique_babeld_opts, interfaces):
         # Assemble the invocation of babeld.
@@ -191,65 +446,127 @@ class MeshConfiguration(object):
         babeld_command = babeld_command + unique_babeld_opts + interfaces
         logging.debug("babeld command to be executed: %s", ' '.join(babeld_command))
 
-        # Test to see if babeld is running.  If it is, it's routing for at
-        # least one interface, in which case we add the one the user just
-        # picked to the list because we'll have to restart babeld.  Otherwise,
-        # we just start babeld.
-        pid = self.pid_check()
-        if pid:
-            if self.test:
-                logging.debug("Pretending to kill babeld.")
-            else:
-                logging.debug("Killing babeld...")
-                os.kill(int(pid), signal.SIGTERM)
-            time.sleep(self.babeld_timeout)
-        if self.test:
-            logging.debug("Pretending to restart babeld.")
-        else:
-            logging.debug("Restarting babeld.")
-            subprocess.Popen(babeld_command)
-        time.sleep(self.babeld_timeout)
+        # The supervisor stops the babeld that's running, if there is one,
+        # and waits for it to exit before starting the new one.  With no
+        # interfaces left to route on, babeld stays stopped.
+        if not interfaces:
+            jobs.report(30, "Stopping babeld.")
+            self.supervisor.shutdown()
+            return babeld_command
+        jobs.report(60, "Restarting babeld.")
+        instance = self.supervisor.restart(babeld_command)
+
+        # A babeld that can't start dies straight away.  Once the supervisor
+        # has seen that, babeld_status() reports it.
+        if instance:
+            instance.done.wait(self.babeld_timeout)
         return babeld_command
 
-    # Runs babeld to turn self.interface into a mesh interface.
+    # Adds an interface to (or removes it from) the running babeld through
+    # its local configuration interface, which leaves the routes through the
+    # node's other interfaces alone.  Returns False if that can't be done
+    # (babeld isn't running, or is too old to be reconfigured on the fly), in
+    # which case it has to be restarted with update_babeld().  Takes the
+    # interface's parameters (such as its channel) when it's being added.
+    def reconfigure_babeld(self, interface, add, parameters=()):
+        if not self.pid_check():
+            return False
+        jobs.report(40, "Reconfiguring babeld.")
+        if self.test:
+            logging.debug("Pretending to %s %s on the running babeld.", 'add' if add else 'remove', interface)
+            return True
+        try:
+            if add:
+                babelctl.add_interface(interface, parameters)
+            else:
+                babelctl.flush_interface(interface)
+        except babelctl.BabelError as ex:
+            logging.debug("Couldn't reconfigure babeld on the fly, restarting it: %s", ex)
+            return False
+        return True
+
+    # Runs babeld to turn self.interface into a mesh interface.  This takes a
+    # while, so it's done by a background job working from a copy of this
+    # object, and the browser is sent to a page that follows its progress.
     def enable(self):
+        jobs.start("Adding " + self.interface + " to the mesh",
+                   copy.copy(self).add_interface,
+                   key=('mesh', self.interface))
+    enable.exposed = True
+
+    # Does the work of enable().  Returns the rendered results page.
+    def add_interface(self):
         # Set up the error and successful output messages.
         error = ''
         output = ''
 
-        # Set up a default set of command line options for babeld.  Some of
-        # these are redundant but are present in case an older version of
-        # babeld is used on the node.  See the following file to see why:
-        # http://www.pps.jussieu.fr/~jch/software/babel/CHANGES.text
-        common_babeld_opts = ['-m', 'ff02:0:0:0:0:0:1:6', '-p', '6696', '-D',
-			      '-g', '33123' , '-c', '/etc/babeld.conf']
-
-        # Create a set of unique command line options for babeld.  Right now,
-        # this variable is empty but it might be used in the future.  Maybe
-        # it'll be populated from a config file or something.
-        unique_babeld_opts = []
-
-        # Set up a list of mesh interfaces for which babeld is already running.
+        # Set up a list of mesh interfaces for which babeld is already running,
+        # and the channels they're on.
+        current = self.mesh_channels()
         interfaces = []
-        query = "SELECT interface, enabled, protocol FROM meshes WHERE enabled='yes' AND protocol='babel';"
-        connection, cursor = _utils.execute_query(self.meshconfdb, query)
-        results = cursor.fetchall()
-        for i in results:
+        for i in current:
             logging.debug("Adding interface: %s", i[0])
             interfaces.append(i[0])
 
         # By definition, if we're in this method the new interface hasn't been
-        # added yet.
+        # added yet.  Its channel is recorded in the mesh configuration
+        # database so that babeld is always told which channel it's on.
         interfaces.append(self.interface)
+        channel = self.wireless_channel(self.interface)
+        channels = current + [(self.interface, channel)]
+
+        # A wired interface has to be up and have an address before babeld
+        # can route over it.  If it can't be brought up it stays out of the
+        # mesh.
+        if self.is_wired(self.interface):
+            jobs.report(20, "Bringing up " + self.interface + ".")
+            if not self.address_wired_interface(self.interface, [i[0] for i in current]):
+                error = "ERROR: Unable to bring up %s, so it hasn't been added to the mesh." % self.interface
+                try:
+                    page = self.templatelookup.get_template("/mesh/enabled.html")
+                    return page.render(title = "Byzantium Node Mesh Configuration",
+                                       purpose_of_page = "Mesh Interface Not Enabled",
+                                       protocol = self.protocol,
+                                       interface = self.interface,
+                                       error = error, output = output)
+                except:
+                    _utils.output_error_data()
+                return
+        connection = sqlite3.connect(self.meshconfdb)
+        cursor = connection.cursor()
+        cursor.execute("UPDATE meshes SET channel=? WHERE interface=?;", (channel, self.interface))
+        connection.commit()
 
-        self.update_babeld(common_babeld_opts, unique_babeld_opts, interfaces)
+        # babeld's configuration file tells it the channel each interface is
+        # on, so that with radios on different channels it can route across
+        # them, and the parameters of each interface's profile.
+        interface_parameters = self.interface_parameters(channels)
+        self.write_babeld_conf(interface_parameters)
+        unique_babeld_opts = diversity_options(channels)
+        parameters = dict(interface_parameters)[self.interface]
+
+        # If babeld is already running, it's told to start routing on the new
+        # interface too.  Otherwise it's (re)started with all of them.  It's
+        # also restarted if this is the first interface on a second channel,
+        # because diversity routing can only be turned on at startup.
+        jobs.checkpoint()
+        reconfigured = False
+        if diverse(current) == diverse(channels):
+            reconfigured = self.reconfigure_babeld(self.interface, True, parameters)
+        else:
+            logging.debug("%s is on a different channel, restarting babeld with diversity routing.", self.interface)
+        if not reconfigured:
+            self.update_babeld(self.babeld_opts, unique_babeld_opts, interfaces)
 
-        # Get the PID of babeld, then test to see if that pid exists and
-        # corresponds to a running babeld process.  If there is no match,
-        # babeld isn't running.
-        pid = self.pid_check()
+        # If babeld is running, the new interface is part of the mesh.
+        pid, error = self.babeld_status()
         if pid:
-            error, output = self._pid_helper(pid, error, output, cursor, connection, commit=True)
+            if reconfigured:
+                output = "%s (PID %s) is now routing on %s." % (self.babeld, pid, self.interface)
+            else:
+                output = "%s has been successfully started with PID %s." % (self.babeld, pid)
+            cursor.execute("UPDATE meshes SET enabled=? WHERE interface=?;", ('yes', self.interface))
+            connection.commit()
         cursor.close()
 
         # Render the HTML page.
@@ -262,7 +579,6 @@ class MeshConfiguration(object):
                                error = error, output = output)
         except:
             _utils.output_error_data()
-    enable.exposed = True
 
     # Allows the user to remove a configured interface from the mesh.  Takes
     # one argument from self.index(), the name of the interface.
@@ -285,64 +601,65 @@ class MeshConfiguration(object):
             _utils.output_error_data()
     removefrommesh.exposed = True
 
-    # Re-runs babeld without self.interface to drop it out of the mesh.
+    # Re-runs babeld without self.interface to drop it out of the mesh.  Like
+    # enable(), this is done in the background.
     def disable(self):
         logging.debug("Entered MeshConfiguration.disable().")
+        jobs.start("Removing " + self.interface + " from the mesh",
+                   copy.copy(self).remove_interface,
+                   key=('mesh', self.interface))
+    disable.exposed = True
+
+    # Does the work of disable().  Returns the rendered results page.
+    def remove_interface(self):
+        logging.debug("Entered MeshConfiguration.remove_interface().")
 
         # Set up the error and successful output messages.
         error = ''
         output = ''
 
-        # Set up a default set of command line options for babeld.  Some of
-        # these are redundant but are present in case an older version of
-        # babeld is used on the node.  See the following file to see why:
-        # http://www.pps.jussieu.fr/~jch/software/babel/CHANGES.text
-        common_babeld_opts = ['-m', 'ff02:0:0:0:0:0:1:6', '-p', '6696', '-D']
-
-        # Create a set of unique command line options for babeld.  Right now,
-        # this variable is empty but it might be used in the future.  Maybe
-        # it'll be populated from a config file or something.
-        unique_babeld_opts = []
-
         # Set up a list of mesh interfaces for which babeld is already running
         # but omit self.interface.
-        interfaces = []
-        query = "SELECT interface FROM meshes WHERE enabled='yes' AND protocol='babel';"
-        connection, cursor = _utils.execute_query(self.meshconfdb, query)
-        results = cursor.fetchall()
-        for i in results:
-            if i[0] != self.interface:
-                interfaces.append(i[0])
+        channels = [i for i in self.mesh_channels() if i[0] != self.interface]
+        interfaces = [i[0] for i in channels]
+
+        # Tell babeld which channel each remaining interface is on.
+        self.write_babeld_conf(self.interface_parameters(channels))
+        unique_babeld_opts = diversity_options(channels)
+        connection = sqlite3.connect(self.meshconfdb)
+        cursor = connection.cursor()
 
         # If there are no mesh interfaces configured anymore, then the node
         # is offline.
         if not interfaces:
             output = 'Byzantium node offline.'
 
-        babeld_command = self.update_babeld(common_babeld_opts, unique_babeld_opts, interfaces)
+        # If other interfaces are still in the mesh, the running babeld is
+        # told to stop routing on this one.  Otherwise (or if that doesn't
+        # work) babeld is restarted without it, or just stopped if it was the
+        # last one.
+        jobs.checkpoint()
+        if interfaces and self.reconfigure_babeld(self.interface, False):
+            output = "%s has stopped routing on %s." % (self.babeld, self.interface)
+        else:
+            self.update_babeld(self.babeld_opts, unique_babeld_opts, interfaces)
 
-        # If there is at least one wireless network interface still configured,
-        # then re-run babeld.
+        # If babeld is supposed to be running, make sure it is.
         if interfaces:
-            logging.debug("value of babeld_command is %s", babeld_command)
-            if self.test:
-                logging.debug("Pretending to restart babeld.")
-            else:
-                subprocess.Popen(babeld_command)
-            time.sleep(self.babeld_timeout)
-
-        # Get the PID of babeld, then test to see if that pid exists and
-        # corresponds to a running babeld process.  If there is no match,
-        # babeld isn't running, in which case something went wrong.
-        pid = self.pid_check()
-        if pid:
-            error, output = self._pid_helper(pid, error, output, cursor, connection)
-        else:
-            # There are no mesh interfaces left, so update the database to
-            # deconfigure self.interface.
-            template = ('no', self.interface, )
-            cursor.execute("UPDATE meshes SET enabled=? WHERE interface=?;",
-                           template)
+            pid, error = self.babeld_status()
+            if pid and not output:
+                output = "%s has been restarted with PID %s." % (self.babeld, pid)
+
+        # A wired interface gives back the address it borrowed.
+        if self.is_wired(self.interface) and not self.unaddress_wired_interface(self.interface):
+            if error:
+                error = error + "  "
+            error = error + "ERROR: Unable to take the mesh address back from %s." % self.interface
+
+        # Either way, self.interface isn't part of the mesh anymore.
+        template = ('no', self.interface, )
+        cursor.execute("UPDATE meshes SET enabled=? WHERE interface=?;",
+                       template)
         connection.commit()
         cursor.close()
 
@@ -354,5 +671,254 @@ class MeshConfiguration(object):
                                error = error, output = output)
         except:
             _utils.output_error_data()
-    removefrommesh.exposed = True
-    disable.exposed = True
+
+    # Shows the babeld profiles and which one each mesh interface uses, and
+    # lets the user change them.
+    def profiles(self):
+        return self.render_profiles()
+    profiles.exposed = True
+
+    def render_profiles(self, error='', output=''):
+        upgrade_meshconfdb(self.meshconfdb)
+        profiles = babelconfig.load_profiles(self.meshconfdb)
+        names = sorted(profiles)
+
+        rows = ""
+        for name in names:
+            rows = rows + "<tr><td>" + name + "</td>"
+            for field in babelconfig.FIELDS:
+                value = profiles[name][field]
+                rows = rows + "\n<td>" + ('default' if value is None else str(value)) + "</td>"
+            rows = rows + "</tr>\n"
+
+        interfaces = ""
+        query = "SELECT interface, enabled, profile FROM meshes;"
+        connection, cursor = _utils.execute_query(self.meshconfdb, query)
+        for interface, enabled, profile in cursor.fetchall():
+            options = ""
+            for name in names:
+                selected = " selected='selected'" if name == (profile or babelconfig.DEFAULT_PROFILE) else ""
+                options = options + "<option value='%s'%s>%s</option>" % (name, selected, name)
+            interfaces = interfaces + "<tr><td>" + interface + "</td>\n<td>" + enabled + "</td>\n<td><form action='set_profile' method='post'><input type='hidden' name='interface' value='" + interface + "' /><select name='profile'>" + options + "</select> <input type='submit' value='Use' /></form></td></tr>\n"
+        connection.close()
+        if not interfaces:
+            interfaces = "<tr><td>n/a</td>\n<td>n/a</td>\n<td>n/a</td></tr>\n"
+
+        try:
+            page = self.templatelookup.get_template("/mesh/profiles.html")
+            return page.render(title = "Byzantium Node Mesh Profiles",
+                               purpose_of_page = "babeld Profiles",
+                               error = error, output = output,
+                               profiles = rows, interfaces = interfaces)
+        except:
+            _utils.output_error_data()
+
+    # Creates or changes a profile, then applies it to the interfaces that
+    # use it.  Intervals left empty are babeld's defaults.
+    def save_profile(self, name=None, hello_interval=None, update_interval=None,
+                     link_quality=None, wired=None, split_horizon=None):
+        if not name or not babelconfig.name_pattern.match(name):
+            return self.render_profiles(error="<p>ERROR: Profile names have to be letters, numbers, hyphens and underscores.</p>")
+        try:
+            profile = babelconfig.validate({'hello_interval': hello_interval,
+                                            'update_interval': update_interval,
+                                            'link_quality': link_quality,
+                                            'wired': wired,
+                                            'split_horizon': split_horizon})
+        except ValueError as ex:
+            return self.render_profiles(error="<p>ERROR: %s</p>" % ex)
+        upgrade_meshconfdb(self.meshconfdb)
+        babelconfig.save_profile(self.meshconfdb, name, profile)
+        jobs.start("Applying babeld profile " + name,
+                   copy.copy(self).apply_profiles, key=('mesh', 'profiles'))
+    save_profile.exposed = True
+
+    # Gives an interface a different profile, then applies it.
+    def set_profile(self, interface=None, profile=None):
+        upgrade_meshconfdb(self.meshconfdb)
+        if profile not in babelconfig.load_profiles(self.meshconfdb):
+            return self.render_profiles(error="<p>ERROR: There's no profile called %s.</p>" % cgi.escape(str(profile)))
+        query = "UPDATE meshes SET profile=? WHERE interface=?;"
+        connection, cursor = _utils.execute_query(self.meshconfdb, query, (profile, interface))
+        connection.commit()
+        updated = cursor.rowcount
+        connection.close()
+        if not updated:
+            return self.render_profiles(error="<p>ERROR: %s isn't a mesh interface.</p>" % cgi.escape(str(interface)))
+        jobs.start("Applying babeld profile " + profile + " to " + interface,
+                   copy.copy(self).apply_profiles, key=('mesh', 'profiles'))
+    set_profile.exposed = True
+
+    # Does the work of save_profile() and set_profile(): regenerates babeld's
+    # configuration file and sends the new parameters of every mesh
+    # interface to the running babeld, or restarts it if that can't be done
+    # (including when a parameter goes back to babeld's default, which the
+    # running babeld can't be told).  Returns the rendered profiles page.
+    def apply_profiles(self):
+        error = ''
+        channels = self.mesh_channels()
+        parameters = self.interface_parameters(channels)
+        cleared = babelconfig.cleared(babelconfig.read_base(self.babeld_conf), parameters)
+        jobs.report(20, "Writing babeld's configuration.")
+        self.write_babeld_conf(parameters)
+        if not channels:
+            return self.render_profiles(output="No interfaces are in the mesh yet.  Their profiles will be used when they are.")
+
+        jobs.checkpoint()
+        applied = not cleared
+        if cleared:
+            logging.debug("Parameters of %s went back to babeld's defaults.", ', '.join(cleared))
+        for interface, interface_parameters in parameters:
+            if not applied:
+                break
+            if not self.reconfigure_babeld(interface, True, interface_parameters):
+                applied = False
+        if applied:
+            output = "babeld is now using the new profiles."
+        else:
+            self.update_babeld(self.babeld_opts, diversity_options(channels),
+                               [i[0] for i in channels])
+            pid, error = self.babeld_status()
+            if pid:
+                output = "%s has been restarted with PID %s to use the new profiles." % (self.babeld, pid)
+            else:
+                output = ''
+                error = "<p>%s</p>" % error
+        return self.render_profiles(error, output)
+
+    # Shows babeld's neighbours, routes and exported routes.
+    def routing(self):
+        tables = self.monitor.tables
+        if self.monitor.connected:
+            state = "Following babeld's routing table."
+        else:
+            state = "Not connected to babeld.  Is it running?"
+        babeld = self.supervisor.describe()
+        downtime = babeld['downtime']
+        if babeld['down_since'] is not None:
+            downtime += time.time() - babeld['down_since']
+            state = state + "  babeld exited unexpectedly (status %s) and is being restarted." % babeld['last_exit']
+        if babeld['restarts'] or downtime:
+            state = state + "  babeld has been restarted %d times after exiting unexpectedly, and the mesh was without it for %d seconds in all." % (babeld['restarts'], downtime)
+
+        neighbours = ""
+        for i in tables.entries('neighbour'):
+            neighbours = neighbours + "<tr><td>" + i.get('address', '') + "</td>\n<td>" + i.get('if', '') + "</td>\n<td>" + i.get('reach', '') + "</td>\n<td>" + i.get('rxcost', '') + "</td>\n<td>" + i.get('txcost', '') + "</td>\n<td>" + i.get('cost', '') + "</td></tr>\n"
+        if not neighbours:
+            neighbours = "<tr><td>n/a</td>\n<td>n/a</td>\n<td>n/a</td>\n<td>n/a</td>\n<td>n/a</td>\n<td>n/a</td></tr>\n"
+
+        routes = ""
+        for i in tables.entries('route'):
+            routes = routes + "<tr><td>" + i.get('prefix', '') + "</td>\n<td>" + i.get('metric', '') + "</td>\n<td>" + i.get('via', '') + "</td>\n<td>" + i.get('if', '') + "</td>\n<td>" + i.get('installed', '') + "</td></tr>\n"
+        if not routes:
+            routes = "<tr><td>n/a</td>\n<td>n/a</td>\n<td>n/a</td>\n<td>n/a</td>\n<td>n/a</td></tr>\n"
+
+        xroutes = ""
+        for i in tables.entries('xroute'):
+            xroutes = xroutes + "<tr><td>" + i.get('prefix', '') + "</td>\n<td>" + i.get('metric', '') + "</td></tr>\n"
+        if not xroutes:
+            xroutes = "<tr><td>n/a</td>\n<td>n/a</td></tr>\n"
+
+        try:
+            page = self.templatelookup.get_template("/mesh/routing.html")
+            return page.render(title = "Byzantium Node Mesh Routing",
+                               purpose_of_page = "Mesh Routing Table",
+                               state = state, neighbours = neighbours,
+                               routes = routes, xroutes = xroutes)
+        except:
+            _utils.output_error_data()
+    routing.exposed = True
+
+    # Graphs the costs of the links to the node's neighbours, the metrics of
+    # the routes through them and the signal and noise of the interfaces
+    # they're on over the last hour or so.
+    def links(self):
+        now = time.time()
+        start = now - self.link_quality.history * self.link_quality.frequency
+        graphs = ""
+        for address, interface in self.link_quality.neighbours():
+            samples = self.link_quality.samples((address, interface), start)
+            if not samples:
+                continue
+            timestamps, values = samples
+            graphs = graphs + "<h2>" + address + " on " + interface + "</h2>\n"
+            graphs = graphs + linkquality.svg_graph(timestamps,
+                [('receive cost', '#32CD32', values['rxcost']),
+                 ('transmit cost', '#4169E1', values['txcost']),
+                 ('best route metric', '#000000', values['metric'])],
+                start, now) + "<br />\n"
+            if [i for i in values['signal'] + values['noise'] if i is not None]:
+                graphs = graphs + linkquality.svg_graph(timestamps,
+                    [('signal (dBm)', '#32CD32', values['signal']),
+                     ('noise (dBm)', '#CC0000', values['noise'])],
+                    start, now) + "<br />\n"
+        if not graphs:
+            graphs = "<p>No neighbours have been heard from yet.</p>\n"
+
+        try:
+            page = self.templatelookup.get_template("/mesh/links.html")
+            return page.render(title = "Byzantium Node Mesh Links",
+                               purpose_of_page = "Mesh Link Quality",
+                               graphs = graphs)
+        except:
+            _utils.output_error_data()
+    links.exposed = True
+
+    # Draws the mesh as the node sees it.
+    def topology(self):
+        if self.monitor.connected:
+            state = "Drawn from babeld's routing table."
+        else:
+            state = "Not connected to babeld.  Is it running?"
+        try:
+            page = self.templatelookup.get_template("/mesh/topology.html")
+            return page.render(title = "Byzantium Node Mesh Map",
+                               purpose_of_page = "Mesh Map",
+                               state = state, graph = self.mesh_map.get_svg())
+        except:
+            _utils.output_error_data()
+    topology.exposed = True
+
+    # Implements /mesh/topology.json and /mesh/topology.svg, which return the
+    # map of the mesh as a graph for other tools to draw, or as a picture.
+    # Both are cached until the graph changes noticeably (see topology.py),
+    # so the generation of the map makes the ETag.
+    def topology_json(self):
+        document = dict(self.mesh_map.get_document())
+        document['version'] = MESH_API_VERSION
+        etag = _utils.make_etag([MESH_API_VERSION, 'topology', document['generation']])
+        return _utils.json_response(document, etag)
+    topology_json.exposed = True
+
+    def topology_svg(self):
+        svg = self.mesh_map.get_svg()
+        etag = _utils.make_etag([MESH_API_VERSION, 'topology.svg', self.mesh_map.generation])
+        cherrypy.response.headers['ETag'] = etag
+        if _utils.etag_matches(etag):
+            cherrypy.response.status = 304
+            return ''
+        cherrypy.response.headers['Content-Type'] = 'image/svg+xml'
+        return svg
+    topology_svg.exposed = True
+
+    # Implements /mesh/api, which returns babeld's tables and the
+    # supervisor's counters as JSON.  The generation of the tables (and the
+    # counters, which are small) make the ETag, so a poller that's already up
+    # to date is answered without the tables being copied at all.
+    def api(self):
+        tables = self.monitor.tables
+        babeld = self.supervisor.describe()
+        etag = _utils.make_etag([MESH_API_VERSION, self.monitor.connected, tables.generation, babeld])
+        if _utils.etag_matches(etag):
+            cherrypy.response.headers['ETag'] = etag
+            cherrypy.response.status = 304
+            return ''
+        connected = self.monitor.connected
+        generation, entries = tables.snapshot()
+        document = {'version': MESH_API_VERSION, 'connected': connected,
+                    'generation': generation, 'babeld': babeld}
+        for kind in babelmonitor.KINDS:
+            document[kind + 's'] = entries[kind]
+        etag = _utils.make_etag([MESH_API_VERSION, connected, generation, babeld])
+        return _utils.json_response(document, etag)
+    api.exposed = True
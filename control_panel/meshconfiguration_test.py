@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# meshconfiguration_test.py
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from flexmock import flexmock
+import meshconfiguration
+
+
+class ReconfigureBabeldTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mesh = meshconfiguration.MeshConfiguration(None, False)
+
+    def test_babeld_is_started_with_a_writable_local_port(self):
+        flexmock(meshconfiguration.babelctl).should_receive('version').and_return((1, 8))
+        mesh = meshconfiguration.MeshConfiguration(None, False)
+        self.assertTrue('-G' in mesh.babeld_opts)
+        self.assertFalse('-g' in mesh.babeld_opts)
+        self.assertEqual(str(meshconfiguration.babelctl.PORT),
+                         mesh.babeld_opts[mesh.babeld_opts.index('-G') + 1])
+
+    def test_adds_interface_to_running_babeld(self):
+        flexmock(self.mesh).should_receive('pid_check').and_return('1234')
+        flexmock(meshconfiguration.babelctl).should_receive('add_interface').with_args('wlan1', ['channel', '6']).once
+        self.assertTrue(self.mesh.reconfigure_babeld('wlan1', True, ['channel', '6']))
+
+    def test_falls_back_when_babeld_is_too_old(self):
+        flexmock(self.mesh).should_receive('pid_check').and_return('1234')
+        flexmock(meshconfiguration.babelctl).should_receive('flush_interface').and_raise(
+            meshconfiguration.babelctl.BabelError("babeld answered 'bad'."))
+        self.assertFalse(self.mesh.reconfigure_babeld('wlan1', False))
+
+    def test_falls_back_when_babeld_is_not_running(self):
+        flexmock(self.mesh).should_receive('pid_check').and_return('')
+        flexmock(meshconfiguration.babelctl).should_receive('add_interface').never
+        self.assertFalse(self.mesh.reconfigure_babeld('wlan1', True))
+
+    def test_last_interface_just_stops_babeld(self):
+        flexmock(self.mesh.supervisor).should_receive('shutdown').once
+        flexmock(self.mesh.supervisor).should_receive('restart').never
+        self.mesh.update_babeld(self.mesh.babeld_opts, [], [])
+
+    def test_babeld_is_restarted_by_the_supervisor(self):
+        instance = flexmock(done=flexmock())
+        instance.done.should_receive('wait').with_args(self.mesh.babeld_timeout).once
+        flexmock(self.mesh.supervisor).should_receive('restart').with_args(
+            [self.mesh.babeld] + self.mesh.babeld_opts + ['wlan0', 'wlan1']).and_return(instance).once
+        self.mesh.update_babeld(self.mesh.babeld_opts, [], ['wlan0', 'wlan1'])
+
+    def test_babeld_status_comes_from_the_supervisor(self):
+        state = {'pid': 1234, 'wanted': True, 'restarts': 0, 'downtime': 0.0,
+                 'down_since': None, 'last_exit': None}
+        flexmock(self.mesh.supervisor).should_receive('describe').and_return(state)
+        self.assertEqual(('1234', ''), self.mesh.babeld_status())
+
+        state.update(pid=None, down_since=1000.0, last_exit=1)
+        pid, error = self.mesh.babeld_status()
+        self.assertEqual('', pid)
+        self.assertTrue('status 1' in error)
+
+        state.update(wanted=False, down_since=None)
+        self.assertEqual('', self.mesh.babeld_status()[0])
+
+
+class InterfacesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.mesh = meshconfiguration.MeshConfiguration(None, False)
+        self.mesh.meshconfdb = os.path.join(self.directory, 'mesh.sqlite')
+        self.mesh.netconfdb = os.path.join(self.directory, 'network.sqlite')
+        self.mesh.babeld_conf_base = os.path.join(self.directory, 'babeld.conf.base')
+        self.mesh.babeld_conf = os.path.join(self.directory, 'babeld.conf')
+        base = open(self.mesh.babeld_conf_base, 'w')
+        base.write('redistribute metric 128\n')
+        base.close()
+
+        # A mesh.sqlite from before interfaces had channels.
+        connection = sqlite3.connect(self.mesh.meshconfdb)
+        connection.execute("CREATE TABLE meshes (enabled TEXT, interface TEXT, protocol TEXT);")
+        connection.execute("INSERT INTO meshes VALUES ('yes', 'wlan0', 'babel');")
+        connection.execute("INSERT INTO meshes VALUES ('no', 'wlan1', 'babel');")
+        connection.commit()
+        connection.close()
+        connection = sqlite3.connect(self.mesh.netconfdb)
+        connection.execute("CREATE TABLE wireless (gateway TEXT, client_interface TEXT, enabled TEXT, channel NUMERIC, essid TEXT, mesh_interface TEXT);")
+        connection.execute("INSERT INTO wireless VALUES ('no', 'wlan0:1', 'yes', 1, 'Byzantium', 'wlan0');")
+        connection.execute("INSERT INTO wireless VALUES ('no', 'wlan1:1', 'yes', 11, 'Byzantium', 'wlan1');")
+        connection.execute("CREATE TABLE wired (enabled TEXT, gateway TEXT, interface TEXT);")
+        connection.execute("INSERT INTO wired VALUES ('no', 'no', 'eth0');")
+        connection.execute("INSERT INTO wired VALUES ('no', 'yes', 'eth1');")
+        connection.commit()
+        connection.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def set_channel(self, interface, channel):
+        meshconfiguration.upgrade_meshconfdb(self.mesh.meshconfdb)
+        connection = sqlite3.connect(self.mesh.meshconfdb)
+        connection.execute("UPDATE meshes SET channel=? WHERE interface=?;", (channel, interface))
+        connection.commit()
+        connection.close()
+
+    def test_old_databases_are_upgraded(self):
+        self.assertEqual([('wlan0', None)], self.mesh.mesh_channels())
+        connection = sqlite3.connect(self.mesh.meshconfdb)
+        columns = [i[1] for i in connection.execute("PRAGMA table_info(meshes);")]
+        connection.close()
+        self.assertEqual(['enabled', 'interface', 'protocol', 'channel', 'profile'], columns)
+
+    def test_diversity_options(self):
+        self.assertEqual([], meshconfiguration.diversity_options([('wlan0', None)]))
+        self.assertEqual([], meshconfiguration.diversity_options([('wlan0', 1), ('wlan1', None)]))
+        self.assertEqual(['-z', meshconfiguration.DIVERSITY],
+                         meshconfiguration.diversity_options([('wlan0', 1), ('wlan1', 11)]))
+
+    def test_second_radio_restarts_babeld_with_diversity(self):
+        self.set_channel('wlan0', 1)
+        self.mesh.interface = 'wlan1'
+        self.mesh.templatelookup = flexmock(get_template=lambda name: flexmock(render=lambda **kwargs: ''))
+        flexmock(self.mesh).should_receive('babeld_status').and_return(('', 'ERROR: babeld is not running!'))
+        flexmock(self.mesh).should_receive('reconfigure_babeld').never
+        flexmock(self.mesh).should_receive('update_babeld').with_args(
+            self.mesh.babeld_opts, ['-z', meshconfiguration.DIVERSITY],
+            ['wlan0', 'wlan1']).once
+        self.mesh.add_interface()
+        connection = sqlite3.connect(self.mesh.meshconfdb)
+        self.assertEqual([(11, )], connection.execute("SELECT channel FROM meshes WHERE interface='wlan1';").fetchall())
+        connection.close()
+        conf = open(self.mesh.babeld_conf).read()
+        self.assertTrue('interface wlan0 channel 1\n' in conf)
+        self.assertTrue('interface wlan1 channel 11\n' in conf)
+
+    def test_babeld_command_writes_the_configuration(self):
+        self.set_channel('wlan0', 1)
+        connection = sqlite3.connect(self.mesh.meshconfdb)
+        connection.execute("UPDATE meshes SET enabled='yes', channel=11, profile='dense' WHERE interface='wlan1';")
+        connection.commit()
+        connection.close()
+        self.assertEqual([self.mesh.babeld] + self.mesh.babeld_opts +
+                         ['-z', meshconfiguration.DIVERSITY, 'wlan0', 'wlan1'],
+                         self.mesh.babeld_command())
+        self.assertEqual(['# Generated by the Byzantium control panel.  Changes made here will be overwritten.',
+                          'redistribute metric 128',
+                          'interface wlan0 channel 1',
+                          'interface wlan1 hello-interval 8 update-interval 32 channel 11'],
+                         open(self.mesh.babeld_conf).read().splitlines())
+
+    def test_profiles_are_applied_live(self):
+        self.set_channel('wlan0', 1)
+        self.mesh.templatelookup = flexmock(get_template=lambda name: flexmock(render=lambda **kwargs: ''))
+        flexmock(self.mesh).should_receive('reconfigure_babeld').with_args(
+            'wlan0', True, ['hello-interval', '2', 'update-interval', '8', 'channel', '1']).and_return(True).once
+        flexmock(self.mesh).should_receive('update_babeld').never
+        connection = sqlite3.connect(self.mesh.meshconfdb)
+        connection.execute("UPDATE meshes SET profile='sparse' WHERE interface='wlan0';")
+        connection.commit()
+        connection.close()
+        self.mesh.apply_profiles()
+
+    def test_babeld_is_restarted_if_profiles_cant_be_applied_live(self):
+        self.mesh.templatelookup = flexmock(get_template=lambda name: flexmock(render=lambda **kwargs: ''))
+        flexmock(self.mesh).should_receive('reconfigure_babeld').and_return(False).once
+        flexmock(self.mesh).should_receive('update_babeld').with_args(self.mesh.babeld_opts, [], ['wlan0']).once
+        flexmock(self.mesh).should_receive('babeld_status').and_return(('1234', ''))
+        self.mesh.apply_profiles()
+
+    def test_babeld_is_restarted_when_a_parameter_is_cleared(self):
+        self.set_channel('wlan0', 1)
+        self.mesh.templatelookup = flexmock(get_template=lambda name: flexmock(render=lambda **kwargs: ''))
+        self.mesh.write_babeld_conf([('wlan0', ['hello-interval', '2', 'update-interval', '8', 'channel', '1'])])
+        flexmock(self.mesh).should_receive('reconfigure_babeld').never
+        flexmock(self.mesh).should_receive('update_babeld').with_args(self.mesh.babeld_opts, [], ['wlan0']).once
+        flexmock(self.mesh).should_receive('babeld_status').and_return(('1234', ''))
+        self.mesh.apply_profiles()
+        self.assertEqual('interface wlan0 channel 1', open(self.mesh.babeld_conf).read().splitlines()[-1])
+
+    def test_unknown_profiles_are_refused(self):
+        rendered = {}
+        self.mesh.templatelookup = flexmock(get_template=lambda name: flexmock(render=lambda **kwargs: rendered.update(kwargs)))
+        flexmock(meshconfiguration.jobs).should_receive('start').never
+        self.mesh.set_profile('wlan0', 'crowded')
+        self.assertTrue('crowded' in rendered['error'])
+
+
+    def test_wired_interfaces_can_mesh(self):
+        rendered = {}
+        self.mesh.templatelookup = flexmock(get_template=lambda name: flexmock(render=lambda **kwargs: rendered.update(kwargs)))
+        self.mesh.index()
+        self.assertTrue("value='eth0'" in rendered['wired_interfaces'])
+        # Gateways face the Internet, not the mesh.
+        self.assertFalse('eth1' in rendered['wired_interfaces'])
+        connection = sqlite3.connect(self.mesh.meshconfdb)
+        self.assertEqual([('no', None, 'wired')], connection.execute("SELECT enabled, channel, profile FROM meshes WHERE interface='eth0';").fetchall())
+        connection.close()
+
+    def test_wired_interfaces_use_the_wired_profile(self):
+        self.set_channel('wlan0', 1)
+        connection = sqlite3.connect(self.mesh.meshconfdb)
+        connection.execute("INSERT INTO meshes (enabled, interface, protocol, profile) VALUES ('no', 'eth0', 'babel', 'wired');")
+        connection.commit()
+        connection.close()
+        self.mesh.interface = 'eth0'
+        self.mesh.templatelookup = flexmock(get_template=lambda name: flexmock(render=lambda **kwargs: ''))
+        flexmock(self.mesh).should_receive('babeld_status').and_return(('1234', ''))
+        flexmock(self.mesh).should_receive('address_wired_interface').with_args('eth0', ['wlan0']).and_return(True).once
+        flexmock(self.mesh).should_receive('reconfigure_babeld').with_args(
+            'eth0', True, ['link-quality', 'false', 'wired', 'true', 'split-horizon', 'true']).and_return(True).once
+        self.mesh.add_interface()
+        self.assertEqual([('wlan0', 1), ('eth0', None)], self.mesh.mesh_channels())
+        self.assertTrue('interface eth0 link-quality false wired true split-horizon true\n' in open(self.mesh.babeld_conf).read())
+
+    def test_wired_interfaces_borrow_the_mesh_address(self):
+        flexmock(meshconfiguration.netlink).should_receive('set_link').with_args('eth0', True).once
+        flexmock(meshconfiguration.netlink).should_receive('get_address').with_args('eth0').and_return('')
+        flexmock(meshconfiguration.netlink).should_receive('get_address').with_args('wlan0').and_return('10.1.2.3')
+        flexmock(meshconfiguration.netlink).should_receive('set_address').with_args('eth0', '10.1.2.3', 32).once
+        self.assertTrue(self.mesh.address_wired_interface('eth0', ['wlan0']))
+
+    def test_wired_interfaces_that_cant_come_up_stay_out(self):
+        self.set_channel('wlan0', 1)
+        connection = sqlite3.connect(self.mesh.meshconfdb)
+        connection.execute("INSERT INTO meshes (enabled, interface, protocol, profile) VALUES ('no', 'eth0', 'babel', 'wired');")
+        connection.commit()
+        connection.close()
+        self.mesh.interface = 'eth0'
+        rendered = {}
+        self.mesh.templatelookup = flexmock(get_template=lambda name: flexmock(render=lambda **kwargs: rendered.update(kwargs)))
+        flexmock(self.mesh).should_receive('address_wired_interface').and_return(False).once
+        flexmock(self.mesh).should_receive('reconfigure_babeld').never
+        flexmock(self.mesh).should_receive('update_babeld').never
+        self.mesh.add_interface()
+        self.assertTrue('eth0' in rendered['error'])
+        self.assertEqual([], [i for i in self.mesh.mesh_channels() if i[0] == 'eth0'])
+
+    def test_wired_interfaces_give_the_mesh_address_back(self):
+        self.set_channel('wlan0', 1)
+        connection = sqlite3.connect(self.mesh.meshconfdb)
+        connection.execute("INSERT INTO meshes (enabled, interface, protocol, profile) VALUES ('yes', 'eth0', 'babel', 'wired');")
+        connection.commit()
+        connection.close()
+        self.mesh.interface = 'eth0'
+        self.mesh.templatelookup = flexmock(get_template=lambda name: flexmock(render=lambda **kwargs: ''))
+        flexmock(self.mesh).should_receive('reconfigure_babeld').with_args('eth0', False).and_return(True).once
+        flexmock(self.mesh).should_receive('babeld_status').and_return(('1234', ''))
+        flexmock(meshconfiguration.netlink).should_receive('get_addresses').and_return(
+            [{'index': 2, 'label': 'eth0', 'address': '10.1.2.3', 'prefixlen': 32},
+             {'index': 3, 'label': 'wlan0', 'address': '10.1.2.3', 'prefixlen': 16}])
+        flexmock(meshconfiguration.netlink).should_receive('remove_address').with_args('eth0', '10.1.2.3', 32).once
+        self.mesh.remove_interface()
+        self.assertEqual([('wlan0', 1)], self.mesh.mesh_channels())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,420 @@
+# netlink.py - Talks to the kernel over netlink sockets to read and change the
+#    configuration of network interfaces, so that the control panel doesn't
+#    have to run ifconfig and iwconfig and pick apart what they print.
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# Link state and IPv4 addresses go through rtnetlink (NETLINK_ROUTE).  The
+# wireless settings go through nl80211, the generic netlink family that
+# cfg80211 drivers implement (the same thing the iw utility uses).  Every
+# request asks the kernel for an acknowledgement, so when one of these
+# methods returns the change has been made; errors are raised as
+# NetlinkError.
+
+# Import modules.
+import errno
+import os
+import socket
+import struct
+
+import linkstate
+
+# From <linux/netlink.h>.
+NETLINK_ROUTE = 0
+NETLINK_GENERIC = 16
+
+NLM_F_REQUEST = 0x1
+NLM_F_MULTI = 0x2
+NLM_F_ACK = 0x4
+NLM_F_REPLACE = 0x100
+NLM_F_DUMP = 0x300
+NLM_F_CREATE = 0x400
+
+NLMSG_ERROR = 0x2
+NLMSG_DONE = 0x3
+
+NLMSG_HEADER = struct.Struct('=IHHII')
+NLATTR_HEADER = struct.Struct('=HH')
+
+# From <linux/rtnetlink.h>, <linux/if_link.h> and <linux/if_addr.h>.
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+
+IFINFOMSG = struct.Struct('=BxHiII')
+IFADDRMSG = struct.Struct('=BBBBI')
+
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_LABEL = 3
+IFA_BROADCAST = 4
+
+IFLA_IFNAME = 3
+IFLA_OPERSTATE = 16
+
+IFF_UP = 0x1
+
+# Multicast groups the kernel announces changes to links and IPv4 addresses
+# on.
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+
+# Operational states (RFC 2863) that mean the link is usable.  Drivers that
+# don't track their link state report it as unknown.
+IF_OPER_UNKNOWN = 0
+IF_OPER_UP = 6
+
+# From <linux/genetlink.h>.
+GENL_ID_CTRL = 0x10
+GENLMSGHDR = struct.Struct('=BBH')
+CTRL_CMD_GETFAMILY = 3
+CTRL_ATTR_FAMILY_ID = 1
+CTRL_ATTR_FAMILY_NAME = 2
+
+# From <linux/nl80211.h>.
+NL80211_CMD_GET_INTERFACE = 5
+NL80211_CMD_SET_INTERFACE = 6
+NL80211_CMD_JOIN_IBSS = 43
+NL80211_CMD_LEAVE_IBSS = 44
+NL80211_CMD_CONNECT = 46
+
+NL80211_ATTR_IFINDEX = 3
+NL80211_ATTR_IFTYPE = 5
+NL80211_ATTR_MAC = 6
+NL80211_ATTR_WIPHY_FREQ = 38
+NL80211_ATTR_SSID = 52
+NL80211_ATTR_FREQ_FIXED = 60
+
+IFTYPE_ADHOC = 1
+IFTYPE_STATION = 2
+
+# How long to wait for the kernel to answer a request, in seconds.
+TIMEOUT = 5
+
+
+class NetlinkError(Exception):
+
+    def __init__(self, error, request=''):
+        Exception.__init__(self, "%s: %s" % (request, os.strerror(error)))
+        self.errno = error
+
+
+# Rounds a length up to the four byte alignment netlink uses.
+def align(length):
+    return (length + 3) & ~3
+
+
+# Packs one attribute: a length and type header followed by the (padded)
+# payload.
+def pack_attr(attr_type, data):
+    length = NLATTR_HEADER.size + len(data)
+    return NLATTR_HEADER.pack(length, attr_type) + data + b'\0' * (align(length) - length)
+
+
+# Unpacks a run of attributes into a dict mapping attribute types to their
+# payloads.  The nested and byte order flags are stripped off the types.
+def parse_attrs(data):
+    attrs = {}
+    offset = 0
+    while offset + NLATTR_HEADER.size <= len(data):
+        length, attr_type = NLATTR_HEADER.unpack_from(data, offset)
+        if length < NLATTR_HEADER.size:
+            break
+        attrs[attr_type & 0x3fff] = data[offset + NLATTR_HEADER.size:offset + length]
+        offset += align(length)
+    return attrs
+
+
+# Splits a datagram from a netlink socket into its messages.  Returns a list
+# of (type, flags, sequence number, body) tuples.
+def parse_messages(data):
+    messages = []
+    offset = 0
+    while offset + NLMSG_HEADER.size <= len(data):
+        length, msg_type, flags, seq, _ = NLMSG_HEADER.unpack_from(data, offset)
+        if length < NLMSG_HEADER.size:
+            break
+        messages.append((msg_type, flags, seq,
+                         data[offset + NLMSG_HEADER.size:offset + length]))
+        offset += align(length)
+    return messages
+
+
+def cstring(data):
+    return data.split(b'\0', 1)[0].decode('ascii', 'replace')
+
+
+# Sends one request to the kernel and collects the replies.  Dumps are read
+# until the kernel says it's done; everything else is sent with a request
+# for an acknowledgement, which either comes back empty or carries the error
+# the request failed with.  Returns a list of (type, body) tuples.  If the
+# kernel doesn't answer within the timeout, NetlinkError is raised with
+# ETIMEDOUT.
+def request(protocol, msg_type, flags, payload, name='netlink request',
+            timeout=TIMEOUT):
+    dump = flags & NLM_F_DUMP == NLM_F_DUMP
+    if not dump:
+        flags |= NLM_F_ACK
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, protocol)
+    try:
+        sock.settimeout(timeout)
+        sock.bind((0, 0))
+        seq = 1
+        sock.send(NLMSG_HEADER.pack(NLMSG_HEADER.size + len(payload), msg_type,
+                                    flags | NLM_F_REQUEST, seq, 0) + payload)
+        replies = []
+        while True:
+            try:
+                data = sock.recv(65536)
+            except socket.timeout:
+                raise NetlinkError(errno.ETIMEDOUT, name)
+            for reply_type, _, reply_seq, body in parse_messages(data):
+                if reply_seq != seq:
+                    continue
+                if reply_type == NLMSG_DONE:
+                    return replies
+                if reply_type == NLMSG_ERROR:
+                    error = struct.unpack('=i', body[:4])[0]
+                    if error:
+                        raise NetlinkError(-error, name)
+                    return replies
+                replies.append((reply_type, body))
+    finally:
+        sock.close()
+
+
+# Returns the kernel's index for a network interface.  Aliases like wlan0:1
+# aren't interfaces of their own as far as the kernel is concerned; they're
+# addresses of the physical interface with a label.
+def interface_index(interface):
+    index = linkstate.read_attribute(interface, 'ifindex')
+    if index is None:
+        raise NetlinkError(errno.ENODEV, interface)
+    return int(index)
+
+
+# Converts a dotted quad netmask into a prefix length.
+def netmask_length(netmask):
+    return bin(struct.unpack('!I', socket.inet_aton(netmask))[0]).count('1')
+
+
+# Converts an 802.11b/g channel number into a frequency in MHz.
+def channel_frequency(channel):
+    channel = int(channel)
+    if channel == 14:
+        return 2484
+    return 2407 + 5 * channel
+
+
+# rtnetlink.
+# Brings an interface up or takes it down.
+def set_link(interface, up):
+    payload = IFINFOMSG.pack(socket.AF_UNSPEC, 0, interface_index(interface),
+                             IFF_UP if up else 0, IFF_UP)
+    request(NETLINK_ROUTE, RTM_NEWLINK, 0, payload, 'set link %s' % interface)
+
+
+# Parses the body of an RTM_NEWLINK or RTM_DELLINK message.  Returns a dict
+# with the interface's index, name and flags, and whether its link is usable.
+def parse_link(body):
+    _, _, index, flags, _ = IFINFOMSG.unpack_from(body)
+    attrs = parse_attrs(body[IFINFOMSG.size:])
+    operstate = IF_OPER_UNKNOWN
+    if IFLA_OPERSTATE in attrs:
+        operstate = struct.unpack('=B', attrs[IFLA_OPERSTATE][:1])[0]
+    return {'index': index, 'name': cstring(attrs.get(IFLA_IFNAME, b'')),
+            'up': bool(flags & IFF_UP),
+            'carrier': operstate in (IF_OPER_UP, IF_OPER_UNKNOWN)}
+
+
+# Returns every network interface on the node, as parsed by parse_link().
+def get_links():
+    replies = request(NETLINK_ROUTE, RTM_GETLINK, NLM_F_DUMP,
+                      IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0), 'get links')
+    return [parse_link(body) for msg_type, body in replies if msg_type == RTM_NEWLINK]
+
+
+# Parses the body of an RTM_NEWADDR or RTM_DELADDR message.  Returns a dict
+# with the index of the interface, its label (the interface or alias name),
+# the address and its prefix length, or None if it isn't an IPv4 address.
+def parse_address(body):
+    family, prefixlen, _, _, index = IFADDRMSG.unpack_from(body)
+    if family != socket.AF_INET:
+        return None
+    attrs = parse_attrs(body[IFADDRMSG.size:])
+    address = attrs.get(IFA_LOCAL, attrs.get(IFA_ADDRESS))
+    if not address:
+        return None
+    return {'index': index,
+            'label': cstring(attrs.get(IFA_LABEL, b'')),
+            'address': socket.inet_ntoa(address),
+            'prefixlen': prefixlen}
+
+
+# Returns every IPv4 address on the node, as parsed by parse_address().
+def get_addresses():
+    replies = request(NETLINK_ROUTE, RTM_GETADDR, NLM_F_DUMP,
+                      IFADDRMSG.pack(socket.AF_INET, 0, 0, 0, 0), 'get addresses')
+    addresses = []
+    for msg_type, body in replies:
+        if msg_type != RTM_NEWADDR:
+            continue
+        address = parse_address(body)
+        if address:
+            addresses.append(address)
+    return addresses
+
+
+# Opens a socket that the kernel sends a message to whenever something in
+# the given multicast groups changes.  Read it with recv() and
+# parse_messages().
+def listen(groups):
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 262144)
+        sock.bind((0, groups))
+    except socket.error:
+        sock.close()
+        raise
+    return sock
+
+
+# Returns the IPv4 address of an interface or alias, or '' if it doesn't have
+# one.
+def get_address(interface):
+    for address in get_addresses():
+        if address['label'] == interface:
+            return address['address']
+    return ''
+
+
+def _address_request(msg_type, flags, index, address, prefixlen, label):
+    packed = socket.inet_aton(address)
+    mask = (0xffffffff << (32 - prefixlen)) & 0xffffffff
+    broadcast = struct.pack('!I', struct.unpack('!I', packed)[0] | (~mask & 0xffffffff))
+    payload = (IFADDRMSG.pack(socket.AF_INET, prefixlen, 0, 0, index) +
+               pack_attr(IFA_LOCAL, packed) +
+               pack_attr(IFA_ADDRESS, packed) +
+               pack_attr(IFA_BROADCAST, broadcast) +
+               pack_attr(IFA_LABEL, label.encode('ascii') + b'\0'))
+    request(NETLINK_ROUTE, msg_type, flags, payload,
+            'set address %s on %s' % (address, label))
+
+
+# Gives an interface (or an alias, like wlan0:1) an IPv4 address, replacing
+# whatever address it had before, the way ifconfig does.
+def set_address(interface, address, prefixlen):
+    index = interface_index(interface)
+    for old in get_addresses():
+        if old['label'] != interface or old['index'] != index:
+            continue
+        if old['address'] == address and old['prefixlen'] == prefixlen:
+            return
+        _address_request(RTM_DELADDR, 0, index, old['address'],
+                         old['prefixlen'], interface)
+    _address_request(RTM_NEWADDR, NLM_F_CREATE | NLM_F_REPLACE, index,
+                     address, prefixlen, interface)
+
+
+# Takes an IPv4 address off an interface (or an alias).
+def remove_address(interface, address, prefixlen):
+    _address_request(RTM_DELADDR, 0, interface_index(interface), address,
+                     prefixlen, interface)
+
+
+# nl80211.
+# Looks up the ID the kernel assigned to a generic netlink family.
+def genl_family(name):
+    payload = (GENLMSGHDR.pack(CTRL_CMD_GETFAMILY, 1, 0) +
+               pack_attr(CTRL_ATTR_FAMILY_NAME, name.encode('ascii') + b'\0'))
+    for _, body in request(NETLINK_GENERIC, GENL_ID_CTRL, 0, payload,
+                           'find %s' % name):
+        attrs = parse_attrs(body[GENLMSGHDR.size:])
+        if CTRL_ATTR_FAMILY_ID in attrs:
+            return struct.unpack('=H', attrs[CTRL_ATTR_FAMILY_ID][:2])[0]
+    raise NetlinkError(errno.ENOENT, 'find %s' % name)
+
+
+def nl80211(command, interface, attrs=b'', name='nl80211 request'):
+    payload = (GENLMSGHDR.pack(command, 0, 0) +
+               pack_attr(NL80211_ATTR_IFINDEX,
+                         struct.pack('=I', interface_index(interface))) +
+               attrs)
+    return request(NETLINK_GENERIC, genl_family('nl80211'), 0, payload, name)
+
+
+def u32_attr(attr_type, value):
+    return pack_attr(attr_type, struct.pack('=I', value))
+
+
+# Returns the wireless settings of an interface as a dict with its type
+# (IFTYPE_ADHOC, IFTYPE_STATION...), ESSID and frequency in MHz.  Older
+# kernels don't report the last two, in which case they're None.
+def get_wireless(interface):
+    settings = {'iftype': None, 'essid': None, 'frequency': None}
+    for _, body in nl80211(NL80211_CMD_GET_INTERFACE, interface,
+                           name='get wireless settings of %s' % interface):
+        attrs = parse_attrs(body[GENLMSGHDR.size:])
+        if NL80211_ATTR_IFTYPE in attrs:
+            settings['iftype'] = struct.unpack('=I', attrs[NL80211_ATTR_IFTYPE][:4])[0]
+        if NL80211_ATTR_SSID in attrs:
+            settings['essid'] = attrs[NL80211_ATTR_SSID].decode('ascii', 'replace')
+        if NL80211_ATTR_WIPHY_FREQ in attrs:
+            settings['frequency'] = struct.unpack('=I', attrs[NL80211_ATTR_WIPHY_FREQ][:4])[0]
+    return settings
+
+
+# Changes the mode of a wireless interface.  The interface has to be down.
+def set_iftype(interface, iftype):
+    nl80211(NL80211_CMD_SET_INTERFACE, interface,
+            u32_attr(NL80211_ATTR_IFTYPE, iftype),
+            'set mode of %s' % interface)
+
+
+# Joins (or starts) an ad-hoc cell.  The interface has to be up and in ad-hoc
+# mode.
+def join_ibss(interface, essid, frequency, bssid=None):
+    attrs = (pack_attr(NL80211_ATTR_SSID, essid.encode('ascii')) +
+             u32_attr(NL80211_ATTR_WIPHY_FREQ, frequency) +
+             pack_attr(NL80211_ATTR_FREQ_FIXED, b''))
+    if bssid:
+        mac = b''.join([struct.pack('B', int(i, 16)) for i in bssid.split(':')])
+        attrs += pack_attr(NL80211_ATTR_MAC, mac)
+    nl80211(NL80211_CMD_JOIN_IBSS, interface, attrs,
+            'join %s on %s' % (essid, interface))
+
+
+# Leaves the ad-hoc cell an interface is in, if any.
+def leave_ibss(interface):
+    try:
+        nl80211(NL80211_CMD_LEAVE_IBSS, interface,
+                name='leave cell on %s' % interface)
+    except NetlinkError as ex:
+        if ex.errno != errno.ENOLINK and ex.errno != errno.ENOTCONN:
+            raise
+
+
+# Associates a wireless interface in managed mode with an (open) access
+# point.
+def connect(interface, essid, frequency=None):
+    attrs = pack_attr(NL80211_ATTR_SSID, essid.encode('ascii'))
+    if frequency:
+        attrs += u32_attr(NL80211_ATTR_WIPHY_FREQ, frequency)
+    nl80211(NL80211_CMD_CONNECT, interface, attrs,
+            'connect %s to %s' % (interface, essid))
+
+
+# Does everything iwconfig <interface> mode ad-hoc essid ... ap ... channel ...
+# used to: takes the interface down to change its mode, brings it back up and
+# joins the cell.  Returns the settings read back from the kernel.
+def configure_adhoc(interface, essid, channel, bssid=None):
+    set_link(interface, False)
+    set_iftype(interface, IFTYPE_ADHOC)
+    set_link(interface, True)
+    leave_ibss(interface)
+    join_ibss(interface, essid, channel_frequency(channel), bssid)
+    return get_wireless(interface)
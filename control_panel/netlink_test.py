@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# netlink_test.py
+
+from flexmock import flexmock  # http://has207.github.com/flexmock
+import errno
+import socket
+import struct
+import unittest
+import netlink
+
+
+# Stands in for a netlink socket.  Records what's sent and answers with
+# canned datagrams.
+class FakeSocket(object):
+
+    def __init__(self, datagrams):
+        self.datagrams = list(datagrams)
+        self.sent = []
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def bind(self, address):
+        pass
+
+    def send(self, data):
+        self.sent.append(data)
+
+    def recv(self, size):
+        if not self.datagrams:
+            raise socket.timeout('timed out')
+        return self.datagrams.pop(0)
+
+    def close(self):
+        pass
+
+
+def message(msg_type, body, seq=1, flags=0):
+    return netlink.NLMSG_HEADER.pack(netlink.NLMSG_HEADER.size + len(body),
+                                     msg_type, flags, seq, 0) + body
+
+
+def ack(error=0):
+    return message(netlink.NLMSG_ERROR, struct.pack('=i', error) + b'\0' * 16)
+
+
+class NetlinkTest(unittest.TestCase):
+
+    def test_attrs_round_trip(self):
+        data = (netlink.pack_attr(1, b'\x7f\0\0\x01') +
+                netlink.pack_attr(3, b'lo:1\0') +
+                netlink.pack_attr(60, b''))
+        self.assertEqual(0, len(data) % 4)
+        self.assertEqual({1: b'\x7f\0\0\x01', 3: b'lo:1\0', 60: b''},
+                         netlink.parse_attrs(data))
+
+    def test_parse_messages(self):
+        data = message(16, b'abcde', seq=7) + b'\0\0\0' + message(netlink.NLMSG_DONE, b'', seq=7)
+        self.assertEqual([(16, 0, 7, b'abcde'), (netlink.NLMSG_DONE, 0, 7, b'')],
+                         netlink.parse_messages(data))
+
+    def test_netmask_length(self):
+        self.assertEqual(16, netlink.netmask_length('255.255.0.0'))
+        self.assertEqual(24, netlink.netmask_length('255.255.255.0'))
+
+    def test_channel_frequency(self):
+        self.assertEqual(2412, netlink.channel_frequency('1'))
+        self.assertEqual(2437, netlink.channel_frequency(6))
+        self.assertEqual(2484, netlink.channel_frequency(14))
+
+    def test_request_asks_for_ack(self):
+        fake = FakeSocket([ack()])
+        flexmock(socket).should_receive('socket').and_return(fake)
+        self.assertEqual([], netlink.request(netlink.NETLINK_ROUTE, netlink.RTM_NEWLINK, 0, b'x' * 4))
+        flags = netlink.NLMSG_HEADER.unpack_from(fake.sent[0])[2]
+        self.assertEqual(netlink.NLM_F_REQUEST | netlink.NLM_F_ACK, flags)
+
+    def test_request_raises_errors(self):
+        flexmock(socket).should_receive('socket').and_return(FakeSocket([ack(-1)]))
+        try:
+            netlink.request(netlink.NETLINK_ROUTE, netlink.RTM_NEWLINK, 0, b'', 'set link')
+            self.fail("Expected a NetlinkError.")
+        except netlink.NetlinkError as ex:
+            self.assertEqual(1, ex.errno)
+
+    def test_request_times_out(self):
+        # The kernel never finishes the dump.
+        fake = FakeSocket([message(netlink.RTM_NEWADDR, b'')])
+        flexmock(socket).should_receive('socket').and_return(fake)
+        try:
+            netlink.request(netlink.NETLINK_ROUTE, netlink.RTM_GETADDR, netlink.NLM_F_DUMP, b'', 'get addresses')
+            self.fail("Expected a NetlinkError.")
+        except netlink.NetlinkError as ex:
+            self.assertEqual(errno.ETIMEDOUT, ex.errno)
+        self.assertEqual(netlink.TIMEOUT, fake.timeout)
+
+    def test_get_addresses_reads_whole_dump(self):
+        def address(index, prefixlen, addr, label):
+            return message(netlink.RTM_NEWADDR,
+                           netlink.IFADDRMSG.pack(socket.AF_INET, prefixlen, 0, 0, index) +
+                           netlink.pack_attr(netlink.IFA_LOCAL, socket.inet_aton(addr)) +
+                           netlink.pack_attr(netlink.IFA_LABEL, label + b'\0'),
+                           flags=netlink.NLM_F_MULTI)
+        datagrams = [address(1, 8, '127.0.0.1', b'lo') + address(3, 16, '192.168.4.7', b'wlan0'),
+                     address(3, 24, '10.0.5.1', b'wlan0:1'),
+                     message(netlink.NLMSG_DONE, b'\0' * 4)]
+        flexmock(socket).should_receive('socket').and_return(FakeSocket(datagrams))
+        addresses = netlink.get_addresses()
+        self.assertEqual(['lo', 'wlan0', 'wlan0:1'], [i['label'] for i in addresses])
+        self.assertEqual({'index': 3, 'label': 'wlan0:1', 'address': '10.0.5.1', 'prefixlen': 24},
+                         addresses[2])
+
+    def test_get_links(self):
+        def link(index, name, flags, operstate):
+            return message(netlink.RTM_NEWLINK,
+                           netlink.IFINFOMSG.pack(socket.AF_UNSPEC, 1, index, flags, 0) +
+                           netlink.pack_attr(netlink.IFLA_IFNAME, name + b'\0') +
+                           netlink.pack_attr(netlink.IFLA_OPERSTATE, struct.pack('=B', operstate)),
+                           flags=netlink.NLM_F_MULTI)
+        datagrams = [link(1, b'lo', netlink.IFF_UP, netlink.IF_OPER_UNKNOWN) + link(3, b'wlan0', netlink.IFF_UP, 2),
+                     message(netlink.NLMSG_DONE, b'\0' * 4)]
+        flexmock(socket).should_receive('socket').and_return(FakeSocket(datagrams))
+        self.assertEqual([{'index': 1, 'name': 'lo', 'up': True, 'carrier': True},
+                          {'index': 3, 'name': 'wlan0', 'up': True, 'carrier': False}],
+                         netlink.get_links())
+
+    def test_set_address_replaces_old_address(self):
+        flexmock(netlink).should_receive('interface_index').and_return(3)
+        flexmock(netlink).should_receive('get_addresses').and_return(
+            [{'index': 3, 'label': 'wlan0:1', 'address': '10.0.5.1', 'prefixlen': 24},
+             {'index': 3, 'label': 'wlan0', 'address': '192.168.4.7', 'prefixlen': 16}])
+        requests = []
+        flexmock(netlink).should_receive('request').replace_with(
+            lambda protocol, msg_type, flags, payload, name: requests.append((msg_type, payload)))
+        netlink.set_address('wlan0:1', '10.0.9.1', 24)
+        self.assertEqual([netlink.RTM_DELADDR, netlink.RTM_NEWADDR], [i[0] for i in requests])
+        attrs = netlink.parse_attrs(requests[1][1][netlink.IFADDRMSG.size:])
+        self.assertEqual(socket.inet_aton('10.0.9.1'), attrs[netlink.IFA_LOCAL])
+        self.assertEqual(socket.inet_aton('10.0.9.255'), attrs[netlink.IFA_BROADCAST])
+        self.assertEqual(b'wlan0:1\0', attrs[netlink.IFA_LABEL])
+
+    def test_remove_address(self):
+        flexmock(netlink).should_receive('interface_index').and_return(2)
+        requests = []
+        flexmock(netlink).should_receive('request').replace_with(
+            lambda protocol, msg_type, flags, payload, name: requests.append((msg_type, payload)))
+        netlink.remove_address('eth0', '10.1.2.3', 32)
+        self.assertEqual([netlink.RTM_DELADDR], [i[0] for i in requests])
+        attrs = netlink.parse_attrs(requests[0][1][netlink.IFADDRMSG.size:])
+        self.assertEqual(socket.inet_aton('10.1.2.3'), attrs[netlink.IFA_LOCAL])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,146 +12,214 @@
 # - Find a way to prune network interfaces that have vanished.
 #   MOOF MOOF MOOF - Stubbed in.
 
+import cherrypy
+
+import copy
 import logging
 import os
 import os.path
-import random
 import re
+import signal
 import sqlite3
 import subprocess
 import time
 
 import _utils
+import addressing
+import channelplanner
+import inventory
+import jobs
+import leasepolicy
+import linkstate
+import netlink
         
 
-# Utility method to enumerate all of the network interfaces on a node.
-# Returns two lists, one of wired interfaces and one of wireless
-# interfaces.
-def enumerate_network_interfaces():
-    logging.debug("Entered NetworkConfiguration.enumerate_network_interfaces().")
-    logging.debug("Reading contents of /sys/class/net/.")
-    wired = []
-    wireless = []
-
-    # Enumerate network interfaces.
-    interfaces = os.listdir('/sys/class/net')
-
-    # Remove the loopback interface because that's our failure case.
-    if 'lo' in interfaces:
-        interfaces.remove('lo')
-
-    # Failure case: If the list of interfaces is empty, return lists
-    # containing only the loopback.
-    if not interfaces:
-        logging.debug("No interfaces found.  Defaulting.")
-        return(['lo'], ['lo'])
-
-    # For each network interface's pseudofile in /sys, test to see if a
-    # subdirectory 'wireless/' exists.  Use this to sort the list of
-    # interfaces into wired and wireless.
-    for i in interfaces:
-        logging.debug("Adding network interface %s.", i)
-        if os.path.isdir("/sys/class/net/%s/wireless" % i):
-            wireless.append(i)
-        else:
-            wired.append(i)
-    return (wired, wireless)
+# Generates the contents of the /etc/hosts.mesh file for dnsmasq.  Takes the
+# IP address of the node's client interface.  Only the node itself is listed;
+# the names of its clients are synthesized by dnsmasq (see dnsmasq_contents()),
+# so the file stays the same size however big the client netblock is.
+def hosts_contents(starting_ip):
+    return starting_ip + '\tbyzantium.byzantium.mesh\n'
 
 
 # Method that generates an /etc/hosts.mesh file for the node for dnsmasq.
-# Takes three args, the first and last IP address of the netblock.  Returns
-# nothing.
+# Takes the IP address of the client interface.  The file is only written if
+# it would change, and then dnsmasq is told to re-read it.  Returns True if
+# something went wrong.
 def make_hosts(hosts_file, test, starting_ip=None):
     logging.debug("Entered NetworkConfiguration.make_hosts().")
-
-    # See if the /etc/hosts.mesh backup file exists.  If it does, delete it.
-    old_hosts_file = hosts_file + '.bak'
-    if test:
-        logging.debug("Deleted old /etc/hosts.mesh.bak.")
-    else:
-        if os.path.exists(old_hosts_file):
-            os.remove(old_hosts_file)
-
-    # Back up the old hosts.mesh file.
-    if test:
-        logging.debug("Renamed /etc/hosts.mesh file to /etc/hosts.mesh.bak.")
-    else:
-        if os.path.exists(hosts_file):
-            os.rename(hosts_file, old_hosts_file)
-
-    # We can make a few assumptions given only the starting IP address of
-    # the client IP block.  Each node has a /24 netblock for clients, so
-    # we only have to generate 254 entries for that file (.2-254).  First,
-    # split the last octet off of the IP address passed to this method.
-    (octet_one, octet_two, octet_three, _) = starting_ip.split('.')
-    prefix = octet_one + '.' + octet_two + '.' + octet_three + '.'
-
-    # Generate the contents of the new hosts.mesh file.
+    contents = hosts_contents(starting_ip)
     if test:
         logging.debug("Pretended to generate new /etc/hosts.mesh file.")
         return False
-    else:
-        hosts = open(hosts_file, "w")
-        line = prefix + str('1') + '\tbyzantium.byzantium.mesh\n'
-        hosts.write(line)
-        for i in range(2, 255):
-            line = prefix + str(i) + '\tclient-' + prefix + str(i) + '.byzantium.mesh\n'
-            hosts.write(line)
-        hosts.close()
-
-    # Test for successful generation of the file.
-    error = False
-    if not os.path.exists(hosts_file):
-        os.rename(old_hosts_file, hosts_file)
-        error = True
-    return error
-
-# Generates an /etc/dnsmasq.conf.include file for the node.  Takes one arg,
-# the IP address to start from.
-def configure_dnsmasq(dnsmasq_include_file, test, starting_ip=None):
-    logging.debug("Entered NetworkConfiguration.configure_dnsmasq().")
-
-    # Split the last octet off of the IP address passed into this
-    # method.
-    (octet_one, octet_two, octet_three, _) = starting_ip.split('.')
-    prefix = octet_one + '.' + octet_two + '.' + octet_three + '.'
-    start = prefix + str('2')
-    end = prefix + str('254')
-
-    # Use that to generate the line for the config file.
-    # dhcp-range=<starting IP>,<ending IP>,<length of lease>
-    dhcp_range = 'dhcp-range=' + start + ',' + end + ',5m\n'
-
-    # If an include file already exists, move it out of the way.
-    oldfile = dnsmasq_include_file + '.bak'
-    if test:
-        logging.debug("Deleting old /etc/dnsmasq.conf.include.bak file.")
-    else:
-        if os.path.exists(oldfile):
-            os.remove(oldfile)
 
-    # Back up the old dnsmasq.conf.include file.
+    try:
+        changed = _utils.write_if_changed(hosts_file, contents)
+    except (IOError, OSError) as ex:
+        logging.error("Unable to write %s: %s", hosts_file, ex)
+        return True
+    if changed:
+        reload_dnsmasq(test)
+    return False
+
+
+# Generates the contents of the /etc/dnsmasq.conf.include file.  Takes the IP
+# address of the client interface (the first address in the client netblock)
+# the prefix length of the netblock and the DHCP lease time.  Every other
+# address in the block is handed out over DHCP.
+def dnsmasq_contents(starting_ip, prefix_length=24, lease='5m'):
+    network, broadcast = addressing.block_bounds(starting_ip, prefix_length)
+    start = addressing.ntoa(addressing.aton(starting_ip) + 1)
+    end = addressing.ntoa(addressing.aton(broadcast) - 1)
+    netmask = addressing.ntoa(addressing.netmask(prefix_length))
+
+    # dhcp-range=<starting IP>,<ending IP>,<netmask>,<length of lease>
+    lines = ['dhcp-range=' + start + ',' + end + ',' + netmask + ',' + lease + '\n']
+
+    # Clients get names like client-10-0-5-23.byzantium.mesh, which dnsmasq
+    # works out from their addresses (and vice versa) on the fly.
+    lines.append('synth-domain=byzantium.mesh,' + network + '/' + str(prefix_length) + ',client-\n')
+    return ''.join(lines)
+
+
+# Generates an /etc/dnsmasq.conf.include file for the node.  Takes the IP
+# address of the client interface and the prefix length of the client
+# netblock.  The lease time already in the file is kept, because it's picked
+# by leasepolicy.LeasePolicy.  The file is only written if it would change.
+# dnsmasq doesn't re-read its configuration files on SIGHUP (only its hosts
+# files), so a changed include file means restarting it.
+def configure_dnsmasq(dnsmasq_include_file, test, starting_ip=None,
+                      prefix_length=24):
+    logging.debug("Entered NetworkConfiguration.configure_dnsmasq().")
+    lease = None
+    try:
+        include = open(dnsmasq_include_file, 'r')
+        lease = leasepolicy.current_lease(include.read())
+        include.close()
+    except IOError:
+        pass
+    contents = dnsmasq_contents(starting_ip, prefix_length, lease or '5m')
     if test:
-        logging.debug("Backing up /etc/dnsmasq.conf.include file.")
-        logging.debug("Now returning to save time.")
+        logging.debug("Pretended to generate new /etc/dnsmasq.conf.include file.")
         return
-    else:
-        if os.path.exists(dnsmasq_include_file):
-            os.rename(dnsmasq_include_file, oldfile)
-
-    # Open the include file so it can be written to.
-    include_file = open(dnsmasq_include_file, 'w')
 
-    # Write the DHCP range for this node's clients.
-    include_file.write(dhcp_range)
+    try:
+        changed = _utils.write_if_changed(dnsmasq_include_file, contents)
+    except (IOError, OSError) as ex:
+        logging.error("Unable to write %s: %s", dnsmasq_include_file, ex)
+        return
+    if changed:
+        reload_dnsmasq(test, restart=True)
+    return
 
-    # Close the include file.
-    include_file.close()
 
-    # Restart dnsmasq.
-    subprocess.Popen(['/etc/rc.d/rc.dnsmasq', 'restart'])
-    return
+# Makes dnsmasq pick up changes to its files.  If it's running and only its
+# hosts files have changed it gets a SIGHUP, which keeps its DHCP leases and
+# only costs it its DNS cache; otherwise it's (re)started.
+def reload_dnsmasq(test, restart=False, pidfile='/var/run/dnsmasq.pid'):
+    pid = ''
+    try:
+        pidfile = open(pidfile, 'r')
+        pid = pidfile.readline().strip()
+        pidfile.close()
+    except IOError:
+        pass
+    if not restart and pid.isdigit() and os.path.isdir('/proc/' + pid):
+        logging.debug("Sending SIGHUP to dnsmasq (PID %s).", pid)
+        if not test:
+            os.kill(int(pid), signal.SIGHUP)
+        return
+    logging.debug("Restarting dnsmasq.")
+    if not test:
+        subprocess.Popen(['/etc/rc.d/rc.dnsmasq', 'restart'])
+
+
+# Builds the arping command that checks whether anything in range has claimed
+# an IP address.  Argument breakdown:
+# -D: Detect specified address.  Return 1 if found, 0 if not,
+# -f: Stop after the first positive response.
+# -q: Don't print anything.
+# -c: Number of packets to send.
+# -w: Give up after this many seconds.
+# -I Network interface to use.  Mandatory.
+def arping_command(interface, addr, count=3):
+    return ['/sbin/arping', '-D', '-f', '-q', '-c', str(count),
+            '-w', str(count), '-I', interface, addr]
+
+
+# Probes a batch of IP addresses at the same time, with one arping process per
+# address.  Each probe takes a few seconds, so running them side by side means
+# a busy mesh doesn't hold up the configuration wizard for a minute.  Returns
+# the first address found to be free as soon as its probe finishes, or None
+# if they're all taken or the timeout runs out.  Probes still running at that
+# point are killed.
+def probe_addresses(interface, addresses, timeout, popen=subprocess.Popen):
+    probes = []
+    for addr in addresses:
+        try:
+            probes.append((addr, popen(arping_command(interface, addr))))
+        except OSError as ex:
+            logging.error("Unable to run arping: %s", ex)
+            break
+
+    free = None
+    give_up = time.time() + timeout
+    try:
+        while probes and not free and time.time() < give_up:
+            for probe in list(probes):
+                addr, process = probe
+                status = process.poll()
+                if status is None:
+                    continue
+                probes.remove(probe)
 
+                # arping returns 1 if the IP is in use, 0 if it's not.
+                if status == 0:
+                    free = addr
+                    break
+                logging.debug("IP address %s is in use.", addr)
+            else:
+                time.sleep(0.05)
+    finally:
+        for addr, process in probes:
+            try:
+                process.kill()
+                process.wait()
+            except OSError:
+                pass
+    return free
+
+
+# Builds the table of channel scores shown on the wireless settings page.
+# Takes the chosen channel's score, the scores of all of the candidates (see
+# channelplanner.score_channels()) and the channels of the node's other mesh
+# radios.
+def channel_plan_table(best, scores, avoid=()):
+    rows = ""
+    for i in scores:
+        channel = str(i['channel'])
+        if i is best:
+            channel = "<b>" + channel + "</b>"
+        strongest = "n/a" if i['strongest'] is None else "%d dBm" % i['strongest']
+        utilisation = "n/a" if i['utilisation'] is None else "%d%%" % (100 * i['utilisation'])
+        mesh = "yes" if i['mesh'] else "no"
+        rows = rows + "<tr><td>" + channel + "</td>\n<td>" + "%.2f" % i['score'] + "</td>\n<td>" + str(i['bsses']) + "</td>\n<td>" + strongest + "</td>\n<td>" + utilisation + "</td>\n<td>" + mesh + "</td></tr>\n"
+    if best['mesh']:
+        reason = "The mesh was heard on channel %d, so that's the one to use." % best['channel']
+    else:
+        reason = "The mesh wasn't heard, and channel %d is the quietest (lower scores are better)." % best['channel']
+        if not avoid and best['channel'] != channelplanner.default_channel:
+            reason = reason + "  Byzantium nodes use channel %d by default, so pick that instead if this node has to find nodes that were set up without a scan." % channelplanner.default_channel
+    if avoid:
+        reason = reason + "  Channels that overlap this node's other mesh radios (on %s) were passed over." % ', '.join([str(i) for i in avoid])
+    return ("<p>" + reason + "</p>\n<table style=\"border:1px solid;\">\n<tr>\n"
+            "<th style=\"border:1px solid;padding:1px;\">Channel</th>\n"
+            "<th style=\"border:1px solid;padding:1px;\">Score</th>\n"
+            "<th style=\"border:1px solid;padding:1px;\">Networks</th>\n"
+            "<th style=\"border:1px solid;padding:1px;\">Strongest signal</th>\n"
+            "<th style=\"border:1px solid;padding:1px;\">Busy</th>\n"
+            "<th style=\"border:1px solid;padding:1px;\">Mesh heard</th>\n</tr>\n" +
+            rows + "</table>\n")
 
 # Constants.
 # Ugly, I know, but we need a list of wi-fi channels to frequencies for the
@@ -159,6 +227,13 @@ def configure_dnsmasq(dnsmasq_include_file, test, starting_ip=None):
 frequencies = [2.412, 2.417, 2.422, 2.427, 2.432, 2.437, 2.442, 2.447, 2.452,
                2.457, 2.462, 2.467, 2.472, 2.484]
 
+# How long to wait for one batch of address probes to finish, in seconds.
+probe_timeout = 5
+
+# Sizes of client netblock the user can pick from, as prefix lengths.  A /24
+# is plenty for most nodes; popular ones can take a /22 or a /20.
+client_prefix_lengths = [24, 22, 20]
+
 # Classes.
 # This class allows the user to configure the network interfaces of their node.
 # Note that this does not configure mesh functionality.
@@ -201,6 +276,20 @@ class NetworkConfiguration(object):
         self.hosts_file = '/etc/hosts.mesh'
         self.dnsmasq_include_file = '/etc/dnsmasq.conf.include'
 
+        # The network interfaces on the node.
+        self.inventory = inventory.shared_inventory(self.netconfdb, self.test)
+
+        # Scans for other wireless networks and proposes a channel for the
+        # mesh.  Scans are cached for a while.
+        self.channel_planner = channelplanner.ChannelPlanner(self.test)
+
+        # The DHCP lease time is adjusted in the background to suit the
+        # number of clients the node has.
+        self.lease_policy = leasepolicy.LeasePolicy(
+            cherrypy.engine, self.dnsmasq_include_file,
+            lambda: reload_dnsmasq(self.test, restart=True), self.test)
+        self.lease_policy.subscribe()
+
     # Pretends to be index.html.
     def index(self):
         logging.debug("Entering NetworkConfiguration.index().")
@@ -211,7 +300,7 @@ class NetworkConfiguration(object):
         self.reinitialize_attributes()
 
         # Get a list of all network interfaces on the node (sans loopback).
-        wired, wireless = enumerate_network_interfaces()
+        wired, wireless = self.inventory.classified()
         logging.debug("Contents of wired[]: %s", wired)
         logging.debug("Contents of wireless[]: %s", wireless)
 
@@ -312,6 +401,7 @@ class NetworkConfiguration(object):
         self.client_ip = ''
         self.frequency = 0.0
         self.gateway = 'no'
+        self.client_netmask = '255.255.255.0'
 
     # This method is run every time the NetworkConfiguration() object is
     # instantiated by the admin browsing to /network.  It traverses the list
@@ -335,7 +425,7 @@ class NetworkConfiguration(object):
         self.client_interface = interface + ':1'
 
         # Default settings for /network/wireless.html page.
-        channel = 3
+        channel = channelplanner.default_channel
         essid = 'Byzantium'
 
         # This is a hidden class attribute setting, used for sanity checking
@@ -344,6 +434,39 @@ class NetworkConfiguration(object):
 
         channel, essid, warning = _utils.check_for_configured_interface(self.netconfdb, interface, channel, essid)
 
+        # If the node already has other mesh radios, this one is proposed a
+        # channel that doesn't overlap theirs, so that they don't share the
+        # air.
+        avoid = self.other_mesh_channels(interface)
+        if not warning:
+            channel = channelplanner.propose_channel(avoid)
+
+        # If the channels near the interface were scanned recently, show how
+        # they scored and propose the best one (unless the interface is
+        # already configured, in which case its channel stays put).
+        best = None
+        if self.channel_planner.scanned(interface):
+            best, scores = self.channel_planner.plan(interface, essid, avoid=avoid)
+        if best:
+            if not warning:
+                channel = best['channel']
+            channel_plan = channel_plan_table(best, scores, avoid)
+        else:
+            channel_plan = "<p><a href='/network/scan?interface=" + interface + "'>Scan for other wireless networks to find the quietest channel.</a></p>\n"
+            if self.channel_planner.failed(interface):
+                channel_plan = "<p>WARNING: Unable to scan for wireless networks near %s, so nothing is known about how busy the channels are.</p>\n" % interface + channel_plan
+            if avoid:
+                channel_plan = "<p>This node's other mesh radios are on channel %s, so channel %d, which doesn't overlap them, is proposed.</p>\n" % (', '.join([str(i) for i in avoid]), channel) + channel_plan
+
+        # Let the user pick how big a netblock to hand out to clients.  The
+        # size picked last time is selected.
+        client_prefix = _utils.get_client_prefix(self.netconfdb, interface)
+        self.client_netmask = addressing.ntoa(addressing.netmask(client_prefix))
+        client_prefixes = ""
+        for i in client_prefix_lengths:
+            selected = " selected='selected'" if i == client_prefix else ""
+            client_prefixes += "<option value='%d'%s>/%d (%d clients)</option>\n" % (i, selected, i, 2 ** (32 - i) - 3)
+
         # The forms in the HTML template do everything here, as well.  This
         # method only accepts input for use later.
         try:
@@ -351,56 +474,91 @@ class NetworkConfiguration(object):
             return page.render(title = "Configure wireless for Byzantium node.",
                            purpose_of_page = "Set wireless network parameters.",
                            warning = warning, interface = self.mesh_interface,
-                           channel = channel, essid = essid)
+                           channel = channel, essid = essid,
+                           client_prefixes = client_prefixes,
+                           channel_plan = channel_plan)
         except:
             _utils.output_error_data()
     wireless.exposed = True
 
-    def get_unused_ip(self, interface, addr, kind):
-        """docstring for get_unused_ip"""
-        ip_in_use = 1
+    # Returns the channels of the node's configured wireless interfaces other
+    # than this one.
+    def other_mesh_channels(self, interface):
+        query = "SELECT channel FROM wireless WHERE enabled='yes' AND mesh_interface!=?;"
+        connection, cursor = _utils.execute_query(self.netconfdb, query, (interface, ))
+        channels = sorted(set([int(i[0]) for i in cursor.fetchall() if i[0]]))
+        connection.close()
+        return channels
+
+    # Scans the channels near an interface.  This takes a few seconds, so
+    # it's done in the background, and the wireless settings page is shown
+    # with the results when it's done.
+    def scan(self, interface=None):
+        if not interface:
+            raise cherrypy.HTTPRedirect('/network', 303)
+        self.mesh_interface = interface
+        self.client_interface = interface + ':1'
+        jobs.start("Scanning for wireless networks near " + interface,
+                   lambda: copy.copy(self).scan_channels(interface),
+                   key=('scan', interface))
+    scan.exposed = True
+
+    # Does the work of scan().  Returns the rendered wireless settings page.
+    def scan_channels(self, interface):
+        jobs.report(10, "Scanning.")
+        self.channel_planner.scan(interface, refresh=True)
+        jobs.report(90, "Scoring channels.")
+        return self.wireless(interface)
+
+    # Finds an IP address nobody in radio range is using.  Takes the network
+    # interface to probe from, an iterator of candidate addresses, and what
+    # kind of interface the address is for (for logging).  Candidates are
+    # probed a batch at a time; returns the first free one, or None if none
+    # turned up before the deadline.
+    def get_unused_ip(self, interface, generate, kind, batch=8, deadline=30):
         # Strip off virtual-ness
         interface = interface.split(':')[0]
-        while ip_in_use:
-            # Run arping to see if any node in range has claimed that IP address
-            # and capture the return code.
-            # Argument breakdown:
-            # -c 5: Send 5 packets
-            # -D: Detect specified address.  Return 1 if found, 0 if not,
-            # -f: Stop after the first positive response.
-            # -I Network interface to use.  Mandatory.
-            arping = ['/sbin/arping', '-c 5', '-D', '-f', '-q', '-I',
-                      interface, addr]
+        give_up = time.time() + deadline
+        while time.time() < give_up:
+            candidates = []
+            for addr in generate:
+                if addr not in candidates:
+                    candidates.append(addr)
+                if len(candidates) == batch:
+                    break
+            if not candidates:
+                break
+
+            # In test mode, don't probe anything; just take the first one.
             if self.test:
-                logging.debug("NetworkConfiguration.tcpip() command to probe for a %s interface IP address is %s", kind, ' '.join(arping))
-                time.sleep(5)
+                for addr in candidates:
+                    logging.debug("NetworkConfiguration.tcpip() command to probe for a %s interface IP address is %s", kind, ' '.join(arping_command(interface, addr)))
+                addr = candidates[0]
             else:
-                ip_in_use = subprocess.call(arping)
-
-            # arping returns 1 if the IP is in use, 0 if it's not.
-            if not ip_in_use:
+                addr = probe_addresses(interface, candidates,
+                                       min(probe_timeout, give_up - time.time()))
+            if addr:
                 logging.debug("IP address of %s interface is %s.", kind, addr)
                 return addr
-                
-            # In test mode, don't let this turn into an endless loop.
-            if self.test:
-                logging.debug("Breaking out of this loop to exercise the rest of the code.")
-                break
+        logging.error("Unable to find an unused IP address for the %s interface.", kind)
+        return None
 
     def update_mesh_interface_status(self, status):
         """docstring for update_mesh_interface_status"""
         logging.debug("Setting wireless interface status: %s", status)
-        command = ['/sbin/ifconfig', self.mesh_interface, status]
         if self.test:
-            logging.debug("NetworkConfiguration.tcpip() command to update mesh interface status: %s", command)
-        else:
-            subprocess.Popen(command)
+            logging.debug("NetworkConfiguration.tcpip() pretending to set %s %s.", self.mesh_interface, status)
+            return
+        try:
+            netlink.set_link(self.mesh_interface, status == 'up')
+        except netlink.NetlinkError as ex:
+            logging.error("Couldn't set %s %s: %s", self.mesh_interface, status, ex)
 
     # Implements step two of the interface configuration process: selecting
     # IP address blocks for the mesh and client interfaces.  Draws upon class
-    # attributes where they exist but pseudorandomly chooses values where it
+    # attributes where they exist but picks values where it
     # needs to.
-    def tcpip(self, essid=None, channel=None):
+    def tcpip(self, essid=None, channel=None, client_prefix=None):
         logging.debug("Entered NetworkConfiguration.tcpip().")
 
         # Store the ESSID and wireless channel in the class' attribute set if
@@ -410,8 +568,10 @@ class NetworkConfiguration(object):
         if channel:
             self.channel = channel
 
-        # Initialize the Python environment's randomizer.
-        random.seed()
+        # The same goes for the size of the client netblock, as long as it's
+        # one of the sizes on offer.
+        if client_prefix and client_prefix.isdigit() and int(client_prefix) in client_prefix_lengths:
+            self.client_netmask = addressing.ntoa(addressing.netmask(int(client_prefix)))
 
         # Connect to the network configuration database.
         connection = sqlite3.connect(self.netconfdb)
@@ -425,29 +585,33 @@ class NetworkConfiguration(object):
         if not result:
             self.update_mesh_interface_status('up')
 
-            # Sleep five seconds to give the hardware a chance to catch up.
-            time.sleep(5)
+            # Give the hardware a chance to catch up.
+            if not self.test:
+                linkstate.wait_until_up(self.mesh_interface, timeout=5)
 
         # First pick an IP address for the mesh interface on the node.
-        # Go into a loop in which pseudorandom IP addresses are chosen and
-        # tested to see if they have been taken already or not.  Loop until we
-        # have a winner.
+        # Candidate IP addresses are chosen and tested in batches to see if
+        # they have been taken already or not, until we have a winner.  They
+        # are generated from the MAC address of the interface, skipping any
+        # netblock that already shows up in the node's routing tables.
+        exclude = addressing.known_prefixes()
+        mac = addressing.interface_mac(self.mesh_interface)
         logging.debug("Probing for an IP address for the mesh interface.")
-        # Pick a random IP address in a 192.168/24.
-        addr = '192.168.'
-        addr = addr + str(random.randint(0, 254)) + '.'
-        addr = addr + str(random.randint(1, 254))
-        self.mesh_ip = self.get_unused_ip(self.mesh_interface, addr, kind="mesh")
+        # Pick IP addresses in 192.168/16.
+        self.mesh_ip = self.get_unused_ip(self.mesh_interface,
+                                          addressing.candidates(mac, addressing.MESH_POOL, exclude),
+                                          kind="mesh")
     
         # Next pick a distinct IP address for the client interface and its
         # netblock.  This is potentially trickier depending on how large the
         # mesh gets.
         logging.debug("Probing for an IP address for the client interface.")
-        # Pick a random IP address in a 10/24.
-        addr = '10.'
-        addr = addr + str(random.randint(0, 254)) + '.'
-        addr = addr + str(random.randint(0, 254)) + '.1'
-        self.mesh_ip = self.get_unused_ip(self.client_interface, addr, kind="client")
+        # Pick IP addresses in a 10/8, in a block of the size the user asked
+        # for.
+        client_pool = addressing.client_pool(netlink.netmask_length(self.client_netmask))
+        self.client_ip = self.get_unused_ip(self.client_interface,
+                                            addressing.candidates(mac, client_pool, exclude),
+                                            kind="client")
 
         # For testing, hardcode some IP addresses so the rest of the code has
         # something to work with.
@@ -462,6 +626,20 @@ class NetworkConfiguration(object):
         # Close the database connection.
         connection.close()
 
+        # If either address couldn't be found there's nothing to confirm, so
+        # say so instead of offering to configure the interface.
+        missing = [kind for kind, addr in (('mesh', self.mesh_ip), ('client', self.client_ip))
+                   if not addr]
+        if missing:
+            try:
+                page = self.templatelookup.get_template("/error.html")
+                return page.render(title = "Unable to pick a network address.",
+                                   purpose_of_page = "No free IP address found.",
+                                   error = "<p>ERROR: Unable to find an unused IP address for the %s interface of %s.  Try again in a little while.</p>" % (' or '.join(missing), self.mesh_interface))
+            except:
+                _utils.output_error_data()
+            return
+
         # Run the "Are you sure?" page through the template interpeter.
         try:
             page = self.templatelookup.get_template("/network/confirm.html")
@@ -476,9 +654,22 @@ class NetworkConfiguration(object):
             _utils.output_error_data()
     tcpip.exposed = True
 
-    # Configure the network interface.
+    # Configure the network interface.  This takes a while, so it's done by
+    # a background job working from a copy of this object (in case somebody
+    # starts configuring another interface in the meantime).  The browser is
+    # sent to a page that follows the job's progress.
     def set_ip(self):
         logging.debug("Entered NetworkConfiguration.set_ip().")
+        if not self.mesh_ip or not self.client_ip:
+            raise cherrypy.HTTPError(409, "No IP addresses have been picked for %s." % self.mesh_interface)
+        jobs.start("Configuring " + self.mesh_interface,
+                   copy.copy(self).configure_interface,
+                   key=('network', self.mesh_interface))
+    set_ip.exposed = True
+
+    # Does the work of set_ip().  Returns the rendered results page.
+    def configure_interface(self):
+        logging.debug("Entered NetworkConfiguration.configure_interface().")
 
         # Set up the error catcher variable.
         error = []
@@ -490,120 +681,85 @@ class NetworkConfiguration(object):
         # If we've made it this far, the user's decided to (re)configure a
         # network interface.  Full steam ahead, damn the torpedoes!
         # First, take the wireless NIC offline so its mode can be changed.
+        jobs.report(10, "Taking " + self.mesh_interface + " down.")
         self.update_mesh_interface_status('down')
-        time.sleep(5)
 
-        # Wrap this whole process in a loop to ensure that stubborn wireless
-        # interfaces are configured reliably.  The wireless NIC has to make it
-        # all the way through one iteration of the loop without errors before
-        # we can go on.
-        while True:
+        # Put the wireless NIC into ad-hoc mode and join (or start) the mesh's
+        # cell.  Stubborn wireless interfaces get a few tries: the settings are
+        # read back from the kernel and if they didn't all take, the whole
+        # thing is done again.  Kernels that don't report the ESSID or
+        # frequency of an interface are taken at their word.
+        for attempt in range(3):
             logging.debug("At top of wireless configuration loop.")
-
-            chunks = {"mode": ("mode", "ad-hoc"),
-                      "ESSID": ("essid", self.essid),
-                      "BSSID": ("ap", self.bssid),
-                      "channel": ("channel", self.channel)}
-            for k, v in chunks:
-                logging.debug("Configuring wireless interface: %s = %s", k, v)
-                command = ['/sbin/iwconfig', self.mesh_interface]
-                command.extend(v)
-                if self.test:
-                    logging.debug("NetworkConfiguration.set_ip() command to set the %s: %s", k, ' '.join(command))
-                else:
-                    subprocess.Popen(command)
-                    time.sleep(1)
-
-            # Run iwconfig again and capture the current wireless configuration.
-            command = ['/sbin/iwconfig', self.mesh_interface]
-            configuration = ''
-            if self.test:
-                logging.debug("NetworkConfiguration.set_ip()command to capture the current state of a network interface: %s", command)
-            else:
-                output = subprocess.Popen(command, stdout=subprocess.PIPE).stdout
-                configuration = output.readlines()
-
-            break_flag = False
-            # Test the interface by going through the captured text to see if
-            # it's in ad-hoc mode.  If it's not, go back to the top of the
-            # loop to try again.
-            for line in configuration:
-                if re.search("Mode|ESSID|Cell|Frequency", line):
-                    line = line.split(' ')
-                else:
-                    continue
-
-                if 'Mode' in line:
-                    mode = line[0].split(':')[1]
-                    if mode != 'Ad-Hoc':
-                        logging.debug("Uh-oh!  Not in ad-hoc mode!  Starting over.")
-                        break_flag = True
-                        break
-
-                # Test the ESSID to see if it's been set properly.
-                if 'ESSID' in line:
-                    essid = line[-1].split(':')[1]
-                    if essid != self.essid:
-                        logging.debug("Uh-oh!  ESSID wasn't set!  Starting over.")
-                        break_flag = True
-                        break
-
-                # Test the BSSID to see if it's been set properly.
-                if 'Cell' in line:
-                    bssid = line[-1]
-                    if bssid != self.bssid:
-                        logging.debug("Uh-oh!  BSSID wasn't set!  Starting over.")
-                        break_flag = True
-                        break
-
-                # Check the wireless channel to see if it's been set properly.
-                if 'Frequency' in line:
-                    frequency = line[2].split(':')[1]
-                    if frequency != self.frequency:
-                        logging.debug("Uh-oh!  Wireless channel wasn't set!  starting over.")
-                        break_flag = True
-                        break
-
-            logging.debug("Hit bottom of the wireless configuration loop.")
-
-            # For the purpose of testing, exit after one iteration so we don't
-            # get stuck in an infinite loop.
+            jobs.checkpoint()
+            jobs.report(20 + 10 * attempt, "Joining the mesh's wireless cell.")
             if self.test:
+                logging.debug("NetworkConfiguration.set_ip() pretending to put %s in ad-hoc mode with ESSID %s, BSSID %s, channel %s.", self.mesh_interface, self.essid, self.bssid, self.channel)
                 break
+            frequency = netlink.channel_frequency(self.channel)
+            try:
+                configuration = netlink.configure_adhoc(self.mesh_interface,
+                                                        self.essid,
+                                                        self.channel,
+                                                        self.bssid)
+            except netlink.NetlinkError as ex:
+                logging.debug("Uh-oh!  Couldn't configure the wireless interface: %s  Starting over.", ex)
+                continue
 
-            # "Victory is mine!"
-            #     --Stewie, _Family Guy_
-            if break_flag:
+            if configuration['iftype'] != netlink.IFTYPE_ADHOC:
+                logging.debug("Uh-oh!  Not in ad-hoc mode!  Starting over.")
+            elif configuration['essid'] not in (None, self.essid):
+                logging.debug("Uh-oh!  ESSID wasn't set!  Starting over.")
+            elif configuration['frequency'] not in (None, frequency):
+                logging.debug("Uh-oh!  Wireless channel wasn't set!  starting over.")
+            else:
+                # "Victory is mine!"
+                #     --Stewie, _Family Guy_
                 break
-
+        else:
+            error.append("<p>WARNING!  Unable to configure the wireless settings of %s!</p>\n" % self.mesh_interface)
         logging.debug("Wireless interface configured successfully.")
 
-        # Call ifconfig and set up the network configuration information.
+        # Set up the network configuration information.
+        jobs.checkpoint()
+        jobs.report(50, "Setting the addresses of the mesh and client interfaces.")
         logging.debug("Setting IP configuration information on wireless interface.")
-        command = ['/sbin/ifconfig', self.mesh_interface, self.mesh_ip,
-                   'netmask', self.mesh_netmask, 'up']
         if self.test:
-            logging.debug("NetworkConfiguration.set_ip()command to set the IP configuration of the mesh interface: %s", command)
+            logging.debug("NetworkConfiguration.set_ip() pretending to set the IP configuration of the mesh interface: %s/%s", self.mesh_ip, self.mesh_netmask)
         else:
-            subprocess.Popen(command)
-        time.sleep(5)
+            try:
+                netlink.set_address(self.mesh_interface, self.mesh_ip,
+                                    netlink.netmask_length(self.mesh_netmask))
+                netlink.set_link(self.mesh_interface, True)
+            except netlink.NetlinkError as ex:
+                logging.error("Couldn't set the address of the mesh interface: %s", ex)
+                error.append("<p>WARNING!  Unable to set the IP address of %s!</p>\n" % self.mesh_interface)
 
         # Add the client interface.
         logging.debug("Adding client interface.")
-        command = ['/sbin/ifconfig', self.client_interface, self.client_ip, 'up']
         if self.test:
-            logging.debug("NetworkConfiguration.set_ip()command to set the IP configuration of the client interface: %s", command)
+            logging.debug("NetworkConfiguration.set_ip() pretending to set the IP configuration of the client interface: %s/%s", self.client_ip, self.client_netmask)
         else:
-            subprocess.Popen(command)
+            try:
+                netlink.set_address(self.client_interface, self.client_ip,
+                                    netlink.netmask_length(self.client_netmask))
+            except netlink.NetlinkError as ex:
+                logging.error("Couldn't set the address of the client interface: %s", ex)
+                error.append("<p>WARNING!  Unable to set the IP address of %s!</p>\n" % self.client_interface)
 
         template = ('yes', self.channel, self.essid, self.mesh_interface, self.client_interface, self.mesh_interface)
         _utils.set_wireless_db_entry(self.netconfdb, template)
+        _utils.set_client_prefix(self.netconfdb, self.mesh_interface,
+                                 netlink.netmask_length(self.client_netmask))
+
+        jobs.report(70, "Starting the captive portal.")
 
         # Start the captive portal daemon.  This will also initialize the IP
         # tables ruleset for the client interface.
         logging.debug("Starting captive portal daemon.")
         captive_portal_daemon = ['/usr/local/sbin/captive_portal.py', '-i',
                                  str(self.mesh_interface), '-a', self.client_ip,
+                                 '-n', str(netlink.netmask_length(self.client_netmask)),
                                  '-d' ]
         captive_portal_return = 0
         if self.test:
@@ -611,8 +767,13 @@ class NetworkConfiguration(object):
             captive_portal_return = 6
         else:
             captive_portal_return = subprocess.Popen(captive_portal_daemon)
-        logging.debug("Sleeping for 5 seconds to see if a race condition is the reason we can't get the PID of the captive portal daemon.")
-        time.sleep(5)
+
+            # The daemon writes its PID file once it's up and running, so
+            # wait for that rather than racing it.
+            logging.debug("Waiting for the captive portal daemon to write its PID file.")
+            captive_portal_pidfile = 'captive_portal.' + self.mesh_interface
+            linkstate.wait_for(lambda: os.path.exists('/var/run/' + captive_portal_pidfile) or os.path.exists('/tmp/' + captive_portal_pidfile),
+                               timeout=5)
 
         # Now do some error checking.
         warnings = "<p>WARNING!  captive_portal.py exited with code %d - %s!</p>\n"
@@ -664,13 +825,16 @@ class NetworkConfiguration(object):
 
         # Send this information to the methods that write the /etc/hosts and
         # dnsmasq config files.
+        jobs.report(90, "Configuring dnsmasq.")
         logging.debug("Generating dnsmasq configuration files.")
 
         problem = make_hosts(self.hosts_file, self.test, starting_ip=self.client_ip)
         if problem:
             error.append("<p>WARNING!  /etc/hosts.mesh not generated!  Something went wrong!</p>")
             logging.debug("Couldn't generate /etc/hosts.mesh!")
-        configure_dnsmasq(self.dnsmasq_include_file, self.test, starting_ip=self.client_ip)
+        configure_dnsmasq(self.dnsmasq_include_file, self.test,
+                          starting_ip=self.client_ip,
+                          prefix_length=netlink.netmask_length(self.client_netmask))
 
         # Render and display the page.
         try:
@@ -685,5 +849,4 @@ class NetworkConfiguration(object):
                                client_netmask = self.client_netmask)
         except:
             _utils.output_error_data()
-    set_ip.exposed = True
 
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# networkconfiguration_test.py
+
+from flexmock import flexmock  # http://has207.github.com/flexmock
+import os
+import os.path
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import _utils
+import networkconfiguration
+
+
+# Stands in for an arping process that exits with the given status after
+# being polled a number of times.
+class FakeProbe(object):
+
+    def __init__(self, status, polls=1):
+        self.status = status
+        self.polls = polls
+        self.killed = False
+
+    def poll(self):
+        self.polls -= 1
+        if self.polls > 0 or self.killed:
+            return None
+        return self.status
+
+    def kill(self):
+        self.killed = True
+
+    def wait(self):
+        return -9
+
+
+class ProbeAddressesTest(unittest.TestCase):
+
+    def _popen(self, probes, commands):
+        def popen(command):
+            commands.append(command)
+            return probes[command[-1]]
+        return popen
+
+    def test_probes_every_address_at_once(self):
+        probes = {'10.0.0.1': FakeProbe(1), '10.0.1.1': FakeProbe(0, 3)}
+        commands = []
+        free = networkconfiguration.probe_addresses(
+            'wlan0', ['10.0.0.1', '10.0.1.1'], 5, self._popen(probes, commands))
+        self.assertEqual('10.0.1.1', free)
+        self.assertEqual(['10.0.0.1', '10.0.1.1'], [i[-1] for i in commands])
+        self.assertTrue(all('wlan0' in i and '-D' in i for i in commands))
+
+    def test_first_free_address_wins_and_others_are_killed(self):
+        probes = {'10.0.0.1': FakeProbe(0, 10), '10.0.1.1': FakeProbe(0, 1)}
+        free = networkconfiguration.probe_addresses(
+            'wlan0', ['10.0.0.1', '10.0.1.1'], 5, self._popen(probes, []))
+        self.assertEqual('10.0.1.1', free)
+        self.assertTrue(probes['10.0.0.1'].killed)
+
+    def test_all_addresses_taken(self):
+        probes = {'10.0.0.1': FakeProbe(1), '10.0.1.1': FakeProbe(1)}
+        self.assertEqual(None, networkconfiguration.probe_addresses(
+            'wlan0', ['10.0.0.1', '10.0.1.1'], 5, self._popen(probes, [])))
+
+    def test_timeout(self):
+        probes = {'10.0.0.1': FakeProbe(0, 1000000)}
+        self.assertEqual(None, networkconfiguration.probe_addresses(
+            'wlan0', ['10.0.0.1'], 0.1, self._popen(probes, [])))
+        self.assertTrue(probes['10.0.0.1'].killed)
+
+
+class GetUnusedIPTest(unittest.TestCase):
+
+    def test_get_unused_ip_probes_batches(self):
+        config = networkconfiguration.NetworkConfiguration(None, False)
+        addresses = iter(['10.0.%d.1' % i for i in range(100)])
+        batches = []
+
+        def probe(interface, candidates, timeout):
+            batches.append((interface, candidates))
+            if len(batches) == 2:
+                return candidates[3]
+            return None
+
+        flexmock(networkconfiguration).should_receive('probe_addresses').replace_with(probe)
+        addr = config.get_unused_ip('wlan0:1', addresses, 'client', batch=4)
+        self.assertEqual('10.0.7.1', addr)
+        self.assertEqual(('wlan0', ['10.0.0.1', '10.0.1.1', '10.0.2.1', '10.0.3.1']), batches[0])
+
+    def test_get_unused_ip_skips_duplicate_candidates(self):
+        config = networkconfiguration.NetworkConfiguration(None, True)
+        addresses = iter(['10.0.0.1', '10.0.0.1', '10.0.1.1'])
+        self.assertEqual('10.0.0.1', config.get_unused_ip(
+            'wlan0', addresses, 'client', batch=2))
+
+    def test_get_unused_ip_runs_out_of_candidates(self):
+        config = networkconfiguration.NetworkConfiguration(None, False)
+        flexmock(networkconfiguration).should_receive('probe_addresses').and_return(None).once
+        self.assertEqual(None, config.get_unused_ip(
+            'wlan0', iter(['10.0.0.1', '10.0.1.1']), 'client', batch=4))
+
+
+class InterfaceSetupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.netconfdb = os.path.join(self.directory, 'network.sqlite')
+        connection = sqlite3.connect(self.netconfdb)
+        connection.execute("CREATE TABLE wireless (gateway TEXT, client_interface TEXT, enabled TEXT, channel NUMERIC, essid TEXT, mesh_interface TEXT);")
+        connection.execute("INSERT INTO wireless VALUES ('no', 'wlan0:1', 'yes', 3, 'Byzantium', 'wlan0');")
+        connection.commit()
+        connection.close()
+        self.rendered = []
+        templatelookup = flexmock(get_template=lambda name: flexmock(
+            render=lambda **kwargs: self.rendered.append((name, kwargs))))
+        self.config = networkconfiguration.NetworkConfiguration(templatelookup, False)
+        self.config.netconfdb = self.netconfdb
+        self.config.mesh_interface = 'wlan0'
+        self.config.client_interface = 'wlan0:1'
+        flexmock(networkconfiguration.addressing).should_receive('known_prefixes').and_return([])
+        flexmock(networkconfiguration.addressing).should_receive('interface_mac').and_return('02:ca:ff:ee:ba:be')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_no_free_address_is_an_error(self):
+        flexmock(self.config).should_receive('get_unused_ip').and_return('192.168.5.1').and_return(None)
+        self.config.tcpip()
+        self.assertEqual(1, len(self.rendered))
+        name, values = self.rendered[0]
+        self.assertEqual('/error.html', name)
+        self.assertTrue('ERROR' in values['error'])
+        self.assertTrue('client interface of wlan0' in values['error'])
+        self.assertRaises(networkconfiguration.cherrypy.HTTPError, self.config.set_ip)
+
+    def test_free_addresses_are_confirmed(self):
+        flexmock(self.config).should_receive('get_unused_ip').and_return('192.168.5.1').and_return('10.5.0.1')
+        self.config.tcpip()
+        name, values = self.rendered[0]
+        self.assertEqual('/network/confirm.html', name)
+        self.assertEqual('10.5.0.1', values['client_ip'])
+
+    def test_failed_scan_keeps_the_proposed_channel(self):
+        flexmock(self.config.channel_planner).should_receive('run_iw').and_return(None)
+        self.assertEqual(None, self.config.channel_planner.scan('wlan1', refresh=True))
+        self.config.wireless('wlan1')
+        name, values = self.rendered[0]
+        self.assertEqual('/network/wireless.html', name)
+        self.assertEqual(networkconfiguration.channelplanner.propose_channel([3]), values['channel'])
+        self.assertTrue('Unable to scan' in values['channel_plan'])
+
+
+class ChannelPlanTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scores = [{'channel': i, 'score': 1.0 + abs(i - 7) / 10.0, 'bsses': 0,
+                        'strongest': None, 'utilisation': None, 'mesh': False}
+                       for i in range(1, 12)]
+
+    def test_default_channel_is_a_note(self):
+        best = self.scores[6]
+        table = networkconfiguration.channel_plan_table(best, self.scores)
+        self.assertTrue('<b>7</b>' in table)
+        self.assertTrue('channel 7 is the quietest' in table)
+        self.assertTrue('channel 3 by default' in table)
+
+    def test_no_note_for_other_radios(self):
+        table = networkconfiguration.channel_plan_table(self.scores[0], self.scores, [11])
+        self.assertFalse('by default' in table)
+        self.assertTrue('passed over' in table)
+
+
+class DnsmasqFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.hosts_file = os.path.join(self.directory, 'hosts.mesh')
+        self.include_file = os.path.join(self.directory, 'dnsmasq.conf.include')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write_if_changed(self):
+        self.assertTrue(_utils.write_if_changed(self.hosts_file, 'one\n'))
+        mtime = os.path.getmtime(self.hosts_file)
+        self.assertFalse(_utils.write_if_changed(self.hosts_file, 'one\n'))
+        self.assertEqual(mtime, os.path.getmtime(self.hosts_file))
+        self.assertTrue(_utils.write_if_changed(self.hosts_file, 'two\n'))
+        self.assertEqual('two\n', open(self.hosts_file).read())
+        self.assertEqual(['hosts.mesh'], os.listdir(self.directory))
+
+    def test_make_hosts_only_reloads_when_changed(self):
+        flexmock(networkconfiguration).should_receive('reload_dnsmasq').with_args(False).once
+        self.assertFalse(networkconfiguration.make_hosts(self.hosts_file, False, '10.0.5.1'))
+        self.assertFalse(networkconfiguration.make_hosts(self.hosts_file, False, '10.0.5.1'))
+        self.assertEqual('10.0.5.1\tbyzantium.byzantium.mesh\n', open(self.hosts_file).read())
+
+    def test_make_hosts_reports_errors(self):
+        hosts_file = os.path.join(self.directory, 'missing', 'hosts.mesh')
+        self.assertTrue(networkconfiguration.make_hosts(hosts_file, False, '10.0.5.1'))
+
+    def test_configure_dnsmasq_restarts_when_changed(self):
+        flexmock(networkconfiguration).should_receive('reload_dnsmasq').with_args(False, restart=True).once
+        networkconfiguration.configure_dnsmasq(self.include_file, False, '10.0.5.1')
+        networkconfiguration.configure_dnsmasq(self.include_file, False, '10.0.5.1')
+        self.assertEqual('dhcp-range=10.0.5.2,10.0.5.254,255.255.255.0,5m\n'
+                         'synth-domain=byzantium.mesh,10.0.5.0/24,client-\n',
+                         open(self.include_file).read())
+
+    def test_dnsmasq_contents_follow_prefix_length(self):
+        self.assertEqual('dhcp-range=10.0.4.2,10.0.7.254,255.255.252.0,5m\n'
+                         'synth-domain=byzantium.mesh,10.0.4.0/22,client-\n',
+                         networkconfiguration.dnsmasq_contents('10.0.4.1', 22))
+        self.assertEqual('dhcp-range=10.0.16.2,10.0.31.254,255.255.240.0,5m\n'
+                         'synth-domain=byzantium.mesh,10.0.16.0/20,client-\n',
+                         networkconfiguration.dnsmasq_contents('10.0.16.1', 20))
+
+    def test_reload_dnsmasq_sends_sighup(self):
+        pidfile = os.path.join(self.directory, 'dnsmasq.pid')
+        open(pidfile, 'w').write('%d\n' % os.getpid())
+        flexmock(os).should_receive('kill').with_args(os.getpid(), networkconfiguration.signal.SIGHUP).once
+        networkconfiguration.reload_dnsmasq(False, pidfile=pidfile)
+
+    def test_reload_dnsmasq_restarts_if_not_running(self):
+        flexmock(networkconfiguration.subprocess).should_receive('Popen').with_args(['/etc/rc.d/rc.dnsmasq', 'restart']).once
+        networkconfiguration.reload_dnsmasq(False, pidfile=os.path.join(self.directory, 'dnsmasq.pid'))
+
+
+class ClientPrefixTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.netconfdb = os.path.join(self.directory, 'network.sqlite')
+        connection = sqlite3.connect(self.netconfdb)
+        connection.execute("CREATE TABLE wireless (gateway TEXT, client_interface TEXT, enabled TEXT, channel NUMERIC, essid TEXT, mesh_interface TEXT);")
+        connection.execute("INSERT INTO wireless VALUES ('no', 'wlan0:1', 'yes', 3, 'Byzantium', 'wlan0');")
+        connection.commit()
+        connection.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_client_prefix_defaults_to_24(self):
+        self.assertEqual(24, _utils.get_client_prefix(self.netconfdb, 'wlan0'))
+        self.assertEqual(24, _utils.get_client_prefix(self.netconfdb, 'wlan1'))
+
+    def test_client_prefix_is_kept(self):
+        _utils.set_client_prefix(self.netconfdb, 'wlan0', 22)
+        self.assertEqual(22, _utils.get_client_prefix(self.netconfdb, 'wlan0'))
+        self.assertEqual(24, _utils.get_client_prefix(self.netconfdb, 'wlan1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,37 +4,316 @@
 # Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
 # License: GPLv3
 
+# Graphs are rendered when somebody asks for them rather than every minute by
+# the stats collector.  Each rendered graph is kept in a cache directory keyed
+# by interface, time window and size, and is only rendered again once the
+# collector has written new data to that interface's database.
+
 # Import modules.
+import cherrypy
+from cherrypy.lib import static
+
+import hashlib
 import logging
 import os
+import os.path
+import threading
+import time
+
+import _utils
+import clienttraffic
+import downsample
+import rrstore
+import trafficstats
+
+# Time windows that can be picked on the traffic page, in the order they're
+# offered: the rrdtool start time, the length in seconds, and how many seconds
+# of new data it takes to visibly change the graph (the longer windows are
+# drawn from the coarser archives in the databases).
+windows = [('hour', '-1h', 3600, 0), ('day', '-1d', 86400, 300),
+           ('week', '-1w', 604800, 1800)]
+window_starts = dict([(i[0], i[1]) for i in windows])
+window_lengths = dict([(i[0], i[2]) for i in windows])
+window_resolutions = dict([(i[0], i[3]) for i in windows])
+
+# Time windows that can be asked for through /traffic/api, in seconds.  These
+# go further back than the graphs because the browser does the drawing.
+api_windows = {'hour': 3600, 'day': 86400, 'week': 604800,
+               'month': 2678400, 'year': 31536000}
+
+# Limits on the number of points per series /traffic/api will send.
+default_points = 300
+max_points = 2000
+
+# Bumped whenever the layout of the /traffic/api document changes.
+TRAFFIC_API_VERSION = 1
+
+# Time windows offered on the top talkers page, in seconds.
+client_windows = [('5min', 300), ('15min', 900), ('hour', 3600)]
+
+# Limits on the size of a rendered graph, so that nobody can fill the cache
+# directory (or tie up the CPU) by asking for arbitrary sizes.
+min_width, max_width = 200, 1200
+min_height, max_height = 40, 400
 
 
 # Classes.
 # This class implements the network traffic status report page.
 class NetworkTraffic(object):
-    # Pretends to be index.html.
-    
-    def __init__(self, filedir, templatelookup):
+
+    def __init__(self, filedir, templatelookup,
+                 databases='/tmp/stats_databases',
+                 cachedir='/tmp/controlcache/graphs', rrdtool=None):
         self.filedir = filedir
         self.templatelookup = templatelookup
-    
-    def index(self):
-        # Enumerate the list of PNG files in the graphs/ directory and generate
-        # a sequence of IMG SRCs to insert into the HTML template.
-        graphdir = os.path.join(self.filedir,"graphs")
+        self.databases = databases
+        self.cachedir = cachedir
+
+        # All graphs are drawn by one rrdtool process running in pipe mode,
+        # started the first time a graph is needed.
+        self.rrdtool = rrdtool or trafficstats.RRDTool()
+
+        # Keeps two requests for the same stale graph from both rendering it.
+        self.render_lock = threading.Lock()
+
+        # Downsampled series, keyed by (interface, window, points).  Each
+        # entry remembers the modification time of the database it came from
+        # so it's thrown out as soon as the collector writes new data.
+        self.series_cache = {}
+        self.series_cache_size = 64
+        self.series_lock = threading.Lock()
+
+        # Round-robin stores written by the stats collector, opened the first
+        # time they're needed and then left mapped.
+        self.stores = {}
+
+        # Per-client traffic is sampled from the captive portal's firewall
+        # counters in the background while the control panel is running.
+        self.client_traffic = clienttraffic.ClientTraffic(cherrypy.engine)
+        self.client_traffic.subscribe()
+
+    # Returns a sorted list of the interfaces that have traffic databases.
+    # If a time window is given, interfaces whose databases haven't been
+    # updated during it (because they've gone away) are left out.
+    def interfaces(self, window=None):
         try:
-          images = os.listdir(graphdir)
+            databases = os.listdir(self.databases)
         except OSError as ex:
-          logging.error("Couldn't find images: %s" % ex)
-          images = []
+            logging.error("Couldn't find traffic databases: %s" % ex)
+            return []
+        interfaces = set()
+        for database in databases:
+            name, extension = os.path.splitext(database)
+            if extension in ('.rrd', '.rrs'):
+                interfaces.add(name)
+        if window:
+            now = time.time()
+            interfaces = [i for i in interfaces if now - self.data_version(i) <= window_lengths[window]]
+        return sorted(interfaces)
 
-        # Pack the string of IMG SRCs into a string.
+    # Pretends to be index.html.
+    def index(self, window='hour'):
+        if window not in window_starts:
+            window = 'hour'
+
+        # Links that let the user pick the time window of the graphs.
+        selector = []
+        for name in [i[0] for i in windows]:
+            if name == window:
+                selector.append('<b>' + name + '</b>')
+            else:
+                selector.append('<a href="/traffic?window=' + name + '">' + name + '</a>')
+
+        # Generate a sequence of IMG SRCs, one per interface, pointing at the
+        # graph renderer.
         graphs = ""
-        for image in images:
-            graphs = graphs + '<img src="/graphs/' + image + '" width="75%"' + 'height="75%" alt="' + image + '" /><br />'
+        for interface in self.interfaces(window):
+            graphs = graphs + '<img src="/traffic/graph?interface=' + interface + '&window=' + window + '" width="75%"' + 'height="75%" alt="' + interface + '" /><br />'
 
         page = self.templatelookup.get_template("/traffic/index.html")
-        return page.render(graphs = graphs,
+        return page.render(graphs = graphs, selector = ' | '.join(selector),
                            title = "Byzantium Network Traffic Report",
                            purpose_of_page = "Traffic Graphs")
     index.exposed = True
+
+    # Makes sure a graph is present in the cache and at least as new as the
+    # data it's drawn from.  Returns the path to the PNG file.
+    def render(self, interface, window, width, height):
+        database = os.path.join(self.databases, interface + '.rrd')
+        graph = os.path.join(self.cachedir, "%s-%s-%ix%i.png" % (interface, window, width, height))
+        with self.render_lock:
+            if os.path.exists(graph):
+                if os.path.getmtime(database) <= os.path.getmtime(graph) + window_resolutions[window]:
+                    return graph
+            if not os.path.isdir(self.cachedir):
+                os.makedirs(self.cachedir)
+            logging.debug("Rendering traffic graph %s.", graph)
+            self.rrdtool.command(trafficstats.graph_command(
+                interface, database, graph, start=window_starts[window],
+                width=width, height=height))
+
+            # rrdtool is run with --lazy, so touch the file to record that it
+            # was checked against the current data even if it wasn't redrawn.
+            os.utime(graph, None)
+        return graph
+
+    # Serves the traffic graph of one interface.
+    def graph(self, interface=None, window='hour', width=600, height=80):
+        try:
+            width = min(max(int(width), min_width), max_width)
+            height = min(max(int(height), min_height), max_height)
+        except ValueError:
+            raise cherrypy.HTTPError(400, "Bad graph size.")
+        if window not in window_starts:
+            raise cherrypy.HTTPError(400, "Unknown time window.")
+        # Graphs are drawn by rrdtool, so they need an rrdtool database.
+        if interface not in self.interfaces():
+            raise cherrypy.NotFound()
+        if not os.path.exists(os.path.join(self.databases, interface + '.rrd')):
+            raise cherrypy.NotFound()
+
+        try:
+            graph = self.render(interface, window, width, height)
+        except trafficstats.RRDError as ex:
+            logging.error("Couldn't render graph of %s: %s", interface, ex)
+            raise cherrypy.HTTPError(500, "Unable to render graph.")
+
+        # The graph only changes when it's re-rendered, so its name and
+        # modification time make a strong validator.  serve_file() takes care
+        # of Last-Modified and If-Modified-Since.
+        etag = '"%s"' % hashlib.sha1("%s:%f" % (graph, os.path.getmtime(graph))).hexdigest()
+        cherrypy.response.headers['ETag'] = etag
+        cherrypy.response.headers['Cache-Control'] = 'no-cache'
+        if _utils.etag_matches(etag):
+            cherrypy.response.status = 304
+            return ''
+        return static.serve_file(os.path.abspath(graph), 'image/png')
+    graph.exposed = True
+
+    # Returns the round-robin store of an interface, or None if the collector
+    # hasn't made one.
+    def store(self, interface):
+        with self.series_lock:
+            if interface not in self.stores:
+                path = os.path.join(self.databases, interface + '.rrs')
+                if not os.path.exists(path):
+                    return None
+                self.stores[interface] = rrstore.RRStore(path)
+            return self.stores[interface]
+
+    # Returns something that changes whenever new data is written for an
+    # interface: the time of the last update if it has a round-robin store
+    # (writes through a memory map don't reliably touch the file's mtime),
+    # otherwise the modification time of its rrdtool database.
+    def data_version(self, interface):
+        store = self.store(interface)
+        if store:
+            return store.last_update()
+        return os.path.getmtime(os.path.join(self.databases, interface + '.rrd'))
+
+    # Fetches the rx/tx history of one interface and downsamples it to the
+    # given number of points.  Reads the round-robin store directly if there
+    # is one and asks rrdtool otherwise.  Results are cached until new data
+    # is written.
+    def series(self, interface, window, points):
+        version = self.data_version(interface)
+        key = (interface, window, points)
+        with self.series_lock:
+            cached = self.series_cache.get(key)
+            if cached and cached[0] == version:
+                return cached[1]
+
+        store = self.store(interface)
+        if store:
+            timestamps, values = store.series('AVERAGE', version - api_windows[window])
+        else:
+            database = os.path.join(self.databases, interface + '.rrd')
+            output = self.rrdtool.command(trafficstats.fetch_command(
+                database, 'end-%is' % api_windows[window]))
+            timestamps, values = trafficstats.parse_fetch(output)
+
+        # Unknown samples (the node was off, or the interface was missing)
+        # are dropped rather than sent as gaps.
+        result = {}
+        for name, label in (('in', 'rx'), ('out', 'tx')):
+            samples = [(t, v) for t, v in zip(timestamps, values.get(name, [])) if v is not None]
+            result[label] = downsample.downsample(samples, points)
+
+        with self.series_lock:
+            if len(self.series_cache) >= self.series_cache_size:
+                self.series_cache.clear()
+            self.series_cache[key] = (version, result)
+        return result
+
+    # Implements /traffic/api, which returns per-interface rx and tx rates (in
+    # bytes per second) as lists of [timestamp, value] pairs for the browser
+    # to draw.  Takes an optional comma-separated list of interfaces (default
+    # all of them), a time window and the maximum number of points per
+    # series.
+    def api(self, interface=None, window='day', points=default_points):
+        if window not in api_windows:
+            raise cherrypy.HTTPError(400, "Unknown time window.")
+        try:
+            points = min(max(int(points), 3), max_points)
+        except ValueError:
+            raise cherrypy.HTTPError(400, "Bad number of points.")
+
+        available = self.interfaces()
+        if interface:
+            interfaces = sorted(set(i.strip() for i in interface.split(',')))
+            for i in interfaces:
+                if i not in available:
+                    raise cherrypy.NotFound()
+        else:
+            interfaces = available
+
+        # The answer depends only on the request and on which version of each
+        # interface's data it's drawn from, so the ETag can be worked out (and a 304
+        # sent) without touching rrdtool at all.
+        versions = [self.data_version(i) for i in interfaces]
+        etag = _utils.make_etag([TRAFFIC_API_VERSION, interfaces, window, points, versions])
+        if _utils.etag_matches(etag):
+            cherrypy.response.headers['ETag'] = etag
+            cherrypy.response.status = 304
+            return ''
+
+        document = {'version': TRAFFIC_API_VERSION, 'window': window,
+                    'points': points, 'interfaces': {}}
+        try:
+            for i in interfaces:
+                document['interfaces'][i] = self.series(i, window, points)
+        except (trafficstats.RRDError, rrstore.RRStoreError) as ex:
+            logging.error("Couldn't fetch traffic history: %s", ex)
+            raise cherrypy.HTTPError(500, "Unable to fetch traffic history.")
+        return _utils.json_response(document, etag)
+    api.exposed = True
+
+    # Shows the clients that have moved the most traffic recently.
+    def clients(self, window='5min', count=10):
+        windows = dict(client_windows)
+        if window not in windows:
+            window = '5min'
+        try:
+            count = min(max(int(count), 1), 100)
+        except ValueError:
+            count = 10
+
+        selector = []
+        for name, _ in client_windows:
+            if name == window:
+                selector.append('<b>' + name + '</b>')
+            else:
+                selector.append('<a href="/traffic/clients?window=' + name + '&count=' + str(count) + '">' + name + '</a>')
+
+        rows = ""
+        for client in self.client_traffic.top(windows[window], count):
+            rows = rows + "<tr><td>" + client['mac'] + "</td>\n<td>" + client['ip_address'] + "</td>\n<td>" + "%.1f" % client['rx_rate'] + "</td>\n<td>" + "%.1f" % client['tx_rate'] + "</td></tr>\n"
+        if not rows:
+            rows = "<tr><td>n/a</td>\n<td>n/a</td>\n<td>0</td>\n<td>0</td></tr>\n"
+
+        page = self.templatelookup.get_template("/traffic/clients.html")
+        return page.render(clients = rows, selector = ' | '.join(selector),
+                           count = count,
+                           title = "Byzantium Top Talkers",
+                           purpose_of_page = "Client Traffic")
+    clients.exposed = True
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# networktraffic_test.py
+
+from flexmock import flexmock  # http://has207.github.com/flexmock
+import cherrypy
+import json
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+import networktraffic
+import trafficstats
+
+
+# Stands in for rrdtool in pipe mode.  Remembers the commands it's given and
+# writes an empty file wherever a graph is asked for.
+class FakeRRDTool(object):
+
+    def __init__(self):
+        self.commands = []
+
+    def command(self, args):
+        self.commands.append(args)
+        if args[0] == 'graph':
+            open(args[1], 'w').close()
+        return []
+
+
+class NetworkTrafficTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.databases = os.path.join(self.directory, 'databases')
+        os.mkdir(self.databases)
+        self.rrdtool = FakeRRDTool()
+        self.client_traffic = flexmock(subscribe=lambda: None, top=lambda window, count: [])
+        flexmock(networktraffic.clienttraffic).should_receive('ClientTraffic').and_return(self.client_traffic)
+        self.rendered = {}
+        templatelookup = flexmock(get_template=lambda name: flexmock(
+            render=lambda **kwargs: self.rendered.update(kwargs)))
+        self.traffic = networktraffic.NetworkTraffic(
+            self.directory, templatelookup, databases=self.databases,
+            cachedir=os.path.join(self.directory, 'graphs'), rrdtool=self.rrdtool)
+        cherrypy.request.headers = {}
+        cherrypy.response.headers = {}
+        cherrypy.response.status = 200
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_database(self, interface):
+        database = os.path.join(self.databases, interface + '.rrd')
+        open(database, 'w').close()
+        return database
+
+    # Writes an hour of samples, a minute apart, to an interface's store.
+    def make_store(self, interface, start=1000000000, minutes=60):
+        store = trafficstats.open_store(os.path.join(self.databases, interface + '.rrs'))
+        for i in range(minutes + 1):
+            store.update(start + 60 * i, [i * 6000, i * i * 600])
+        return store
+
+    def test_graphs_are_only_rendered_again_after_new_data(self):
+        database = self.make_database('wlan0')
+        graph = self.traffic.render('wlan0', 'hour', 600, 80)
+        self.assertEqual(1, len(self.rrdtool.commands))
+        os.utime(database, (1000, 1000))
+        os.utime(graph, (2000, 2000))
+        self.assertEqual(graph, self.traffic.render('wlan0', 'hour', 600, 80))
+        self.assertEqual(1, len(self.rrdtool.commands))
+
+        # The collector writes new data.
+        os.utime(database, (3000, 3000))
+        self.traffic.render('wlan0', 'hour', 600, 80)
+        self.assertEqual(2, len(self.rrdtool.commands))
+
+        # Longer windows don't change until enough new data has come in.
+        self.traffic.render('wlan0', 'day', 600, 80)
+        day = os.path.join(self.directory, 'graphs', 'wlan0-day-600x80.png')
+        os.utime(day, (3000, 3000))
+        os.utime(database, (3000 + networktraffic.window_resolutions['day'], ) * 2)
+        self.traffic.render('wlan0', 'day', 600, 80)
+        self.assertEqual(3, len(self.rrdtool.commands))
+
+    def test_graph_honours_if_none_match(self):
+        self.make_database('wlan0')
+        flexmock(networktraffic.static).should_receive('serve_file').and_return('PNG').once
+        self.assertEqual('PNG', self.traffic.graph('wlan0'))
+        etag = cherrypy.response.headers['ETag']
+        cherrypy.request.headers = {'If-None-Match': etag}
+        self.assertEqual('', self.traffic.graph('wlan0'))
+        self.assertEqual(304, cherrypy.response.status)
+
+    def test_graph_checks_its_arguments(self):
+        self.make_database('wlan0')
+        self.assertRaises(cherrypy.HTTPError, self.traffic.graph, 'wlan0', width='wide')
+        self.assertRaises(cherrypy.HTTPError, self.traffic.graph, 'wlan0', window='fortnight')
+        self.assertRaises(cherrypy.NotFound, self.traffic.graph, 'eth7')
+        # A store alone can't be drawn by rrdtool.
+        self.make_store('eth0')
+        self.assertRaises(cherrypy.NotFound, self.traffic.graph, 'eth0')
+
+    def test_api_checks_its_arguments(self):
+        self.make_store('wlan0')
+        self.assertRaises(cherrypy.HTTPError, self.traffic.api, window='fortnight')
+        self.assertRaises(cherrypy.HTTPError, self.traffic.api, points='lots')
+        self.assertRaises(cherrypy.NotFound, self.traffic.api, interface='wlan0,eth7')
+        self.assertEqual(3, json.loads(self.traffic.api(points='1'))['points'])
+        self.assertEqual(networktraffic.max_points,
+                         json.loads(self.traffic.api(points='99999'))['points'])
+
+    def test_api_downsamples(self):
+        self.make_store('wlan0')
+        document = json.loads(self.traffic.api(interface='wlan0', window='hour', points='10'))
+        self.assertEqual(networktraffic.TRAFFIC_API_VERSION, document['version'])
+        rx = document['interfaces']['wlan0']['rx']
+        tx = document['interfaces']['wlan0']['tx']
+        self.assertEqual(10, len(rx))
+        self.assertEqual(10, len(tx))
+        # Largest-triangle-three-buckets keeps the first and last points.
+        store = self.traffic.store('wlan0')
+        timestamps, values = store.series('AVERAGE', store.last_update() - 3600)
+        self.assertEqual(timestamps[0], rx[0][0])
+        self.assertEqual(timestamps[-1], rx[-1][0])
+        # 6000 bytes a minute is 100 bytes a second.
+        self.assertEqual(set([100.0]), set([i[1] for i in rx]))
+
+    def test_api_etag_follows_the_data(self):
+        store = self.make_store('wlan0')
+        self.traffic.api()
+        etag = cherrypy.response.headers['ETag']
+        cherrypy.request.headers = {'If-None-Match': etag}
+        flexmock(self.traffic).should_receive('series').never
+        self.assertEqual('', self.traffic.api())
+        self.assertEqual(304, cherrypy.response.status)
+
+        store.update(1000000000 + 61 * 60, [61 * 6000, 61 * 61 * 600])
+        flexmock(self.traffic).should_receive('series').and_return({'rx': [], 'tx': []})
+        cherrypy.response.status = 200
+        self.traffic.api()
+        self.assertNotEqual(etag, cherrypy.response.headers['ETag'])
+        self.assertEqual(200, cherrypy.response.status)
+
+    def test_clients_checks_window_and_count(self):
+        self.client_traffic.should_receive('top').with_args(300, 10).and_return([]).once
+        self.traffic.clients(window='fortnight', count='lots')
+        self.assertTrue('<b>5min</b>' in self.rendered['selector'])
+        self.assertEqual(10, self.rendered['count'])
+        self.assertTrue('n/a' in self.rendered['clients'])
+
+    def test_clients_lists_top_talkers(self):
+        clients = [{'mac': '02:ca:ff:ee:ba:be', 'ip_address': '10.0.0.5',
+                    'rx_rate': 1500.0, 'tx_rate': 25.5}]
+        self.client_traffic.should_receive('top').with_args(3600, 100).and_return(clients).once
+        self.traffic.clients(window='hour', count='500')
+        self.assertEqual(100, self.rendered['count'])
+        self.assertTrue('<b>hour</b>' in self.rendered['selector'])
+        self.assertTrue('10.0.0.5' in self.rendered['clients'])
+        self.assertTrue('1500.0' in self.rendered['clients'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,339 @@
+# rrstore.py - A small round-robin time series store for node metrics, in the
+#    spirit of rrdtool but written in Python so that the control panel and the
+#    stats collectors can read and write it directly.
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# A store is one fixed-size file, meant to live on tmpfs, that's memory-mapped
+# by everyone using it.  It holds a number of data sources (say, bytes in and
+# bytes out) and a number of round-robin archives, each of which consolidates
+# a fixed number of primary data points per row with one of the consolidation
+# functions below and keeps a fixed number of rows.  Appending a sample costs
+# the same no matter how much history is kept, and reads hand back views of
+# the mapped file rather than copies where the Python version allows it.
+#
+# Layout of the file (all little-endian):
+#   header:    magic, step, number of data sources, number of archives,
+#              timestamp of the last update
+#   per source: name, type, last raw value, primary data point sum and count
+#   per archive: consolidation function, primary data points per row, rows,
+#              index of the next row to write, primary data points in the
+#              row being built, end time of the newest row, and then the
+#              running value and count of the row being built per source
+#   data:      rows * sources doubles per archive, row-major
+#
+# Rows are written before the archive's header is updated, so if the node
+# crashes in the middle of an update the worst case is that the newest row is
+# lost.
+
+# Import modules.
+import array
+import math
+import mmap
+import os
+import os.path
+import struct
+import sys
+import threading
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Consolidation functions.
+AVERAGE = 0
+MAX = 1
+LAST = 2
+consolidation_functions = {'AVERAGE': AVERAGE, 'MAX': MAX, 'LAST': LAST}
+
+# Data source types.  A GAUGE is stored as is; a DERIVE is a counter that's
+# stored as its rate of change per second.
+GAUGE = 'GAUGE'
+DERIVE = 'DERIVE'
+
+MAGIC = b'BYZRRS01'
+HEADER = struct.Struct('<8sIIId')
+SOURCE = struct.Struct('<16s8sddd')
+ARCHIVE = struct.Struct('<IIIIId')
+ACCUMULATOR = struct.Struct('<dd')
+VALUE = struct.Struct('<d')
+
+NAN = float('nan')
+
+
+class RRStoreError(Exception):
+    pass
+
+
+# Creates a new store.  Takes the path of the file, the length of a primary
+# data point in seconds, a list of (name, type) data sources and a list of
+# (consolidation function, primary data points per row, rows) archives.
+# Refuses to overwrite an existing file.
+def create(path, step, sources, archives):
+    if os.path.exists(path):
+        raise RRStoreError("%s already exists." % path)
+    size = HEADER.size + SOURCE.size * len(sources)
+    for _, _, rows in archives:
+        size += ARCHIVE.size + ACCUMULATOR.size * len(sources)
+        size += VALUE.size * rows * len(sources)
+
+    header = HEADER.pack(MAGIC, step, len(sources), len(archives), 0.0)
+    body = [header]
+    for name, kind in sources:
+        body.append(SOURCE.pack(name.encode('ascii'), kind.encode('ascii'), NAN, 0.0, 0.0))
+    for cf, steps, rows in archives:
+        body.append(ARCHIVE.pack(consolidation_functions[cf], steps, rows, 0, 0, 0.0))
+        body.append(ACCUMULATOR.pack(0.0, 0.0) * len(sources))
+    for _, _, rows in archives:
+        body.append(VALUE.pack(NAN) * (rows * len(sources)))
+
+    # Write to a temporary file and move it into place so that readers never
+    # see a half-initialized store.
+    temporary = path + '.tmp'
+    store = open(temporary, 'wb')
+    store.write(b''.join(body))
+    store.close()
+    assert os.path.getsize(temporary) == size
+    os.rename(temporary, path)
+    return RRStore(path)
+
+
+class RRStore(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.lock = threading.Lock()
+
+        magic, self.step, source_count, archive_count, _ = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise RRStoreError("%s is not a round-robin store." % path)
+
+        self.sources = []
+        offset = HEADER.size
+        for i in range(source_count):
+            name, kind, _, _, _ = SOURCE.unpack_from(self.map, offset)
+            self.sources.append((str(name.rstrip(b'\0').decode('ascii')),
+                                 str(kind.rstrip(b'\0').decode('ascii'))))
+            offset += SOURCE.size
+        self.source_offset = HEADER.size
+
+        # Work out where each archive's header and data live.
+        self.archives = []
+        data = offset
+        for i in range(archive_count):
+            data += ARCHIVE.size + ACCUMULATOR.size * source_count
+        for i in range(archive_count):
+            cf, steps, rows, _, _, _ = ARCHIVE.unpack_from(self.map, offset)
+            self.archives.append({'cf': cf, 'steps': steps, 'rows': rows,
+                                  'offset': offset, 'data': data})
+            offset += ARCHIVE.size + ACCUMULATOR.size * source_count
+            data += VALUE.size * rows * source_count
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def flush(self):
+        self.map.flush()
+
+    def last_update(self):
+        return HEADER.unpack_from(self.map, 0)[4]
+
+    # Adds one sample.  Takes a timestamp and one raw value per data source.
+    # Samples that fall into the same step are averaged into one primary data
+    # point, which is handed to the archives when the next step starts.
+    def update(self, timestamp, values):
+        if len(values) != len(self.sources):
+            raise RRStoreError("Expected %i values, got %i." % (len(self.sources), len(values)))
+        with self.lock:
+            last = self.last_update()
+            if timestamp <= last:
+                raise RRStoreError("Sample at %s is not newer than the last update at %s." % (timestamp, last))
+
+            # Turn the raw values into rates where necessary, and remember
+            # the raw values for next time.
+            rates = []
+            for i, (_, kind) in enumerate(self.sources):
+                offset = self.source_offset + SOURCE.size * i
+                name, raw_kind, last_raw, pdp_sum, pdp_count = SOURCE.unpack_from(self.map, offset)
+                value = values[i]
+                if kind == DERIVE:
+                    if value is None or last_raw != last_raw or not last:
+                        rate = NAN
+                    else:
+                        rate = (value - last_raw) / float(timestamp - last)
+
+                        # A counter that went backwards was reset (say, the
+                        # interface was removed and plugged back in).
+                        if rate < 0:
+                            rate = NAN
+                    last_raw = NAN if value is None else float(value)
+                else:
+                    rate = NAN if value is None else float(value)
+                rates.append(rate)
+                SOURCE.pack_into(self.map, offset, name, raw_kind, last_raw, pdp_sum, pdp_count)
+
+            # If this sample starts a new step, the step that just ended
+            # becomes a primary data point.  Steps that were skipped entirely
+            # are unknown.
+            if last:
+                last_slot = int(last // self.step)
+                slot = int(timestamp // self.step)
+                if slot > last_slot:
+                    self._commit_pdp((last_slot + 1) * self.step)
+                    # Only the skipped steps that are still recent enough to
+                    # be in an archive need to be written.
+                    skipped = slot - last_slot - 1
+                    longest = max([i['rows'] * i['steps'] for i in self.archives] or [0])
+                    for i in range(max(skipped - longest, 0), skipped):
+                        self._commit_pdp((last_slot + 2 + i) * self.step, unknown=True)
+
+            # Fold the sample into the primary data point being built.
+            for i, rate in enumerate(rates):
+                if rate != rate:
+                    continue
+                offset = self.source_offset + SOURCE.size * i
+                name, kind, last_raw, pdp_sum, pdp_count = SOURCE.unpack_from(self.map, offset)
+                SOURCE.pack_into(self.map, offset, name, kind, last_raw,
+                                 pdp_sum + rate, pdp_count + 1)
+
+            magic, step, source_count, archive_count, _ = HEADER.unpack_from(self.map, 0)
+            HEADER.pack_into(self.map, 0, magic, step, source_count, archive_count, float(timestamp))
+
+    # Hands the finished primary data point (ending at end_time) to every
+    # archive and resets it.
+    def _commit_pdp(self, end_time, unknown=False):
+        pdp = []
+        for i in range(len(self.sources)):
+            offset = self.source_offset + SOURCE.size * i
+            name, kind, last_raw, pdp_sum, pdp_count = SOURCE.unpack_from(self.map, offset)
+            if unknown or not pdp_count:
+                pdp.append(NAN)
+            else:
+                pdp.append(pdp_sum / pdp_count)
+            SOURCE.pack_into(self.map, offset, name, kind, last_raw, 0.0, 0.0)
+
+        for archive in self.archives:
+            offset = archive['offset']
+            cf, steps, rows, head, filled, row_end = ARCHIVE.unpack_from(self.map, offset)
+            accumulators = offset + ARCHIVE.size
+            row = []
+            for i, value in enumerate(pdp):
+                position = accumulators + ACCUMULATOR.size * i
+                accumulated, count = ACCUMULATOR.unpack_from(self.map, position)
+                if value == value:
+                    if cf == AVERAGE:
+                        accumulated += value
+                    elif cf == MAX:
+                        accumulated = value if not count else max(accumulated, value)
+                    else:
+                        accumulated = value
+                    count += 1
+                ACCUMULATOR.pack_into(self.map, position, accumulated, count)
+                row.append((accumulated, count))
+
+            filled += 1
+            if filled < steps:
+                ARCHIVE.pack_into(self.map, offset, cf, steps, rows, head, filled, row_end)
+                continue
+
+            # The row is complete: write it out, then move the head.
+            position = archive['data'] + VALUE.size * len(self.sources) * head
+            for i, (accumulated, count) in enumerate(row):
+                if not count:
+                    value = NAN
+                elif cf == AVERAGE:
+                    value = accumulated / count
+                else:
+                    value = accumulated
+                VALUE.pack_into(self.map, position + VALUE.size * i, value)
+                ACCUMULATOR.pack_into(self.map, accumulators + ACCUMULATOR.size * i, 0.0, 0.0)
+            ARCHIVE.pack_into(self.map, offset, cf, steps, rows, (head + 1) % rows, 0, end_time)
+
+    # Returns a view of count doubles starting at offset in the file.  With
+    # NumPy this is an array backed directly by the mapping; on Pythons whose
+    # mmap supports the buffer protocol it's a memoryview; otherwise it's a
+    # copy.
+    def _view(self, offset, count):
+        if numpy is not None:
+            return numpy.frombuffer(self.map, dtype='<f8', count=count, offset=offset)
+        if sys.version_info[0] >= 3:
+            return memoryview(self.map)[offset:offset + VALUE.size * count].cast('d')
+        values = array.array('d')
+        values.fromstring(self.map[offset:offset + VALUE.size * count])
+        return values
+
+    # Picks the archive to read from: the finest one with the given
+    # consolidation function that reaches back to start.  Falls back to the
+    # one that reaches back furthest.
+    def choose_archive(self, cf, start):
+        candidates = [i for i in self.archives if i['cf'] == consolidation_functions[cf]]
+        if not candidates:
+            raise RRStoreError("No %s archive in %s." % (cf, self.path))
+        candidates.sort(key=lambda i: i['steps'])
+        now = self.last_update()
+        for archive in candidates:
+            if now - archive['steps'] * self.step * archive['rows'] <= start:
+                return archive
+        return candidates[-1]
+
+    # Reads a stretch of history.  Takes a consolidation function name and
+    # the start and end times.  Returns the time of the first row, the number
+    # of seconds per row, and a list of one or two views (the archive is a
+    # ring, so the range may wrap around the end of it) of rows * sources
+    # doubles each, oldest first.
+    def fetch(self, cf, start, end=None):
+        with self.lock:
+            archive = self.choose_archive(cf, start)
+            _, steps, rows, head, _, row_end = ARCHIVE.unpack_from(self.map, archive['offset'])
+        resolution = steps * self.step
+        if not row_end:
+            return start, resolution, []
+        if end is None or end > row_end:
+            end = row_end
+
+        # The newest row is the one just before the head and ends at row_end.
+        # Skip the rows that end after the end of the range, then take the
+        # rows that end after its start.
+        skip = int(math.ceil((row_end - end) / float(resolution)))
+        last_end = row_end - skip * resolution
+        wanted = int((last_end - start) // resolution)
+        wanted = max(min(wanted, rows - skip), 0)
+        newest = (head - 1 - skip) % rows
+        oldest = (newest - wanted + 1) % rows
+        first_time = last_end - wanted * resolution
+
+        width = len(self.sources)
+        segments = []
+        if wanted == 0:
+            return first_time, resolution, segments
+        if oldest <= newest:
+            segments.append(self._view(archive['data'] + VALUE.size * width * oldest,
+                                       (newest - oldest + 1) * width))
+        else:
+            segments.append(self._view(archive['data'] + VALUE.size * width * oldest,
+                                       (rows - oldest) * width))
+            segments.append(self._view(archive['data'], (newest + 1) * width))
+        return first_time, resolution, segments
+
+    # Convenience wrapper around fetch() that returns a list of timestamps and
+    # a dict mapping each data source's name to a list of values, with None
+    # for unknown values.  This copies, so use fetch() for large reads.
+    def series(self, cf, start, end=None):
+        first_time, resolution, segments = self.fetch(cf, start, end)
+        width = len(self.sources)
+        values = dict([(name, []) for name, _ in self.sources])
+        timestamps = []
+        row = 0
+        for segment in segments:
+            for i in range(0, len(segment), width):
+                timestamps.append(int(first_time + resolution * (row + 1)))
+                for j, (name, _) in enumerate(self.sources):
+                    value = float(segment[i + j])
+                    values[name].append(None if value != value else value)
+                row += 1
+        return timestamps, values
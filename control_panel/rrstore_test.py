@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# rrstore_test.py
+
+import os
+import shutil
+import tempfile
+import unittest
+import rrstore
+
+
+class RRStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'eth0.rrs')
+        self.store = rrstore.create(self.path, 60,
+                                    [('in', rrstore.DERIVE), ('load', rrstore.GAUGE)],
+                                    [('AVERAGE', 1, 10), ('MAX', 5, 4),
+                                     ('LAST', 5, 4)])
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def fill(self, samples):
+        # One sample per minute, on the minute, starting at t=600.
+        for i in range(samples):
+            self.store.update(600 + 60 * i, [1000 * i, float(i % 7)])
+
+    def test_create_refuses_to_overwrite(self):
+        self.assertRaises(rrstore.RRStoreError, rrstore.create, self.path,
+                          60, [('in', rrstore.GAUGE)], [('AVERAGE', 1, 10)])
+
+    def test_reopen(self):
+        store = rrstore.RRStore(self.path)
+        self.assertEqual([('in', 'DERIVE'), ('load', 'GAUGE')], store.sources)
+        self.assertEqual(3, len(store.archives))
+        store.close()
+
+    def test_update_rejects_old_samples(self):
+        self.fill(3)
+        self.assertRaises(rrstore.RRStoreError, self.store.update, 600, [0, 0])
+
+    def test_derive_is_stored_as_a_rate(self):
+        self.fill(5)
+        timestamps, values = self.store.series('AVERAGE', 600, 900)
+        self.assertEqual([None, 1000 / 60.0, 1000 / 60.0, 1000 / 60.0],
+                         values['in'])
+        self.assertEqual([660, 720, 780, 840], timestamps)
+        self.assertEqual([0.0, 1.0, 2.0, 3.0], values['load'])
+
+    def test_archive_wraps_around(self):
+        self.fill(30)
+        timestamps, values = self.store.series('AVERAGE', 0)
+        self.assertEqual(10, len(timestamps))
+        self.assertEqual([float(i % 7) for i in range(19, 29)], values['load'])
+        self.assertEqual(2, len(self.store.fetch('AVERAGE', 0)[2]))
+
+    def test_consolidation_functions(self):
+        self.fill(11)
+        _, values = self.store.series('MAX', 0)
+        self.assertEqual([4.0, 6.0], values['load'][-2:])
+        _, values = self.store.series('LAST', 0)
+        self.assertEqual([4.0, 2.0], values['load'][-2:])
+
+    def test_skipped_steps_are_unknown(self):
+        self.fill(3)
+        self.store.update(600 + 60 * 6, [6000, 6.0])
+        self.store.update(600 + 60 * 7, [7000, 0.0])
+        _, values = self.store.series('AVERAGE', 600)
+        self.assertEqual([0.0, 1.0, 2.0, None, None, None, 6.0], values['load'])
+
+if __name__ == '__main__':
+    unittest.main()
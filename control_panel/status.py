@@ -7,19 +7,33 @@
 # License: GPLv3
 
 # Import modules.
+import cherrypy
+
 import logging
 import os
 import os.path
 import sqlite3
-import subprocess
+import time
 
 # Import control panel modules.
 # from control_panel import *
+import _utils
+import clienttraffic
+import jobs
+import netlink
 from networktraffic import NetworkTraffic
 from networkconfiguration import NetworkConfiguration
 from meshconfiguration import MeshConfiguration
 from services import Services
 from gateways import Gateways
+from statusstream import StatusPublisher
+
+# Bump this whenever the layout of the /api/status document changes in a way
+# that would break existing consumers.
+STATUS_API_VERSION = 1
+
+# Fields of the status document that change every time it's collected.
+VOLATILE_FIELDS = ('generated', 'uptime')
 
 
 # Query the node's uptime (in seconds) from the OS.
@@ -99,22 +113,123 @@ def get_memory(injected_open=open):
     return (memtotal, memused)
 
 
+# Returns the IPv4 address of an interface (or alias), as the kernel reports
+# it over netlink.
 def get_ip_address(interface):
-    ip_address = ''
-    command = ['/sbin/ifconfig', interface]
-    output = subprocess.Popen(command, stdout=subprocess.PIPE).stdout
-    configuration = output.readlines()
-    logging.debug("Output of ifconfig:")
-    logging.debug(configuration)
-
-    # Parse the output of ifconfig.
-    for line in configuration:
-        if 'inet addr' in line:
-            line = line.strip()
-            ip_address = line.split(' ')[1].split(':')[1]
-            logging.debug("IP address is %s", ip_address)
+    try:
+        ip_address = netlink.get_address(interface)
+    except netlink.NetlinkError as ex:
+        logging.error("Unable to get the IP address of %s: %s", interface, ex)
+        return ''
+    logging.debug("IP address of %s is %s", interface, ip_address)
     return ip_address
 
+# Reports whether babeld is running by checking the PID in its PID file
+# against the process table.
+def get_babeld_state(pidfile='/var/run/babeld.pid', injected_open=open):
+    try:
+        pidfile = injected_open(pidfile, 'r')
+    except IOError:
+        return {'running': False, 'pid': 0}
+    pid = pidfile.readline().strip()
+    pidfile.close()
+    if not pid.isdigit():
+        return {'running': False, 'pid': 0}
+    return {'running': os.path.isdir('/proc/' + pid), 'pid': int(pid)}
+
+
+# Counts the clients associated with a client interface from the kernel's ARP
+# table.
+def get_number_of_clients(client_interface, injected_open=open):
+    number_of_clients = len(clienttraffic.read_arp_table(injected_open, client_interface))
+    logging.debug("Number of clients associated with %s: %i", client_interface, number_of_clients)
+    return number_of_clients
+
+
+# Gathers everything the status page and the status API report into a single
+# dictionary.  This is the expensive part (it asks the kernel for addresses,
+# reads the ARP table and queries the network configuration database), so
+# callers should go through a _utils.CachedResult instead of calling it
+# directly.
+def collect_status(netconfdb, test):
+    logging.debug("Collecting node status.")
+    status = {'version': STATUS_API_VERSION, 'generated': int(time.time())}
+
+    # Get the node's uptime and load from the OS.
+    status['uptime'] = float(get_uptime() or 0)
+    status['load'] = [float(i) for i in (get_load() or [0, 0, 0])]
+
+    # Get the amount of RAM in and in use by the system.
+    ram, ram_used = get_memory() or (0, 0)
+    status['memory'] = {'total': ram, 'used': ram_used}
+
+    # Is the mesh routing daemon up?
+    status['babeld'] = get_babeld_state()
+
+    # For the purposes of debugging, test to see if the network
+    # configuration database file exists and print a tell to the console.
+    logging.debug("Checking for existence of network configuration database.")
+    if os.path.exists(netconfdb):
+        logging.debug("Network configuration database %s found.", netconfdb)
+    else:
+        logging.debug("DEBUG: Network configuration database %s NOT found!", netconfdb)
+
+    connection = sqlite3.connect(netconfdb)
+    cursor = connection.cursor()
+
+    # Pull a list of the mesh interfaces on this system out of the network
+    # configuration database.
+    mesh_interfaces = []
+    cursor.execute("SELECT mesh_interface, essid, channel FROM wireless;")
+    for (mesh_interface, essid, channel) in cursor.fetchall():
+        # Test to see if any of the variables retrieved from the database are
+        # empty, and if they are set them to obviously non-good but also
+        # non-null values.
+        if not mesh_interface:
+            logging.debug("Value of mesh_interface is empty.")
+            mesh_interface = ' '
+        if not essid:
+            logging.debug("Value of ESSID is empty.")
+            essid = ' '
+        if not channel:
+            logging.debug("Value of channel is empty.")
+            channel = 0
+
+        # For every mesh interface found in the database, get its current IP
+        # address.
+        ip_address = ''
+        if test:
+            print "TEST: collect_status() would pull the configuration of mesh interface " + mesh_interface
+        else:
+            logging.debug("Collecting configuration of interface %s.", mesh_interface)
+            ip_address = get_ip_address(mesh_interface)
+        mesh_interfaces.append({'interface': mesh_interface,
+                                'ip_address': ip_address,
+                                'essid': essid, 'channel': int(channel)})
+    status['mesh_interfaces'] = mesh_interfaces
+
+    # Pull a list of the client interfaces on this system, their addresses and
+    # the number of clients associated with each.
+    client_interfaces = []
+    cursor.execute("SELECT client_interface FROM wireless;")
+    for (client_interface, ) in cursor.fetchall():
+        ip_address = ''
+        number_of_clients = 0
+        if test:
+            print "TEST: collect_status() would pull the configuration of client interface " + client_interface
+        else:
+            ip_address = get_ip_address(client_interface)
+            number_of_clients = get_number_of_clients(client_interface)
+        client_interfaces.append({'interface': client_interface,
+                                  'ip_address': ip_address,
+                                  'clients': number_of_clients})
+    status['client_interfaces'] = client_interfaces
+
+    cursor.close()
+    connection.close()
+    return status
+
+
 # The Status class implements the system status report page that makes up
 # /index.html.
 class Status(object):
@@ -129,6 +244,10 @@ class Status(object):
         self.services = Services(templatelookup, test)
         self.gateways = Gateways(templatelookup, test)
 
+        # The slow operations the other pages start are run in the background
+        # and can be followed under /jobs.
+        self.jobs = jobs.Jobs(templatelookup)
+
         # Location of the network.sqlite database, which holds the configuration
         # of every network interface in the node.
         if test:
@@ -138,130 +257,68 @@ class Status(object):
         else:
             self.netconfdb = '/var/db/controlpanel/network.sqlite'
 
+        # The status report is collected at most once every cache_ttl seconds
+        # no matter how many browsers or monitoring systems are asking for it.
+        # The time it was generated and the uptime change every time, so
+        # they're left out of its ETag.
+        self.cache_ttl = 10
+        self.status_cache = _utils.CachedResult(
+            lambda: collect_status(self.netconfdb, self.test), self.cache_ttl,
+            volatile=VOLATILE_FIELDS)
+
+        # A single background publisher pushes status changes to every open
+        # status page.  It starts and stops along with CherryPy.
+        self.publisher = StatusPublisher(cherrypy.engine, self.status_cache)
+        self.publisher.subscribe()
+
+        # Machine-readable versions of the node's status live under /api.
+        self.api = StatusAPI(self.status_cache, self.publisher)
+
     # Pretends to be index.html.
     def index(self):
         logging.debug("Entered Status.index().")
-        
-        # Get the node's uptime from the OS.
-        uptime = get_uptime() or 0
+        status, _ = self.status_cache.get()
 
         # Convert the uptime in seconds into something human readable.
-        (minutes, seconds) = divmod(float(uptime), 60)
+        (minutes, seconds) = divmod(status['uptime'], 60)
         (hours, minutes) = divmod(minutes, 60)
         uptime = "%i hours, %i minutes, %i seconds" % (hours, minutes, seconds)
         logging.debug("System uptime: %s", uptime)
 
-        # Get the amount of RAM in and in use by the system.
-        ram, ram_used = get_memory()
+        ram = status['memory']['total']
+        ram_used = status['memory']['used']
         logging.debug("Total RAM: %s", ram)
         logging.debug("RAM in use: %s", ram_used)
 
-        # For the purposes of debugging, test to see if the network
-        # configuration database file exists and print a tell to the console.
-        logging.debug("Checking for existence of network configuration database.")
-        if os.path.exists(self.netconfdb):
-            logging.debug("Network configuration database %s found.", self.netconfdb)
+        load = ' '.join(["%.2f" % i for i in status['load']])
+        if status['babeld']['running']:
+            babeld = "running (PID %i)" % status['babeld']['pid']
         else:
-            logging.debug("DEBUG: Network configuration database %s NOT found!", self.netconfdb)
+            babeld = "not running"
 
-        # Pull a list of the mesh interfaces on this system out of the network
-        # configuration database.  If none are found, report none.
+        # Assemble the HTML for the status page using the mesh interface
+        # configuration data.  If none are found, report none.
         mesh_interfaces = ''
-        ip_address = ''
-
-        connection = sqlite3.connect(self.netconfdb)
-        cursor = connection.cursor()
-        query = "SELECT mesh_interface, essid, channel FROM wireless;"
-        cursor.execute(query)
-        result = cursor.fetchall()
-
-        if not result:
+        if not status['mesh_interfaces']:
             # Fields:
             #    interface, IP, ESSID, channel
             mesh_interfaces = "<tr><td>n/a</td>\n<td>n/a</td>\n<td>n/a</td>\n<td>n/a</td></tr>\n"
-        else:
-            for (mesh_interface, essid, channel) in result:
-                # Test to see if any of the variables retrieved from the
-                # database are empty, and if they are set them to obviously
-                # non-good but also non-null values.
-                if not mesh_interface:
-                    logging.debug("Value of mesh_interface is empty.")
-                    mesh_interface = ' '
-                if not essid:
-                    logging.debug("Value of ESSID is empty.")
-                    essid = ' '
-                if not channel:
-                    logging.debug("Value of channel is empty.")
-                    channel = 0
-
-                # For every mesh interface found in the database, get its
-                # current IP address with ifconfig.
-                command = ['/sbin/ifconfig', mesh_interface]
-                if self.test:
-                    print "TEST: Status.index() command to pull the configuration of a mesh interface:"
-                    print '/sbin/ifconfig' + mesh_interface
-                else:
-                    logging.debug("Running ifconfig to collect configuration of interface %s.", mesh_interface)
-
-                    ip_address = get_ip_address(mesh_interface)
-
-                # Assemble the HTML for the status page using the mesh
-                # interface configuration data.
-                mesh_interfaces = mesh_interfaces + "<tr><td>" + mesh_interface + "</td>\n<td>" + ip_address + "</td>\n<td>" + essid + "</td>\n<td>" + str(channel) + "</td></tr>\n"
-
-        # Pull a list of the client interfaces on this system.  If none are
-        # found, report none.
-        client_interfaces = ''
-        ip_address = ''
-        number_of_clients = 0
+        for i in status['mesh_interfaces']:
+            mesh_interfaces = mesh_interfaces + "<tr><td>" + i['interface'] + "</td>\n<td>" + i['ip_address'] + "</td>\n<td>" + i['essid'] + "</td>\n<td>" + str(i['channel']) + "</td></tr>\n"
 
-        query = "SELECT client_interface FROM wireless;"
-        cursor.execute(query)
-        result = cursor.fetchall()
-
-        if not result:
+        # Same for the client interfaces.
+        client_interfaces = ''
+        if not status['client_interfaces']:
             # Fields:
             #    interface, IP, active clients
             client_interfaces = "<tr><td>n/a</td>\n<td>n/a</td>\n<td>0</td></tr>\n"
-        else:
-            for client_interface in result:
-                # For every client interface found, run ifconfig and pull
-                # its configuration information.
-                if self.test:
-                    print "TEST: Status.index() command to pull the configuration of a client interface:"
-                    print '/sbin/ifconfig' + client_interface[0]
-                else:
-                    logging.debug("Running ifconfig to collect configuration of interface %s.", client_interface)
-                    ip_address = get_ip_address(client_interface[0])
-
-                # For each client interface, count the number of rows in its
-                # associated arp table to count the number of clients currently
-                # associated.  Note that one has to be subtracted from the
-                # count of rows to account for the line of column headers.
-                command = ['/sbin/arp', '-n', '-i', client_interface[0]]
-                if self.test:
-                    print "TEST: Status.index() command to dump the ARP table of interface %s: " % client_interface
-                    print command
-                else:
-                    logging.debug("Running arp to dump the ARP table of client interface %s.", client_interface)
-                    output = subprocess.Popen(command, stdout=subprocess.PIPE).stdout
-                    arp_table = output.readlines()
-                    logging.debug("Contents of ARP table:")
-                    logging.debug(arp_table)
-
-                    # Count the number of clients associated with the client
-                    # interface by analyzing the ARP table.
-                    number_of_clients = len(arp_table) - 1
-                    logging.debug("Number of associated clients: %i", number_of_clients)
-
-                # Assemble the HTML for the status page using the mesh
-                # interface configuration data.
-                client_interfaces = client_interfaces + "<tr><td>" + client_interface[0] + "</td>\n<td>" + ip_address + "</td>\n<td>" + str(number_of_clients) + "</td></tr>\n"
+        for i in status['client_interfaces']:
+            client_interfaces = client_interfaces + "<tr><td>" + i['interface'] + "</td>\n<td>" + i['ip_address'] + "</td>\n<td>" + str(i['clients']) + "</td></tr>\n"
 
         # Render the HTML page and return to the client.
-        cursor.close()
         page = self.templatelookup.get_template("index.html")
         return page.render(ram_used = ram_used, ram = ram, uptime = uptime,
+                           load = load, babeld = babeld,
                            mesh_interfaces = mesh_interfaces,
                            client_interfaces = client_interfaces,
                            title = "Byzantium Mesh Node Status",
@@ -269,6 +326,49 @@ class Status(object):
     index.exposed = True
 
 
-
-
-
+# Implements /api/status, a versioned JSON document describing the node for
+# monitoring systems to poll.  It is built from the same cached data as the
+# status page, carries an ETag, and honours If-None-Match, so a poller that
+# already has the current document costs one hash comparison.  The ETags
+# are weak ones.  Neither covers the uptime or the time the document was
+# generated unless they were asked for with fields=, so a poller that wants
+# those fresh asks for them.
+class StatusAPI(object):
+
+    def __init__(self, status_cache, publisher=None):
+        self.status_cache = status_cache
+        self.publisher = publisher
+
+    # Takes an optional comma-separated list of top-level fields to return,
+    # e.g. /api/status?fields=uptime,load.  The version field is always sent.
+    def status(self, fields=None):
+        document, etag = self.status_cache.get()
+        if fields:
+            wanted = [i.strip() for i in fields.split(',') if i.strip()]
+            unknown = [i for i in wanted if i not in document]
+            if unknown:
+                raise cherrypy.HTTPError(400, "Unknown fields: %s" % ', '.join(unknown))
+            wanted = sorted(set(wanted + ['version']))
+            document = dict((i, document[i]) for i in wanted)
+
+            # The subset gets an ETag of its own, so that pollers asking for
+            # fields that haven't changed get a 304 even if others have, and
+            # ones that asked for the uptime get it fresh.  It's weak like
+            # the whole document's.
+            etag = _utils.make_etag(document, weak=True)
+        return _utils.json_response(document, etag)
+    status.exposed = True
+
+    # Implements /api/stream, a Server-Sent Events feed of changes to the
+    # status document.  Used by the status page to update itself in place.
+    def stream(self):
+        if not self.publisher:
+            raise cherrypy.HTTPError(404)
+        queue = self.publisher.add_viewer()
+        if queue is None:
+            raise cherrypy.HTTPError(503, "Too many status viewers.  Poll /api/status instead.")
+        cherrypy.response.headers['Content-Type'] = 'text/event-stream'
+        cherrypy.response.headers['Cache-Control'] = 'no-cache'
+        return self.publisher.stream(queue)
+    stream.exposed = True
+    stream._cp_config = {'response.stream': True}
@@ -6,7 +6,12 @@
 # captive_portal_test.py
 
 from flexmock import flexmock  # http://has207.github.com/flexmock
+import cherrypy
+import StringIO
+import json
 import unittest
+import _utils
+import netlink
 import status
 import subprocess
 import sys
@@ -53,13 +58,95 @@ class StatusHelpersTest(unittest.TestCase):
         self.assertEqual(expected, status.get_memory(injected_open=lambda x, y: mem))
 
     def test_get_ip_address(self):
-        out = ['eth0      Link encap:Ethernet  HWaddr ff:ff:ff:ff:ff:ff\n',
-               '          inet addr:12.12.12.12  Bcast:12.12.12.255  Mask:255.255.255.0\n',
-               '          inet6 addr: ffff::ffff:ffff:ffff:ffff/64 Scope:Link\n']
-        mockfile = flexmock(readlines=lambda: out)
-        mock = flexmock(stdout=mockfile)
-        flexmock(subprocess).should_receive('Popen').once.and_return(mock)
+        addresses = [{'index': 2, 'label': 'eth0', 'address': '12.12.12.12', 'prefixlen': 24},
+                     {'index': 2, 'label': 'eth0:1', 'address': '10.0.0.1', 'prefixlen': 24}]
+        flexmock(netlink).should_receive('get_addresses').and_return(addresses)
         self.assertEqual('12.12.12.12', status.get_ip_address('eth0'))
+        self.assertEqual('10.0.0.1', status.get_ip_address('eth0:1'))
+        self.assertEqual('', status.get_ip_address('wlan0'))
+
+    def test_get_ip_address_netlink_error(self):
+        flexmock(netlink).should_receive('get_addresses').and_raise(netlink.NetlinkError(1, 'get addresses'))
+        self.assertEqual('', status.get_ip_address('eth0'))
+
+    def test_get_number_of_clients(self):
+        arp = ['IP address       HW type     Flags       HW address            Mask     Device\n',
+               '10.0.0.23        0x1         0x2         00:11:22:33:44:55     *        wlan0\n',
+               '10.0.0.42        0x1         0x0         00:00:00:00:00:00     *        wlan0\n',
+               '10.0.0.66        0x1         0x2         AA:BB:CC:DD:EE:FF     *        wlan0\n',
+               '192.168.1.1      0x1         0x2         66:77:88:99:aa:bb     *        eth0\n']
+        self.assertEqual(2, status.get_number_of_clients('wlan0', injected_open=lambda x, y: StringIO.StringIO(''.join(arp))))
+        self.assertEqual(0, status.get_number_of_clients('wlan0', injected_open=self._raise_ioerror))
+
+
+class StatusAPITest(unittest.TestCase):
+
+    def setUp(self):
+        self.document = {'version': 1, 'uptime': 12.5, 'load': [0.0, 0.1, 0.2],
+                         'memory': {'total': 509424, 'used': 449192}}
+        self.cache = _utils.CachedResult(lambda: self.document, ttl=60)
+        self.api = status.StatusAPI(self.cache)
+        cherrypy.request.headers = {}
+        cherrypy.response.headers = {}
+        cherrypy.response.status = 200
+
+    def test_status_returns_whole_document(self):
+        self.assertEqual(self.document, json.loads(self.api.status()))
+        self.assertEqual(self.cache.get()[1], cherrypy.response.headers['ETag'])
+
+    def test_status_selects_fields(self):
+        result = json.loads(self.api.status(fields='uptime,load'))
+        self.assertEqual(['load', 'uptime', 'version'], sorted(result.keys()))
+
+    def test_status_rejects_unknown_fields(self):
+        self.assertRaises(cherrypy.HTTPError, self.api.status, fields='bogus')
+
+    def test_status_honours_if_none_match(self):
+        self.api.status(fields='uptime')
+        etag = cherrypy.response.headers['ETag']
+        cherrypy.request.headers = {'If-None-Match': etag}
+        self.assertEqual('', self.api.status(fields='uptime'))
+        self.assertEqual(304, cherrypy.response.status)
+
+    def test_etag_ignores_volatile_fields(self):
+        cache = _utils.CachedResult(lambda: dict(self.document), ttl=0,
+                                    volatile=status.VOLATILE_FIELDS)
+        api = status.StatusAPI(cache)
+        api.status()
+        etag = cherrypy.response.headers['ETag']
+        self.assertTrue(etag.startswith('W/"'))
+        self.document['uptime'] = 17.5
+        self.document['generated'] = 1700000000
+        api.status()
+        self.assertEqual(etag, cherrypy.response.headers['ETag'])
+        self.document['memory'] = {'total': 509424, 'used': 449000}
+        api.status()
+        self.assertNotEqual(etag, cherrypy.response.headers['ETag'])
+
+    def test_selected_fields_have_their_own_etag(self):
+        self.api.status(fields='memory')
+        etag = cherrypy.response.headers['ETag']
+        self.assertTrue(etag.startswith('W/"'))
+        self.document['load'] = [1.0, 0.5, 0.25]
+        self.cache.invalidate()
+        self.api.status(fields='memory')
+        self.assertEqual(etag, cherrypy.response.headers['ETag'])
+        self.api.status(fields='memory,load')
+        self.assertNotEqual(etag, cherrypy.response.headers['ETag'])
+
+    def test_weak_etags_match(self):
+        cherrypy.request.headers = {'If-None-Match': 'W/"abc", "def"'}
+        self.assertTrue(_utils.etag_matches('W/"abc"'))
+        self.assertTrue(_utils.etag_matches('"def"'))
+        self.assertFalse(_utils.etag_matches('W/"ghi"'))
+
+    def test_status_is_collected_once_per_ttl(self):
+        calls = []
+        cache = _utils.CachedResult(lambda: calls.append(1) or self.document, ttl=60)
+        api = status.StatusAPI(cache)
+        api.status()
+        api.status(fields='memory')
+        self.assertEqual(1, len(calls))
 
 if __name__ == '__main__':
     unittest.main()
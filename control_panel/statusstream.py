@@ -0,0 +1,126 @@
+# statusstream.py - Pushes live updates of the node's status to browsers using
+#    Server-Sent Events, so that admins don't have to keep reloading the status
+#    page to see what the node is doing.
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# One StatusPublisher runs per control panel.  Every few seconds it reads the
+# shared status cache and, if anything changed, sends only the fields that
+# changed to every connected browser.  The cache's TTL decides how often the
+# status is actually collected, so neither the publisher nor the number of
+# viewers makes it happen more often, and when nobody is watching the
+# publisher doesn't ask for it at all.
+
+# Import modules.
+from cherrypy.process.plugins import Monitor
+
+import json
+import logging
+import Queue
+import threading
+
+
+# Works out which top-level fields of the status document have changed.  The
+# generation timestamp is left out because it changes every time.
+def status_delta(old, new):
+    delta = {}
+    for key, value in new.items():
+        if key == 'generated':
+            continue
+        if old.get(key) != value:
+            delta[key] = value
+    return delta
+
+
+# Formats one Server-Sent Events message.
+def format_event(event, data, event_id=None):
+    message = ''
+    if event_id is not None:
+        message += 'id: %s\n' % event_id
+    message += 'event: %s\n' % event
+    message += 'data: %s\n\n' % json.dumps(data, sort_keys=True)
+    return message
+
+
+class StatusPublisher(Monitor):
+
+    def __init__(self, bus, status_cache, frequency=5, max_viewers=16):
+        Monitor.__init__(self, bus, self.tick, frequency,
+                         name='StatusPublisher')
+        self.status_cache = status_cache
+
+        # Every streaming connection ties up one of CherryPy's worker threads,
+        # so the number of viewers is capped below the size of the thread pool.
+        # Browsers that are turned away fall back to polling /api/status.
+        self.max_viewers = max_viewers
+
+        # Each viewer gets its own queue of pending messages.
+        self.viewers = []
+        self.lock = threading.Lock()
+
+        # The last version of the status document that was published.
+        self.last_status = None
+        self.sequence = 0
+
+    # Runs in the publisher's background thread.  Gets the status from the
+    # cache, which collects it again once it's gone stale, and fans the
+    # changes out to everyone who's listening.  The status cache's ETag
+    # leaves out the uptime, which viewers want to see tick along, so the
+    # documents themselves are compared.
+    def tick(self):
+        with self.lock:
+            if not self.viewers:
+                return
+
+        status, _ = self.status_cache.get()
+        if status is self.last_status:
+            return
+        if self.last_status is None:
+            delta = status
+        else:
+            delta = status_delta(self.last_status, status)
+        self.last_status = status
+        if not delta:
+            return
+
+        self.sequence += 1
+        message = format_event('delta', delta, self.sequence)
+        logging.debug("Publishing status delta %i: %s", self.sequence, delta.keys())
+        with self.lock:
+            for queue in self.viewers:
+                queue.put(message)
+
+    # Registers a new viewer.  Returns its queue, or None if there are already
+    # too many viewers.
+    def add_viewer(self):
+        with self.lock:
+            if len(self.viewers) >= self.max_viewers:
+                return None
+            queue = Queue.Queue()
+            self.viewers.append(queue)
+            logging.debug("Status stream viewer added, %i total.", len(self.viewers))
+            return queue
+
+    def remove_viewer(self, queue):
+        with self.lock:
+            if queue in self.viewers:
+                self.viewers.remove(queue)
+            logging.debug("Status stream viewer removed, %i left.", len(self.viewers))
+
+    # Generator that produces the body of one streaming response.  The first
+    # message is the complete status document so the page starts out in sync;
+    # after that only deltas are sent.  A comment line is sent periodically to
+    # keep proxies from timing out an idle connection and to notice browsers
+    # that have gone away.
+    def stream(self, queue, keepalive=15):
+        try:
+            status, _ = self.status_cache.get()
+            yield format_event('snapshot', status, self.sequence)
+            while True:
+                try:
+                    yield queue.get(True, keepalive)
+                except Queue.Empty:
+                    yield ': keepalive\n\n'
+        finally:
+            self.remove_viewer(queue)
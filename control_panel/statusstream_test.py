@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# statusstream_test.py
+
+from flexmock import flexmock  # http://has207.github.com/flexmock
+import json
+import unittest
+import _utils
+import statusstream
+
+
+class StatusDeltaTest(unittest.TestCase):
+
+    def test_only_changed_fields_are_sent(self):
+        old = {'version': 1, 'generated': 100, 'uptime': 12.5, 'load': [0.0, 0.1, 0.2]}
+        new = {'version': 1, 'generated': 105, 'uptime': 17.5, 'load': [0.0, 0.1, 0.2]}
+        self.assertEqual({'uptime': 17.5}, statusstream.status_delta(old, new))
+
+    def test_generation_time_is_ignored(self):
+        self.assertEqual({}, statusstream.status_delta({'generated': 100}, {'generated': 105}))
+
+    def test_new_fields_are_sent(self):
+        self.assertEqual({'babeld': {'running': True}},
+                         statusstream.status_delta({}, {'babeld': {'running': True}}))
+
+
+class FormatEventTest(unittest.TestCase):
+
+    def test_format_event(self):
+        self.assertEqual('id: 3\nevent: delta\ndata: {"load": [0.5], "uptime": 1.0}\n\n',
+                         statusstream.format_event('delta', {'uptime': 1.0, 'load': [0.5]}, 3))
+
+    def test_format_event_without_id(self):
+        message = statusstream.format_event('snapshot', {'version': 1})
+        self.assertEqual('event: snapshot\ndata: {"version": 1}\n\n', message)
+        self.assertEqual({'version': 1}, json.loads(message.splitlines()[1][len('data: '):]))
+
+
+class StatusPublisherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.document = {'version': 1, 'generated': 100, 'uptime': 12.5}
+        self.cache = _utils.CachedResult(lambda: dict(self.document), ttl=0)
+        self.publisher = statusstream.StatusPublisher(flexmock(), self.cache, max_viewers=2)
+
+    def test_too_many_viewers_are_turned_away(self):
+        first = self.publisher.add_viewer()
+        second = self.publisher.add_viewer()
+        self.assertTrue(first is not None and second is not None)
+        self.assertEqual(None, self.publisher.add_viewer())
+        # Once somebody leaves, there's room again.
+        self.publisher.remove_viewer(first)
+        self.assertTrue(self.publisher.add_viewer() is not None)
+
+    def test_nothing_is_collected_without_viewers(self):
+        flexmock(self.cache).should_receive('get').never
+        self.publisher.tick()
+
+    def test_tick_publishes_changes(self):
+        queue = self.publisher.add_viewer()
+        self.publisher.tick()
+        self.assertTrue(queue.get_nowait().startswith('id: 1\nevent: delta\n'))
+        self.document['uptime'] = 17.5
+        self.document['generated'] = 105
+        self.publisher.tick()
+        self.assertEqual(statusstream.format_event('delta', {'uptime': 17.5}, 2), queue.get_nowait())
+        # Nothing changed, so nothing is sent.
+        self.publisher.tick()
+        self.assertTrue(queue.empty())
+
+    def test_tick_leaves_refreshing_to_the_cache(self):
+        collected = []
+        cache = _utils.CachedResult(lambda: collected.append(1) or dict(self.document), ttl=60)
+        publisher = statusstream.StatusPublisher(flexmock(), cache)
+        queue = publisher.add_viewer()
+        publisher.tick()
+        self.document['uptime'] = 17.5
+        publisher.tick()
+        self.assertEqual(1, len(collected))
+        self.assertTrue(queue.get_nowait().startswith('id: 1\nevent: delta\n'))
+        self.assertTrue(queue.empty())
+
+    def test_stream_starts_with_a_snapshot(self):
+        queue = self.publisher.add_viewer()
+        stream = self.publisher.stream(queue, keepalive=0)
+        self.assertEqual(statusstream.format_event('snapshot', self.document, 0), next(stream))
+        self.assertEqual(': keepalive\n\n', next(stream))
+        stream.close()
+        self.assertEqual([], self.publisher.viewers)
+
+
+if __name__ == '__main__':
+    unittest.main()
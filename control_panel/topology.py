@@ -0,0 +1,332 @@
+# topology.py - Draws the mesh as the node sees it: its neighbours, the other
+#    routers it has routes to, and the links between them, weighted by
+#    babel's metrics.
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# The graph is built from babelmonitor's tables.  The node itself is in the
+# middle.  Each neighbour is linked to it, weighted by the cost of the link.
+# Every router that originates an installed route is linked to the neighbour
+# that route goes through, weighted by the metric the neighbour advertised
+# for it (the route's refmetric).  A route with a refmetric of 0 was
+# originated by the neighbour itself, which is how neighbours (known by their
+# link-local addresses) are matched up with router IDs.
+#
+# The layout is force-directed (Fruchterman and Reingold, "Graph Drawing by
+# Force-directed Placement", 1991), with springs whose rest length grows with
+# the metric of the link.  It's only worked out from scratch the first time.
+# After that, when the routing table changes, nodes that are already on the
+# map start where they were, new ones start next to whatever they're linked
+# to, and a few cooler iterations settle things, so the picture doesn't jump
+# around every time a metric changes.  The graph, its JSON and its SVG are
+# cached until the graph itself changes.  babeld reports every wobble of a
+# link's cost and every change in reachability, so metrics are bucketed
+# (see metric_bucket()) before graphs are compared: the map is only laid out
+# and drawn again when a node or link comes or goes or a metric changes
+# noticeably, and the metrics it shows are the ones from then.
+
+# Import modules.
+import math
+import random
+import threading
+from xml.sax.saxutils import escape
+
+import babelmonitor
+
+# Node kinds.
+SELF = 'self'
+NEIGHBOUR = 'neighbour'
+ROUTER = 'router'
+
+# babeld's cost for a perfect wireless link.  Springs for links this good get
+# the shortest rest length.
+BASE_METRIC = 96
+
+# How long the layout runs the first time, and after a change.
+initial_iterations = 200
+incremental_iterations = 30
+
+# How far a node may move in one iteration to start with, as a fraction of
+# the width of the map, the first time and after a change.
+initial_temperature = 0.1
+incremental_temperature = 0.02
+
+# Size of the rendered map, in pixels.
+width = 800
+height = 600
+
+# How finely metrics are bucketed: this many buckets per doubling, so that
+# metrics within about a tenth of each other are treated as the same.
+metric_buckets_per_doubling = 4
+
+
+# Builds the graph from a snapshot of the routing tables (the second half of
+# what RoutingTables.snapshot() returns).  Returns a dict mapping node IDs to
+# dicts with each node's kind and label, and a list of (node, node, metric)
+# links.
+def build_graph(entries):
+    nodes = {SELF: {'kind': SELF, 'label': 'this node'}}
+    links = {}
+
+    # Neighbours are known by address until a route shows their router ID.
+    neighbours = {}
+    for neighbour in entries['neighbour']:
+        key = babelmonitor.neighbour_of(neighbour)
+        neighbours[key] = 'neighbour:%s%%%s' % key
+    installed = [i for i in entries['route'] if i.get('installed') == 'yes' and i.get('id')]
+    for route in installed:
+        key = babelmonitor.neighbour_of(route)
+        if key in neighbours and babelmonitor.to_metric(route.get('refmetric')) == 0:
+            neighbours[key] = route['id']
+
+    for neighbour in entries['neighbour']:
+        key = babelmonitor.neighbour_of(neighbour)
+        node = neighbours[key]
+        nodes[node] = {'kind': NEIGHBOUR, 'label': '%s (%s)' % key}
+        links[(SELF, node)] = babelmonitor.to_metric(neighbour.get('cost'))
+
+    for route in installed:
+        key = babelmonitor.neighbour_of(route)
+        via = neighbours.get(key)
+        router = route['id']
+        if router not in nodes:
+            nodes[router] = {'kind': ROUTER, 'label': router, 'prefixes': []}
+        nodes[router].setdefault('prefixes', []).append(route.get('prefix'))
+        if via is None or via == router:
+            continue
+        metric = babelmonitor.to_metric(route.get('refmetric'))
+        # A router may announce several prefixes; keep the best link.
+        if (via, router) not in links or (metric is not None and
+                                          (links[(via, router)] is None or metric < links[(via, router)])):
+            links[(via, router)] = metric
+
+    for node in nodes.values():
+        if 'prefixes' in node:
+            node['prefixes'] = sorted(set(node['prefixes']))
+    return nodes, sorted([(a, b, metric) for (a, b), metric in links.items()])
+
+
+# The rest length of a link's spring, as a multiple of the ideal distance
+# between nodes.  Unreachable links get the longest.
+def rest_length(metric):
+    if metric is None:
+        return 4.0
+    return 1.0 + min(math.log(max(metric, BASE_METRIC) / float(BASE_METRIC), 2), 3.0)
+
+
+# Returns the bucket a metric falls in, on a logarithmic scale like the one
+# rest_length() uses.  Unreachable links are a bucket of their own.
+def metric_bucket(metric):
+    if metric is None:
+        return None
+    return int(round(math.log(max(metric, BASE_METRIC) / float(BASE_METRIC), 2) *
+                     metric_buckets_per_doubling))
+
+
+# Returns what has to change for a graph to be laid out and drawn again: its
+# nodes and its links, with their metrics bucketed.
+def graph_key(nodes, links):
+    return (sorted([(node, nodes[node]['kind'], nodes[node]['label'],
+                     tuple(nodes[node].get('prefixes', ()))) for node in nodes]),
+            [(a, b, metric_bucket(metric)) for a, b, metric in links])
+
+
+# Force-directed positions of the nodes of a graph, in the unit square,
+# updated in place as the graph changes.
+class Layout(object):
+
+    def __init__(self, seed=0):
+        self.positions = {}
+        self.random = random.Random(seed)
+
+    # Places the nodes of a new version of the graph.  Takes the nodes (a
+    # collection of node IDs) and the links.  Returns the number of
+    # iterations that were run.
+    def update(self, nodes, links):
+        first = not self.positions
+        for node in list(self.positions):
+            if node not in nodes:
+                del self.positions[node]
+
+        # New nodes start close to a node they're linked to that's already
+        # placed, if there is one.
+        placed = dict(self.positions)
+        placed[SELF] = (0.5, 0.5)
+        for _ in range(len(nodes)):
+            waiting = [i for i in sorted(nodes) if i not in placed]
+            if not waiting:
+                break
+            for node in waiting:
+                anchors = [b if a == node else a for a, b, _ in links
+                           if node in (a, b) and (b if a == node else a) in placed]
+                if anchors:
+                    x, y = placed[sorted(anchors)[0]]
+                    placed[node] = self.clamp(x + self.random.uniform(-0.05, 0.05),
+                                              y + self.random.uniform(-0.05, 0.05))
+            if not [i for i in waiting if i in placed]:
+                break
+        for node in nodes:
+            if node not in placed:
+                placed[node] = (self.random.random(), self.random.random())
+        self.positions = dict([(i, placed[i]) for i in nodes])
+
+        if first:
+            iterations, temperature = initial_iterations, initial_temperature
+        else:
+            iterations, temperature = incremental_iterations, incremental_temperature
+        self.run(links, iterations, temperature)
+        return iterations
+
+    def clamp(self, x, y):
+        return min(max(x, 0.05), 0.95), min(max(y, 0.05), 0.95)
+
+    # Runs the force-directed layout.  The node itself is pinned to the
+    # middle of the map.  The temperature cools linearly to nothing.
+    def run(self, links, iterations, temperature):
+        nodes = sorted(self.positions)
+        if len(nodes) < 2:
+            return
+        k = math.sqrt(1.0 / len(nodes))
+        for iteration in range(iterations):
+            limit = temperature * (1 - iteration / float(iterations))
+            displacement = dict([(i, [0.0, 0.0]) for i in nodes])
+
+            # Every pair of nodes pushes apart.
+            for i, a in enumerate(nodes):
+                ax, ay = self.positions[a]
+                for b in nodes[i + 1:]:
+                    dx = ax - self.positions[b][0]
+                    dy = ay - self.positions[b][1]
+                    distance = max(math.hypot(dx, dy), 0.001)
+                    force = k * k / distance
+                    displacement[a][0] += dx / distance * force
+                    displacement[a][1] += dy / distance * force
+                    displacement[b][0] -= dx / distance * force
+                    displacement[b][1] -= dy / distance * force
+
+            # Linked nodes pull together (or apart) towards their rest
+            # length.
+            for a, b, metric in links:
+                if a not in self.positions or b not in self.positions:
+                    continue
+                dx = self.positions[a][0] - self.positions[b][0]
+                dy = self.positions[a][1] - self.positions[b][1]
+                distance = max(math.hypot(dx, dy), 0.001)
+                force = (distance - k * rest_length(metric)) * distance / k
+                displacement[a][0] -= dx / distance * force
+                displacement[a][1] -= dy / distance * force
+                displacement[b][0] += dx / distance * force
+                displacement[b][1] += dy / distance * force
+
+            for node in nodes:
+                if node == SELF:
+                    continue
+                dx, dy = displacement[node]
+                length = math.hypot(dx, dy)
+                if not length:
+                    continue
+                step = min(length, limit)
+                x, y = self.positions[node]
+                self.positions[node] = self.clamp(x + dx / length * step,
+                                                  y + dy / length * step)
+            if SELF in self.positions:
+                self.positions[SELF] = (0.5, 0.5)
+
+
+# Returns the graph as a dict ready to be sent as JSON.  The generation is
+# that of the map (see Topology), not of the routing tables.
+def to_document(generation, nodes, links, positions):
+    document = {'generation': generation, 'nodes': [], 'links': []}
+    for node in sorted(nodes):
+        entry = dict(nodes[node])
+        entry['id'] = node
+        entry['x'], entry['y'] = [round(i, 4) for i in positions[node]]
+        document['nodes'].append(entry)
+    for a, b, metric in links:
+        document['links'].append({'source': a, 'target': b, 'metric': metric})
+    return document
+
+
+# Draws the graph as an SVG document.  Better links are drawn thicker, and
+# each is labelled with its metric.
+def render_svg(nodes, links, positions):
+    def point(node):
+        x, y = positions[node]
+        return x * width, y * height
+
+    svg = ['<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" viewBox="0 0 %d %d">' % (width, height, width, height)]
+    for a, b, metric in links:
+        (x1, y1), (x2, y2) = point(a), point(b)
+        if metric is None:
+            stroke, label = 'stroke="#CC0000" stroke-dasharray="4,4" stroke-width="1"', 'unreachable'
+        else:
+            stroke = 'stroke="#336600" stroke-width="%.1f"' % max(5 - rest_length(metric), 1)
+            label = str(metric)
+        svg.append('<line x1="%.1f" y1="%.1f" x2="%.1f" y2="%.1f" %s />' % (x1, y1, x2, y2, stroke))
+        svg.append('<text x="%.1f" y="%.1f" font-size="10" fill="#666666">%s</text>' % ((x1 + x2) / 2, (y1 + y2) / 2, label))
+    colours = {SELF: '#32CD32', NEIGHBOUR: '#4169E1', ROUTER: '#999999'}
+    for node in sorted(nodes):
+        x, y = point(node)
+        label = nodes[node]['label']
+        if nodes[node].get('prefixes'):
+            label = label + ': ' + ', '.join(nodes[node]['prefixes'][:3])
+            if len(nodes[node]['prefixes']) > 3:
+                label = label + ', ...'
+        svg.append('<circle cx="%.1f" cy="%.1f" r="6" fill="%s" stroke="#000000" />' % (x, y, colours[nodes[node]['kind']]))
+        svg.append('<text x="%.1f" y="%.1f" font-size="11">%s</text>' % (x + 8, y - 8, escape(label)))
+    svg.append('</svg>')
+    return '\n'.join(svg)
+
+
+# The mesh as seen from babeld's tables, laid out and cached until the graph
+# changes.
+class Topology(object):
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.layout = Layout()
+        self.lock = threading.Lock()
+
+        # The generation of the tables the graph was last built from, and
+        # the key of that graph (see graph_key()).
+        self.tables_generation = None
+        self.key = None
+
+        # The generation of the map, bumped every time it's laid out again,
+        # the graph, its document and the SVG (drawn the first time it's
+        # asked for).
+        self.generation = 0
+        self.graph = None
+        self.document = None
+        self.svg = None
+
+    # Rebuilds the graph if the tables have changed, and moves the layout on
+    # if the graph has.  Must be called with the lock held.
+    def refresh(self):
+        if self.document is not None and self.tables_generation == self.tables.generation:
+            return
+        self.tables_generation, entries = self.tables.snapshot()
+        nodes, links = build_graph(entries)
+        key = graph_key(nodes, links)
+        if self.document is not None and key == self.key:
+            return
+        self.layout.update(nodes, links)
+        self.key = key
+        self.generation += 1
+        self.document = to_document(self.generation, nodes, links, self.layout.positions)
+        self.graph = (nodes, links, dict(self.layout.positions))
+        self.svg = None
+
+    # Returns the graph as a dict (see to_document()).
+    def get_document(self):
+        with self.lock:
+            self.refresh()
+            return self.document
+
+    def get_svg(self):
+        with self.lock:
+            self.refresh()
+            if self.svg is None:
+                self.svg = render_svg(*self.graph)
+            return self.svg
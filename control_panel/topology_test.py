@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# topology_test.py
+
+import unittest
+from flexmock import flexmock
+import babelmonitor
+import topology
+
+EVENTS = [
+    'add neighbour 1 address fe80::1 if wlan0 reach ffff rxcost 96 txcost 96 cost 96',
+    'add neighbour 2 address fe80::2 if wlan0 reach ff00 rxcost 256 txcost 256 cost 512',
+    'add route 10 prefix 10.0.1.0/24 installed yes id aa metric 96 refmetric 0 via fe80::1 if wlan0',
+    'add route 11 prefix 10.0.3.0/24 installed yes id cc metric 192 refmetric 96 via fe80::1 if wlan0',
+    'add route 12 prefix 10.0.4.0/24 installed yes id cc metric 192 refmetric 128 via fe80::1 if wlan0',
+    'add route 13 prefix 10.0.3.0/24 installed no id cc metric 608 refmetric 96 via fe80::2 if wlan0',
+]
+
+
+class TopologyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tables = babelmonitor.RoutingTables()
+        for line in EVENTS:
+            self.tables.apply(*babelmonitor.parse_event(line))
+
+    def test_build_graph(self):
+        nodes, links = topology.build_graph(self.tables.snapshot()[1])
+        self.assertEqual(set(['self', 'aa', 'neighbour:fe80::2%wlan0', 'cc']), set(nodes))
+        self.assertEqual(topology.NEIGHBOUR, nodes['aa']['kind'])
+        self.assertEqual(['10.0.3.0/24', '10.0.4.0/24'], nodes['cc']['prefixes'])
+        self.assertEqual([('aa', 'cc', 96), ('self', 'aa', 96), ('self', 'neighbour:fe80::2%wlan0', 512)],
+                         links)
+
+    def test_layout_is_incremental(self):
+        nodes, links = topology.build_graph(self.tables.snapshot()[1])
+        layout = topology.Layout()
+        self.assertEqual(topology.initial_iterations, layout.update(nodes, links))
+        self.assertEqual((0.5, 0.5), layout.positions['self'])
+        before = dict(layout.positions)
+
+        # A new router shows up: it starts next to its neighbour, and nothing
+        # else moves far.
+        self.tables.apply(*babelmonitor.parse_event(
+            'add route 14 prefix 10.0.5.0/24 installed yes id dd metric 192 refmetric 96 via fe80::1 if wlan0'))
+        nodes, links = topology.build_graph(self.tables.snapshot()[1])
+        self.assertEqual(topology.incremental_iterations, layout.update(nodes, links))
+        limit = topology.incremental_iterations * topology.incremental_temperature
+        for node, (x, y) in before.items():
+            self.assertTrue(abs(layout.positions[node][0] - x) <= limit + 1e-9)
+            self.assertTrue(abs(layout.positions[node][1] - y) <= limit + 1e-9)
+        self.assertTrue('dd' in layout.positions)
+
+    def test_cached_until_the_tables_change(self):
+        mesh_map = topology.Topology(self.tables)
+        svg = mesh_map.get_svg()
+        document = mesh_map.get_document()
+        self.assertEqual(1, document['generation'])
+        flexmock(topology).should_receive('build_graph').never
+        flexmock(topology).should_receive('render_svg').never
+        self.assertTrue(mesh_map.get_svg() is svg)
+        self.assertTrue(mesh_map.get_document() is document)
+
+    def test_changes_are_picked_up(self):
+        mesh_map = topology.Topology(self.tables)
+        mesh_map.get_svg()
+        self.tables.apply(*babelmonitor.parse_event('flush neighbour 2'))
+        document = mesh_map.get_document()
+        self.assertEqual(3, len(document['nodes']))
+        self.assertTrue('fe80::2' not in mesh_map.get_svg())
+
+    def test_metric_wobbles_are_ignored(self):
+        mesh_map = topology.Topology(self.tables)
+        svg = mesh_map.get_svg()
+        flexmock(mesh_map.layout).should_receive('update').never
+        # A link's cost wobbling a little, or its reach changing, leaves the
+        # map alone...
+        self.tables.apply(*babelmonitor.parse_event(
+            'change neighbour 2 address fe80::2 if wlan0 reach fe00 rxcost 256 txcost 256 cost 530'))
+        self.assertTrue(mesh_map.get_svg() is svg)
+        self.assertEqual(1, mesh_map.generation)
+
+    def test_metric_changes_are_picked_up(self):
+        mesh_map = topology.Topology(self.tables)
+        mesh_map.get_svg()
+        # ...but a noticeable change doesn't.
+        self.tables.apply(*babelmonitor.parse_event(
+            'change neighbour 2 address fe80::2 if wlan0 reach ff00 rxcost 256 txcost 256 cost 1024'))
+        document = mesh_map.get_document()
+        self.assertEqual(2, document['generation'])
+        self.assertEqual([1024], [i['metric'] for i in document['links'] if i['target'] == 'neighbour:fe80::2%wlan0'])
+
+    def test_metric_bucket(self):
+        self.assertEqual(None, topology.metric_bucket(None))
+        self.assertEqual(0, topology.metric_bucket(topology.BASE_METRIC))
+        self.assertEqual(0, topology.metric_bucket(50))
+        self.assertEqual(topology.metric_bucket(512), topology.metric_bucket(530))
+        self.assertNotEqual(topology.metric_bucket(512), topology.metric_bucket(1024))
+
+
+if __name__ == '__main__':
+    unittest.main()
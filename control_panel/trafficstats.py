@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+
+# trafficstats.py - Network traffic stats collector.  Starts when a Byzantium
+#    node is booted and runs in the background, sampling the byte counters of
+#    every network interface once a minute and storing them in rrdtool
+#    databases for the control panel's traffic page, which draws the graphs
+#    when someone looks at them.
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# This replaces traffic_stats.sh, which ran ifconfig | grep | awk | sed once
+# per interface and forked rrdtool twice per interface every minute.  Here
+# /proc/net/dev is read once per tick and every interface is parsed from that
+# one read, and all of the rrdtool work goes through a single long-running
+# `rrdtool -` process in pipe mode.
+
+# Calls to rrdtool shamelessly taken from rrd_traffic.pl by Martin Pot.
+# http://martybugs.net/linux/rrdtool/traffic.cgi
+
+# Requires: rrdtool
+
+# Import modules.
+import argparse
+import logging
+import os
+import os.path
+import subprocess
+import threading
+import time
+
+import rrstore
+
+
+# Parses the contents of /proc/net/dev.  Takes an iterable of lines and
+# returns a dict mapping interface names to (bytes received, bytes sent).
+# The first two lines are column headers.  Note that on some kernels there's
+# no space between the colon and the first counter when it gets large.
+def parse_procnetdev(lines):
+    counters = {}
+    for line in list(lines)[2:]:
+        if ':' not in line:
+            continue
+        interface, fields = line.split(':', 1)
+        fields = fields.split()
+        if len(fields) < 9:
+            continue
+        counters[interface.strip()] = (int(fields[0]), int(fields[8]))
+    return counters
+
+
+def read_procnetdev(injected_open=open):
+    try:
+        procnetdev = injected_open('/proc/net/dev', 'r')
+    except IOError:
+        logging.error("Unable to open /proc/net/dev.")
+        return {}
+    counters = parse_procnetdev(procnetdev)
+    procnetdev.close()
+    return counters
+
+
+# Wraps a persistent `rrdtool -` process.  Commands are written to its stdin
+# one per line and it answers each one with any output followed by a line
+# starting with OK or ERROR.  Arguments containing whitespace have to be
+# double quoted.  If rrdtool dies it's restarted on the next command.
+class RRDTool(object):
+
+    def __init__(self, rrdtool='/usr/bin/rrdtool'):
+        self.rrdtool = rrdtool
+        self.process = None
+        self.lock = threading.Lock()
+
+    def _start(self):
+        logging.debug("Starting %s in pipe mode.", self.rrdtool)
+        self.process = subprocess.Popen([self.rrdtool, '-'],
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT)
+
+    # Runs one rrdtool command.  Takes the command's arguments as a list and
+    # returns the lines of output that preceded the OK.  Raises RRDError if
+    # rrdtool reported an error.
+    def command(self, args):
+        line = ' '.join([quote(i) for i in args]) + '\n'
+        with self.lock:
+            if self.process is None or self.process.poll() is not None:
+                self._start()
+            try:
+                self.process.stdin.write(line)
+                self.process.stdin.flush()
+                output = []
+                while True:
+                    response = self.process.stdout.readline()
+                    if not response:
+                        raise RRDError("rrdtool exited unexpectedly.")
+                    if response.startswith('OK'):
+                        return output
+                    if response.startswith('ERROR'):
+                        raise RRDError(response[len('ERROR:'):].strip())
+                    output.append(response.rstrip('\n'))
+            except (IOError, RRDError):
+                self.close()
+                raise
+
+    def close(self):
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+                self.process.wait()
+            except (IOError, OSError):
+                pass
+            self.process = None
+
+
+class RRDError(Exception):
+    pass
+
+
+# Double quotes an argument for rrdtool's pipe mode if it needs it.
+def quote(arg):
+    arg = str(arg)
+    if not arg or any(i.isspace() for i in arg):
+        return '"' + arg + '"'
+    return arg
+
+
+# Builds the command that creates a new traffic database: a DERIVE data source
+# for each direction and round-robin archives covering two days at five minute
+# resolution, two weeks at half an hour, two months at two hours and two years
+# at half a day.
+def create_command(database):
+    return ['create', database, '-s', '300',
+            'DS:in:DERIVE:600:0:12500000',
+            'DS:out:DERIVE:600:0:12500000',
+            'RRA:AVERAGE:0.5:1:576',
+            'RRA:AVERAGE:0.5:6:672',
+            'RRA:AVERAGE:0.5:24:732',
+            'RRA:AVERAGE:0.5:144:1460']
+
+
+# Builds the command that renders a traffic graph for one interface.
+def graph_command(interface, database, graph, start='-1h', end='now',
+                  width=600, height=80):
+    return ['graph', graph,
+            '-s', start, '-e', end,
+            '-t', 'Traffic on %s.' % interface,
+            '--lazy', '-h', str(height), '-w', str(width), '-l', '0',
+            '-a', 'PNG', '-v', 'bytes/sec',
+            'DEF:in=%s:in:AVERAGE' % database,
+            'DEF:out=%s:out:AVERAGE' % database,
+            'CDEF:out_neg=out,-1,*',
+            'AREA:in#32CD32:Incoming',
+            'LINE1:in#336600',
+            'GPRINT:in:MAX:  Max\\: %5.1lf %s',
+            'GPRINT:in:AVERAGE: Avg\\: %5.1lf %S',
+            'GPRINT:in:LAST: Current\\: %5.1lf %Sbytes/sec\\n',
+            'AREA:out_neg#4169E1:Outgoing',
+            'LINE1:out_neg#0033CC',
+            'GPRINT:out:MAX:  Max\\: %5.1lf %S',
+            'GPRINT:out:AVERAGE: Avg\\: %5.1lf %S',
+            'GPRINT:out:LAST: Current\\: %5.1lf %Sbytes/sec',
+            'HRULE:0#000000']
+
+
+# Builds the command that pulls the averaged samples of a database for a
+# stretch of time.  rrdtool picks the finest archive that covers it.
+def fetch_command(database, start, end='now'):
+    return ['fetch', database, 'AVERAGE', '-s', str(start), '-e', str(end)]
+
+
+# Parses the output of rrdtool fetch: a line of data source names, a blank
+# line, and then one "timestamp: value value ..." line per row.  Returns a
+# list of timestamps and a dict mapping each data source to a list of
+# values, with None for unknown values.
+def parse_fetch(lines):
+    names = []
+    timestamps = []
+    series = {}
+    for line in lines:
+        if not line.strip():
+            continue
+        if ':' not in line:
+            names = line.split()
+            series = dict([(i, []) for i in names])
+            continue
+        timestamp, values = line.split(':', 1)
+        timestamps.append(int(timestamp))
+        for name, value in zip(names, values.split()):
+            value = float(value)
+            if value != value:
+                value = None
+            series[name].append(value)
+    return timestamps, series
+
+
+# Creates a new round-robin store for an interface's traffic.  It's sampled
+# once a minute and keeps a day of one minute averages, a week of five minute
+# averages, a month of half hour averages and a year of twelve hour averages,
+# plus the peaks for the longer windows.
+def create_store(path):
+    return rrstore.create(path, 60,
+                          [('in', rrstore.DERIVE), ('out', rrstore.DERIVE)],
+                          [('AVERAGE', 1, 1440), ('AVERAGE', 5, 2016),
+                           ('AVERAGE', 30, 1488), ('AVERAGE', 720, 730),
+                           ('MAX', 30, 1488), ('MAX', 720, 730)])
+
+
+# Opens an interface's round-robin store, creating it if need be.
+def open_store(path):
+    if os.path.exists(path):
+        return rrstore.RRStore(path)
+    return create_store(path)
+
+
+# Samples the traffic counters of every interface on the node.
+class TrafficCollector(object):
+
+    def __init__(self, databases='/tmp/stats_databases', rrdtool=None,
+                 ignore=('lo', )):
+        self.databases = databases
+        self.rrdtool = rrdtool or RRDTool()
+        self.ignore = ignore
+
+        # The set of interfaces that were present at the last tick.
+        self.interfaces = set()
+
+        # Every interface's samples are also written to a memory-mapped
+        # round-robin store (see rrstore.py), which the control panel reads
+        # without having to go through rrdtool.
+        self.stores = {}
+
+    def database(self, interface):
+        return os.path.join(self.databases, interface + '.rrd')
+
+    def store(self, interface):
+        return os.path.join(self.databases, interface + '.rrs')
+
+    # Takes one sample of every interface.  Interfaces that have appeared
+    # since the last tick get a database if they don't already have one;
+    # interfaces that have gone away (say, someone unplugged a USB wifi
+    # device) stop being sampled.  Their databases are kept in case they
+    # come back.  rrdtool being missing or broken only costs the rrdtool
+    # databases: the stores keep collecting, and a database that couldn't be
+    # created is tried again on the next tick.
+    def tick(self, counters=None):
+        if counters is None:
+            counters = read_procnetdev()
+        current = set(i for i in counters if i not in self.ignore)
+
+        for interface in sorted(current - self.interfaces):
+            logging.debug("Interface %s appeared.", interface)
+            self.stores[interface] = open_store(self.store(interface))
+
+        for interface in sorted(self.interfaces - current):
+            logging.debug("Interface %s went away.", interface)
+            self.stores.pop(interface).close()
+
+        self.interfaces = current
+
+        now = time.time()
+        for interface in sorted(current):
+            bytes_in, bytes_out = counters[interface]
+            try:
+                self.stores[interface].update(now, [bytes_in, bytes_out])
+            except rrstore.RRStoreError as ex:
+                logging.error("Couldn't update store for %s: %s", interface, ex)
+            try:
+                if not os.path.exists(self.database(interface)):
+                    self.rrdtool.command(create_command(self.database(interface)))
+                self.rrdtool.command(['update', self.database(interface),
+                                      '-t', 'in:out',
+                                      'N:%d:%d' % (bytes_in, bytes_out)])
+            except (RRDError, IOError, OSError) as ex:
+                logging.error("Couldn't update stats for %s: %s", interface, ex)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Collects network traffic "
+                                     "statistics for the Byzantium control "
+                                     "panel.")
+    parser.add_argument("--databases", action="store",
+                        default="/tmp/stats_databases")
+    parser.add_argument("-i", "--interval", action="store", type=int,
+                        default=60, help="Seconds between samples.")
+    parser.add_argument("-d", "--debug", action="store_true", default=False,
+                        help="Enable debugging mode.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.debug:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.ERROR)
+
+    # Create the directory to store the rrdtool databases in.
+    if not os.path.isdir(args.databases):
+        os.makedirs(args.databases)
+
+    collector = TrafficCollector(args.databases)
+
+    # Set up the loop that updates everything once a minute.
+    while True:
+        started = time.time()
+        try:
+            collector.tick()
+        except (IOError, OSError, RRDError) as ex:
+            logging.error("Traffic stats collection failed: %s", ex)
+        time.sleep(max(args.interval - (time.time() - started), 1))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+# Project Byzantium: http://wiki.hacdc.org/index.php/Byzantium
+# License: GPLv3
+
+# trafficstats_test.py
+
+from flexmock import flexmock  # http://has207.github.com/flexmock
+import shutil
+import tempfile
+import unittest
+import trafficstats
+
+
+PROCNETDEV = ['Inter-|   Receive                                                |  Transmit\n',
+              ' face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls carrier compressed\n',
+              '    lo:    1000      10    0    0    0     0          0         0     1000      10    0    0    0     0       0          0\n',
+              '  eth0:12345678901  120    0    0    0     0          0         0      300       3    0    0    0     0       0          0\n',
+              ' wlan0:     400       4    0    0    0     0          0         0      500       5    0    0    0     0       0          0\n']
+
+
+class ParseProcNetDevTest(unittest.TestCase):
+
+    def test_parse_procnetdev(self):
+        expected = {'lo': (1000, 1000), 'eth0': (12345678901, 300),
+                    'wlan0': (400, 500)}
+        self.assertEqual(expected, trafficstats.parse_procnetdev(PROCNETDEV))
+
+    def test_parse_procnetdev_skips_headers_only(self):
+        self.assertEqual({}, trafficstats.parse_procnetdev(PROCNETDEV[:2]))
+
+    def test_quote(self):
+        self.assertEqual('N:1:2', trafficstats.quote('N:1:2'))
+        self.assertEqual('"Traffic on eth0."', trafficstats.quote('Traffic on eth0.'))
+
+    def test_parse_fetch(self):
+        output = ['                          in                  out',
+                  '',
+                  '1700000100: 1.2500000000e+02 -nan',
+                  '1700000400: 2.5000000000e+02 3.0000000000e+01']
+        timestamps, series = trafficstats.parse_fetch(output)
+        self.assertEqual([1700000100, 1700000400], timestamps)
+        self.assertEqual([125.0, 250.0], series['in'])
+        self.assertEqual([None, 30.0], series['out'])
+
+
+class TrafficCollectorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.rrdtool = flexmock(command=lambda args: [])
+        self.collector = trafficstats.TrafficCollector(self.directory,
+                                                       rrdtool=self.rrdtool)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_tick_creates_databases_for_new_interfaces(self):
+        commands = []
+        self.rrdtool.command = commands.append
+        self.collector.tick({'lo': (1, 1), 'eth0': (2, 3)})
+        self.assertEqual(set(['eth0']), self.collector.interfaces)
+        self.assertEqual(['create', 'update'], [i[0] for i in commands])
+
+    def test_tick_forgets_interfaces_that_go_away(self):
+        commands = []
+        self.collector.tick({'eth0': (2, 3), 'wlan0': (4, 5)})
+        self.rrdtool.command = commands.append
+        self.collector.tick({'eth0': (6, 7)})
+        self.assertEqual(set(['eth0']), self.collector.interfaces)
+        self.assertEqual(set([self.collector.database('eth0')]), set([i[1] for i in commands]))
+
+    def test_tick_does_not_accumulate_interfaces(self):
+        for _ in range(3):
+            self.collector.tick({'eth0': (2, 3)})
+        self.assertEqual(set(['eth0']), self.collector.interfaces)
+
+    def test_tick_carries_on_without_rrdtool(self):
+        self.rrdtool.command = lambda args: (_ for _ in ()).throw(OSError(2, 'No such file or directory'))
+        self.collector.tick({'eth0': (2, 3), 'wlan0': (4, 5)})
+        self.assertEqual(set(['eth0', 'wlan0']), self.collector.interfaces)
+        stores = dict(self.collector.stores)
+        last_update = stores['eth0'].last_update()
+        self.assertTrue(last_update)
+        self.collector.tick({'eth0': (6, 7), 'wlan0': (8, 9)})
+        # The stores opened on the first tick are kept, and still collect.
+        self.assertTrue(self.collector.stores['eth0'] is stores['eth0'])
+        self.assertTrue(stores['eth0'].last_update() > last_update)
+
+    def test_tick_retries_creating_databases(self):
+        commands = []
+
+        def command(args):
+            commands.append(args[0])
+            if len(commands) == 1:
+                raise trafficstats.RRDError("opening '%s': Permission denied" % args[1])
+            if args[0] == 'create':
+                open(args[1], 'w').close()
+            return []
+        self.rrdtool.command = command
+        self.collector.tick({'eth0': (2, 3)})
+        self.collector.tick({'eth0': (4, 5)})
+        self.collector.tick({'eth0': (6, 7)})
+        self.assertEqual(['create', 'create', 'update', 'update'], commands)
+
+if __name__ == '__main__':
+    unittest.main()
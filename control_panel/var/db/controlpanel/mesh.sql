@@ -1,3 +1,3 @@
 BEGIN TRANSACTION;
-CREATE TABLE meshes (enabled TEXT, interface TEXT, protocol TEXT);
+CREATE TABLE meshes (enabled TEXT, interface TEXT, protocol TEXT, channel NUMERIC);
 COMMIT;